@@ -16,6 +16,7 @@
 from __future__ import absolute_import
 from __future__ import print_function
 from future.utils import PY3
+from future.utils import integer_types
 from future.utils import iteritems
 from future.utils import itervalues
 from future.utils import string_types
@@ -206,10 +207,15 @@ class MasterConfig(util.ComparableMixin, WorkerAPICompatMixin):
         self.logEncoding = 'utf-8'
         self.logMaxSize = None
         self.logMaxTailSize = None
+        self.logAppendBatchDelay = 0
+        self.logAppendBatchMaxSize = 1024 * 1024
         self.properties = properties.Properties()
         self.collapseRequests = None
         self.codebaseGenerator = None
         self.prioritizeBuilders = None
+        self.buildStartConcurrency = 1
+        self.latentWarmPool = None
+        self.artifactStore = None
         self.multiMaster = False
         self.manhole = None
         self.protocols = {}
@@ -252,11 +258,13 @@ class MasterConfig(util.ComparableMixin, WorkerAPICompatMixin):
         self.services = {}
 
     _known_config_keys = set([
+        "artifactStore",
         "buildbotNetUsageData",
         "buildbotURL",
         "buildCacheSize",
         "builders",
         "buildHorizon",
+        "buildStartConcurrency",
         "caches",
         "change_source",
         "codebaseGenerator",
@@ -266,12 +274,15 @@ class MasterConfig(util.ComparableMixin, WorkerAPICompatMixin):
         'db',
         "db_poll_interval",
         "db_url",
+        "latentWarmPool",
         "logCompressionLimit",
         "logCompressionMethod",
         "logEncoding",
         "logHorizon",
         "logMaxSize",
         "logMaxTailSize",
+        "logAppendBatchDelay",
+        "logAppendBatchMaxSize",
         "manhole",
         "collapseRequests",
         "metrics",
@@ -349,6 +360,8 @@ class MasterConfig(util.ComparableMixin, WorkerAPICompatMixin):
             config.load_schedulers(filename, config_dict)
             config.load_builders(filename, config_dict)
             config.load_workers(filename, config_dict)
+            config.load_latent_warm_pool(filename, config_dict)
+            config.load_artifact_store(filename, config_dict)
             config.load_change_sources(filename, config_dict)
             config.load_status(filename, config_dict)
             config.load_user_managers(filename, config_dict)
@@ -360,6 +373,7 @@ class MasterConfig(util.ComparableMixin, WorkerAPICompatMixin):
             config.check_schedulers()
             config.check_locks()
             config.check_builders()
+            config.check_latent_warm_pool()
             config.check_status()
             config.check_ports()
         finally:
@@ -434,9 +448,11 @@ class MasterConfig(util.ComparableMixin, WorkerAPICompatMixin):
 
         self.logCompressionMethod = config_dict.get(
             'logCompressionMethod', 'gz')
-        if self.logCompressionMethod not in ('raw', 'bz2', 'gz', 'lz4'):
+        if self.logCompressionMethod not in ('raw', 'bz2', 'gz', 'lz4',
+                                             'zstd'):
             error(
-                "c['logCompressionMethod'] must be 'raw', 'bz2', 'gz' or 'lz4'")
+                "c['logCompressionMethod'] must be 'raw', 'bz2', 'gz', 'lz4' "
+                "or 'zstd'")
 
         if self.logCompressionMethod == "lz4":
             try:
@@ -447,9 +463,25 @@ class MasterConfig(util.ComparableMixin, WorkerAPICompatMixin):
                 error(
                     "To set c['logCompressionMethod'] to 'lz4' you must install the lz4 library ('pip install lz4')")
 
+        if self.logCompressionMethod == "zstd":
+            try:
+                import zstandard
+                [zstandard]
+            except ImportError:
+                warnings.warn(
+                    "c['logCompressionMethod'] is 'zstd', but the zstandard "
+                    "library is not installed ('pip install zstandard'); "
+                    "using 'gz' instead",
+                    category=ConfigWarning,
+                )
+                self.logCompressionMethod = 'gz'
+
         copy_int_param('logMaxSize')
         copy_int_param('logMaxTailSize')
         copy_param('logEncoding')
+        copy_param('logAppendBatchDelay', check_type=(int, float),
+                   check_type_name='a number')
+        copy_int_param('logAppendBatchMaxSize')
 
         properties = config_dict.get('properties', {})
         if not isinstance(properties, dict):
@@ -478,6 +510,11 @@ class MasterConfig(util.ComparableMixin, WorkerAPICompatMixin):
         else:
             self.prioritizeBuilders = prioritizeBuilders
 
+        copy_int_param('buildStartConcurrency')
+        if self.buildStartConcurrency < 1:
+            error("c['buildStartConcurrency'] must be at least 1")
+            self.buildStartConcurrency = 1
+
         protocols = config_dict.get('protocols', {})
         if isinstance(protocols, dict):
             for proto, options in iteritems(protocols):
@@ -630,6 +667,66 @@ class MasterConfig(util.ComparableMixin, WorkerAPICompatMixin):
                 error(msg)
             self.caches['Changes'] = config_dict['changeCacheSize']
 
+    def load_latent_warm_pool(self, filename, config_dict):
+        if config_dict.get('latentWarmPool') is None:
+            return
+        pool = config_dict['latentWarmPool']
+        if not isinstance(pool, dict):
+            error("c['latentWarmPool'] must be a dictionary")
+            return
+
+        unknown = set(pool) - set(['workernames', 'minIdle', 'maxTotal',
+                                   'idleTimeout'])
+        if unknown:
+            error("unrecognized keys in c['latentWarmPool']: %s"
+                  % (', '.join(sorted(unknown)),))
+
+        workernames = pool.get('workernames')
+        if (not isinstance(workernames, list) or
+                not all(isinstance(n, string_types) for n in workernames)):
+            error("c['latentWarmPool']['workernames'] must be a list of "
+                  "worker names")
+            return
+
+        self.latentWarmPool = dict(workernames=workernames, minIdle=0,
+                                   maxTotal=None, idleTimeout=10 * 60)
+        for key, minimum in [('minIdle', 0), ('maxTotal', 1),
+                             ('idleTimeout', 1)]:
+            if key not in pool or (key == 'maxTotal' and pool[key] is None):
+                continue
+            value = pool[key]
+            if not isinstance(value, int) or value < minimum:
+                error("c['latentWarmPool']['%s'] must be an integer of at "
+                      "least %d" % (key, minimum))
+                continue
+            self.latentWarmPool[key] = value
+
+    def load_artifact_store(self, filename, config_dict):
+        if config_dict.get('artifactStore') is None:
+            return
+        store = config_dict['artifactStore']
+        if not isinstance(store, dict):
+            error("c['artifactStore'] must be a dictionary")
+            return
+
+        unknown = set(store) - set(['basedir', 'maxSize'])
+        if unknown:
+            error("unrecognized keys in c['artifactStore']: %s"
+                  % (', '.join(sorted(unknown)),))
+
+        self.artifactStore = dict(basedir='artifacts',
+                                  maxSize=10 * 1024 ** 3)
+        basedir = store.get('basedir', 'artifacts')
+        if not isinstance(basedir, string_types) or not basedir:
+            error("c['artifactStore']['basedir'] must be a directory name")
+        else:
+            self.artifactStore['basedir'] = basedir
+        maxSize = store.get('maxSize', self.artifactStore['maxSize'])
+        if not isinstance(maxSize, integer_types) or maxSize < 1:
+            error("c['artifactStore']['maxSize'] must be a positive integer")
+        else:
+            self.artifactStore['maxSize'] = maxSize
+
     def load_schedulers(self, filename, config_dict):
         if 'schedulers' not in config_dict:
             return
@@ -922,6 +1019,17 @@ class MasterConfig(util.ComparableMixin, WorkerAPICompatMixin):
                 error("duplicate builder builddir '%s'" % b.builddir)
             seen_builddirs.add(b.builddir)
 
+    def check_latent_warm_pool(self):
+        if self.latentWarmPool is None:
+            return
+        workers = dict((w.workername, w) for w in self.workers)
+        for name in self.latentWarmPool['workernames']:
+            if name not in workers:
+                error("c['latentWarmPool'] uses unknown worker %r" % (name,))
+            elif not interfaces.ILatentWorker.providedBy(workers[name]):
+                error("c['latentWarmPool'] uses worker %r, which is not a "
+                      "latent worker" % (name,))
+
     def check_status(self):
         # allow status receivers to check themselves against the rest of the
         # receivers
@@ -18,12 +18,12 @@ from __future__ import print_function
 from future.builtins import range
 from future.moves.collections import UserList
 
-import copy
 import re
 
 from twisted.internet import defer
 
 from buildbot.data import exceptions
+from buildbot.util import bbcollections
 
 
 class ResourceType(object):
@@ -39,17 +39,31 @@ class ResourceType(object):
         self.compileEventPathPatterns()
 
     def compileEventPathPatterns(self):
-        # We'll run a single format, and then split the string
-        # to get the final event path tuple
+        # Each event path is compiled into a tuple of (is_field, value) parts,
+        # so that routing keys can be built without formatting and splitting
+        # a string for every event.
         pathPatterns = self.eventPathPatterns
         pathPatterns = pathPatterns.split()
         identifiers = re.compile(r':([^/]*)')
-        for i, pp in enumerate(pathPatterns):
-            pp = identifiers.sub(r'{\1}', pp)
+        self.eventPaths = []
+        self.eventPathParts = []
+        for pp in pathPatterns:
             if pp.startswith("/"):
                 pp = pp[1:]
-            pathPatterns[i] = pp
-        self.eventPaths = pathPatterns
+            self.eventPaths.append(identifiers.sub(r'{\1}', pp))
+            parts = []
+            for elt in pp.split("/"):
+                mo = identifiers.match(elt)
+                if mo and mo.group(0) == elt:
+                    parts.append((True, mo.group(1)))
+                else:
+                    parts.append((False, identifiers.sub(r'{\1}', elt)))
+            self.eventPathParts.append(tuple(parts))
+
+    def getRoutingKeys(self, msg, event):
+        for parts in self.eventPathParts:
+            yield tuple(str(msg[v]) if is_field else v.format(**msg)
+                        for is_field, v in parts) + (event,)
 
     def getEndpoints(self):
         endpoints = self.endpoints[:]
@@ -62,15 +76,16 @@ class ResourceType(object):
 
     @staticmethod
     def sanitizeMessage(msg):
-        msg = copy.deepcopy(msg)
-        return msg
+        # messages are shared between all consumers, so make them read-only
+        # rather than giving each a copy; a consumer adding to a message, like
+        # a reporter adding the build details, makes a shallow copy of it with
+        # dict(msg)
+        return bbcollections.freeze(msg)
 
     def produceEvent(self, msg, event):
         if msg is not None:
             msg = self.sanitizeMessage(msg)
-            for path in self.eventPaths:
-                path = path.format(**msg)
-                routingKey = tuple(path.split("/")) + (event,)
+            for routingKey in self.getRoutingKeys(msg, event):
                 self.master.mq.produce(routingKey, msg)
 
 
@@ -87,6 +102,13 @@ class Endpoint(object):
     def get(self, resultSpec, kwargs):
         raise NotImplementedError
 
+    def stream(self, resultSpec, kwargs):
+        # raw endpoints may override this to return a dictionary whose
+        # 'chunks' key is an iterable of Deferreds, each firing with the
+        # next piece of content; by default, the whole content is returned
+        # at once in the 'raw' key, as for get()
+        return self.get(resultSpec, kwargs)
+
     def control(self, action, args, kwargs):
         raise exceptions.InvalidControlException
 
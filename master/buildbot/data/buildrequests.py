@@ -149,7 +149,7 @@ class BuildRequestsEndpoint(Db2DataMixin, base.Endpoint):
         defer.returnValue(results)
 
 
-class BuildRequest(base.ResourceType):
+class BuildRequest(Db2DataMixin, base.ResourceType):
 
     name = "buildrequest"
     plural = "buildrequests"
@@ -178,10 +178,16 @@ class BuildRequest(base.ResourceType):
 
     @defer.inlineCallbacks
     def generateEvent(self, brids, event):
+        # get all the buildrequests at once, and munge the results for the
+        # notifications
+        brdicts = yield self.master.db.buildrequests.getBuildRequests(
+            brids=brids)
+        # a buildrequest may be returned once per sourcestamp
+        brdicts = dict((br['buildrequestid'], br) for br in brdicts)
         for brid in brids:
-            # get the build and munge the result for the notification
-            br = yield self.master.data.get(('buildrequests', str(brid)))
-            self.produceEvent(br, event)
+            if brid in brdicts:
+                br = yield self.db2data(brdicts[brid])
+                self.produceEvent(br, event)
 
     @defer.inlineCallbacks
     def callDbBuildRequests(self, brids, db_callable, event, **kw):
@@ -163,12 +163,16 @@ class BuildsEndpoint(Db2DataMixin, base.Endpoint):
             resultSpec=resultSpec)
         # returns properties' list
         filters = resultSpec.popProperties()
+        # Avoid to request DB for Build's properties if not specified, and
+        # fetch them for all builds at once otherwise
+        if filters and builds:  # pragma: no cover
+            allprops = yield self.master.db.builds.getBuildPropertiesForBuilds(
+                [b['id'] for b in builds])
         buildscol = []
         for b in builds:
             data = yield self.db2data(b)
-            # Avoid to request DB for Build's properties if not specified
             if filters:  # pragma: no cover
-                props = yield self.master.db.builds.getBuildProperties(b['id'])
+                props = allprops.get(b['id'], {})
                 filtered_properties = self._generate_filtered_properties(
                     props, filters)
                 if filtered_properties:
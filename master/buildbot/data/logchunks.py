@@ -103,7 +103,7 @@ class RawLogChunkEndpoint(LogChunkEndpointBase):
     """
 
     @defer.inlineCallbacks
-    def get(self, resultSpec, kwargs):
+    def stream(self, resultSpec, kwargs):
         logid, dbdict = yield self.getLogIdAndDbDictFromKwargs(kwargs)
         if logid is None:
             return
@@ -112,19 +112,62 @@ class RawLogChunkEndpoint(LogChunkEndpointBase):
             dbdict = yield self.master.db.logs.getLog(logid)
             if not dbdict:
                 return
-        lastline = max(0, dbdict['num_lines'] - 1)
-
-        logLines = yield self.master.db.logs.getLogLines(
-            logid, 0, lastline)
-
-        if dbdict['type'] == 's':
-            logLines = "\n".join([line[1:] for line in logLines.splitlines()])
+        num_lines = dbdict['num_lines']
+        firstline = int(resultSpec.offset or 0)
+        lastline = num_lines - 1
+        if resultSpec.limit is not None:
+            lastline = min(lastline, firstline + int(resultSpec.limit) - 1)
+        resultSpec.removePagination()
 
         defer.returnValue({
-            'raw': logLines,
+            'chunks': self._iterChunks(logid, dbdict['type'],
+                                       firstline, lastline),
+            'firstline': firstline,
+            'lastline': lastline,
+            'num_lines': num_lines,
             'mime-type': u'text/html' if dbdict['type'] == 'h' else u'text/plain',
             'filename': dbdict['slug']})
 
+    def _iterChunks(self, logid, logtype, firstline, lastline):
+        # yields one Deferred per stored chunk; each Deferred must have fired
+        # before the next one is requested, as it advances the position
+        pos = [firstline]
+
+        def gotChunk(res):
+            content, chunk_lastline = res
+            if chunk_lastline is None:
+                # the log is shorter than advertised
+                pos[0] = lastline + 1
+                return u''
+            pos[0] = chunk_lastline + 1
+            if logtype == 's':
+                content = u"\n".join([line[1:]
+                                      for line in content.splitlines()])
+                if pos[0] <= lastline:
+                    content += u"\n"
+            return content
+
+        while pos[0] <= lastline:
+            d = self.master.db.logs.getLogLinesChunk(logid, pos[0], lastline)
+            d.addCallback(gotChunk)
+            yield d
+
+    @defer.inlineCallbacks
+    def get(self, resultSpec, kwargs):
+        data = yield self.stream(resultSpec, kwargs)
+        if data is None:
+            return
+
+        pieces = []
+        for d in data['chunks']:
+            piece = yield d
+            pieces.append(piece)
+
+        defer.returnValue({
+            'raw': u''.join(pieces),
+            'mime-type': data['mime-type'],
+            'filename': data['filename']})
+
 
 class LogChunk(base.ResourceType):
 
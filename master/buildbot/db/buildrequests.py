@@ -82,7 +82,11 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
         return self.db.pool.do(thd)
 
     def getBuildRequests(self, builderid=None, complete=None, claimed=None,
-                         bsid=None, branch=None, repository=None, resultSpec=None):
+                         bsid=None, branch=None, repository=None, resultSpec=None,
+                         brids=None):
+        assert resultSpec is None or brids is None, \
+            "resultSpec cannot be applied to requests fetched by brids"
+
         def thd(conn):
             reqs_tbl = self.db.model.buildrequests
             claims_tbl = self.db.model.buildrequest_claims
@@ -115,6 +119,16 @@ class BuildRequestsConnectorComponent(base.DBConnectorComponent):
             if repository is not None:
                 q = q.where(sstamps_tbl.c.repository == repository)
 
+            if brids is not None:
+                # we'll need to batch the brids into groups of 100, so that the
+                # parameter lists supported by the DBAPI aren't exhausted
+                rv = []
+                for batch in self.doBatch(brids, 100):
+                    res = conn.execute(q.where(reqs_tbl.c.id.in_(batch)))
+                    rv.extend([self._brdictFromRow(row, self.db.master.masterid)
+                               for row in res.fetchall()])
+                return rv
+
             if resultSpec is not None:
                 return resultSpec.thd_execute(
                     conn, q,
@@ -25,6 +25,7 @@ from twisted.internet import reactor
 
 from buildbot.db import NULL
 from buildbot.db import base
+from buildbot.process.results import RETRY
 from buildbot.util import epoch2datetime
 
 
@@ -52,6 +53,25 @@ class BuildsConnectorComponent(base.DBConnectorComponent):
             (self.db.model.builds.c.builderid == builderid) &
             (self.db.model.builds.c.number == number))
 
+    def getPreviousBuild(self, builderid, number):
+        def thd(conn):
+            tbl = self.db.model.builds
+            # builds only get results once finished, so this also skips the
+            # running builds
+            q = tbl.select(whereclause=((tbl.c.builderid == builderid) &
+                                        (tbl.c.number < number) &
+                                        (tbl.c.results != NULL) &
+                                        (tbl.c.results != RETRY)),
+                           order_by=[sa.desc(tbl.c.number)],
+                           limit=1)
+            res = conn.execute(q)
+            row = res.fetchone()
+            res.close()
+            if row:
+                return self._builddictFromRow(row)
+            return None
+        return self.db.pool.do(thd)
+
     def _getRecentBuilds(self, whereclause, offset=0, limit=1):
         def thd(conn):
             tbl = self.db.model.builds
@@ -122,6 +142,21 @@ class BuildsConnectorComponent(base.DBConnectorComponent):
 
         return self.db.pool.do(thd)
 
+    def getBuildsForBuildRequests(self, buildrequestids):
+        def thd(conn):
+            tbl = self.db.model.builds
+            rv = []
+            # batch the ids so that the parameter lists supported by the
+            # DBAPI aren't exhausted
+            for batch in self.doBatch(buildrequestids, 100):
+                q = tbl.select(whereclause=tbl.c.buildrequestid.in_(batch))
+                res = conn.execute(q)
+                rv.extend(self._builddictFromRow(row)
+                          for row in res.fetchall())
+            rv.sort(key=lambda bdict: bdict['id'])
+            return rv
+        return self.db.pool.do(thd)
+
     def addBuild(self, builderid, buildrequestid, workerid, masterid,
                  state_string, _reactor=reactor, _race_hook=None):
         started_at = _reactor.seconds()
@@ -184,6 +219,23 @@ class BuildsConnectorComponent(base.DBConnectorComponent):
             return dict(props)
         return self.db.pool.do(thd)
 
+    def getBuildPropertiesForBuilds(self, buildids):
+        def thd(conn):
+            bp_tbl = self.db.model.build_properties
+            rv = dict((bid, {}) for bid in buildids)
+            # we'll need to batch the buildids into groups of 100, so that the
+            # parameter lists supported by the DBAPI aren't exhausted
+            for batch in self.doBatch(list(rv), 100):
+                q = sa.select(
+                    [bp_tbl.c.buildid, bp_tbl.c.name, bp_tbl.c.value,
+                     bp_tbl.c.source],
+                    whereclause=(bp_tbl.c.buildid.in_(batch)))
+                for row in conn.execute(q):
+                    prop = (json.loads(row.value), row.source)
+                    rv[row.buildid][row.name] = prop
+            return rv
+        return self.db.pool.do(thd)
+
     def setBuildProperty(self, bid, name, value, source):
         """ A kind of create_or_update, that's between one or two queries per
         call """
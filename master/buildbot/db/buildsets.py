@@ -163,7 +163,7 @@ class BuildsetsConnectorComponent(base.DBConnectorComponent):
             return self._thd_row2dict(conn, row)
         return self.db.pool.do(thd)
 
-    def getBuildsets(self, complete=None, resultSpec=None):
+    def getBuildsets(self, complete=None, resultSpec=None, bsids=None):
         def thd(conn):
             bs_tbl = self.db.model.buildsets
             q = bs_tbl.select()
@@ -173,6 +173,18 @@ class BuildsetsConnectorComponent(base.DBConnectorComponent):
                 else:
                     q = q.where((bs_tbl.c.complete == 0) |
                                 (bs_tbl.c.complete == NULL))
+            if bsids is not None:
+                # we'll need to batch the bsids into groups of 100, so that the
+                # parameter lists supported by the DBAPI aren't exhausted
+                rv = []
+                for batch in self.doBatch(bsids, 100):
+                    rows = conn.execute(
+                        q.where(bs_tbl.c.id.in_(batch))).fetchall()
+                    sourcestamps = self._thd_getSourcestampIds(conn, batch)
+                    rv.extend([self._thd_row2dict(conn, row,
+                                                  sourcestamps[row.id])
+                               for row in rows])
+                return rv
             if resultSpec is not None:
                 return resultSpec.thd_execute(conn, q, lambda x: self._thd_row2dict(conn, x))
             res = conn.execute(q)
@@ -225,12 +237,43 @@ class BuildsetsConnectorComponent(base.DBConnectorComponent):
             return BsProps(ret)
         return self.db.pool.do(thd)
 
-    def _thd_row2dict(self, conn, row):
-        # get sourcestamps
+    def getBuildsetPropertiesForBuildsets(self, bsids):
+        def thd(conn):
+            bsp_tbl = self.db.model.buildset_properties
+            rv = dict((bsid, BsProps()) for bsid in bsids)
+            # we'll need to batch the bsids into groups of 100, so that the
+            # parameter lists supported by the DBAPI aren't exhausted
+            for batch in self.doBatch(list(rv), 100):
+                q = sa.select(
+                    [bsp_tbl.c.buildsetid, bsp_tbl.c.property_name,
+                     bsp_tbl.c.property_value],
+                    whereclause=(bsp_tbl.c.buildsetid.in_(batch)))
+                for row in conn.execute(q):
+                    try:
+                        properties = json.loads(row.property_value)
+                        rv[row.buildsetid][row.property_name] = \
+                            tuple(properties)
+                    except ValueError:
+                        pass
+            return rv
+        return self.db.pool.do(thd)
+
+    def _thd_getSourcestampIds(self, conn, bsids):
         tbl = self.db.model.buildset_sourcestamps
-        sourcestamps = [r.sourcestampid for r in
-                        conn.execute(sa.select([tbl.c.sourcestampid],
-                                               (tbl.c.buildsetid == row.id))).fetchall()]
+        rv = dict((bsid, []) for bsid in bsids)
+        q = sa.select([tbl.c.buildsetid, tbl.c.sourcestampid],
+                      tbl.c.buildsetid.in_(bsids))
+        for r in conn.execute(q.order_by(tbl.c.id)).fetchall():
+            rv[r.buildsetid].append(r.sourcestampid)
+        return rv
+
+    def _thd_row2dict(self, conn, row, sourcestamps=None):
+        # get sourcestamps, unless they were fetched along with other buildsets
+        if sourcestamps is None:
+            tbl = self.db.model.buildset_sourcestamps
+            sourcestamps = [r.sourcestampid for r in
+                            conn.execute(sa.select([tbl.c.sourcestampid],
+                                                   (tbl.c.buildsetid == row.id))).fetchall()]
 
         def mkdt(epoch):
             if epoch:
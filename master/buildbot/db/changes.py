@@ -202,17 +202,83 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
             toCbChange = toChanges.get(cb) or {}
             if change and change['changeid'] != toCbChange.get('changeid'):
                 changes.append(change)
-                while ((toCbChange.get('changeid') not in change['parent_changeids']) and
-                       change['parent_changeids']):
-                    # For the moment, a Change only have 1 parent.
-                    change = yield self.master.db.changes.getChange(change['parent_changeids'][0])
-                    # http://trac.buildbot.net/ticket/3461 sometimes,
-                    # parent_changeids could be corrupted
-                    if change is None:
-                        break
-                    changes.append(change)
+                ancestors = yield self._getChangeAncestors(
+                    change, toCbChange.get('changeid'))
+                changes.extend(ancestors)
         defer.returnValue(changes)
 
+    def _getChangeAncestors(self, change, stop_changeid):
+        """
+        Get the ancestors of a change, most recent first, up to but excluding
+        the change C{stop_changeid}, with a single database round trip
+        """
+        # For the moment, a Change only have 1 parent.
+        if not change['parent_changeids']:
+            return defer.succeed([])
+
+        def thd(conn):
+            changeids = self._thd_getAncestorChangeIds(
+                conn, change['parent_changeids'][0], stop_changeid)
+            if change['changeid'] in changeids:
+                changeids = changeids[:changeids.index(change['changeid'])]
+            chdicts = self._thd_getChanges(conn, changeids)
+            return [chdicts[changeid] for changeid in changeids]
+        return self.db.pool.do(thd)
+
+    def _thd_supportsRecursiveCTE(self, conn):
+        dialect = conn.dialect.name
+        if dialect == 'postgresql':
+            return True
+        if dialect == 'sqlite':
+            return self.db.pool.get_sqlite_version() >= (3, 8, 3)
+        # MySQL only supports them since 8.0 (and MariaDB since 10.2), so it
+        # uses the portable walk
+        return False
+
+    def _thd_getAncestorChangeIds(self, conn, changeid, stop_changeid):
+        # returns the ids of the changes from changeid up its ancestry,
+        # stopping before stop_changeid
+        changes_tbl = self.db.model.changes
+        if self._thd_supportsRecursiveCTE(conn):
+            ancestry = sa.select(
+                [changes_tbl.c.changeid, changes_tbl.c.parent_changeids],
+                whereclause=(changes_tbl.c.changeid == changeid)
+            ).cte('ancestry', recursive=True)
+            parents = changes_tbl.alias('parents')
+            wc = (parents.c.changeid == ancestry.c.parent_changeids)
+            if stop_changeid is not None:
+                wc = wc & (parents.c.changeid != stop_changeid)
+            # UNION rather than UNION ALL, so that corrupted parent_changeids
+            # forming a cycle cannot make the query run forever
+            ancestry = ancestry.union(sa.select(
+                [parents.c.changeid, parents.c.parent_changeids],
+                whereclause=wc))
+            q = sa.select([ancestry.c.changeid, ancestry.c.parent_changeids])
+            parentids = dict((row.changeid, row.parent_changeids)
+                             for row in conn.execute(q))
+        else:
+            parentids = {}
+            current = changeid
+            while (current and current != stop_changeid and
+                   current not in parentids):
+                q = sa.select([changes_tbl.c.parent_changeids],
+                              whereclause=(changes_tbl.c.changeid == current))
+                row = conn.execute(q).fetchone()
+                if row is None:
+                    break
+                parentids[current] = row.parent_changeids
+                current = row.parent_changeids
+
+        # http://trac.buildbot.net/ticket/3461 sometimes, parent_changeids
+        # could be corrupted, so stop at missing changes and cycles
+        changeids = []
+        current = changeid
+        while (current and current != stop_changeid and
+               current in parentids and current not in changeids):
+            changeids.append(current)
+            current = parentids[current]
+        return changeids
+
     def getChangeFromSSid(self, sourcestampid):
         assert sourcestampid >= 0
 
@@ -346,36 +412,77 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
         change_files_tbl = self.db.model.change_files
         change_properties_tbl = self.db.model.change_properties
 
+        chdict = self._chdict_from_row(ch_row)
+
+        query = change_files_tbl.select(
+            whereclause=(change_files_tbl.c.changeid == ch_row.changeid))
+        rows = conn.execute(query)
+        for r in rows:
+            chdict['files'].append(r.filename)
+
+        query = change_properties_tbl.select(
+            whereclause=(change_properties_tbl.c.changeid == ch_row.changeid))
+        rows = conn.execute(query)
+        for r in rows:
+            self._add_property(chdict, r)
+
+        return chdict
+
+    def _thd_getChanges(self, conn, changeids):
+        # This method must be run in a db.pool thread, and returns a dict
+        # mapping the given change ids to their chdicts, loading the changes
+        # with their files and properties in batches rather than one by one
+        changes_tbl = self.db.model.changes
+        change_files_tbl = self.db.model.change_files
+        change_properties_tbl = self.db.model.change_properties
+
+        chdicts = {}
+        for batch in self.doBatch(changeids, 100):
+            query = changes_tbl.select(
+                whereclause=changes_tbl.c.changeid.in_(batch))
+            for r in conn.execute(query):
+                chdicts[r.changeid] = self._chdict_from_row(r)
+
+            query = change_files_tbl.select(
+                whereclause=change_files_tbl.c.changeid.in_(batch))
+            for r in conn.execute(query):
+                chdicts[r.changeid]['files'].append(r.filename)
+
+            query = change_properties_tbl.select(
+                whereclause=change_properties_tbl.c.changeid.in_(batch))
+            for r in conn.execute(query):
+                self._add_property(chdicts[r.changeid], r)
+
+        return chdicts
+
+    def _chdict_from_row(self, ch_row):
+        # returns a chdict without files and properties given a row from the
+        # 'changes' table
         if ch_row.parent_changeids:
             parent_changeids = [ch_row.parent_changeids]
         else:
             parent_changeids = []
 
-        chdict = ChDict(
+        return ChDict(
             changeid=ch_row.changeid,
             parent_changeids=parent_changeids,
             author=ch_row.author,
-            files=[],  # see below
+            files=[],
             comments=ch_row.comments,
             revision=ch_row.revision,
             when_timestamp=epoch2datetime(ch_row.when_timestamp),
             branch=ch_row.branch,
             category=ch_row.category,
             revlink=ch_row.revlink,
-            properties={},  # see below
+            properties={},
             repository=ch_row.repository,
             codebase=ch_row.codebase,
             project=ch_row.project,
             sourcestampid=int(ch_row.sourcestampid))
 
-        query = change_files_tbl.select(
-            whereclause=(change_files_tbl.c.changeid == ch_row.changeid))
-        rows = conn.execute(query)
-        for r in rows:
-            chdict['files'].append(r.filename)
-
-        # and properties must be given without a source, so strip that, but
-        # be flexible in case users have used a development version where the
+    def _add_property(self, chdict, prop_row):
+        # properties must be given without a source, so strip that, but be
+        # flexible in case users have used a development version where the
         # change properties were recorded incorrectly
         def split_vs(vs):
             try:
@@ -386,14 +493,8 @@ class ChangesConnectorComponent(base.DBConnectorComponent):
                 v, s = vs, "Change"
             return v, s
 
-        query = change_properties_tbl.select(
-            whereclause=(change_properties_tbl.c.changeid == ch_row.changeid))
-        rows = conn.execute(query)
-        for r in rows:
-            try:
-                v, s = split_vs(json.loads(r.property_value))
-                chdict['properties'][r.property_name] = (v, s)
-            except ValueError:
-                pass
-
-        return chdict
+        try:
+            v, s = split_vs(json.loads(prop_row.property_value))
+            chdict['properties'][prop_row.property_name] = (v, s)
+        except ValueError:
+            pass
@@ -16,11 +16,16 @@
 from __future__ import absolute_import
 from __future__ import print_function
 from future.builtins import range
+from future.utils import iteritems
 from future.utils import itervalues
 
+import array
+from collections import OrderedDict
+
 import sqlalchemy as sa
 
 from twisted.internet import defer
+from twisted.python import failure
 from twisted.python import log
 
 from buildbot.db import base
@@ -43,6 +48,25 @@ except ImportError:
             return data
 
 
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    # config.py falls back to another compression method
+    zstandard = None
+
+
+ZSTD_LEVEL = 3
+
+
+def dumps_zstd(data, zdict=None):
+    return zstandard.ZstdCompressor(
+        level=ZSTD_LEVEL, dict_data=zdict).compress(data)
+
+
+def read_zstd(data, zdict=None):
+    return zstandard.ZstdDecompressor(dict_data=zdict).decompress(data)
+
+
 def dumps_gzip(data):
     import zlib
     return zlib.compress(data, 9)
@@ -63,6 +87,48 @@ def read_bz2(data):
     return bz2.decompress(data)
 
 
+class LogChunkLines(object):
+
+    """
+    The decompressed content of a log chunk, along with an index of the offset
+    of each line in that content.  The index is only computed the first time
+    a subset of the lines is requested, and then allows slicing any range of
+    lines without searching for newlines again.
+    """
+
+    __slots__ = ('content', 'offsets')
+
+    # size of each entry in the offsets index
+    OFFSET_SIZE = array.array('I').itemsize
+
+    def __init__(self, content):
+        self.content = content
+        self.offsets = None
+
+    def _computeOffsets(self):
+        offsets = array.array('I', [0])
+        find = self.content.find
+        idx = find(u'\n')
+        while idx != -1:
+            offsets.append(idx + 1)
+            idx = find(u'\n', idx + 1)
+        self.offsets = offsets
+        return offsets
+
+    def getLines(self, first, last):
+        """
+        Return lines FIRST through LAST, counted from the beginning of the
+        chunk, without a trailing newline.
+        """
+        offsets = self.offsets
+        if offsets is None:
+            offsets = self._computeOffsets()
+        start = offsets[first]
+        if last + 1 < len(offsets):
+            return self.content[start:offsets[last + 1] - 1]
+        return self.content[start:]
+
+
 class LogsConnectorComponent(base.DBConnectorComponent):
 
     # Postgres and MySQL will both allow bigger sizes than this.  The limit
@@ -72,10 +138,22 @@ class LogsConnectorComponent(base.DBConnectorComponent):
     COMPRESSION_MODE = {"raw": {"id": 0, "dumps": lambda x: x, "read": lambda x: x},
                         "gz": {"id": 1, "dumps": dumps_gzip, "read": read_gzip},
                         "bz2": {"id": 2, "dumps": dumps_bz2, "read": read_bz2},
-                        "lz4": {"id": 3, "dumps": dumps_lz4, "read": read_lz4}}
+                        "lz4": {"id": 3, "dumps": dumps_lz4, "read": read_lz4},
+                        "zstd": {"id": 4, "dumps": dumps_zstd, "read": read_zstd}}
     COMPRESSION_BYID = dict((x["id"], x) for x in itervalues(COMPRESSION_MODE))
     total_raw_bytes = 0
     total_compressed_bytes = 0
+    # default size, in bytes, of the decompressed chunk cache
+    DEFAULT_CHUNK_CACHE_SIZE = 4 * 1024 * 1024
+    # zstd dictionaries are trained once a builder's logs have at least
+    # ZSTD_DICT_MIN_SAMPLES bytes of content, using at most
+    # ZSTD_DICT_MAX_SAMPLES bytes cut in pieces of ZSTD_DICT_SAMPLE_SIZE; a
+    # failed training is retried after ZSTD_DICT_RETRY_DELAY seconds
+    ZSTD_DICT_SIZE = 65536
+    ZSTD_DICT_SAMPLE_SIZE = 4096
+    ZSTD_DICT_MIN_SAMPLES = 1024 * 1024
+    ZSTD_DICT_MAX_SAMPLES = 16 * 1024 * 1024
+    ZSTD_DICT_RETRY_DELAY = 3600
 
     def _getLog(self, whereclause):
         def thd_getLog(conn):
@@ -108,40 +186,112 @@ class LogsConnectorComponent(base.DBConnectorComponent):
             return [self._logdictFromRow(row) for row in res.fetchall()]
         return self.db.pool.do(thdGetLogs)
 
-    def getLogLines(self, logid, first_line, last_line):
-        def thdGetLogLines(conn):
-            # get a set of chunks that completely cover the requested range
-            tbl = self.db.model.logchunks
+    def getLogsForSteps(self, stepids):
+        def thdGetLogsForSteps(conn):
+            tbl = self.db.model.logs
+            rv = dict((stepid, []) for stepid in stepids)
+            for batch in self.doBatch(list(rv), 100):
+                q = tbl.select(whereclause=tbl.c.stepid.in_(batch))
+                q = q.order_by(tbl.c.id)
+                res = conn.execute(q)
+                for row in res.fetchall():
+                    rv[row.stepid].append(self._logdictFromRow(row))
+            return rv
+        return self.db.pool.do(thdGetLogsForSteps)
+
+    def __init__(self, connector):
+        base.DBConnectorComponent.__init__(self, connector)
+        # decompressed chunks, as LogChunkLines instances keyed by
+        # (logid, first_line, last_line)
+        self.chunkCache = self.master.caches.get_sized_cache(
+            'LogChunks', self.DEFAULT_CHUNK_CACHE_SIZE)
+        # appends waiting to be written, as lists of (content, Deferred)
+        # keyed by logid
+        self._pendingAppends = OrderedDict()
+        self._pendingAppendsSize = 0
+        self._appendsTimer = None
+        self._appendsLock = defer.DeferredLock()
+        # zstd dictionaries by ID, and the ID of the current dictionary of
+        # each builder (None if there is none yet)
+        self._zstdDicts = {}
+        self._builderZstdDictIds = {}
+        self._zstdTrainingAttempts = {}
+
+    def _thdGetChunks(self, conn, logid, first_line, last_line, limit=None):
+        # get the chunks that completely cover the requested range, as a list
+        # of (first_line, last_line, LogChunkLines) tuples.  Only the chunks missing
+        # from the cache are fetched and decompressed.
+        tbl = self.db.model.logchunks
+        q = sa.select([tbl.c.first_line, tbl.c.last_line])
+        q = q.where(tbl.c.logid == logid)
+        q = q.where(tbl.c.first_line <= last_line)
+        q = q.where(tbl.c.last_line >= first_line)
+        q = q.order_by(tbl.c.first_line)
+        if limit is not None:
+            q = q.limit(limit)
+        bounds = [(row.first_line, row.last_line) for row in conn.execute(q)]
+
+        contents = {}
+        missing = []
+        for key in bounds:
+            content = self.chunkCache.get((logid,) + key)
+            if content is None:
+                missing.append(key[0])
+            else:
+                contents[key] = content
+
+        if missing:
             q = sa.select([tbl.c.first_line, tbl.c.last_line,
                            tbl.c.content, tbl.c.compressed])
             q = q.where(tbl.c.logid == logid)
-            q = q.where(tbl.c.first_line <= last_line)
-            q = q.where(tbl.c.last_line >= first_line)
-            q = q.order_by(tbl.c.first_line)
-            rv = []
+            q = q.where(tbl.c.first_line.in_(missing))
             for row in conn.execute(q):
                 # Retrieve associated "reader" and extract the data
-                # Note that row.content is stored as bytes, and our caller expects unicode
-                data = self.COMPRESSION_BYID[
-                    row.compressed]["read"](row.content)
-                content = data.decode('utf-8')
-
-                if row.first_line < first_line:
-                    idx = -1
-                    count = first_line - row.first_line
-                    for _ in range(count):
-                        idx = content.index('\n', idx + 1)
-                    content = content[idx + 1:]
-                if row.last_line > last_line:
-                    idx = len(content) + 1
-                    count = row.last_line - last_line
-                    for _ in range(count):
-                        idx = content.rindex('\n', 0, idx)
-                    content = content[:idx]
-                rv.append(content)
+                # Note that row.content is stored as bytes, and our caller
+                # expects unicode
+                data = self.thdDecompressChunk(conn, row.content,
+                                               row.compressed)
+                content = LogChunkLines(data.decode('utf-8'))
+                key = (row.first_line, row.last_line)
+                # account for the line index, even if it is not computed yet
+                size = len(data) + LogChunkLines.OFFSET_SIZE * (
+                    row.last_line - row.first_line + 1)
+                self.chunkCache.put((logid,) + key, content, size=size)
+                contents[key] = content
+
+        if len(contents) < len(bounds):
+            # the chunks were concurrently rewritten by compressLog; try again
+            return self._thdGetChunks(conn, logid, first_line, last_line,
+                                      limit=limit)
+        return [key + (contents[key],) for key in bounds]
+
+    def _chunkLines(self, chunk, first_line, last_line):
+        # trim the content of a chunk to the requested lines
+        chunk_first_line, chunk_last_line, lines = chunk
+        if chunk_first_line >= first_line and chunk_last_line <= last_line:
+            return lines.content
+        return lines.getLines(
+            max(first_line, chunk_first_line) - chunk_first_line,
+            min(last_line, chunk_last_line) - chunk_first_line)
+
+    def getLogLines(self, logid, first_line, last_line):
+        def thdGetLogLines(conn):
+            chunks = self._thdGetChunks(conn, logid, first_line, last_line)
+            rv = [self._chunkLines(chunk, first_line, last_line)
+                  for chunk in chunks]
             return u'\n'.join(rv) + u'\n' if rv else u''
         return self.db.pool.do(thdGetLogLines)
 
+    def getLogLinesChunk(self, logid, first_line, last_line):
+        def thdGetLogLinesChunk(conn):
+            chunks = self._thdGetChunks(conn, logid, first_line, last_line,
+                                        limit=1)
+            if not chunks:
+                return u'', None
+            content = self._chunkLines(chunks[0], first_line, last_line)
+            return content + u'\n', min(chunks[0][1], last_line)
+        return self.db.pool.do(thdGetLogLinesChunk)
+
     def addLog(self, stepid, name, slug, type):
         assert type in 'tsh', "Log type must be one of t, s, or h"
 
@@ -156,7 +306,7 @@ class LogsConnectorComponent(base.DBConnectorComponent):
                     "log with slug '%r' already exists in this step" % (slug,))
         return self.db.pool.do(thdAddLog)
 
-    def thdCompressChunk(self, chunk):
+    def thdCompressChunk(self, chunk, zdict=None):
         # Set the default compressed mode to "raw" id
         compressed_id = self.COMPRESSION_MODE["raw"]["id"]
         self.total_raw_bytes += len(chunk)
@@ -164,7 +314,10 @@ class LogsConnectorComponent(base.DBConnectorComponent):
         if self.master.config.logCompressionMethod != "raw":
             compressed_mode = self.COMPRESSION_MODE[
                 self.master.config.logCompressionMethod]
-            compressed_chunk = compressed_mode["dumps"](chunk)
+            if zdict is not None:
+                compressed_chunk = compressed_mode["dumps"](chunk, zdict)
+            else:
+                compressed_chunk = compressed_mode["dumps"](chunk)
             # Is it useful to compress the chunk?
             if len(chunk) > len(compressed_chunk):
                 compressed_id = compressed_mode["id"]
@@ -172,49 +325,266 @@ class LogsConnectorComponent(base.DBConnectorComponent):
         self.total_compressed_bytes += len(chunk)
         return chunk, compressed_id
 
-    def thdSplitAndAppendChunk(self, conn, logid, content, first_line):
-        # Break the content up into chunks.  This takes advantage of the
-        # fact that no character but u'\n' maps to b'\n' in UTF-8.
+    def thdDecompressChunk(self, conn, content, compressed_id):
+        mode = self.COMPRESSION_BYID[compressed_id]
+        if mode is self.COMPRESSION_MODE["zstd"]:
+            if zstandard is None:
+                raise RuntimeError(
+                    "log chunks are compressed with zstd, but the zstandard "
+                    "library is not installed ('pip install zstandard')")
+            # the frame header names the dictionary it was compressed with
+            dictid = zstandard.get_frame_parameters(content).dict_id
+            if dictid:
+                return mode["read"](content,
+                                    self._thdGetZstdDict(conn, dictid))
+        return mode["read"](content)
+
+    def _thdGetZstdDict(self, conn, dictid):
+        try:
+            return self._zstdDicts[dictid]
+        except KeyError:
+            pass
+        tbl = self.db.model.logchunk_dictionaries
+        res = conn.execute(sa.select([tbl.c.content]).where(tbl.c.id == dictid))
+        row = res.fetchone()
+        res.close()
+        if row is None:
+            raise KeyError("zstd dictionary %d does not exist" % (dictid,))
+        zdict = zstandard.ZstdCompressionDict(row.content)
+        # compressing a chunk otherwise digests the whole dictionary again
+        zdict.precompute_compress(level=ZSTD_LEVEL)
+        self._zstdDicts[dictid] = zdict
+        return zdict
+
+    def _thdGetLogsBuilderIds(self, conn, logids):
+        model = self.db.model
+        rv = {}
+        for batch in self.doBatch(logids, 100):
+            q = sa.select([model.logs.c.id, model.builds.c.builderid])
+            q = q.select_from(
+                model.logs
+                .join(model.steps, model.steps.c.id == model.logs.c.stepid)
+                .join(model.builds, model.builds.c.id == model.steps.c.buildid))
+            q = q.where(model.logs.c.id.in_(batch))
+            res = conn.execute(q)
+            rv.update((row.id, row.builderid) for row in res)
+            res.close()
+        return rv
+
+    def _thdGetBuilderZstdDict(self, conn, builderid, train=False):
+        # return the zstd dictionary to use for the logs of this builder, or
+        # None; if TRAIN is true, try to train one if there is none yet
+        if self.master.config.logCompressionMethod != "zstd":
+            return None
+        if builderid not in self._builderZstdDictIds:
+            tbl = self.db.model.logchunk_dictionaries
+            q = sa.select([tbl.c.id])
+            q = q.where(tbl.c.builderid == builderid)
+            q = q.order_by(tbl.c.created_at.desc()).limit(1)
+            self._builderZstdDictIds[builderid] = conn.execute(q).scalar()
+        dictid = self._builderZstdDictIds[builderid]
+        if dictid is None and train:
+            dictid = self._thdTrainZstdDict(conn, builderid)
+        if dictid is None:
+            return None
+        return self._thdGetZstdDict(conn, dictid)
+
+    def _thdTrainZstdDict(self, conn, builderid):
+        now = self.db.pool.reactor.seconds()
+        last_attempt = self._zstdTrainingAttempts.get(builderid)
+        if last_attempt is not None and \
+                now - last_attempt < self.ZSTD_DICT_RETRY_DELAY:
+            return None
+        self._zstdTrainingAttempts[builderid] = now
+
+        # use the most recent log content of this builder as samples
+        model = self.db.model
+        tbl = model.logchunks
+        q = sa.select([tbl.c.content, tbl.c.compressed])
+        q = q.select_from(
+            tbl.join(model.logs, model.logs.c.id == tbl.c.logid)
+            .join(model.steps, model.steps.c.id == model.logs.c.stepid)
+            .join(model.builds, model.builds.c.id == model.steps.c.buildid))
+        q = q.where(model.builds.c.builderid == builderid)
+        q = q.order_by(tbl.c.logid.desc(), tbl.c.first_line)
+        samples = []
+        samples_size = 0
+        res = conn.execute(q)
+        for row in res:
+            data = self.thdDecompressChunk(conn, row.content, row.compressed)
+            for i in range(0, len(data), self.ZSTD_DICT_SAMPLE_SIZE):
+                samples.append(data[i:i + self.ZSTD_DICT_SAMPLE_SIZE])
+            samples_size += len(data)
+            if samples_size >= self.ZSTD_DICT_MAX_SAMPLES:
+                break
+        res.close()
+        if samples_size < self.ZSTD_DICT_MIN_SAMPLES:
+            return None
+
+        try:
+            zdict = zstandard.train_dictionary(self.ZSTD_DICT_SIZE, samples)
+        except zstandard.ZstdError as e:
+            log.msg("could not train a zstd dictionary for builder %d: %s"
+                    % (builderid, e))
+            return None
+        zdict.precompute_compress(level=ZSTD_LEVEL)
+        dictid = zdict.dict_id()
+        conn.execute(model.logchunk_dictionaries.insert(),
+                     dict(id=dictid, builderid=builderid,
+                          content=zdict.as_bytes(), created_at=int(now)))
+        self._zstdDicts[dictid] = zdict
+        self._builderZstdDictIds[builderid] = dictid
+        return dictid
+
+    def thdSplitChunks(self, logid, content, first_line, zdict=None):
+        # Break the content up into chunks, returning the rows to insert and
+        # the last line.  This takes advantage of the fact that no character
+        # but u'\n' maps to b'\n' in UTF-8.
+        rows = []
         remaining = content
         chunk_first_line = last_line = first_line
         while remaining:
             chunk, remaining = self._splitBigChunk(remaining, logid)
             last_line = chunk_first_line + chunk.count(b'\n')
 
-            chunk, compressed_id = self.thdCompressChunk(chunk)
-            conn.execute(self.db.model.logchunks.insert(),
-                         dict(logid=logid, first_line=chunk_first_line,
-                              last_line=last_line, content=chunk,
-                              compressed=compressed_id)).close()
+            chunk, compressed_id = self.thdCompressChunk(chunk, zdict)
+            rows.append(dict(logid=logid, first_line=chunk_first_line,
+                             last_line=last_line, content=chunk,
+                             compressed=compressed_id))
             chunk_first_line = last_line + 1
-        conn.execute(self.db.model.logs.update(whereclause=(self.db.model.logs.c.id == logid)),
-                     num_lines=last_line + 1).close()
-        return first_line, last_line
-
-    def thdAppendLog(self, conn, logid, content):
-        # check for trailing newline and strip it for storage -- chunks omit
-        # the trailing newline
-        assert content[-1] == u'\n'
-        # Note that row.content is stored as bytes, and our caller is sending unicode
-        content = content[:-1].encode('utf-8')
-        q = sa.select([self.db.model.logs.c.num_lines])
-        q = q.where(self.db.model.logs.c.id == logid)
-        res = conn.execute(q)
-        num_lines = res.fetchone()
-        res.close()
-        if not num_lines:
-            return  # ignore a missing log
+        return rows, last_line
 
-        return self.thdSplitAndAppendChunk(conn=conn,
-                                           logid=logid,
-                                           content=content,
-                                           first_line=num_lines[0])
+    def thdAppendLogs(self, conn, appends):
+        # APPENDS is a list of (logid, [content, ..]) tuples; all of the
+        # content is appended in a single transaction, and the first and last
+        # line of each content is returned in a dictionary keyed by logid.
+        # Missing logs are ignored, with None results.
+        tbl = self.db.model.logs
+        num_lines = {}
+        for batch in self.doBatch([logid for logid, _ in appends], 100):
+            q = sa.select([tbl.c.id, tbl.c.num_lines])
+            q = q.where(tbl.c.id.in_(batch))
+            res = conn.execute(q)
+            num_lines.update((row.id, row.num_lines) for row in res)
+            res.close()
+
+        builderids = {}
+        if self.master.config.logCompressionMethod == "zstd":
+            builderids = self._thdGetLogsBuilderIds(conn, list(num_lines))
+
+        results = {}
+        chunk_rows = []
+        log_rows = []
+        for logid, contents in appends:
+            if logid not in num_lines:
+                results[logid] = [None] * len(contents)
+                continue
+            first_line = line = num_lines[logid]
+            results[logid] = rv = []
+            for content in contents:
+                # check for trailing newline -- chunks omit it
+                assert content[-1] == u'\n'
+                count = content.count(u'\n')
+                rv.append((line, line + count - 1))
+                line += count
+            # Note that row.content is stored as bytes, and our caller is
+            # sending unicode
+            content = u''.join(contents)[:-1].encode('utf-8')
+            zdict = None
+            if logid in builderids:
+                zdict = self._thdGetBuilderZstdDict(conn, builderids[logid])
+            rows, last_line = self.thdSplitChunks(logid, content, first_line,
+                                                  zdict)
+            chunk_rows.extend(rows)
+            log_rows.append(dict(_logid=logid, num_lines=last_line + 1))
+
+        if log_rows:
+            transaction = conn.begin()
+            # appending bare newlines only updates num_lines
+            if chunk_rows:
+                conn.execute(self.db.model.logchunks.insert(),
+                             chunk_rows).close()
+            q = tbl.update().where(tbl.c.id == sa.bindparam('_logid'))
+            q = q.values(num_lines=sa.bindparam('num_lines'))
+            conn.execute(q, log_rows).close()
+            transaction.commit()
+        return results
 
     def appendLog(self, logid, content):
-        def thdappendLog(conn):
-            return self.thdAppendLog(conn, logid, content)
+        # appends are buffered for up to c['logAppendBatchDelay'] seconds, or
+        # until c['logAppendBatchMaxSize'] characters are waiting, then
+        # written along with those to other logs in a single transaction.
+        # Appends made while a previous batch is being written are buffered
+        # until it is done, even without a delay.
+        # check for trailing newline -- chunks omit it; this is checked here
+        # so that a bad append does not fail the whole batch
+        if not content or content[-1] != u'\n':
+            return defer.fail(AssertionError(
+                "log content must end with a newline"))
+        config = self.master.config
+        d = defer.Deferred()
+        self._pendingAppends.setdefault(logid, []).append((content, d))
+        self._pendingAppendsSize += len(content)
+        if (not config.logAppendBatchDelay or
+                self._pendingAppendsSize >= config.logAppendBatchMaxSize):
+            self._flushAppends()
+        elif self._appendsTimer is None:
+            self._appendsTimer = self.db.pool.reactor.callLater(
+                config.logAppendBatchDelay, self._flushAppends)
+        return d
+
+    def _flushAppends(self):
+        if self._appendsTimer is not None:
+            if self._appendsTimer.active():
+                self._appendsTimer.cancel()
+            self._appendsTimer = None
+        # only one flush runs at a time, so that line numbers are assigned
+        # in order; appends made meanwhile go in the next flush
+        return self._appendsLock.run(self._doFlushAppends)
+
+    def _flushAppendsTo(self, logid):
+        # wait until all of the appends made to this log have been written
+        if logid in self._pendingAppends or self._appendsLock.locked:
+            return self._flushAppends()
+        return defer.succeed(None)
 
-        return self.db.pool.do(thdappendLog)
+    @defer.inlineCallbacks
+    def _doFlushAppends(self):
+        pending = list(iteritems(self._pendingAppends))
+        if not pending:
+            return
+        self._pendingAppends = OrderedDict()
+        self._pendingAppendsSize = 0
+
+        appends = [(logid, [content for content, _ in l])
+                   for logid, l in pending]
+        try:
+            results = yield self.db.pool.do(self.thdAppendLogs, appends)
+        except Exception:
+            if len(pending) == 1:
+                self._failAppends(pending[0][1], failure.Failure())
+                return
+            # nothing was written; append to each log on its own, so that
+            # the failure only affects the log which caused it
+            results = {}
+            for logid, l in pending:
+                try:
+                    res = yield self.db.pool.do(
+                        self.thdAppendLogs,
+                        [(logid, [content for content, _ in l])])
+                except Exception:
+                    self._failAppends(l, failure.Failure())
+                else:
+                    results.update(res)
+
+        for logid, l in pending:
+            if logid in results:
+                for (_, d), res in zip(l, results[logid]):
+                    d.callback(res)
+
+    def _failAppends(self, appends, f):
+        for _, d in appends:
+            d.errback(f)
 
     def _splitBigChunk(self, content, logid):
         """
@@ -247,16 +617,28 @@ class LogsConnectorComponent(base.DBConnectorComponent):
             return truncline, None
         return truncline, content[i + 1:]
 
+    @defer.inlineCallbacks
     def finishLog(self, logid):
         def thdfinishLog(conn):
             tbl = self.db.model.logs
-            q = tbl.update(whereclause=(tbl.c.id == logid))
-            conn.execute(q, complete=1)
-        return self.db.pool.do(thdfinishLog)
+            queue_tbl = self.db.model.logcompaction_queue
+            transaction = conn.begin()
+            q = tbl.update(whereclause=((tbl.c.id == logid) &
+                                        (tbl.c.complete == 0)))
+            res = conn.execute(q, complete=1)
+            # queue the log for compaction, unless it was already finished
+            if res.rowcount:
+                conn.execute(queue_tbl.insert(),
+                             dict(logid=logid,
+                                  queued_at=int(self.db.pool.reactor.seconds())))
+            transaction.commit()
+        # make sure the log is complete before marking it so
+        yield self._flushAppendsTo(logid)
+        yield self.db.pool.do(thdfinishLog)
 
     @defer.inlineCallbacks
     def compressLog(self, logid, force=False):
-        def thdcompressLog(conn):
+        def thdGetGroups(conn):
             tbl = self.db.model.logchunks
             q = sa.select([tbl.c.first_line, tbl.c.last_line, sa.func.length(tbl.c.content),
                            tbl.c.compressed])
@@ -294,55 +676,121 @@ class LogsConnectorComponent(base.DBConnectorComponent):
 
             if totlength == 0:
                 # empty log
-                return 0
+                return 0, [], None
 
             if todo_numchunks > 1 or (force and todo_numchunks):
                 # last chunk group
                 todo_gather_list.append((todo_first_line, todo_last_line))
-            for todo_first_line, todo_last_line in todo_gather_list:
-                # decompress this group of chunks. Note that the content is binary bytes.
-                # no need to decode anything as we are going to put in back stored as bytes anyway
-                q = sa.select(
-                    [tbl.c.first_line, tbl.c.last_line, tbl.c.content, tbl.c.compressed])
-                q = q.where(tbl.c.logid == logid)
-                q = q.where(tbl.c.first_line >= todo_first_line)
-                q = q.where(tbl.c.last_line <= todo_last_line)
-                q = q.order_by(tbl.c.first_line)
-                rows = conn.execute(q)
-                chunk = b""
-                for row in rows:
-                    if chunk:
-                        chunk += b"\n"
-                    chunk += self.COMPRESSION_BYID[row.compressed][
-                        "read"](row.content)
-                rows.close()
-
-                # Transaction is necessary so that readers don't see disappeared chunks
-                transaction = conn.begin()
-
-                # we remove the chunks that we are compressing
-                d = tbl.delete()
-                d = d.where(tbl.c.logid == logid)
-                d = d.where(tbl.c.first_line >= todo_first_line)
-                d = d.where(tbl.c.last_line <= todo_last_line)
-                conn.execute(d).close()
-
-                # and we recompress them in one big chunk
-                chunk, compressed_id = self.thdCompressChunk(chunk)
-                conn.execute(tbl.insert(),
-                             dict(logid=logid, first_line=todo_first_line,
-                                  last_line=todo_last_line, content=chunk,
-                                  compressed=compressed_id)).close()
-                transaction.commit()
 
-            # calculate how many bytes we saved
+            zdict = None
+            if todo_gather_list and \
+                    self.master.config.logCompressionMethod == "zstd":
+                builderid = self._thdGetLogsBuilderIds(conn, [logid]).get(logid)
+                if builderid is not None:
+                    zdict = self._thdGetBuilderZstdDict(conn, builderid,
+                                                        train=True)
+            return totlength, todo_gather_list, zdict
+
+        def thdGatherGroup(conn, todo_first_line, todo_last_line, zdict):
+            tbl = self.db.model.logchunks
+            # decompress this group of chunks. Note that the content is binary bytes.
+            # no need to decode anything as we are going to put in back stored as bytes anyway
+            q = sa.select(
+                [tbl.c.first_line, tbl.c.last_line, tbl.c.content, tbl.c.compressed])
+            q = q.where(tbl.c.logid == logid)
+            q = q.where(tbl.c.first_line >= todo_first_line)
+            q = q.where(tbl.c.last_line <= todo_last_line)
+            q = q.order_by(tbl.c.first_line)
+            rows = conn.execute(q)
+            chunk = b""
+            stale_keys = []
+            for row in rows:
+                stale_keys.append((logid, row.first_line, row.last_line))
+                if chunk:
+                    chunk += b"\n"
+                chunk += self.thdDecompressChunk(conn, row.content,
+                                                 row.compressed)
+            rows.close()
+
+            # Transaction is necessary so that readers don't see disappeared chunks
+            transaction = conn.begin()
+
+            # we remove the chunks that we are compressing
+            d = tbl.delete()
+            d = d.where(tbl.c.logid == logid)
+            d = d.where(tbl.c.first_line >= todo_first_line)
+            d = d.where(tbl.c.last_line <= todo_last_line)
+            conn.execute(d).close()
+
+            # and we recompress them in one big chunk
+            chunk, compressed_id = self.thdCompressChunk(chunk, zdict)
+            conn.execute(tbl.insert(),
+                         dict(logid=logid, first_line=todo_first_line,
+                              last_line=todo_last_line, content=chunk,
+                              compressed=compressed_id)).close()
+            transaction.commit()
+
+            for key in stale_keys:
+                self.chunkCache.remove(key)
+
+        def thdGetSize(conn):
+            tbl = self.db.model.logchunks
             q = sa.select([sa.func.sum(sa.func.length(tbl.c.content))])
             q = q.where(tbl.c.logid == logid)
-            newsize = conn.execute(q).fetchone()[0]
-            return totlength - newsize
+            return conn.execute(q).fetchone()[0]
+
+        yield self._flushAppendsTo(logid)
+        try:
+            totlength, todo_gather_list, zdict = \
+                yield self.db.pool.do(thdGetGroups)
+            # gather each group in its own call, so that compressing a big log
+            # does not hold a database thread for the whole time
+            for todo_first_line, todo_last_line in todo_gather_list:
+                yield self.db.pool.do(thdGatherGroup, todo_first_line,
+                                      todo_last_line, zdict)
+            # calculate how many bytes we saved
+            newsize = (yield self.db.pool.do(thdGetSize)) if totlength else 0
+        finally:
+            # whatever happened, the log does not need to be compacted again
+            yield self.removeLogCompaction(logid)
+        defer.returnValue(totlength - newsize)
+
+    def getLogCompactions(self, masterid=None, limit=None):
+        def thdGetLogCompactions(conn):
+            model = self.db.model
+            tbl = model.logcompaction_queue
+            q = sa.select([tbl.c.logid])
+            if masterid is not None:
+                j = tbl.join(model.logs)
+                j = j.join(model.steps)
+                j = j.join(model.builds)
+                j = j.join(model.masters)
+                # the logs left by inactive masters are compacted by any other
+                q = q.select_from(j).where(sa.or_(
+                    model.builds.c.masterid == masterid,
+                    model.masters.c.active == 0))
+            q = q.order_by(tbl.c.queued_at, tbl.c.logid)
+            if limit is not None:
+                q = q.limit(limit)
+            return [row.logid for row in conn.execute(q).fetchall()]
+        return self.db.pool.do(thdGetLogCompactions)
+
+    def claimLogCompaction(self, logid):
+        def thdClaimLogCompaction(conn):
+            tbl = self.db.model.logcompaction_queue
+            res = conn.execute(tbl.delete(whereclause=(tbl.c.logid == logid)))
+            # several masters may try to compact the logs of an inactive one,
+            # only the one which took the log out of the queue does it
+            claimed = res.rowcount == 1
+            res.close()
+            return claimed
+        return self.db.pool.do(thdClaimLogCompaction)
 
-        saved = yield self.db.pool.do(thdcompressLog)
-        defer.returnValue(saved)
+    def removeLogCompaction(self, logid):
+        def thdRemoveLogCompaction(conn):
+            tbl = self.db.model.logcompaction_queue
+            conn.execute(tbl.delete(whereclause=(tbl.c.logid == logid)))
+        return self.db.pool.do(thdRemoveLogCompaction)
 
     def deleteOldLogChunks(self, older_than_timestamp):
         def thddeleteOldLogs(conn):
@@ -376,6 +824,8 @@ class LogsConnectorComponent(base.DBConnectorComponent):
             res = conn.execute(sa.select([sa.func.count(model.logchunks.c.content)]))
             count2 = res.fetchone()[0]
             res.close()
+            # the deleted chunks could come from any log
+            self.chunkCache.clear()
             return count1 - count2
         return self.db.pool.do(thddeleteOldLogs)
 
@@ -0,0 +1,47 @@
+# This file is part of Buildbot. Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import sqlalchemy as sa
+
+from buildbot.util import sautils
+
+
+def upgrade(migrate_engine):
+    metadata = sa.MetaData()
+    metadata.bind = migrate_engine
+
+    sautils.Table('logs', metadata,
+                  sa.Column('id', sa.Integer, primary_key=True),
+                  # ..
+                  )
+
+    # This table contains the finished logs waiting to be compacted
+    logcompaction_queue = sautils.Table(
+        'logcompaction_queue', metadata,
+        sa.Column('logid', sa.Integer, sa.ForeignKey('logs.id'),
+                  nullable=False),
+        sa.Column('queued_at', sa.Integer, nullable=False),
+    )
+
+    # create the new table
+    logcompaction_queue.create()
+
+    # and an Index on it.
+    idx = sa.Index('logcompaction_queue_logid',
+                   logcompaction_queue.c.logid, unique=True)
+    idx.create()
@@ -191,11 +191,31 @@ class Model(base.DBConnectorComponent):
         sa.Column('first_line', sa.Integer, nullable=False),
         sa.Column('last_line', sa.Integer, nullable=False),
         # log contents, including a terminating newline, encoded in utf-8 or,
-        # if 'compressed' is not 0, compressed with gzip, bzip2 or lz4
+        # if 'compressed' is not 0, compressed with gzip, bzip2, lz4 or zstd
         sa.Column('content', sa.LargeBinary(65536)),
         sa.Column('compressed', sa.SmallInteger, nullable=False),
     )
 
+    # zstd dictionaries trained on the logs of a builder, used to compress
+    # its log chunks
+    logchunk_dictionaries = sautils.Table(
+        'logchunk_dictionaries', metadata,
+        # the dictionary ID, as referenced by zstd frames
+        sa.Column('id', sa.Integer, primary_key=True, autoincrement=False),
+        sa.Column('builderid', sa.Integer, sa.ForeignKey('builders.id'),
+                  nullable=False),
+        sa.Column('content', sa.LargeBinary(65536), nullable=False),
+        sa.Column('created_at', sa.Integer, nullable=False),
+    )
+
+    # finished logs waiting for their chunks to be compacted
+    logcompaction_queue = sautils.Table(
+        'logcompaction_queue', metadata,
+        sa.Column('logid', sa.Integer, sa.ForeignKey('logs.id'),
+                  nullable=False),
+        sa.Column('queued_at', sa.Integer, nullable=False),
+    )
+
     # buildsets
 
     # This table contains input properties for buildsets
@@ -719,6 +739,10 @@ class Model(base.DBConnectorComponent):
     sa.Index('logs_slug', logs.c.stepid, logs.c.slug, unique=True)
     sa.Index('logchunks_firstline', logchunks.c.logid, logchunks.c.first_line)
     sa.Index('logchunks_lastline', logchunks.c.logid, logchunks.c.last_line)
+    sa.Index('logchunk_dictionaries_builderid',
+             logchunk_dictionaries.c.builderid)
+    sa.Index('logcompaction_queue_logid', logcompaction_queue.c.logid,
+             unique=True)
 
     # MySQL creates indexes for foreign keys, and these appear in the
     # reflection.  This is a list of (table, index) names that should be
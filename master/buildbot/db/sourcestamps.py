@@ -131,10 +131,19 @@ class SourceStampsConnectorComponent(base.DBConnectorComponent):
 
         return self.db.pool.do(thd)
 
-    def getSourceStamps(self):
+    def getSourceStamps(self, ssids=None):
         def thd(conn):
             tbl = self.db.model.sourcestamps
             q = tbl.select()
+            if ssids is not None:
+                # we'll need to batch the ssids into groups of 100, so that the
+                # parameter lists supported by the DBAPI aren't exhausted
+                rv = []
+                for batch in self.doBatch(ssids, 100):
+                    res = conn.execute(q.where(tbl.c.id.in_(batch)))
+                    rv.extend([self._rowToSsdict_thd(conn, row)
+                               for row in res.fetchall()])
+                return rv
             res = conn.execute(q)
             return [self._rowToSsdict_thd(conn, row)
                     for row in res.fetchall()]
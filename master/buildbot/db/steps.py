@@ -68,6 +68,19 @@ class StepsConnectorComponent(base.DBConnectorComponent):
             return [self._stepdictFromRow(row) for row in res.fetchall()]
         return self.db.pool.do(thd)
 
+    def getStepsForBuilds(self, buildids):
+        def thd(conn):
+            tbl = self.db.model.steps
+            rv = dict((bid, []) for bid in buildids)
+            for batch in self.doBatch(list(rv), 100):
+                q = tbl.select(whereclause=tbl.c.buildid.in_(batch))
+                q = q.order_by(tbl.c.number)
+                res = conn.execute(q)
+                for row in res.fetchall():
+                    rv[row.buildid].append(self._stepdictFromRow(row))
+            return rv
+        return self.db.pool.do(thd)
+
     def addStep(self, buildid, name, state_string):
         def thd(conn):
             tbl = self.db.model.steps
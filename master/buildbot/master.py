@@ -43,12 +43,17 @@ from buildbot.data import connector as dataconnector
 from buildbot.db import connector as dbconnector
 from buildbot.db import exceptions
 from buildbot.mq import connector as mqconnector
+from buildbot.process import artifactstore
 from buildbot.process import cache
 from buildbot.process import debug
 from buildbot.process import metrics
+from buildbot.process import remotetransfer
 from buildbot.process.botmaster import BotMaster
 from buildbot.process.builder import BuilderControl
+from buildbot.process.logcompactor import LogCompactor
 from buildbot.process.users.manager import UserManagerManager
+from buildbot.reporters.utils import BuildDetailsLoader
+from buildbot.reporters.utils import PreviousBuildCache
 from buildbot.schedulers.manager import SchedulerManager
 from buildbot.secrets.manager import SecretManager
 from buildbot.status.master import Status
@@ -181,6 +186,21 @@ class BuildMaster(service.ReconfigurableServiceMixin, service.MasterService,
         self.data = dataconnector.DataConnector()
         self.data.setServiceParent(self)
 
+        self.logcompactor = LogCompactor()
+        self.logcompactor.setServiceParent(self)
+
+        self.previous_builds = PreviousBuildCache()
+        self.previous_builds.setServiceParent(self)
+
+        self.build_details = BuildDetailsLoader()
+        self.build_details.setServiceParent(self)
+
+        self.artifacts = artifactstore.ArtifactStore()
+        self.artifacts.setServiceParent(self)
+
+        self.extractions = remotetransfer.ExtractionPool()
+        self.extractions.setServiceParent(self)
+
         self.www = wwwservice.WWWService()
         self.www.setServiceParent(self)
 
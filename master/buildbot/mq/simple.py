@@ -23,14 +23,116 @@ from twisted.python import log
 
 from buildbot.mq import base
 from buildbot.util import service
-from buildbot.util import tuplematch
+
+
+class RoutingIndex(object):
+
+    """
+    An index of consumers by their filter, arranged as a trie keyed on the
+    routing-key position.  Each level has a branch for every literal value
+    used at that position, and a separate branch for the C{None} wildcard, so
+    a routing key only visits the branches it can actually match.
+    """
+
+    def __init__(self):
+        # filter length -> root node; a node is [children dict, wildcard
+        # node, {seq: qref}]
+        self.roots = {}
+        self.seq = 0
+
+    def _newNode(self):
+        return [{}, None, None]
+
+    def add(self, qref):
+        self.seq += 1
+        qref.seq = self.seq
+        filter = qref.filter
+        node = self.roots.get(len(filter))
+        if node is None:
+            node = self.roots[len(filter)] = self._newNode()
+        for f in filter:
+            if f is None:
+                if node[1] is None:
+                    node[1] = self._newNode()
+                node = node[1]
+            else:
+                child = node[0].get(f)
+                if child is None:
+                    child = node[0][f] = self._newNode()
+                node = child
+        if node[2] is None:
+            node[2] = {}
+        node[2][qref.seq] = qref
+
+    def remove(self, qref):
+        filter = qref.filter
+        root = self.roots.get(len(filter))
+        if root is None:
+            return
+        path = [root]
+        node = root
+        for f in filter:
+            node = node[1] if f is None else node[0].get(f)
+            if node is None:
+                return
+            path.append(node)
+        if not node[2] or node[2].pop(qref.seq, None) is None:
+            return
+        # prune the branches that no longer lead to any consumer
+        for depth in range(len(filter), 0, -1):
+            node = path[depth]
+            if node[0] or node[1] is not None or node[2]:
+                return
+            parent = path[depth - 1]
+            f = filter[depth - 1]
+            if f is None:
+                parent[1] = None
+            else:
+                del parent[0][f]
+        if not root[0] and root[1] is None and not root[2]:
+            del self.roots[len(filter)]
+
+    def match(self, routingKey):
+        """
+        Return the consumers whose filter matches C{routingKey}, in the order
+        in which they were added.
+        """
+        node = self.roots.get(len(routingKey))
+        if node is None:
+            return []
+        nodes = [node]
+        for k in routingKey:
+            next_nodes = []
+            for node in nodes:
+                child = node[0].get(k)
+                if child is not None:
+                    next_nodes.append(child)
+                if node[1] is not None:
+                    next_nodes.append(node[1])
+            if not next_nodes:
+                return []
+            nodes = next_nodes
+        matched = {}
+        for node in nodes:
+            if node[2]:
+                matched.update(node[2])
+        return [matched[seq] for seq in sorted(matched)]
+
+    def __len__(self):
+        def count(node):
+            n = len(node[2]) if node[2] else 0
+            n += sum(count(c) for c in node[0].values())
+            if node[1] is not None:
+                n += count(node[1])
+            return n
+        return sum(count(root) for root in self.roots.values())
 
 
 class SimpleMQ(service.ReconfigurableServiceMixin, base.MQBase):
 
     def __init__(self):
         base.MQBase.__init__(self)
-        self.qrefs = []
+        self.qrefs = RoutingIndex()
         self.persistent_qrefs = {}
         self.debug = False
 
@@ -42,9 +144,8 @@ class SimpleMQ(service.ReconfigurableServiceMixin, base.MQBase):
     def produce(self, routingKey, data):
         if self.debug:
             log.msg("MSG: %s\n%s" % (routingKey, pprint.pformat(data)))
-        for qref in self.qrefs:
-            if tuplematch.matchTuple(routingKey, qref.filter):
-                qref.invoke(routingKey, data)
+        for qref in self.qrefs.match(routingKey):
+            qref.invoke(routingKey, data)
 
     def startConsuming(self, callback, filter, persistent_name=None):
         if any(not isinstance(k, str) and k is not None for k in filter):
@@ -55,29 +156,27 @@ class SimpleMQ(service.ReconfigurableServiceMixin, base.MQBase):
                 qref.startConsuming(callback)
             else:
                 qref = PersistentQueueRef(self, callback, filter)
-                self.qrefs.append(qref)
+                self.qrefs.add(qref)
                 self.persistent_qrefs[persistent_name] = qref
         else:
             qref = QueueRef(self, callback, filter)
-            self.qrefs.append(qref)
+            self.qrefs.add(qref)
         return defer.succeed(qref)
 
 
 class QueueRef(base.QueueRef):
 
-    __slots__ = ['mq', 'filter']
+    __slots__ = ['mq', 'filter', 'seq']
 
     def __init__(self, mq, callback, filter):
         base.QueueRef.__init__(self, callback)
         self.mq = mq
-        self.filter = filter
+        self.filter = tuple(filter)
+        self.seq = None
 
     def stopConsuming(self):
         self.callback = None
-        try:
-            self.mq.qrefs.remove(self)
-        except ValueError:
-            pass
+        self.mq.qrefs.remove(self)
 
 
 class PersistentQueueRef(QueueRef):
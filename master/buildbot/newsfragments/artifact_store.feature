@@ -0,0 +1 @@
+The new :bb:cfg:`artifactStore` configuration key enables a content-addressed store on the master: :bb:step:`FileUpload` and :bb:step:`MultipleFileUpload` no longer transfer files whose content is already stored, and workers cache the files downloaded by :bb:step:`FileDownload` so that unchanged files are not downloaded again.
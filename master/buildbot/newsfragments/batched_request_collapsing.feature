@@ -0,0 +1 @@
+Collapsing build requests with the default strategy now fetches the unclaimed requests once per builder and the sourcestamps once per buildset, and compares precomputed sourcestamp keys, instead of querying both buildsets for every pair of requests.
@@ -0,0 +1 @@
+The botmaster now finds the builder of a new build request by its id instead of scanning all builders, and bursts of new build requests for a builder only trigger one build distribution run.
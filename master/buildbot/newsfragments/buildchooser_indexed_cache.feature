@@ -0,0 +1 @@
+Build choosers now keep their cache of unclaimed build requests indexed by id, so choosing builds from a deep queue no longer takes time quadratic in its length.
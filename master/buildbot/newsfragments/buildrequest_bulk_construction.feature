@@ -0,0 +1 @@
+Build choosers with a custom ``nextBuild`` now construct the build requests they pass to it with the new ``BuildRequest.fromBrdicts``, which loads the buildsets, their properties and their sourcestamps for all requests in a few queries.
@@ -0,0 +1 @@
+Build request claim, unclaim and completion events are now generated from a single :py:meth:`~buildbot.db.buildrequests.BuildRequestsConnectorComponent.getBuildRequests` call with the new ``brids`` argument, rather than one query per build request.
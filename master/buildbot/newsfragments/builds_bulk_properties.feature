@@ -0,0 +1 @@
+The ``/builds`` REST endpoint and the reporters now load the properties of all requested builds with :py:meth:`~buildbot.db.builds.BuildsConnectorComponent.getBuildPropertiesForBuilds`, instead of issuing one database query per build.
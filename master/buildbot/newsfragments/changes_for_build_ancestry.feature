@@ -0,0 +1 @@
+Getting the changes of a build now fetches the ancestry of its changes with a single database round trip, using a recursive query where the database supports it, instead of one query per change.
@@ -0,0 +1 @@
+New :bb:cfg:`latentWarmPool` option to start latent workers ahead of demand and keep them idle for a while, with metrics on its hit rate and idle cost.
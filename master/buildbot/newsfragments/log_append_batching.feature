@@ -0,0 +1,2 @@
+Log appends made at about the same time, to any number of logs, are now written to the database in a single transaction, considerably reducing the number of transactions when many steps produce output concurrently.
+The new :bb:cfg:`logAppendBatchDelay` and :bb:cfg:`logAppendBatchMaxSize` settings let the master wait for more output before writing a batch.
@@ -0,0 +1,2 @@
+Finished logs are now compacted in the background by a new ``LogCompactor`` master service, working a few logs at a time from a queue kept in the database, instead of all at once when each log finishes.
+Its progress is reported through the metrics as ``LogCompactor.compacted_logs``, ``LogCompactor.bytes_saved`` and ``LogCompactor.compactLog``.
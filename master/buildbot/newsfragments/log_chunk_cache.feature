@@ -0,0 +1 @@
+Decompressed log chunks are now kept in a new ``LogChunks`` cache, whose total size in bytes is configurable in :bb:cfg:`caches`, so that repeatedly reading the same part of a log does not fetch and decompress its chunks again.
@@ -0,0 +1 @@
+Cached log chunks keep an index of their line offsets, so that reading a few lines from the middle of a large log chunk no longer scans the whole chunk for newlines.
@@ -0,0 +1 @@
+:bb:cfg:`logCompressionMethod` now accepts ``zstd``, which compresses build logs with Zstandard using a dictionary trained per builder from its previous logs, and stored in the database.
@@ -0,0 +1 @@
+:bb:step:`MultipleFileUpload` can run several uploads at once with ``maxConcurrentUploads``, and upload the files smaller than ``packThreshold`` bytes together as a single archive.  It gets the type of all sources with a single ``stat`` command on workers 3.3 and later.
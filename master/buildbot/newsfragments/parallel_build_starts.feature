@@ -0,0 +1 @@
+New :bb:cfg:`buildStartConcurrency` option to start builds on several builders at once, with a new ``BuildRequestDistributor.timeToSaturate`` metric.
@@ -0,0 +1 @@
+Reporters now get the previous build of a build with a single database query, skipping the unfinished and retried builds, and share a master-wide cache of previous builds kept up to date from the build finished messages.
@@ -0,0 +1 @@
+Raw log downloads are now streamed to the client one stored chunk at a time instead of being loaded into memory in full, and support the ``Range: lines=<first>-<last>`` HTTP header.
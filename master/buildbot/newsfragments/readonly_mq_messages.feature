@@ -0,0 +1,2 @@
+Messages produced by the data API are no longer deep-copied for every event; they are made read-only with :py:func:`buildbot.util.bbcollections.freeze` and shared by all consumers.
+Consumers which add data to a message must now copy it first.
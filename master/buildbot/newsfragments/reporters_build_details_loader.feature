@@ -0,0 +1 @@
+Reporters now fetch the details of the builds they report (builds, builders, properties, steps and logs) with one query per kind of detail instead of one per build, and the reporters handling the same buildset or build completion share these fetches.
@@ -0,0 +1 @@
+The default ``simple`` message queue now indexes its consumers by their routing-key filter, so producing a message only visits the matching consumers instead of all of them.
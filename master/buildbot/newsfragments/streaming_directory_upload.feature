@@ -0,0 +1 @@
+:bb:step:`DirectoryUpload` streams the directory tarball: the worker sends it while creating it and the master extracts it in a thread while it arrives, instead of each side storing it in a temporary file and the master extracting it on the reactor thread.
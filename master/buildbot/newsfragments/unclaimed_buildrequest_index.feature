@@ -0,0 +1 @@
+The master now keeps an in-memory index of the unclaimed build requests of each builder, updated from the build request messages, so that prioritizing builders, choosing builds and collapsing requests no longer query all unclaimed requests from the database each time.
@@ -0,0 +1 @@
+File transfer steps (:bb:step:`FileUpload`, :bb:step:`DirectoryUpload`, :bb:step:`MultipleFileUpload`, :bb:step:`FileDownload` and :bb:step:`StringDownload`) keep up to ``window`` blocks (8 by default) in flight with workers 3.2 and later, instead of waiting for each block to be acknowledged before sending the next one.
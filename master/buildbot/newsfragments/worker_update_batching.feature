@@ -0,0 +1 @@
+Workers now keep at most two status update calls in flight per builder, and send the updates queued in the meantime to the master in a single call, so chatty commands no longer cost one round trip per output chunk.
@@ -0,0 +1,285 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import errno
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+from collections import OrderedDict
+
+from twisted.internet import defer
+from twisted.internet import threads
+from twisted.python import log
+
+from buildbot.util import service
+
+DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+def hashFile(path, blocksize=1024 * 1024):
+    """
+    Get the SHA-256 digest of the file at C{path}.  This blocks, so call it
+    from a thread.
+    """
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(blocksize)
+            if not data:
+                break
+            h.update(data)
+    return h.hexdigest()
+
+
+def copyFile(src, dest):
+    """
+    Copy C{src} to C{dest}, replacing it at once.  This blocks, so call it
+    from a thread.
+    """
+    tmpdir = os.path.dirname(dest)
+    fd, tmpname = tempfile.mkstemp(dir=tmpdir, suffix='.tmp')
+    os.close(fd)
+    try:
+        shutil.copyfile(src, tmpname)
+        # on windows, os.rename does not automatically unlink
+        if os.path.exists(dest):
+            os.unlink(dest)
+        os.rename(tmpname, dest)
+    except Exception:
+        if os.path.exists(tmpname):
+            os.unlink(tmpname)
+        raise
+
+
+class ArtifactStore(service.AsyncService):
+
+    """
+    Content-addressed store of the files uploaded to the master, enabled by
+    C{c['artifactStore']}.
+
+    The files are kept under their SHA-256 digest, as copies of the files
+    uploaded, so that changing an upload destination does not change the
+    stored file.  A worker uploading a file whose content is already in the
+    store only sends its digest, and the stored file is copied to the new
+    destination.  L{FileDownload} sends the digest of the file it transfers,
+    so that workers can reuse the copy they cached.
+
+    The least recently used files are removed from the store once their
+    total size exceeds C{maxSize}.
+    """
+
+    # number of files whose digest is remembered by hashFile
+    HASHED_FILES = 1000
+
+    def __init__(self):
+        self._basedir = None
+        # digest -> size, least recently used first; None until loaded
+        self._index = None
+        self._totalSize = 0
+        # path -> (stat key, digest), least recently used first
+        self._hashes = OrderedDict()
+        # additions made by addInBackground which did not complete yet
+        self._adding = set()
+
+    @property
+    def enabled(self):
+        return self.master.config.artifactStore is not None
+
+    def _getConfig(self):
+        config = self.master.config.artifactStore
+        basedir = os.path.join(self.master.basedir, config['basedir'])
+        if basedir != self._basedir:
+            self._basedir = basedir
+            self._index = None
+        return config
+
+    def _path(self, digest):
+        return os.path.join(self._basedir, digest[:2], digest)
+
+    @defer.inlineCallbacks
+    def _getIndex(self):
+        self._getConfig()
+        basedir = self._basedir
+        if self._index is None:
+            entries = yield threads.deferToThread(self._thd_scan, basedir)
+            # a concurrent call may have loaded the index in the meantime
+            if self._index is None and basedir == self._basedir:
+                self._index = OrderedDict(
+                    (digest, size) for _, digest, size in sorted(entries))
+                self._totalSize = sum(self._index.values())
+        defer.returnValue(self._index)
+
+    def _thd_scan(self, basedir):
+        # the modification times of the stored files are updated when they
+        # are used, so they order the files after a restart
+        entries = []
+        if not os.path.isdir(basedir):
+            return entries
+        for subdir in os.listdir(basedir):
+            subpath = os.path.join(basedir, subdir)
+            if len(subdir) != 2 or not os.path.isdir(subpath):
+                continue
+            for name in os.listdir(subpath):
+                if not DIGEST_RE.match(name):
+                    continue
+                st = os.stat(os.path.join(subpath, name))
+                entries.append((st.st_mtime, name, st.st_size))
+        return entries
+
+    def _touch(self, digest):
+        self._index[digest] = self._index.pop(digest)
+
+    def _forget(self, digest):
+        self._totalSize -= self._index.pop(digest)
+
+    @defer.inlineCallbacks
+    def lookup(self, digest):
+        """
+        Look for a file in the store, marking it as recently used
+
+        @param digest: SHA-256 digest of the file content
+        @returns: (path, size) of the stored file, or None, via Deferred
+        """
+        index = yield self._getIndex()
+        if not DIGEST_RE.match(digest) or digest not in index:
+            defer.returnValue(None)
+        path = self._path(digest)
+        try:
+            os.utime(path, None)
+        except OSError:
+            # removed behind our back
+            self._forget(digest)
+            defer.returnValue(None)
+        self._touch(digest)
+        defer.returnValue((path, index[digest]))
+
+    @defer.inlineCallbacks
+    def retrieve(self, digest, dest):
+        """
+        Copy the stored file with the given digest to C{dest}
+
+        @returns: True if the file was found, via Deferred
+        """
+        stored = yield self.lookup(digest)
+        if stored is None:
+            defer.returnValue(False)
+        try:
+            yield threads.deferToThread(copyFile, stored[0], dest)
+        except (IOError, OSError) as e:
+            if e.errno != errno.ENOENT:
+                raise
+            # evicted while copying
+            defer.returnValue(False)
+        defer.returnValue(True)
+
+    @defer.inlineCallbacks
+    def add(self, digest, filename):
+        """
+        Add a file to the store, then evict the least recently used files if
+        the store grew too large
+
+        @param digest: SHA-256 digest of the file content
+        @param filename: the file, which is copied into the store
+        """
+        config = self._getConfig()
+        index = yield self._getIndex()
+        if digest in index:
+            self._touch(digest)
+            return
+        size = os.path.getsize(filename)
+        if size > config['maxSize']:
+            return
+        path = self._path(digest)
+        yield threads.deferToThread(self._thd_add, filename, path)
+        if digest not in index:
+            index[digest] = size
+            self._totalSize += size
+        self._evict(config['maxSize'])
+
+    def addInBackground(self, digest, filename):
+        """
+        Like L{add}, without waiting for the file to be copied; errors are
+        logged.  The service waits for these additions when it stops.
+        """
+        d = self.add(digest, filename)
+        d.addErrback(log.err, 'while adding %s to the artifact store'
+                     % (filename,))
+        self._adding.add(d)
+
+        @d.addBoth
+        def done(_):
+            self._adding.discard(d)
+
+    def waitForAdditions(self):
+        """
+        @returns: Deferred firing once the additions made by
+            L{addInBackground} so far are complete
+        """
+        return defer.DeferredList(list(self._adding))
+
+    @defer.inlineCallbacks
+    def stopService(self):
+        yield self.waitForAdditions()
+        yield service.AsyncService.stopService(self)
+
+    def _thd_add(self, filename, path):
+        dirname = os.path.dirname(path)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        copyFile(filename, path)
+
+    def _evict(self, maxSize):
+        while self._totalSize > maxSize and self._index:
+            digest = next(iter(self._index))
+            self._forget(digest)
+            try:
+                os.unlink(self._path(digest))
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    log.err(e, 'while evicting %s from the artifact store'
+                            % (digest,))
+
+    @staticmethod
+    def _statKey(st):
+        # a file replaced by another one has a new inode, and the change time
+        # catches the edits which keep the size and the modification time;
+        # python 2 has no nanosecond timestamps
+        return (st.st_ino, st.st_size,
+                getattr(st, 'st_mtime_ns', st.st_mtime),
+                getattr(st, 'st_ctime_ns', st.st_ctime))
+
+    @defer.inlineCallbacks
+    def hashFile(self, path):
+        """
+        Get the SHA-256 digest of a file on the master, remembering it until
+        the file changes
+
+        @returns: the hexadecimal digest, via Deferred
+        """
+        key = self._statKey(os.stat(path))
+        cached = self._hashes.pop(path, None)
+        if cached is not None and cached[0] == key:
+            digest = cached[1]
+        else:
+            digest = yield threads.deferToThread(hashFile, path)
+        self._hashes[path] = (key, digest)
+        while len(self._hashes) > self.HASHED_FILES:
+            self._hashes.popitem(last=False)
+        defer.returnValue(digest)
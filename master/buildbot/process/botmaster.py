@@ -27,10 +27,12 @@ from buildbot import util
 from buildbot.process import metrics
 from buildbot.process.builder import Builder
 from buildbot.process.buildrequestdistributor import BuildRequestDistributor
+from buildbot.process.buildrequestindex import UnclaimedBuildRequestIndex
 from buildbot.process.results import CANCELLED
 from buildbot.process.results import RETRY
 from buildbot.process.workerforbuilder import States
 from buildbot.util import service
+from buildbot.worker.warmpool import LatentWorkerWarmPool
 
 
 class BotMaster(service.ReconfigurableServiceMixin, service.AsyncMultiService):
@@ -49,6 +51,8 @@ class BotMaster(service.ReconfigurableServiceMixin, service.AsyncMultiService):
         self.builderNames = []
         # builders maps Builder names to instances of bb.p.builder.Builder,
         # which is the master-side object that defines and controls a build.
+        # buildersById maps their builderids to the same instances.
+        self.buildersById = {}
 
         self.watchers = {}
 
@@ -57,13 +61,23 @@ class BotMaster(service.ReconfigurableServiceMixin, service.AsyncMultiService):
 
         self.shuttingDown = False
 
-        # subscription to new build requests
+        # subscription to build request messages
         self.buildrequest_consumer = None
 
+        # an index of the unclaimed build requests, kept up to date from the
+        # build request messages
+        self.brIndex = UnclaimedBuildRequestIndex()
+        self.brIndex.setServiceParent(self)
+
         # a distributor for incoming build requests; see below
         self.brd = BuildRequestDistributor(self)
         self.brd.setServiceParent(self)
 
+        # a pool of latent workers substantiated ahead of demand, if
+        # c['latentWarmPool'] is set
+        self.warmPool = LatentWorkerWarmPool()
+        self.warmPool.setServiceParent(self)
+
     @defer.inlineCallbacks
     def cleanShutdown(self, quickMode=False, stopReactor=True, _reactor=reactor):
         """Shut down the entire process, once all currently-running builds are
@@ -158,26 +172,21 @@ class BotMaster(service.ReconfigurableServiceMixin, service.AsyncMultiService):
 
     @defer.inlineCallbacks
     def startService(self):
-        @defer.inlineCallbacks
-        def buildRequestAdded(key, msg):
-            builderid = msg['builderid']
-            buildername = None
-            # convert builderid to buildername
-            for builder in itervalues(self.builders):
-                if builderid == (yield builder.getBuilderId()):
-                    buildername = builder.name
-                    break
-            if buildername:
-                self.maybeStartBuildsForBuilder(buildername)
-
-        # consume both 'new' and 'unclaimed' build requests
-        startConsuming = self.master.mq.startConsuming
-        self.buildrequest_consumer_new = yield startConsuming(
-            buildRequestAdded,
-            ('buildrequests', None, "new"))
-        self.buildrequest_consumer_unclaimed = yield startConsuming(
-            buildRequestAdded,
-            ('buildrequests', None, 'unclaimed'))
+        def buildRequestEvent(key, msg):
+            # update the index first, so that the builds started below see
+            # this request
+            self.brIndex.handleMessage(key, msg)
+            # any change to the queue may change the demand on the warm pool
+            self.maybeRebalanceWarmPool()
+            # start builds for both 'new' and 'unclaimed' build requests
+            if key[-1] in ('new', 'unclaimed'):
+                builder = self.buildersById.get(msg['builderid'])
+                if builder is not None:
+                    self.maybeStartBuildsForBuilder(builder.name)
+
+        self.buildrequest_consumer = yield self.master.mq.startConsuming(
+            buildRequestEvent,
+            ('buildrequests', None, None))
         yield service.AsyncMultiService.startService(self)
 
     @defer.inlineCallbacks
@@ -195,9 +204,14 @@ class BotMaster(service.ReconfigurableServiceMixin, service.AsyncMultiService):
         # try to start a build for every builder; this is necessary at master
         # startup, and a good idea in any other case
         self.maybeStartBuildsForAllBuilders()
+        self.maybeRebalanceWarmPool()
 
         timer.stop()
 
+    def maybeRebalanceWarmPool(self):
+        if self.master.config.latentWarmPool is not None:
+            self.warmPool.rebalance()
+
     @defer.inlineCallbacks
     def reconfigServiceBuilders(self, new_config):
 
@@ -245,18 +259,21 @@ class BotMaster(service.ReconfigurableServiceMixin, service.AsyncMultiService):
             self.master.masterid,
             [util.ascii2unicode(n) for n in self.builderNames])
 
+        buildersById = {}
+        for builder in itervalues(self.builders):
+            builderid = yield builder.getBuilderId()
+            buildersById[builderid] = builder
+        self.buildersById = buildersById
+
         metrics.MetricCountEvent.log("num_builders",
                                      len(self.builders), absolute=True)
 
         timer.stop()
 
     def stopService(self):
-        if self.buildrequest_consumer_new:
-            self.buildrequest_consumer_new.stopConsuming()
-            self.buildrequest_consumer_new = None
-        if self.buildrequest_consumer_unclaimed:
-            self.buildrequest_consumer_unclaimed.stopConsuming()
-            self.buildrequest_consumer_unclaimed = None
+        if self.buildrequest_consumer:
+            self.buildrequest_consumer.stopConsuming()
+            self.buildrequest_consumer = None
         return service.AsyncMultiService.stopService(self)
 
     def getLockByID(self, lockid):
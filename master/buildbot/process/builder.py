@@ -159,6 +159,9 @@ class Builder(util_service.ReconfigurableServiceMixin,
         @returns: datetime instance or None, via Deferred
         """
         bldrid = yield self.getBuilderId()
+        brIndex = self.master.botmaster.brIndex
+        if brIndex.synced:
+            defer.returnValue(brIndex.getOldestRequestTime(bldrid))
         unclaimed = yield self.master.data.get(
             ('builders', bldrid, 'buildrequests'),
             [resultspec.Filter('claimed', 'eq', [False])])
@@ -46,10 +46,15 @@ class BuildRequestCollapser(object):
     def __init__(self, master, brids):
         self.master = master
         self.brids = brids
+        # collapse keys of the buildsets seen so far, by buildset id
+        self._collapseKeys = {}
 
     @defer.inlineCallbacks
     def _getUnclaimedBrs(self, builderid):
         # Retrieve the list of Brs for all unclaimed builds
+        brIndex = self.master.botmaster.brIndex
+        if brIndex.synced:
+            defer.returnValue(brIndex.getUnclaimedBuildRequests(builderid))
         unclaim_brs = yield self.master.data.get(('builders',
                                                   builderid,
                                                   'buildrequests'),
@@ -61,35 +66,85 @@ class BuildRequestCollapser(object):
         defer.returnValue(unclaim_brs)
 
     @defer.inlineCallbacks
-    def collapse(self):
+    def _getCollapseKey(self, bsid):
+        # the sourcestamps of a buildset are fetched only once, however many
+        # buildrequests and builders it has
+        if bsid not in self._collapseKeys:
+            buildset = yield self.master.data.get(('buildsets', str(bsid)))
+            self._collapseKeys[bsid] = BuildRequest.collapseKey(
+                buildset['sourcestamps'])
+        defer.returnValue(self._collapseKeys[bsid])
+
+    @staticmethod
+    def _isDefaultCollapseRequestsFn(collapseRequestsFn):
+        from buildbot.process.builder import Builder
+        return collapseRequestsFn is Builder._defaultCollapseRequestFn
+
+    @defer.inlineCallbacks
+    def _collapseOnBuilder(self, builderid, brs):
+        bldrdict = yield self.master.data.get(('builders', builderid))
+        # Get the builder object
+        bldr = self.master.botmaster.builders.get(bldrdict['name'])
+        # Get the Collapse BuildRequest function (from the configuration)
+        collapseRequestsFn = bldr.getCollapseRequestsFn() if bldr else None
+        if not collapseRequestsFn:
+            defer.returnValue([])
+
+        unclaim_brs = yield self._getUnclaimedBrs(builderid)
+
         collapseBRs = []
+        if self._isDefaultCollapseRequestsFn(collapseRequestsFn):
+            # the default strategy only compares sourcestamps, so compare
+            # precomputed keys instead of calling it for each pair
+            for br in brs:
+                key = yield self._getCollapseKey(br['buildsetid'])
+                for unclaim_br in unclaim_brs:
+                    if unclaim_br['buildrequestid'] == br['buildrequestid']:
+                        continue
+                    if unclaim_br['buildsetid'] == br['buildsetid']:
+                        collapseBRs.append(unclaim_br)
+                        continue
+                    if key is None:
+                        continue
+                    unclaim_key = yield self._getCollapseKey(
+                        unclaim_br['buildsetid'])
+                    if unclaim_key == key:
+                        collapseBRs.append(unclaim_br)
+        else:
+            for br in brs:
+                for unclaim_br in unclaim_brs:
+                    if unclaim_br['buildrequestid'] == br['buildrequestid']:
+                        continue
+
+                    canCollapse = yield collapseRequestsFn(self.master, bldr, br, unclaim_br)
+                    if canCollapse is True:
+                        collapseBRs.append(unclaim_br)
+
+        defer.returnValue(collapseBRs)
 
+    @defer.inlineCallbacks
+    def collapse(self):
+        # group the new buildrequests by builder, so that each builder is
+        # only examined once
+        builderids = []
+        brsByBuilder = {}
         for brid in self.brids:
-            # Get the BuildRequest object
             br = yield self.master.data.get(('buildrequests', brid))
-            # Retreive the buildername
             builderid = br['builderid']
-            bldrdict = yield self.master.data.get(('builders', builderid))
-            # Get the builder object
-            bldr = self.master.botmaster.builders.get(bldrdict['name'])
-            # Get the Collapse BuildRequest function (from the configuration)
-            collapseRequestsFn = bldr.getCollapseRequestsFn() if bldr else None
-            unclaim_brs = yield self._getUnclaimedBrs(builderid)
-
-            # short circuit if there is no merging to do
-            if not collapseRequestsFn or not unclaim_brs:
-                continue
-
-            for unclaim_br in unclaim_brs:
-                if unclaim_br['buildrequestid'] == br['buildrequestid']:
-                    continue
-
-                canCollapse = yield collapseRequestsFn(self.master, bldr, br, unclaim_br)
-                if canCollapse is True:
-                    collapseBRs.append(unclaim_br)
-
-        brids = [b['buildrequestid'] for b in collapseBRs]
-        if collapseBRs:
+            if builderid not in brsByBuilder:
+                builderids.append(builderid)
+                brsByBuilder[builderid] = []
+            brsByBuilder[builderid].append(br)
+
+        brids = []
+        for builderid in builderids:
+            collapseBRs = yield self._collapseOnBuilder(
+                builderid, brsByBuilder[builderid])
+            for unclaim_br in collapseBRs:
+                if unclaim_br['buildrequestid'] not in brids:
+                    brids.append(unclaim_br['buildrequestid'])
+
+        if brids:
             # Claim the buildrequests
             yield self.master.data.updates.claimBuildRequests(brids)
             # complete the buildrequest with result SKIPPED.
@@ -193,12 +248,96 @@ class BuildRequest(object):
 
     @classmethod
     @defer.inlineCallbacks
-    def _make_br(cls, brid, brdict, master):
+    def fromBrdicts(cls, master, brdicts):
+        """
+        Construct new L{BuildRequest}s from a list of dictionaries, like
+        L{fromBrdict} does for each of them.
+
+        The buildsets, their properties and their sourcestamps are loaded for
+        all the requests at once, and requests from the same buildset share
+        the same sourcestamp objects.
+
+        @param master: current build master
+        @param brdicts: list of build request dictionaries
+
+        @returns: list of L{BuildRequest}, in the order of C{brdicts}, via
+        Deferred
+        """
+        brdicts = list(brdicts)
+        bsids = sorted(set(brdict['buildsetid'] for brdict in brdicts))
+        buildsets = yield cls._loadBuildsets(master, bsids)
+        builderNames = {}
+        for builderid in set(brdict['builderid'] for brdict in brdicts):
+            builder = yield master.db.builders.getBuilder(builderid)
+            builderNames[builderid] = builder['name']
+
+        # everything is loaded already, so constructing the requests one by
+        # one does not wait on the database
+        cache = master.caches.get_cache("BuildRequests", cls._make_br)
+        breqs = []
+        for brdict in brdicts:
+            breq = yield cache.get(
+                brdict['buildrequestid'], brdict=brdict, master=master,
+                buildset=buildsets.get(brdict['buildsetid']),
+                buildername=builderNames[brdict['builderid']])
+            breqs.append(breq)
+        defer.returnValue(breqs)
+
+    @classmethod
+    @defer.inlineCallbacks
+    def _loadBuildsets(cls, master, bsids):
+        # load what build requests need to know about the given buildsets,
+        # with a few queries for all of them; returns a dictionary mapping
+        # bsid to a dictionary with 'reason', 'properties' and 'sources'
+        bsdicts = yield master.db.buildsets.getBuildsets(bsids=bsids)
+        bsprops = yield master.db.buildsets.getBuildsetPropertiesForBuildsets(
+            bsids)
+        ssids = sorted(set(ssid for bsdict in bsdicts
+                           for ssid in bsdict['sourcestamps']))
+        ssdicts = yield master.db.sourcestamps.getSourceStamps(ssids=ssids)
+
+        sourcestamps = {}
+        for ssdict in ssdicts:
+            ss = sourcestamps[ssdict['ssid']] = TempSourceStamp()
+            ss.ssid = ssdict['ssid']
+            ss.branch = ssdict['branch']
+            ss.revision = ssdict['revision']
+            ss.repository = ssdict['repository']
+            ss.project = ssdict['project']
+            ss.codebase = ssdict['codebase']
+            if ssdict['patch_body']:
+                ss.patch = (ssdict['patch_level'], ssdict['patch_body'],
+                            ssdict['patch_subdir'])
+                ss.patch_info = (ssdict['patch_author'],
+                                 ssdict['patch_comment'])
+            else:
+                ss.patch = None
+                ss.patch_info = (None, None)
+            changes = yield master.data.get(("sourcestamps", ss.ssid, "changes"))
+            ss.changes = [TempChange(change) for change in changes]
+
+        buildsets = {}
+        for bsdict in bsdicts:
+            sources = {}
+            for ssid in bsdict['sourcestamps']:
+                ss = sourcestamps[ssid]
+                sources[ss.codebase] = ss
+            buildsets[bsdict['bsid']] = dict(
+                reason=bsdict['reason'],
+                properties=bsprops[bsdict['bsid']],
+                sources=sources)
+        defer.returnValue(buildsets)
+
+    @classmethod
+    @defer.inlineCallbacks
+    def _make_br(cls, brid, brdict, master, buildset=None, buildername=None):
         buildrequest = cls()
         buildrequest.id = brid
         buildrequest.bsid = brdict['buildsetid']
-        builder = yield master.db.builders.getBuilder(brdict['builderid'])
-        buildrequest.buildername = builder['name']
+        if buildername is None:
+            builder = yield master.db.builders.getBuilder(brdict['builderid'])
+            buildername = builder['name']
+        buildrequest.buildername = buildername
         buildrequest.builderid = brdict['builderid']
         buildrequest.priority = brdict['priority']
         dt = brdict['submitted_at']
@@ -206,6 +345,16 @@ class BuildRequest(object):
         buildrequest.master = master
         buildrequest.waitedFor = brdict['waited_for']
 
+        if buildset is not None:
+            # the buildset was loaded by fromBrdicts, along with others
+            buildrequest.reason = buildset['reason']
+            buildrequest.properties = properties.Properties.fromDict(
+                buildset['properties'])
+            assert buildset[
+                'sources'], "buildset must have at least one sourcestamp"
+            buildrequest.sources = buildset['sources']
+            defer.returnValue(buildrequest)
+
         # fetch the buildset to get the reason
         buildset = yield master.db.buildsets.getBuildset(brdict['buildsetid'])
         assert buildset  # schema should guarantee this
@@ -242,6 +391,27 @@ class BuildRequest(object):
 
         defer.returnValue(buildrequest)
 
+    @staticmethod
+    def collapseKey(sourcestamps):
+        """
+        Returns a key for the given sourcestamp dictionaries, as found in the
+        C{sourcestamps} of a buildset, such that the default collapse
+        strategy collapses buildrequests of different buildsets if and only
+        if their keys are equal.  The key is None if the sourcestamps have a
+        patch, as such buildrequests are never collapsed.
+        """
+        # extract sourcestamps, by codebase
+        sources = dict((ss['codebase'], ss) for ss in sourcestamps)
+
+        # anything with a patch won't be collapsed
+        if any(ss['patch'] for ss in itervalues(sources)):
+            return None
+
+        return tuple(sorted(
+            (codebase, ss['revision'], ss['repository'], ss['branch'],
+             ss['project'])
+            for codebase, ss in iteritems(sources)))
+
     @staticmethod
     @defer.inlineCallbacks
     def canBeCollapsed(master, br1, br2):
@@ -261,37 +431,10 @@ class BuildRequest(object):
         otherBuildsets = yield master.data.get(
             ('buildsets', str(br2['buildsetid'])))
 
-        # extract sourcestamps, as dictionaries by codebase
-        selfSources = dict((ss['codebase'], ss)
-                           for ss in selfBuildsets['sourcestamps'])
-        otherSources = dict((ss['codebase'], ss)
-                            for ss in otherBuildsets['sourcestamps'])
-
-        # if the sets of codebases do not match, we can't collapse
-        if set(selfSources) != set(otherSources):
-            defer.returnValue(False)
-            return
-
-        for c, selfSS in iteritems(selfSources):
-            otherSS = otherSources[c]
-            if selfSS['revision'] != otherSS['revision']:
-                defer.returnValue(False)
-                return
-            if selfSS['repository'] != otherSS['repository']:
-                defer.returnValue(False)
-                return
-            if selfSS['branch'] != otherSS['branch']:
-                defer.returnValue(False)
-                return
-            if selfSS['project'] != otherSS['project']:
-                defer.returnValue(False)
-                return
-            # anything with a patch won't be collapsed
-            if selfSS['patch'] or otherSS['patch']:
-                defer.returnValue(False)
-                return
-
-        defer.returnValue(True)
+        # the sourcestamps must match for each codebase, without patches
+        selfKey = BuildRequest.collapseKey(selfBuildsets['sourcestamps'])
+        otherKey = BuildRequest.collapseKey(otherBuildsets['sourcestamps'])
+        defer.returnValue(selfKey is not None and selfKey == otherKey)
 
     def mergeSourceStampsWith(self, others):
         """ Returns one merged sourcestamp for every codebase """
@@ -15,8 +15,10 @@
 
 from __future__ import absolute_import
 from __future__ import print_function
+from future.utils import itervalues
 
 import random
+from collections import OrderedDict
 from datetime import datetime
 
 from dateutil.tz import tzutc
@@ -33,6 +35,40 @@ from buildbot.util import epoch2datetime
 from buildbot.util import service
 
 
+class UnclaimedBrdicts(object):
+    # An ordered collection of brdicts, indexed by buildrequest id, used by
+    # build choosers as their cache of unclaimed build requests.  It behaves
+    # like the list it replaces (iteration, len(), [0], remove), but looking
+    # up and removing a brdict takes constant time, so that choosing builds
+    # from a deep queue is not quadratic.
+
+    def __init__(self, brdicts=()):
+        self._brdicts = OrderedDict(
+            (brdict['buildrequestid'], brdict) for brdict in brdicts)
+
+    def __len__(self):
+        return len(self._brdicts)
+
+    def __iter__(self):
+        return iter(itervalues(self._brdicts))
+
+    def __getitem__(self, index):
+        if index == 0:
+            for brdict in itervalues(self._brdicts):
+                return brdict
+            raise IndexError(index)
+        return list(itervalues(self._brdicts))[index]
+
+    def get(self, brid):
+        return self._brdicts.get(brid)
+
+    def remove(self, brdict):
+        try:
+            del self._brdicts[brdict['buildrequestid']]
+        except KeyError:
+            raise ValueError("brdict not in unclaimed brdicts")
+
+
 class BuildChooserBase(object):
     #
     # WARNING: This API is experimental and in active development.
@@ -82,16 +118,21 @@ class BuildChooserBase(object):
         # exists, this function does nothing. If a refetch is desired, set
         # the self.unclaimedBrdicts to None before calling."""
         if self.unclaimedBrdicts is None:
-            # TODO: use order of the DATA API
-            brdicts = yield self.master.data.get(('builders',
-                                                  (yield self.bldr.getBuilderId()),
-                                                  'buildrequests'),
-                                                 [resultspec.Filter('claimed',
-                                                                    'eq',
-                                                                    [False])])
-            # sort by submitted_at, so the first is the oldest
-            brdicts.sort(key=lambda brd: brd['submitted_at'])
-            self.unclaimedBrdicts = brdicts
+            builderid = yield self.bldr.getBuilderId()
+            brIndex = self.master.botmaster.brIndex
+            if brIndex.synced:
+                brdicts = brIndex.getUnclaimedBuildRequests(builderid)
+            else:
+                # TODO: use order of the DATA API
+                brdicts = yield self.master.data.get(('builders',
+                                                      builderid,
+                                                      'buildrequests'),
+                                                     [resultspec.Filter('claimed',
+                                                                        'eq',
+                                                                        [False])])
+                # sort by submitted_at, so the first is the oldest
+                brdicts.sort(key=lambda brd: brd['submitted_at'])
+            self.unclaimedBrdicts = UnclaimedBrdicts(brdicts)
         defer.returnValue(self.unclaimedBrdicts)
 
     @defer.inlineCallbacks
@@ -113,11 +154,7 @@ class BuildChooserBase(object):
         if breq is None:
             return None
 
-        brid = breq.id
-        for brdict in self.unclaimedBrdicts:
-            if brid == brdict['buildrequestid']:
-                return brdict
-        return None
+        return self.unclaimedBrdicts.get(breq.id)
 
     def _removeBuildRequest(self, breq):
         # Remove a BuildrRequest object (and its brdict)
@@ -133,11 +170,21 @@ class BuildChooserBase(object):
         if breq.id in self.breqCache:
             del self.breqCache[breq.id]
 
+    @defer.inlineCallbacks
     def _getUnclaimedBuildRequests(self):
-        # Retrieve the list of BuildRequest objects for all unclaimed builds
-        return defer.gatherResults([
+        # Retrieve the list of BuildRequest objects for all unclaimed builds,
+        # constructing those not cached yet all at once
+        missing = [brdict for brdict in self.unclaimedBrdicts
+                   if brdict['buildrequestid'] not in self.breqCache]
+        if missing:
+            breqs = yield BuildRequest.fromBrdicts(self.master, missing)
+            for brdict, breq in zip(missing, breqs):
+                if breq:
+                    self.breqCache[brdict['buildrequestid']] = breq
+        breqs = yield defer.gatherResults([
             self._getBuildRequestForBrdict(brdict)
             for brdict in self.unclaimedBrdicts])
+        defer.returnValue(breqs)
 
 
 class BasicBuildChooser(BuildChooserBase):
@@ -320,11 +367,28 @@ class BuildRequestDistributor(service.AsyncMultiService):
         # sorted list of names of builders that need their maybeStartBuild
         # method invoked.
         self._pending_builders = []
+        # names of the builders passed to maybeStartBuildsOn which were not
+        # picked by the activity loop yet; calls for those builders are no-ops
+        self._queuedBuilders = set()
         self.activity_lock = defer.DeferredLock()
         self.active = False
 
         self._pendingMSBOCalls = []
 
+        # with c['buildStartConcurrency'] > 1, builds are started on several
+        # builders at once: these are the names of those builders, mapped to
+        # the Deferred of their run
+        self._startingBuilders = {}
+        # the workers getting a build, mapped to the names of the builders to
+        # run again once that is done
+        self._startingWorkers = {}
+        # builders to run again once their current run is done
+        self._rerunBuilders = set()
+        # fired to wake up an activity loop waiting for running builders
+        self._activityWakeup = None
+        # when the last build was started, for the timeToSaturate metric
+        self._lastBuildStartedAt = None
+
     @defer.inlineCallbacks
     def stopService(self):
         # Lots of stuff happens asynchronously here, so we need to let it all
@@ -332,6 +396,9 @@ class BuildRequestDistributor(service.AsyncMultiService):
         # activities; then the loop will stop calling itself, since
         # self.running is false.
         yield self.activity_lock.run(service.AsyncService.stopService, self)
+        self._wakeupActivityLoop()
+        if self._startingBuilders:
+            yield defer.DeferredList(list(self._startingBuilders.values()))
 
         # now let any outstanding calls to maybeStartBuildsOn to finish, so
         # they don't get interrupted in mid-stride.  This tends to be
@@ -352,6 +419,14 @@ class BuildRequestDistributor(service.AsyncMultiService):
         if not self.running:
             return
 
+        # coalesce the calls made for builders that are already waiting for
+        # the activity loop, e.g. on bursts of new build requests
+        new_builders = [n for n in new_builders
+                        if n not in self._queuedBuilders]
+        if not new_builders:
+            return
+        self._queuedBuilders.update(new_builders)
+
         d = self._maybeStartBuildsOn(new_builders)
         self._pendingMSBOCalls.append(d)
 
@@ -378,15 +453,24 @@ class BuildRequestDistributor(service.AsyncMultiService):
                 existing_pending = set(self._pending_builders)
 
                 # then sort the new, expanded set of builders
+                sorting = existing_pending | new_builders
                 self._pending_builders = \
-                    yield self._sortBuilders(
-                        list(existing_pending | new_builders))
+                    yield self._sortBuilders(list(sorting))
+                # the sort drops the builders which are gone, and a custom
+                # prioritizeBuilders may drop others: they are no longer
+                # waiting for the activity loop
+                self._queuedBuilders.difference_update(
+                    sorting - set(self._pending_builders))
 
                 # start the activity loop, if we aren't already
                 # working on that.
                 if not self.active:
                     self._activityLoop()
+                else:
+                    self._wakeupActivityLoop()
             except Exception:
+                self._queuedBuilders.difference_update(
+                    new_builders - set(self._pending_builders))
                 log.err(Failure(),
                         "while attempting to start builds on %s" % self.name)
 
@@ -472,8 +556,17 @@ class BuildRequestDistributor(service.AsyncMultiService):
 
         timer = metrics.Timer('BuildRequestDistributor._activityLoop()')
         timer.start()
+        started_at = self.master.reactor.seconds()
+        self._lastBuildStartedAt = None
+
+        # the number of builders to start builds on at once
+        concurrency = self.master.config.buildStartConcurrency
+        slots = defer.DeferredSemaphore(concurrency)
 
         while True:
+            # wait for a free slot before picking the next builder, so that
+            # it is the one with the highest priority at that time
+            yield slots.acquire()
             yield self.activity_lock.acquire()
 
             # lock pending_builders, pop an element from it, and release
@@ -482,30 +575,76 @@ class BuildRequestDistributor(service.AsyncMultiService):
             # bail out if we shouldn't keep looping
             if not self.running or not self._pending_builders:
                 self.pending_builders_lock.release()
+                slots.release()
                 self.activity_lock.release()
+                if self.running and self._startingBuilders:
+                    # wait for new builders, or for a running builder to be
+                    # done, as it may need to run again
+                    self._activityWakeup = defer.Deferred()
+                    yield self._activityWakeup
+                    continue
                 break
 
             bldr_name = self._pending_builders.pop(0)
+            self._queuedBuilders.discard(bldr_name)
             self.pending_builders_lock.release()
 
-            # get the actual builder object
-            bldr = self.botmaster.builders.get(bldr_name)
-            try:
-                if bldr:
-                    yield self._maybeStartBuildsOnBuilder(bldr)
-            except Exception:
-                log.err(Failure(),
-                        "from maybeStartBuild for builder '%s'" % (bldr_name,))
+            if bldr_name in self._startingBuilders:
+                # never run a builder twice at once; run it again instead
+                self._rerunBuilders.add(bldr_name)
+                slots.release()
+                self.activity_lock.release()
+                continue
 
+            d = self._startingBuilders[bldr_name] = \
+                self._runBuilder(bldr_name, concurrency)
+
+            @d.addBoth
+            def done(_, bldr_name=bldr_name):
+                del self._startingBuilders[bldr_name]
+                slots.release()
+                if bldr_name in self._rerunBuilders:
+                    self._rerunBuilders.discard(bldr_name)
+                    self.maybeStartBuildsOn([bldr_name])
+                self._wakeupActivityLoop()
+
+            if concurrency == 1:
+                # run one builder at a time, under the activity lock
+                yield d
             self.activity_lock.release()
 
+        if self._lastBuildStartedAt is not None:
+            metrics.MetricTimeEvent.log(
+                'BuildRequestDistributor.timeToSaturate',
+                self._lastBuildStartedAt - started_at)
         timer.stop()
 
         self.active = False
         self._quiet()
 
+    def _wakeupActivityLoop(self):
+        if self._activityWakeup is not None:
+            d, self._activityWakeup = self._activityWakeup, None
+            d.callback(None)
+
+    @defer.inlineCallbacks
+    def _runBuilder(self, bldr_name, concurrency):
+        # get the actual builder object
+        bldr = self.botmaster.builders.get(bldr_name)
+        try:
+            if bldr:
+                if concurrency == 1:
+                    yield self._maybeStartBuildsOnBuilder(bldr)
+                else:
+                    yield self._maybeStartBuildsOnBuilder(
+                        bldr, _reserveWorkers=True)
+        except Exception:
+            log.err(Failure(),
+                    "from maybeStartBuild for builder '%s'" % (bldr_name,))
+
     @defer.inlineCallbacks
-    def _maybeStartBuildsOnBuilder(self, bldr, _reactor=reactor):
+    def _maybeStartBuildsOnBuilder(self, bldr, _reactor=reactor,
+                                   _reserveWorkers=False):
         # create a chooser to give us our next builds
         # this object is temporary and will go away when we're done
         bc = self.createBuildChooser(bldr, self.master)
@@ -515,18 +654,35 @@ class BuildRequestDistributor(service.AsyncMultiService):
             if not worker or not breqs:
                 break
 
-            # claim brid's
-            brids = [br.id for br in breqs]
-            claimed_at_epoch = _reactor.seconds()
-            claimed_at = epoch2datetime(claimed_at_epoch)
-            if not (yield self.master.data.updates.claimBuildRequests(
-                    brids, claimed_at=claimed_at)):
-                # some brids were already claimed, so start over
-                bc = self.createBuildChooser(bldr, self.master)
-                continue
-
-            buildStarted = yield bldr.maybeStartBuild(worker, breqs)
-            if not buildStarted:
+            if _reserveWorkers:
+                # when builds are started on several builders at once, make
+                # sure that a worker is not given two builds at once; the
+                # builder will run again once the worker is free, keeping
+                # the order of its build requests
+                if worker.worker in self._startingWorkers:
+                    self._startingWorkers[worker.worker].add(bldr.name)
+                    break
+                self._startingWorkers[worker.worker] = set()
+            try:
+                # claim brid's
+                brids = [br.id for br in breqs]
+                claimed_at_epoch = _reactor.seconds()
+                claimed_at = epoch2datetime(claimed_at_epoch)
+                if not (yield self.master.data.updates.claimBuildRequests(
+                        brids, claimed_at=claimed_at)):
+                    # some brids were already claimed, so start over
+                    bc = self.createBuildChooser(bldr, self.master)
+                    continue
+
+                buildStarted = yield bldr.maybeStartBuild(worker, breqs)
+            finally:
+                if _reserveWorkers:
+                    waiting = self._startingWorkers.pop(worker.worker)
+                    if waiting:
+                        self.maybeStartBuildsOn(waiting)
+            if buildStarted:
+                self._lastBuildStartedAt = self.master.reactor.seconds()
+            else:
                 yield self.master.data.updates.unclaimBuildRequests(brids)
                 # try starting builds again.  If we still have a working worker,
                 # then this may re-claim the same buildrequests
@@ -0,0 +1,153 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import heapq
+
+from twisted.internet import defer
+
+from buildbot.data import resultspec
+from buildbot.process import metrics
+from buildbot.util import poll
+from buildbot.util import service
+
+
+class UnclaimedBuildRequestIndex(service.AsyncService):
+
+    """
+    Master-side index of the unclaimed build requests of each builder.
+
+    The index is kept up to date from the build request messages, which the
+    botmaster passes to L{handleMessage}, and is periodically resynchronized
+    with the database in case some messages were missed.  Until the first
+    synchronization is done, C{synced} is False and users must query the data
+    API instead.
+
+    The requests of each builder are kept in a heap ordered by submission
+    time, so the oldest one is found in O(log n).  Claimed and completed
+    requests are removed from the heaps lazily.
+    """
+
+    # interval, in seconds, between resynchronizations with the database
+    RESYNC_INTERVAL = 600
+
+    def __init__(self):
+        self.synced = False
+        # brid -> brdict, for the unclaimed requests
+        self._brdicts = {}
+        # builderid -> heap of (submitted_at, brid)
+        self._heaps = {}
+        # messages received during a resynchronization, or None
+        self._pendingMessages = None
+
+    def startService(self):
+        service.AsyncService.startService(self)
+        self.resync._reactor = self.master.reactor
+        self.resync.start(interval=self.RESYNC_INTERVAL, now=True)
+
+    @defer.inlineCallbacks
+    def stopService(self):
+        yield service.AsyncService.stopService(self)
+        yield self.resync.stop()
+        self.synced = False
+        self._brdicts = {}
+        self._heaps = {}
+
+    @poll.method
+    @defer.inlineCallbacks
+    def resync(self):
+        timer = metrics.Timer("UnclaimedBuildRequestIndex.resync")
+        timer._reactor = self.master.reactor
+        timer.start()
+        self._pendingMessages = []
+        try:
+            brdicts = yield self.master.data.get(
+                ('buildrequests',),
+                [resultspec.Filter('claimed', 'eq', [False])])
+        except Exception:
+            self._pendingMessages = None
+            raise
+
+        self._brdicts = {}
+        self._heaps = {}
+        for brdict in brdicts:
+            self._add(brdict)
+        # replay the messages received in the meantime, as the results may
+        # predate them
+        pending, self._pendingMessages = self._pendingMessages, None
+        for event, brdict in pending:
+            self._apply(event, brdict)
+        self.synced = True
+        timer.stop()
+
+    def handleMessage(self, key, msg):
+        event = key[-1]
+        if self._pendingMessages is not None:
+            self._pendingMessages.append((event, msg))
+        self._apply(event, msg)
+
+    def _apply(self, event, brdict):
+        if event in ('new', 'unclaimed'):
+            self._add(brdict)
+        elif event in ('claimed', 'complete'):
+            self._brdicts.pop(brdict['buildrequestid'], None)
+
+    def _add(self, brdict):
+        brid = brdict['buildrequestid']
+        if brdict['claimed'] or brdict['complete']:
+            self._brdicts.pop(brid, None)
+            return
+        if brid not in self._brdicts:
+            heap = self._heaps.setdefault(brdict['builderid'], [])
+            heapq.heappush(heap, (brdict['submitted_at'], brid))
+        self._brdicts[brid] = brdict
+
+    def _getHeap(self, builderid):
+        # return the heap for this builder, with a live request at its top
+        heap = self._heaps.get(builderid)
+        if heap is None:
+            return []
+        while heap and heap[0][1] not in self._brdicts:
+            heapq.heappop(heap)
+        if not heap:
+            del self._heaps[builderid]
+        return heap
+
+    def getOldestRequestTime(self, builderid):
+        """
+        Get the submission time of the oldest unclaimed request of a builder
+
+        @returns: datetime instance, or None if there are no unclaimed
+            requests
+        """
+        heap = self._getHeap(builderid)
+        if not heap:
+            return None
+        return heap[0][0]
+
+    def getUnclaimedBuildRequests(self, builderid):
+        """
+        Get the unclaimed requests of a builder
+
+        @returns: list of brdicts, oldest first
+        """
+        heap = self._getHeap(builderid)
+        if not heap:
+            return []
+        # drop the claimed requests from the heap, while we are at it
+        heap[:] = sorted(entry for entry in heap if entry[1] in self._brdicts)
+        return [self._brdicts[brid] for _, brid in heap]
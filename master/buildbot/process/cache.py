@@ -40,6 +40,7 @@ class CacheManager(service.ReconfigurableServiceMixin, service.AsyncService):
         self.setName('caches')
         self.config = {}
         self._caches = {}
+        self._default_sizes = {}
 
     def get_cache(self, cache_name, miss_fn):
         """
@@ -62,17 +63,39 @@ class CacheManager(service.ReconfigurableServiceMixin, service.AsyncService):
             c = self._caches[cache_name] = lru.AsyncLRUCache(miss_fn, max_size)
             return c
 
+    def get_sized_cache(self, cache_name, default_max_size):
+        """
+        Get a L{SizedLRUCache} object with the given name, creating it if
+        necessary.  As for L{get_cache}, the result should be stored
+        indefinitely.
+
+        @param cache_name: name of the cache
+        @param default_max_size: total size of the cached values, used when
+        the cache is not configured in C{c['caches']}
+        @returns: L{SizedLRUCache} instance
+        """
+        try:
+            return self._caches[cache_name]
+        except KeyError:
+            self._default_sizes[cache_name] = default_max_size
+            max_size = self.config.get(cache_name, default_max_size)
+            c = self._caches[cache_name] = lru.SizedLRUCache(max_size)
+            return c
+
     def reconfigServiceWithBuildbotConfig(self, new_config):
         self.config = new_config.caches
         for name, cache in iteritems(self._caches):
-            cache.set_max_size(new_config.caches.get(name,
-                                                     self.DEFAULT_CACHE_SIZE))
+            default = self._default_sizes.get(name, self.DEFAULT_CACHE_SIZE)
+            cache.set_max_size(new_config.caches.get(name, default))
 
         return service.ReconfigurableServiceMixin.reconfigServiceWithBuildbotConfig(self,
                                                                                     new_config)
 
     def get_metrics(self):
-        return dict([
-            (n, dict(hits=c.hits, refhits=c.refhits,
-                     misses=c.misses, max_size=c.max_size))
-            for n, c in iteritems(self._caches)])
+        metrics = {}
+        for n, c in iteritems(self._caches):
+            metrics[n] = dict(hits=c.hits, refhits=c.refhits,
+                              misses=c.misses, max_size=c.max_size)
+            if isinstance(c, lru.SizedLRUCache):
+                metrics[n]['size'] = c.size
+        return metrics
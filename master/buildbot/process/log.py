@@ -21,7 +21,6 @@ from future.utils import text_type
 import re
 
 from twisted.internet import defer
-from twisted.python import log
 
 from buildbot import util
 from buildbot.util import lineboundaries
@@ -107,16 +106,11 @@ class Log(object):
         # notify subscribers *after* finishing the log
         self.subPoint.deliver(None, None)
 
-        # notify those waiting for finish
+        # notify those waiting for finish; the log is then compressed in
+        # the background by the master's LogCompactor
         for d in self.finishWaiters:
             d.callback(None)
 
-        # start a compressLog call but don't make our caller wait for
-        # it to complete
-        d = self.master.data.updates.compressLog(self.logid)
-        d.addErrback(
-            log.err, "while compressing log %d (ignored)" % self.logid)
-
 
 class PlainLog(Log):
 
@@ -0,0 +1,125 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from twisted.internet import defer
+from twisted.python import log
+
+from buildbot.process import metrics
+from buildbot.util import poll
+from buildbot.util import service
+
+
+class LogCompactor(service.AsyncService):
+
+    """
+    Compact the chunks of finished logs in the background.
+
+    Finished logs are queued for compaction in the database, so that the
+    logs of the builds run by this master are compacted even if it is
+    restarted in between; the logs left by masters which are no longer
+    active are compacted by the others.  They are processed a few at a time,
+    pausing between logs so that compaction does not monopolize the database.
+    """
+
+    # interval, in seconds, between checks of the queue, in addition to the
+    # checks triggered by finished logs
+    POLL_INTERVAL = 60
+    # number of logs fetched from the queue at once
+    BATCH_SIZE = 20
+    # maximum fraction of the time spent compacting logs
+    MAX_LOAD = 0.5
+
+    def __init__(self):
+        self.setName('logcompactor')
+        self.consumer = None
+        self._pause = None
+
+    @defer.inlineCallbacks
+    def startService(self):
+        yield service.AsyncService.startService(self)
+        self.compactLogs._reactor = self.master.reactor
+        self.consumer = yield self.master.mq.startConsuming(
+            self.logFinished, ('logs', None, 'finished'))
+        self.compactLogs.start(interval=self.POLL_INTERVAL, now=True)
+
+    @defer.inlineCallbacks
+    def stopService(self):
+        yield service.AsyncService.stopService(self)
+        if self.consumer:
+            self.consumer.stopConsuming()
+            self.consumer = None
+        # interrupt any pause, so compactLogs notices that we are stopping
+        if self._pause:
+            call, d = self._pause
+            self._pause = None
+            if call.active():
+                call.cancel()
+                d.callback(None)
+        yield self.compactLogs.stop()
+
+    def logFinished(self, key, msg):
+        self.compactLogs()
+
+    @poll.method
+    @defer.inlineCallbacks
+    def compactLogs(self):
+        while self.running:
+            logids = yield self.master.db.logs.getLogCompactions(
+                masterid=self.master.masterid, limit=self.BATCH_SIZE)
+            if not logids:
+                return
+            for logid in logids:
+                if not self.running:
+                    return
+                claimed = yield self.master.db.logs.claimLogCompaction(logid)
+                if not claimed:
+                    # another master is compacting it
+                    continue
+                elapsed = yield self.compactLog(logid)
+                yield self._rateLimit(elapsed)
+
+    @defer.inlineCallbacks
+    def compactLog(self, logid):
+        reactor = self.master.reactor
+        started = reactor.seconds()
+        timer = metrics.Timer("LogCompactor.compactLog")
+        timer._reactor = reactor
+        timer.start()
+        try:
+            saved = yield self.master.db.logs.compressLog(logid)
+        except Exception:
+            # the log was taken out of the queue, so it won't be retried
+            log.err(None, "while compacting log %d" % (logid,))
+        else:
+            metrics.MetricCountEvent.log("LogCompactor.compacted_logs", 1)
+            metrics.MetricCountEvent.log("LogCompactor.bytes_saved", saved)
+        finally:
+            timer.stop()
+        defer.returnValue(reactor.seconds() - started)
+
+    def _rateLimit(self, elapsed):
+        # pause long enough that at most MAX_LOAD of the time is spent
+        # compacting
+        delay = elapsed * (1 - self.MAX_LOAD) / self.MAX_LOAD
+        if delay <= 0 or not self.running:
+            return defer.succeed(None)
+        d = defer.Deferred()
+        call = self.master.reactor.callLater(delay, d.callback, None)
+        self._pause = (call, d)
+        return d
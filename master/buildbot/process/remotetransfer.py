@@ -16,12 +16,21 @@
 from __future__ import absolute_import
 from __future__ import print_function
 
+import hashlib
 import os
 import tarfile
 import tempfile
+import threading
+from collections import deque
 from io import BytesIO
 
+from twisted.internet import defer
+from twisted.internet import reactor
+from twisted.internet import threads
+from twisted.python import threadpool
+
 from buildbot.util import bytes2NativeString
+from buildbot.util import service
 from buildbot.util import unicode2bytes
 from buildbot.worker.protocols import base
 
@@ -97,42 +106,254 @@ class FileWriter(base.FileWriterImpl):
                 os.unlink(self.tmpname)
 
 
-class DirectoryWriter(FileWriter):
+class StoringFileWriter(FileWriter):
 
     """
-    A DirectoryWriter is implemented as a FileWriter, with an added post-processing
-    step to unpack the archive, once the transfer has completed.
+    L{FileWriter} which adds the uploaded file to an artifact store, and
+    which lets the worker skip the transfer of a file whose content is
+    already stored
     """
 
-    def __init__(self, destroot, maxsize, compress, mode):
-        self.destroot = destroot
-        self.compress = compress
+    def __init__(self, store, destfile, maxsize, mode):
+        FileWriter.__init__(self, destfile, maxsize, mode)
+        self.store = store
+        self.maxsize = maxsize
+        self.hasher = hashlib.sha256()
+        self.stored = False
 
-        self.fd, self.tarname = tempfile.mkstemp()
-        os.close(self.fd)
+    def remote_write(self, data):
+        data = unicode2bytes(data)
+        if self.remaining is not None:
+            data = data[:self.remaining]
+        self.hasher.update(data)
+        FileWriter.remote_write(self, data)
 
-        FileWriter.__init__(self, self.tarname, maxsize, mode)
+    @defer.inlineCallbacks
+    def remote_useStored(self, digest):
+        """
+        Called by the worker, before sending any data, with the digest of
+        the file it uploads
 
-    def remote_unpack(self):
+        @returns: True if the stored copy of the file is used, in which case
+            the worker does not send the file, via Deferred
         """
-        Called by remote worker to state that no more data will be transferred
+        found = yield self.store.lookup(digest)
+        if found is None or (self.maxsize is not None and
+                             found[1] > self.maxsize):
+            defer.returnValue(False)
+        self.stored = yield self.store.retrieve(digest, self.tmpname)
+        defer.returnValue(self.stored)
+
+    def remote_close(self):
+        FileWriter.remote_close(self)
+        # the worker does not wait for the copy into the store; the file was
+        # uploaded all the same if it fails
+        if not self.stored:
+            self.store.addInBackground(self.hasher.hexdigest(), self.destfile)
+
+
+class _BlockPipe(object):
+
+    """
+    A file-like object read by a thread, fed with blocks of data from the
+    reactor thread.  Feeding it returns a Deferred when more than C{limit}
+    bytes are waiting to be read, which fires once the reader caught up.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.cond = threading.Condition()
+        self.blocks = deque()
+        self.size = 0
+        self.closed = False
+        self.aborted = False
+        self.waiting = None
+
+    def feed(self, data):
+        with self.cond:
+            self.blocks.append(data)
+            self.size += len(data)
+            self.cond.notify()
+            if self.size <= self.limit:
+                return None
+            if self.waiting is None:
+                self.waiting = defer.Deferred()
+            return self.waiting
+
+    def close(self, abort=False):
+        with self.cond:
+            self.closed = True
+            self.aborted = self.aborted or abort
+            self.cond.notify()
+
+    def read(self, size=-1):
+        # called from the thread
+        with self.cond:
+            while not self.blocks and not self.closed:
+                self.cond.wait()
+            if self.aborted:
+                raise IOError("transfer cancelled")
+            if not self.blocks:
+                return b''
+            data = self.blocks.popleft()
+            if 0 <= size < len(data):
+                self.blocks.appendleft(data[size:])
+                data = data[:size]
+            self.size -= len(data)
+            if self.waiting is not None and self.size <= self.limit:
+                reactor.callFromThread(self.waiting.callback, None)
+                self.waiting = None
+            return data
+
+
+class ExtractionPool(service.AsyncService):
+
+    """
+    The threads extracting the archives of directory uploads.  These threads
+    spend most of their time waiting for the data sent by the workers, so
+    they are kept apart from the reactor's thread pool, which a few slow
+    uploads would otherwise exhaust.  At most C{MAX_THREADS} archives are
+    extracted at once; the uploads of the others wait for a thread.
+    """
+
+    MAX_THREADS = 8
+
+    def __init__(self):
+        self._pool = None
+        self._pipes = set()
+
+    def startService(self):
+        self._pool = threadpool.ThreadPool(
+            minthreads=0, maxthreads=self.MAX_THREADS, name='ExtractionPool')
+        self._pool.start()
+        return service.AsyncService.startService(self)
+
+    def stopService(self):
+        # wake up the extractions waiting for data, so that their threads
+        # can be joined
+        for pipe in list(self._pipes):
+            pipe.close(abort=True)
+        self._pool.stop()
+        self._pool = None
+        return service.AsyncService.stopService(self)
+
+    def extract(self, pipe, fn):
+        """
+        Call C{fn}, which reads the archive from C{pipe}, in a thread
+
+        @returns: Deferred firing with the result of C{fn}
         """
-        # Make sure remote_close is called, otherwise atomic rename wont happen
-        self.remote_close()
+        if self._pool is None:
+            return defer.fail(RuntimeError("the master is not running"))
+        self._pipes.add(pipe)
+        d = threads.deferToThreadPool(self.master.reactor, self._pool, fn)
+
+        @d.addBoth
+        def forget(res):
+            self._pipes.discard(pipe)
+            return res
+        return d
+
+
+class DirectoryWriter(base.FileWriterImpl):
+
+    """
+    A DirectoryWriter extracts the archive sent by the worker into
+    C{destroot} while it arrives.  The extraction runs in a thread of
+    C{pool}, an L{ExtractionPool}, or of the reactor's thread pool if none is
+    given, so neither is the whole archive stored on the master, nor is the
+    reactor blocked while extracting it.
+    """
 
+    # the most archive data held in memory, waiting to be extracted
+    MAX_BUFFERED = 1024 * 1024
+
+    def __init__(self, destroot, maxsize, compress, mode, pool=None):
+        self.destroot = destroot
+        self.compress = compress
+        self.remaining = maxsize
+        self.pool = pool
+        self.pipe = _BlockPipe(self.MAX_BUFFERED)
+        self.extraction = None
+        self.failure = None
+
+    def _startExtraction(self):
+        if self.extraction is None:
+            if self.pool is not None:
+                self.extraction = self.pool.extract(self.pipe,
+                                                    self._thd_extract)
+            else:
+                self.extraction = threads.deferToThread(self._thd_extract)
+            self.extraction.addErrback(self._extractionFailed)
+
+    def _thd_extract(self):
         # Map configured compression to a TarFile setting
         if self.compress == 'bz2':
             mode = 'r|bz2'
         elif self.compress == 'gz':
             mode = 'r|gz'
         else:
-            mode = 'r'
+            mode = 'r|'
+
+        archive = tarfile.open(mode=mode, fileobj=self.pipe)
+        try:
+            archive.extractall(path=self.destroot)
+        finally:
+            archive.close()
+        # consume any padding after the end of the archive
+        while self.pipe.read(64 * 1024):
+            pass
+
+    def _extractionFailed(self, f):
+        self.failure = f
+        # let the remaining writes through; they will fail
+        self.pipe.close(abort=True)
+        if self.pipe.waiting is not None:
+            self.pipe.waiting.callback(None)
+            self.pipe.waiting = None
 
-        # Unpack archive and clean up after self
-        archive = tarfile.open(name=self.tarname, mode=mode)
-        archive.extractall(path=self.destroot)
-        archive.close()
-        os.remove(self.tarname)
+    def remote_write(self, data):
+        """
+        Called from remote worker to extract L{data} within boundaries of
+        L{maxsize}
+
+        @type  data: C{string}
+        @param data: String of data to write
+        """
+        if self.failure is not None:
+            return defer.fail(self.failure)
+        data = unicode2bytes(data)
+        if self.remaining is not None:
+            data = data[:self.remaining]
+            self.remaining = self.remaining - len(data)
+        self._startExtraction()
+        return self.pipe.feed(data)
+
+    def remote_utime(self, accessed_modified):
+        pass
+
+    def remote_close(self):
+        """
+        Called by remote worker to state that no more data will be transferred
+        """
+        self.pipe.close()
+
+    @defer.inlineCallbacks
+    def remote_unpack(self):
+        """
+        Called by remote worker to state that no more data will be
+        transferred; fires once the archive is completely extracted
+        """
+        self._startExtraction()
+        self.pipe.close()
+        yield self.extraction
+        if self.failure is not None:
+            self.failure.raiseException()
+
+    def cancel(self):
+        # unclean shutdown, stop extracting; what has already been extracted
+        # is left as is
+        self.pipe.close(abort=True)
 
 
 class FileReader(base.FileReaderImpl):
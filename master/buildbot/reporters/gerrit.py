@@ -284,6 +284,7 @@ class GerritStatusPush(service.BuildbotService):
     def buildStarted(self, key, build):
         if self.startCB is None:
             return
+        build = dict(build)
         yield self.getBuildDetails(build)
         if self.isBuildReported(build):
             result = yield self.startCB(build['builder']['name'], build, self.startArg)
@@ -293,6 +294,7 @@ class GerritStatusPush(service.BuildbotService):
     def buildComplete(self, key, build):
         if self.reviewCB is None:
             return
+        build = dict(build)
         yield self.getBuildDetails(build)
         if self.isBuildReported(build):
             result = yield self.reviewCB(build['builder']['name'], build, build['results'],
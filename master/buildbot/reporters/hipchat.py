@@ -54,6 +54,7 @@ class HipChatStatusPush(HttpStatusPushBase):
 
     @defer.inlineCallbacks
     def getBuildDetailsAndSendMessage(self, build, key):
+        build = dict(build)
         yield utils.getDetailsForBuild(self.master, build, **self.neededDetails)
         postData = yield self.getRecipientList(build, key)
         postData['message'] = yield self.getMessage(build, key)
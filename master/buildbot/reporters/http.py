@@ -79,6 +79,7 @@ class HttpStatusPushBase(service.BuildbotService):
 
     @defer.inlineCallbacks
     def getMoreInfoAndSend(self, build):
+        build = dict(build)
         yield utils.getDetailsForBuild(self.master, build, **self.neededDetails)
         if self.filterBuilds(build):
             yield self.send(build)
@@ -178,6 +178,7 @@ class NotifierBase(service.BuildbotService):
     def buildComplete(self, key, build):
         if self.buildSetSummary:
             return
+        build = dict(build)
         br = yield self.master.data.get(("buildrequests", build['buildrequestid']))
         buildset = yield self.master.data.get(("buildsets", br['buildsetid']))
         yield utils.getDetailsForBuilds(
@@ -15,52 +15,379 @@
 
 from __future__ import absolute_import
 from __future__ import print_function
-from future.moves.collections import UserList
+from future.utils import iteritems
 from future.utils import lrange
 from future.utils import string_types
 
+import copy
+from collections import OrderedDict
+
 from twisted.internet import defer
+from twisted.python import failure
 from twisted.python import log
 
 from buildbot.data import resultspec
+from buildbot.data.builds import Db2DataMixin as BuildsDb2DataMixin
+from buildbot.data.logs import EndpointMixin as LogsDb2DataMixin
+from buildbot.data.steps import Db2DataMixin as StepsDb2DataMixin
 from buildbot.process.properties import renderer
 from buildbot.process.results import RETRY
-from buildbot.util import flatten
+from buildbot.util import Notifier
+from buildbot.util import service
+
+
+_buildsDb2Data = BuildsDb2DataMixin()
+_stepsDb2Data = StepsDb2DataMixin()
+_logsDb2Data = LogsDb2DataMixin()
 
 
-@defer.inlineCallbacks
 def getPreviousBuild(master, build):
-    # naive n-1 algorithm. Still need to define what we should skip
-    # SKIP builds? forced builds? rebuilds?
-    # don't hesitate to contribute improvements to that algorithm
-    n = build['number'] - 1
-    while n >= 0:
-        prev = yield master.data.get(("builders", build['builderid'], "builds", n))
-        if prev and prev['results'] != RETRY:
-            defer.returnValue(prev)
-        n -= 1
-    defer.returnValue(None)
+    """
+    Get the build preceding C{build} on its builder, skipping the unfinished
+    and the retried builds
+
+    @returns: build dictionary or None, via Deferred
+    """
+    return master.previous_builds.getPreviousBuild(build)
+
+
+class PreviousBuildCache(service.AsyncService):
+
+    """
+    Master-wide cache of the previous builds, shared by the reporters through
+    L{getPreviousBuild}.
+
+    For each builder, the cache maps the numbers of the last builds it was
+    asked about to their previous build.  It is kept up to date from the
+    build finished messages, which also tell it the previous build of the
+    next build, so that a reporter asking for the previous build of each
+    finished build seldom needs to query the database.
+    """
+
+    # number of builds whose previous build is cached, per builder
+    BUILDS_PER_BUILDER = 50
+
+    def __init__(self):
+        # builderid -> OrderedDict of number -> previous build, or None
+        self._builders = {}
+        # (builderid, number) -> Notifier for the database queries in
+        # progress
+        self._fetching = {}
+        # keys of the queries whose result may be outdated by a build
+        # finished in the meantime
+        self._outdated = set()
+        self._consumer = None
+        self._consuming = False
+
+    @defer.inlineCallbacks
+    def stopService(self):
+        if self._consumer is not None:
+            self._consumer.stopConsuming()
+            self._consumer = None
+        self._consuming = False
+        self._builders = {}
+        yield service.AsyncService.stopService(self)
+
+    @defer.inlineCallbacks
+    def _startConsuming(self):
+        # the cache only follows the build messages once it is used
+        self._consuming = True
+        consumer = yield self.master.mq.startConsuming(
+            self._buildFinished, ('builds', None, 'finished'))
+        if self._consuming:
+            self._consumer = consumer
+        else:
+            consumer.stopConsuming()
+
+    @defer.inlineCallbacks
+    def getPreviousBuild(self, build):
+        if not self._consuming:
+            yield self._startConsuming()
+
+        builderid, number = build['builderid'], build['number']
+        cached = self._builders.get(builderid)
+        if cached is not None and number in cached:
+            defer.returnValue(self._copy(cached[number]))
+
+        key = (builderid, number)
+        notifier = self._fetching.get(key)
+        if notifier is not None:
+            prev = yield notifier.wait()
+            defer.returnValue(self._copy(prev))
+
+        notifier = self._fetching[key] = Notifier()
+        try:
+            dbdict = yield self.master.db.builds.getPreviousBuild(builderid,
+                                                                  number)
+            prev = None
+            if dbdict is not None:
+                prev = yield _buildsDb2Data.db2data(dbdict)
+        except Exception:
+            del self._fetching[key]
+            self._outdated.discard(key)
+            notifier.notify(failure.Failure())
+            raise
+
+        del self._fetching[key]
+        if key in self._outdated:
+            self._outdated.discard(key)
+        else:
+            self._store(builderid, number, prev)
+        notifier.notify(prev)
+        defer.returnValue(self._copy(prev))
+
+    def _copy(self, prev):
+        # callers are free to modify the dictionaries they get
+        return dict(prev) if prev is not None else None
+
+    def _store(self, builderid, number, prev):
+        cached = self._builders.setdefault(builderid, OrderedDict())
+        cached.pop(number, None)
+        cached[number] = prev
+        while len(cached) > self.BUILDS_PER_BUILDER:
+            cached.popitem(last=False)
+
+    def _buildFinished(self, key, build):
+        builderid, number = build['builderid'], build['number']
+        for fetching in self._fetching:
+            if fetching[0] == builderid and fetching[1] > number:
+                self._outdated.add(fetching)
+
+        cached = self._builders.get(builderid, {})
+        if build['results'] == RETRY:
+            # the next build has the same previous build as this one
+            if number in cached:
+                self._store(builderid, number + 1, cached[number])
+            return
+
+        build = dict(build)
+        for n, prev in iteritems(cached):
+            if n > number and (prev is None or prev['number'] < number):
+                cached[n] = build
+        self._store(builderid, number + 1, build)
+
+
+class BuildDetailsLoader(service.AsyncService):
+
+    """
+    Loads the details of the builds reported by the reporters, through
+    L{getDetailsForBuildset} and L{getDetailsForBuilds}.
+
+    Each kind of detail is fetched for all the builds of a report at once.
+    The details of the completed buildsets and builds cannot change anymore,
+    so the last ones are kept: the reporters handling the same buildset or
+    build completion share a single fetch, even when they ask for it
+    concurrently.  Log contents can be big, so they are never kept; only the
+    reporters asking for them concurrently share their fetch.
+    """
+
+    # number of buildsets or builds whose details are kept, per kind of
+    # detail
+    KEPT = {
+        'buildset': 50,
+        'properties': 500,
+        'steps': 500,
+    }
+
+    def __init__(self):
+        # kind -> OrderedDict of id -> details
+        self._details = dict((kind, OrderedDict()) for kind in self.KEPT)
+        # (kind, id) -> Notifier for the fetches in progress
+        self._fetching = {}
+
+    def stopService(self):
+        for details in self._details.values():
+            details.clear()
+        return service.AsyncService.stopService(self)
+
+    def getBuildset(self, bsid):
+        """
+        Get a buildset and its builds
+
+        @returns: tuple (buildset, list of builds), via Deferred
+        """
+        def keep(bsid, details):
+            buildset = details[0]
+            return buildset is not None and buildset['complete']
+        d = self._load('buildset', [bsid], self._fetchBuildsets, keep)
+        d.addCallback(lambda rv: rv[bsid])
+        return d
+
+    @defer.inlineCallbacks
+    def getBuilders(self, builderids):
+        """
+        @returns: dict mapping the builder ids to their builders, via Deferred
+        """
+        builderids = set(builderids)
+        if len(builderids) > 1:
+            builders = yield self.master.data.get(('builders',))
+        else:
+            builders = yield defer.gatherResults(
+                [self.master.data.get(('builders', _id)) for _id in builderids])
+        defer.returnValue(dict((builder['builderid'], builder)
+                               for builder in builders
+                               if builder['builderid'] in builderids))
+
+    def getProperties(self, builds):
+        """
+        @returns: dict mapping the build ids to their properties, via Deferred
+        """
+        return self._load('properties', [b['buildid'] for b in builds],
+                          self.master.db.builds.getBuildPropertiesForBuilds,
+                          self._keepCompleteBuilds(builds))
+
+    @defer.inlineCallbacks
+    def getSteps(self, builds, wantLogs=False):
+        """
+        Get the steps of builds, with their logs and the contents of the logs
+        in the C{logs} key of each step if C{wantLogs} is true
+
+        @returns: dict mapping the build ids to their steps, via Deferred
+        """
+        buildids = [b['buildid'] for b in builds]
+        keep = self._keepCompleteBuilds(builds)
+        stepsbyid = yield self._load('steps', buildids, self._fetchSteps, keep)
+        if wantLogs:
+            logsbyid = yield self._load(
+                'logs', buildids,
+                lambda buildids: self._fetchLogs(
+                    dict((_id, stepsbyid[_id]) for _id in buildids)),
+                None)
+            for buildid, steps in iteritems(stepsbyid):
+                for step in steps:
+                    step['logs'] = logsbyid[buildid].get(step['stepid'], [])
+        defer.returnValue(stepsbyid)
+
+    def _keepCompleteBuilds(self, builds):
+        complete = set(b['buildid'] for b in builds if b.get('complete'))
+        return lambda buildid, details: buildid in complete
+
+    @defer.inlineCallbacks
+    def _load(self, kind, ids, fetch, keep):
+        """
+        Get a kind of details for several buildsets or builds, fetching those
+        neither kept nor being fetched with a single call to C{fetch}
+
+        @param fetch: callable taking a list of ids and returning a dict
+            mapping them to their details, via Deferred
+        @param keep: callable telling whether the details of an id can be
+            kept, or None if this kind of details is never kept
+        @returns: dict mapping the ids to their details, via Deferred; the
+            details kept or shared with concurrent calls are copies
+        """
+        kept = self._details[kind] if keep is not None else {}
+        rv = {}
+        # the details fetched by this call which no one else refers to
+        own = {}
+        missing = []
+        waiting = []
+        notifiers = set()
+        for _id in ids:
+            if _id in rv or _id in own or _id in missing:
+                continue
+            if _id in kept:
+                # move it to the end, so that the least recently used
+                # details are dropped first
+                rv[_id] = kept[_id] = kept.pop(_id)
+                continue
+            notifier = self._fetching.get((kind, _id))
+            if notifier is None:
+                missing.append(_id)
+            elif notifier not in notifiers:
+                notifiers.add(notifier)
+                waiting.append(notifier.wait())
+
+        if missing:
+            notifier = Notifier()
+            for _id in missing:
+                self._fetching[(kind, _id)] = notifier
+            try:
+                fetched = yield fetch(missing)
+            except Exception:
+                f = failure.Failure()
+                for _id in missing:
+                    del self._fetching[(kind, _id)]
+                notifier.notify(f)
+                f.raiseException()
+            shared = bool(notifier)
+            for _id in missing:
+                del self._fetching[(kind, _id)]
+                if keep is not None and keep(_id, fetched[_id]):
+                    kept[_id] = fetched[_id]
+                    while len(kept) > self.KEPT[kind]:
+                        kept.popitem(last=False)
+                    rv[_id] = fetched[_id]
+                elif shared:
+                    rv[_id] = fetched[_id]
+                else:
+                    own[_id] = fetched[_id]
+            notifier.notify(fetched)
+
+        for d in waiting:
+            fetched = yield d
+            rv.update((_id, details) for _id, details in iteritems(fetched)
+                      if _id in ids)
+
+        # the reporters are free to modify the details they get
+        own.update((_id, copy.deepcopy(details))
+                   for _id, details in iteritems(rv))
+        defer.returnValue(own)
+
+    @defer.inlineCallbacks
+    def _fetchBuildsets(self, bsids):
+        rv = {}
+        for bsid in bsids:
+            buildset, breqs = yield defer.gatherResults([
+                self.master.data.get(("buildsets", bsid)),
+                self.master.data.get(
+                    ('buildrequests', ),
+                    filters=[resultspec.Filter('buildsetid', 'eq', [bsid])])])
+            dbdicts = yield self.master.db.builds.getBuildsForBuildRequests(
+                [breq['buildrequestid'] for breq in breqs])
+            builds = []
+            for dbdict in dbdicts:
+                builds.append((yield _buildsDb2Data.db2data(dbdict)))
+            rv[bsid] = (buildset, builds)
+        defer.returnValue(rv)
+
+    @defer.inlineCallbacks
+    def _fetchSteps(self, buildids):
+        stepsbyid = yield self.master.db.steps.getStepsForBuilds(buildids)
+        rv = {}
+        for buildid, stepdicts in iteritems(stepsbyid):
+            rv[buildid] = []
+            for stepdict in stepdicts:
+                rv[buildid].append((yield _stepsDb2Data.db2data(stepdict)))
+        defer.returnValue(rv)
+
+    @defer.inlineCallbacks
+    def _fetchLogs(self, stepsbyid):
+        stepids = [step['stepid'] for steps in stepsbyid.values()
+                   for step in steps]
+        logsbystep = yield self.master.db.logs.getLogsForSteps(stepids)
+        allLogs = []
+        for stepid, logdicts in iteritems(logsbystep):
+            logs = logsbystep[stepid] = []
+            for logdict in logdicts:
+                logs.append((yield _logsDb2Data.db2data(logdict)))
+            allLogs.extend(logs)
+        contents = yield defer.gatherResults(
+            [self.master.data.get(("logs", l['logid'], 'contents'))
+             for l in allLogs])
+        for l, content in zip(allLogs, contents):
+            l['content'] = content
+        defer.returnValue(dict(
+            (buildid, dict((step['stepid'], logsbystep[step['stepid']])
+                           for step in steps))
+            for buildid, steps in iteritems(stepsbyid)))
 
 
 @defer.inlineCallbacks
 def getDetailsForBuildset(master, bsid, wantProperties=False, wantSteps=False,
                           wantPreviousBuild=False, wantLogs=False):
-    # Here we will do a bunch of data api calls on behalf of the reporters
-    # We do try to make *some* calls in parallel with the help of gatherResults, but don't commit
-    # to much in that. The idea is to do parallelism while keeping the code readable
-    # and maintainable.
-
-    # first, just get the buildset and all build requests for our buildset id
-    dl = [master.data.get(("buildsets", bsid)),
-          master.data.get(('buildrequests', ),
-                          filters=[resultspec.Filter('buildsetid', 'eq', [bsid])])]
-    (buildset, breqs) = yield defer.gatherResults(dl)
-    # next, get the bdictlist for each build request
-    dl = [master.data.get(("buildrequests", breq['buildrequestid'], 'builds'))
-          for breq in breqs]
-
-    builds = yield defer.gatherResults(dl)
-    builds = flatten(builds, types=(list, UserList))
+    # the details are fetched in bulk and shared between the reporters by
+    # the master's build details loader
+    buildset, builds = yield master.build_details.getBuildset(bsid)
     if builds:
         yield getDetailsForBuilds(master, buildset, builds, wantProperties=wantProperties,
                                   wantSteps=wantSteps, wantPreviousBuild=wantPreviousBuild, wantLogs=wantLogs)
@@ -83,21 +410,13 @@ def getDetailsForBuild(master, build, wantProperties=False, wantSteps=False,
 @defer.inlineCallbacks
 def getDetailsForBuilds(master, buildset, builds, wantProperties=False, wantSteps=False,
                         wantPreviousBuild=False, wantLogs=False):
+    loader = master.build_details
 
-    builderids = set([build['builderid'] for build in builds])
-
-    builders = yield defer.gatherResults([master.data.get(("builders", _id))
-                                          for _id in builderids])
-
-    buildersbyid = dict([(builder['builderid'], builder)
-                         for builder in builders])
+    buildersbyid = yield loader.getBuilders(
+        [build['builderid'] for build in builds])
 
     if wantProperties:
-        buildproperties = yield defer.gatherResults(
-            [master.data.get(("builds", build['buildid'], 'properties'))
-             for build in builds])
-    else:  # we still need a list for the big zip
-        buildproperties = lrange(len(builds))
+        propsbyid = yield loader.getProperties(builds)
 
     if wantPreviousBuild:
         prev_builds = yield defer.gatherResults(
@@ -106,30 +425,20 @@ def getDetailsForBuilds(master, buildset, builds, wantProperties=False, wantStep
         prev_builds = lrange(len(builds))
 
     if wantSteps:
-        buildsteps = yield defer.gatherResults(
-            [master.data.get(("builds", build['buildid'], 'steps'))
-             for build in builds])
-        if wantLogs:
-            for s in flatten(buildsteps, types=(list, UserList)):
-                s['logs'] = yield master.data.get(("steps", s['stepid'], 'logs'))
-                for l in s['logs']:
-                    l['content'] = yield master.data.get(("logs", l['logid'], 'contents'))
-
-    else:  # we still need a list for the big zip
-        buildsteps = lrange(len(builds))
+        stepsbyid = yield loader.getSteps(builds, wantLogs=wantLogs)
 
     # a big zip to connect everything together
-    for build, properties, steps, prev in zip(builds, buildproperties, buildsteps, prev_builds):
+    for build, prev in zip(builds, prev_builds):
         build['builder'] = buildersbyid[build['builderid']]
         build['buildset'] = buildset
         build['url'] = getURLForBuild(
             master, build['builderid'], build['number'])
 
         if wantProperties:
-            build['properties'] = properties
+            build['properties'] = propsbyid[build['buildid']]
 
         if wantSteps:
-            build['steps'] = steps
+            build['steps'] = stepsbyid[build['buildid']]
 
         if wantPreviousBuild:
             build['prev_build'] = prev
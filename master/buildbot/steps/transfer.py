@@ -21,6 +21,7 @@ import os
 import stat
 
 from twisted.internet import defer
+from twisted.python import failure
 from twisted.python import log
 
 from buildbot import config
@@ -60,13 +61,42 @@ class _TransferBuildStep(BuildStep):
     def __init__(self, workdir=None, **buildstep_kwargs):
         BuildStep.__init__(self, **buildstep_kwargs)
         self.workdir = workdir
+        # the transfer commands running, several at once for concurrent
+        # uploads
+        self.cmds = set()
+        self.interrupted = False
+
+    def addWindowArg(self, args, command):
+        # workers older than 3.2 wait for each block to be acknowledged before
+        # sending the next one, and do not know about the window argument
+        if self.window > 1 and not self.workerVersionIsOlderThan(command,
+                                                                 '3.2'):
+            args['window'] = self.window
+
+    def makeFileWriter(self, masterdest, command, args):
+        # with an artifact store, the uploaded files are added to it, and the
+        # workers knowing about it do not send the files it already has
+        store = self.master.artifacts
+        if not store.enabled:
+            return remotetransfer.FileWriter(masterdest, self.maxsize,
+                                             self.mode)
+        if not self.workerVersionIsOlderThan(command, '3.4'):
+            args['contentHash'] = True
+        return remotetransfer.StoringFileWriter(store, masterdest,
+                                                self.maxsize, self.mode)
 
     def runTransferCommand(self, cmd, writer=None):
         # Run a transfer step, add a callback to extract the command status,
         # add an error handler that cancels the writer.
         self.cmd = cmd
+        self.cmds.add(cmd)
         d = self.runCommand(cmd)
 
+        @d.addBoth
+        def forget(res):
+            self.cmds.discard(cmd)
+            return res
+
         @d.addCallback
         def checkResult(_):
             if writer and cmd.didFail():
@@ -83,9 +113,11 @@ class _TransferBuildStep(BuildStep):
 
     def interrupt(self, reason):
         self.addCompleteLog('interrupt', str(reason))
-        if self.cmd:
-            d = self.cmd.interrupt(reason)
-            return d
+        self.interrupted = True
+        cmds = list(self.cmds) or ([self.cmd] if self.cmd else [])
+        if cmds:
+            return defer.gatherResults(
+                [cmd.interrupt(reason) for cmd in cmds])
 
 
 class FileUpload(_TransferBuildStep, WorkerAPICompatMixin):
@@ -95,7 +127,8 @@ class FileUpload(_TransferBuildStep, WorkerAPICompatMixin):
     renderables = ['workersrc', 'masterdest', 'url']
 
     def __init__(self, workersrc=None, masterdest=None,
-                 workdir=None, maxsize=None, blocksize=16 * 1024, mode=None,
+                 workdir=None, maxsize=None, blocksize=16 * 1024,
+                 window=8, mode=None,
                  keepstamp=False, url=None, urlText=None,
                  slavesrc=None,  # deprecated, use `workersrc` instead
                  **buildstep_kwargs):
@@ -118,6 +151,7 @@ class FileUpload(_TransferBuildStep, WorkerAPICompatMixin):
         self.masterdest = masterdest
         self.maxsize = maxsize
         self.blocksize = blocksize
+        self.window = window
         if not isinstance(mode, (int, type(None))):
             config.error(
                 'mode must be an integer or None')
@@ -161,10 +195,6 @@ class FileUpload(_TransferBuildStep, WorkerAPICompatMixin):
 
         self.step_status.setText(self.description)
 
-        # we use maxsize to limit the amount of data on both sides
-        fileWriter = remotetransfer.FileWriter(
-            masterdest, self.maxsize, self.mode)
-
         if self.keepstamp and self.workerVersionIsOlderThan("uploadFile", "2.13"):
             m = ("This worker (%s) does not support preserving timestamps. "
                  "Please upgrade the worker." % self.build.workername)
@@ -173,17 +203,21 @@ class FileUpload(_TransferBuildStep, WorkerAPICompatMixin):
         # default arguments
         args = {
             'workdir': self.workdir,
-            'writer': fileWriter,
             'maxsize': self.maxsize,
             'blocksize': self.blocksize,
             'keepstamp': self.keepstamp,
         }
 
+        # we use maxsize to limit the amount of data on both sides
+        fileWriter = args['writer'] = self.makeFileWriter(
+            masterdest, 'uploadFile', args)
+
         if self.workerVersionIsOlderThan('uploadFile', '3.0'):
             args['slavesrc'] = source
         else:
             args['workersrc'] = source
 
+        self.addWindowArg(args, 'uploadFile')
         cmd = makeStatusRemoteCommand(self, 'uploadFile', args)
         d = self.runTransferCommand(cmd, fileWriter)
         d.addCallback(self.finished).addErrback(self.failed)
@@ -196,7 +230,7 @@ class DirectoryUpload(_TransferBuildStep, WorkerAPICompatMixin):
     renderables = ['workersrc', 'masterdest', 'url']
 
     def __init__(self, workersrc=None, masterdest=None,
-                 workdir=None, maxsize=None, blocksize=16 * 1024,
+                 workdir=None, maxsize=None, blocksize=16 * 1024, window=8,
                  compress=None, url=None,
                  slavesrc=None,  # deprecated, use `workersrc` instead
                  **buildstep_kwargs
@@ -220,6 +254,7 @@ class DirectoryUpload(_TransferBuildStep, WorkerAPICompatMixin):
         self.masterdest = masterdest
         self.maxsize = maxsize
         self.blocksize = blocksize
+        self.window = window
         if compress not in (None, 'gz', 'bz2'):
             config.error(
                 "'compress' must be one of None, 'gz', or 'bz2'")
@@ -246,7 +281,8 @@ class DirectoryUpload(_TransferBuildStep, WorkerAPICompatMixin):
 
         # we use maxsize to limit the amount of data on both sides
         dirWriter = remotetransfer.DirectoryWriter(
-            masterdest, self.maxsize, self.compress, 0o600)
+            masterdest, self.maxsize, self.compress, 0o600,
+            pool=self.master.extractions)
 
         # default arguments
         args = {
@@ -262,6 +298,7 @@ class DirectoryUpload(_TransferBuildStep, WorkerAPICompatMixin):
         else:
             args['workersrc'] = source
 
+        self.addWindowArg(args, 'uploadDirectory')
         cmd = makeStatusRemoteCommand(self, 'uploadDirectory', args)
         d = self.runTransferCommand(cmd, dirWriter)
         d.addCallback(self.finished).addErrback(self.failed)
@@ -276,8 +313,10 @@ class MultipleFileUpload(_TransferBuildStep, WorkerAPICompatMixin,
     renderables = ['workersrcs', 'masterdest', 'url']
 
     def __init__(self, workersrcs=None, masterdest=None,
-                 workdir=None, maxsize=None, blocksize=16 * 1024, glob=False,
+                 workdir=None, maxsize=None, blocksize=16 * 1024,
+                 window=8, glob=False,
                  mode=None, compress=None, keepstamp=False, url=None,
+                 maxConcurrentUploads=1, packThreshold=None,
                  slavesrcs=None,  # deprecated, use `workersrcs` instead
                  **buildstep_kwargs):
         # Deprecated API support.
@@ -299,6 +338,7 @@ class MultipleFileUpload(_TransferBuildStep, WorkerAPICompatMixin,
         self.masterdest = masterdest
         self.maxsize = maxsize
         self.blocksize = blocksize
+        self.window = window
         if not isinstance(mode, (int, type(None))):
             config.error(
                 'mode must be an integer or None')
@@ -310,30 +350,35 @@ class MultipleFileUpload(_TransferBuildStep, WorkerAPICompatMixin,
         self.glob = glob
         self.keepstamp = keepstamp
         self.url = url
+        if not isinstance(maxConcurrentUploads, int) or maxConcurrentUploads < 1:
+            config.error(
+                'maxConcurrentUploads must be a positive integer')
+        self.maxConcurrentUploads = maxConcurrentUploads
+        self.packThreshold = packThreshold
 
     def uploadFile(self, source, masterdest):
-        fileWriter = remotetransfer.FileWriter(
-            masterdest, self.maxsize, self.mode)
-
         args = {
             'workdir': self.workdir,
-            'writer': fileWriter,
             'maxsize': self.maxsize,
             'blocksize': self.blocksize,
             'keepstamp': self.keepstamp,
         }
+        fileWriter = args['writer'] = self.makeFileWriter(
+            masterdest, 'uploadFile', args)
 
         if self.workerVersionIsOlderThan('uploadFile', '3.0'):
             args['slavesrc'] = source
         else:
             args['workersrc'] = source
 
+        self.addWindowArg(args, 'uploadFile')
         cmd = makeStatusRemoteCommand(self, 'uploadFile', args)
         return self.runTransferCommand(cmd, fileWriter)
 
     def uploadDirectory(self, source, masterdest):
         dirWriter = remotetransfer.DirectoryWriter(
-            masterdest, self.maxsize, self.compress, 0o600)
+            masterdest, self.maxsize, self.compress, 0o600,
+            pool=self.master.extractions)
 
         args = {
             'workdir': self.workdir,
@@ -348,6 +393,7 @@ class MultipleFileUpload(_TransferBuildStep, WorkerAPICompatMixin,
         else:
             args['workersrc'] = source
 
+        self.addWindowArg(args, 'uploadDirectory')
         cmd = makeStatusRemoteCommand(self, 'uploadDirectory', args)
         return self.runTransferCommand(cmd, dirWriter)
 
@@ -363,11 +409,17 @@ class MultipleFileUpload(_TransferBuildStep, WorkerAPICompatMixin,
 
         @d.addCallback
         def checkStat(_):
-            s = cmd.updates['stat'][-1]
-            if stat.S_ISDIR(s[stat.ST_MODE]):
-                return self.uploadDirectory(source, masterdest)
-            elif stat.S_ISREG(s[stat.ST_MODE]):
-                return self.uploadFile(source, masterdest)
+            return self.uploadStatted(source, masterdest,
+                                      cmd.updates['stat'][-1])
+
+        return d
+
+    def uploadStatted(self, source, masterdest, s):
+        if s is not None and stat.S_ISDIR(s[stat.ST_MODE]):
+            d = self.uploadDirectory(source, masterdest)
+        elif s is not None and stat.S_ISREG(s[stat.ST_MODE]):
+            d = self.uploadFile(source, masterdest)
+        else:
             return defer.fail('%r is neither a regular file, nor a directory' % source)
 
         @d.addCallback
@@ -379,6 +431,129 @@ class MultipleFileUpload(_TransferBuildStep, WorkerAPICompatMixin,
 
         return d
 
+    def uploadPacked(self, sources, destdir):
+        # upload regular files together, as a single archive extracted into
+        # destdir
+        dirWriter = remotetransfer.DirectoryWriter(
+            destdir, None, self.compress, 0o600,
+            pool=self.master.extractions)
+
+        args = {
+            'workdir': self.workdir,
+            'workersrc': '.',
+            'files': sources,
+            'writer': dirWriter,
+            'maxsize': None,
+            'blocksize': self.blocksize,
+            'compress': self.compress
+        }
+
+        self.addWindowArg(args, 'uploadDirectory')
+        cmd = makeStatusRemoteCommand(self, 'uploadDirectory', args)
+        d = self.runTransferCommand(cmd, dirWriter)
+
+        @d.addCallback
+        def uploadDone(result):
+            dl = [defer.maybeDeferred(
+                self.uploadDone, result, source,
+                os.path.join(destdir, os.path.basename(source)))
+                for source in sources]
+            d = defer.gatherResults(dl, consumeErrors=True)
+            d.addCallback(lambda _: result)
+            return d
+
+        return d
+
+    @defer.inlineCallbacks
+    def statSources(self, sources):
+        """
+        Stat all of the sources with a single command, if the worker can
+
+        @returns: list of stat results, None for the sources which do not
+            exist; or None if the worker cannot stat several files at once
+        """
+        if len(sources) < 2 or self.workerVersionIsOlderThan('stat', '3.3'):
+            defer.returnValue(None)
+        args = {
+            'files': sources,
+            'workdir': self.workdir
+        }
+        cmd = makeStatusRemoteCommand(self, 'stat', args)
+        yield self.runCommand(cmd)
+        defer.returnValue(cmd.updates['stats'][-1])
+
+    def planUploads(self, sources, stats, destdir):
+        """
+        Get the uploads needed for the sources
+
+        @returns: list of callables starting an upload and returning a
+            Deferred firing with its result
+        """
+        if stats is None:
+            return [lambda source=source: self.startUpload(source, destdir)
+                    for source in sources]
+
+        packed = []
+        uploads = []
+        for source, s in zip(sources, stats):
+            if self.canPack(s):
+                packed.append(source)
+                continue
+            masterdest = os.path.join(destdir, os.path.basename(source))
+            uploads.append(lambda source=source, masterdest=masterdest, s=s:
+                           self.uploadStatted(source, masterdest, s))
+        if len(packed) > 1:
+            uploads.insert(0, lambda: self.uploadPacked(packed, destdir))
+        elif packed:
+            source = packed[0]
+            masterdest = os.path.join(destdir, os.path.basename(source))
+            s = stats[sources.index(source)]
+            uploads.insert(0, lambda: self.uploadStatted(source, masterdest, s))
+        return uploads
+
+    def canPack(self, s):
+        # the mode of the master-side files cannot be set when they are
+        # extracted from an archive
+        if self.packThreshold is None or self.mode is not None:
+            return False
+        if s is None or not stat.S_ISREG(s[stat.ST_MODE]):
+            return False
+        if self.workerVersionIsOlderThan('uploadDirectory', '3.3'):
+            return False
+        size = s[stat.ST_SIZE]
+        return size < self.packThreshold and (self.maxsize is None or
+                                              size <= self.maxsize)
+
+    @defer.inlineCallbacks
+    def runUploads(self, uploads):
+        """
+        Run the uploads, at most C{maxConcurrentUploads} at a time; no new
+        upload is started once one failed or the step is interrupted
+
+        @returns: list of upload results
+        """
+        sem = defer.DeferredSemaphore(self.maxConcurrentUploads)
+        failed = []
+
+        def run(upload):
+            if failed or self.interrupted:
+                return SKIPPED
+            d = upload()
+
+            @d.addBoth
+            def check(result):
+                if result == FAILURE or isinstance(result, failure.Failure):
+                    failed.append(result)
+                return result
+            return d
+
+        results = yield defer.DeferredList(
+            [sem.run(run, upload) for upload in uploads], consumeErrors=True)
+        for success, result in results:
+            if not success:
+                result.raiseException()
+        defer.returnValue([result for _, result in results])
+
     def uploadDone(self, result, source, masterdest):
         pass
 
@@ -422,10 +597,11 @@ class MultipleFileUpload(_TransferBuildStep, WorkerAPICompatMixin,
             if not sources:
                 defer.returnValue(SKIPPED)
             else:
-                for source in sources:
-                    result = yield self.startUpload(source, masterdest)
-                    if result == FAILURE:
-                        defer.returnValue(FAILURE)
+                stats = yield self.statSources(sources)
+                uploads = self.planUploads(sources, stats, masterdest)
+                results = yield self.runUploads(uploads)
+                if FAILURE in results:
+                    defer.returnValue(FAILURE)
                 defer.returnValue(SUCCESS)
 
         def logUpload(sources):
@@ -465,7 +641,8 @@ class FileDownload(_TransferBuildStep, WorkerAPICompatMixin):
     renderables = ['mastersrc', 'workerdest']
 
     def __init__(self, mastersrc, workerdest=None,
-                 workdir=None, maxsize=None, blocksize=16 * 1024, mode=None,
+                 workdir=None, maxsize=None, blocksize=16 * 1024,
+                 window=8, mode=None,
                  slavedest=None,  # deprecated, use `workerdest` instead
                  **buildstep_kwargs):
         # Deprecated API support.
@@ -487,6 +664,7 @@ class FileDownload(_TransferBuildStep, WorkerAPICompatMixin):
         self._registerOldWorkerAttr("workerdest")
         self.maxsize = maxsize
         self.blocksize = blocksize
+        self.window = window
         if not isinstance(mode, (int, type(None))):
             config.error(
                 'mode must be an integer or None')
@@ -532,8 +710,23 @@ class FileDownload(_TransferBuildStep, WorkerAPICompatMixin):
         else:
             args['workerdest'] = workerdest
 
-        cmd = makeStatusRemoteCommand(self, 'downloadFile', args)
-        d = self.runTransferCommand(cmd)
+        self.addWindowArg(args, 'downloadFile')
+        d = defer.succeed(None)
+        store = self.master.artifacts
+        if store.enabled and not self.workerVersionIsOlderThan('downloadFile',
+                                                               '3.4'):
+            # workers cache the files they download by digest, and copy them
+            # from their cache as long as they do not change
+            d.addCallback(lambda _: store.hashFile(source))
+
+            @d.addCallback
+            def setDigest(digest):
+                args['sha256'] = digest
+
+        @d.addCallback
+        def run(_):
+            cmd = makeStatusRemoteCommand(self, 'downloadFile', args)
+            return self.runTransferCommand(cmd)
         d.addCallback(self.finished).addErrback(self.failed)
 
 
@@ -544,7 +737,8 @@ class StringDownload(_TransferBuildStep, WorkerAPICompatMixin):
     renderables = ['workerdest', 's']
 
     def __init__(self, s, workerdest=None,
-                 workdir=None, maxsize=None, blocksize=16 * 1024, mode=None,
+                 workdir=None, maxsize=None, blocksize=16 * 1024,
+                 window=8, mode=None,
                  slavedest=None,  # deprecated, use `workerdest` instead
                  **buildstep_kwargs):
         # Deprecated API support.
@@ -566,6 +760,7 @@ class StringDownload(_TransferBuildStep, WorkerAPICompatMixin):
         self._registerOldWorkerAttr("workerdest")
         self.maxsize = maxsize
         self.blocksize = blocksize
+        self.window = window
         if not isinstance(mode, (int, type(None))):
             config.error(
                 "StringDownload step's mode must be an integer or None,"
@@ -602,6 +797,7 @@ class StringDownload(_TransferBuildStep, WorkerAPICompatMixin):
         else:
             args['workerdest'] = workerdest
 
+        self.addWindowArg(args, 'downloadFile')
         cmd = makeStatusRemoteCommand(self, 'downloadFile', args)
         d = self.runTransferCommand(cmd)
         d.addCallback(self.finished).addErrback(self.failed)
@@ -0,0 +1,142 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import absolute_import
+from __future__ import print_function
+from future.utils import iteritems
+
+import random
+import time
+
+from buildbot.db import logs
+from buildbot.test.util import benchmark
+
+try:
+    import lz4
+    [lz4]
+    hasLz4 = True
+except ImportError:
+    hasLz4 = False
+
+
+def makeBuildLog(rnd, num_lines):
+    # something resembling the output of a compile and test step: lots of
+    # similar lines, with varying file names and numbers
+    lines = []
+    for i in range(num_lines):
+        module = rnd.choice(['core', 'net', 'ui', 'db', 'util'])
+        name = 'file%d' % rnd.randint(1, 400)
+        kind = rnd.randint(0, 9)
+        if kind < 5:
+            lines.append('gcc -O2 -g -Wall -Wextra -Iinclude -Isrc/%s -c '
+                         'src/%s/%s.c -o build/%s/%s.o'
+                         % (module, module, name, module, name))
+        elif kind < 7:
+            lines.append('src/%s/%s.c:%d:%d: warning: unused variable '
+                         "'tmp%d' [-Wunused-variable]"
+                         % (module, name, rnd.randint(1, 3000),
+                            rnd.randint(1, 80), rnd.randint(0, 20)))
+        elif kind < 9:
+            lines.append('test_%s.%sTests.test_%s ... ok (%.3fs)'
+                         % (module, name.title(), rnd.randint(1, 50),
+                            rnd.random()))
+        else:
+            lines.append('[%5d/%5d] Linking CXX executable bin/%s_%s'
+                         % (i, num_lines, module, name))
+    return '\n'.join(lines).encode('utf-8')
+
+
+def splitChunks(data, chunk_size):
+    # split on line boundaries, as appendLog does
+    chunks = []
+    while data:
+        i = data.rfind(b'\n', 0, chunk_size)
+        if len(data) <= chunk_size or i == -1:
+            chunks.append(data[:chunk_size])
+            data = data[chunk_size:]
+        else:
+            chunks.append(data[:i])
+            data = data[i + 1:]
+    return chunks
+
+
+class LogCompressionBenchmark(benchmark.BenchmarkTestCase):
+
+    NUM_LINES = 200000
+    # chunks written while a step runs are small, while those rewritten by
+    # compressLog are up to MAX_CHUNK_SIZE
+    CHUNK_SIZES = (4096, logs.LogsConnectorComponent.MAX_CHUNK_SIZE)
+
+    def getModes(self, training_data):
+        modes = {}
+        for name, mode in iteritems(logs.LogsConnectorComponent.COMPRESSION_MODE):
+            if name == 'lz4' and not hasLz4:
+                continue
+            if name == 'zstd' and logs.zstandard is None:
+                continue
+            modes[name] = (mode['dumps'], mode['read'])
+        if logs.zstandard is not None:
+            # a dictionary trained on the log of a previous build
+            zdict = logs.zstandard.train_dictionary(
+                logs.LogsConnectorComponent.ZSTD_DICT_SIZE,
+                splitChunks(training_data,
+                            logs.LogsConnectorComponent.ZSTD_DICT_SAMPLE_SIZE))
+            zdict.precompute_compress(level=logs.ZSTD_LEVEL)
+            modes['zstd+dict'] = (lambda data: logs.dumps_zstd(data, zdict),
+                                  lambda data: logs.read_zstd(data, zdict))
+        return modes
+
+    def measure(self, modes, chunks):
+        results = {}
+        raw_size = sum(len(c) for c in chunks)
+        for name, (dumps, read) in sorted(iteritems(modes)):
+            start = time.time()
+            compressed = [dumps(c) for c in chunks]
+            compress_time = time.time() - start
+            start = time.time()
+            decompressed = [read(c) for c in compressed]
+            decompress_time = time.time() - start
+            assert decompressed == chunks, name
+            results[name] = (raw_size,
+                             sum(len(c) for c in compressed),
+                             compress_time, decompress_time)
+        return results
+
+    def test_benchmark_compression(self):
+        rnd = random.Random(0)
+        training_data = makeBuildLog(rnd, self.NUM_LINES // 4)
+        data = makeBuildLog(rnd, self.NUM_LINES)
+        modes = self.getModes(training_data)
+        for chunk_size in self.CHUNK_SIZES:
+            chunks = splitChunks(data, chunk_size)
+            results = self.measure(modes, chunks)
+            for name, (raw, compressed, ctime, dtime) in sorted(iteritems(results)):
+                what = "%s, %d byte chunks" % (name, chunk_size)
+                self.report(what + ", space saving",
+                            100.0 * (raw - compressed) / raw, "%")
+                self.report(what + ", compression",
+                            raw / ctime / 1e6, "MB/s")
+                self.report(what + ", decompression",
+                            raw / dtime / 1e6, "MB/s")
+
+    def test_compression_smoke(self):
+        # make sure the benchmark itself keeps working, even when not enabled
+        rnd = random.Random(0)
+        data = makeBuildLog(rnd, 5000)
+        modes = self.getModes(data)
+        results = self.measure(modes, splitChunks(data, 4096))
+        self.assertIn('gz', results)
+        for raw, compressed, _, _ in results.values():
+            self.assertTrue(compressed <= raw)
@@ -0,0 +1,81 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import random
+
+from buildbot.mq import simple
+from buildbot.test.fake import fakemaster
+from buildbot.test.util import benchmark
+
+
+class SimpleMQBenchmark(benchmark.BenchmarkTestCase):
+
+    NUM_MESSAGES = 100000
+    NUM_SUBSCRIPTIONS = 5000
+
+    def setUp(self):
+        benchmark.BenchmarkTestCase.setUp(self)
+        self.master = fakemaster.make_master()
+        self.mq = simple.SimpleMQ()
+        self.mq.setServiceParent(self.master)
+        self.received = 0
+
+    def callback(self, routingKey, data):
+        self.received += 1
+
+    def subscribe(self, count):
+        # roughly what a lot of open web UI tabs look like: each one watches
+        # a few specific builds, steps and logs, and a few of them also use
+        # wildcard filters
+        rnd = random.Random(0)
+        for i in range(count):
+            buildid = str(rnd.randint(1, 1000))
+            if i % 100 == 0:
+                filter = ('builds', None, 'new')
+            elif i % 4 == 0:
+                filter = ('builds', buildid, None)
+            elif i % 4 == 1:
+                filter = ('steps', buildid, None)
+            elif i % 4 == 2:
+                filter = ('logs', buildid, 'append')
+            else:
+                filter = ('builders', None, 'builds', buildid, None)
+            self.mq.startConsuming(self.callback, filter)
+
+    def produceMessages(self, count):
+        rnd = random.Random(1)
+        keys = [('builds', str(rnd.randint(1, 1000)), 'new'),
+                ('logs', str(rnd.randint(1, 1000)), 'append'),
+                ('steps', str(rnd.randint(1, 1000)), 'finished'),
+                ('changes', str(rnd.randint(1, 1000)), 'new')]
+        produce = self.mq.produce
+        for i in range(count):
+            produce(keys[i % len(keys)], None)
+
+    def test_benchmark_produce(self):
+        self.subscribe(self.NUM_SUBSCRIPTIONS)
+        elapsed = self.timeit(self.produceMessages, self.NUM_MESSAGES)
+        self.report("produce with %d subscriptions" % self.NUM_SUBSCRIPTIONS,
+                    self.NUM_MESSAGES / elapsed, "messages/sec")
+        self.assertTrue(self.received > 0)
+
+    def test_produce_smoke(self):
+        # make sure the benchmark itself keeps working, even when not enabled
+        self.subscribe(50)
+        self.produceMessages(100)
+        self.assertTrue(self.received > 0)
@@ -0,0 +1,134 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import random
+import time
+
+import mock
+
+from twisted.internet import defer
+
+from buildbot.process import buildrequestdistributor
+from buildbot.test.fake import fakedb
+from buildbot.test.fake import fakemaster
+from buildbot.test.util import benchmark
+
+
+class FakeBuildRequest(object):
+    # all the chooser's caches need; lighter than a BuildRequest or a mock
+
+    def __init__(self, id):
+        self.id = id
+
+
+class BuildChooserBenchmark(benchmark.BenchmarkTestCase):
+
+    QUEUE_LENGTHS = (10000, 50000)
+    NUM_WORKERS = 500
+
+    def setUp(self):
+        benchmark.BenchmarkTestCase.setUp(self)
+        self.master = fakemaster.make_master(testcase=self,
+                                             wantData=True, wantDb=True)
+
+    @defer.inlineCallbacks
+    def makeBuilder(self, num_requests, num_workers):
+        rows = [
+            fakedb.Builder(id=77, name='A'),
+            fakedb.SourceStamp(id=21),
+            fakedb.Buildset(id=11, reason='because'),
+            fakedb.BuildsetSourceStamp(sourcestampid=21, buildsetid=11),
+        ]
+        rnd = random.Random(0)
+        for brid in range(1, num_requests + 1):
+            rows.append(fakedb.BuildRequest(
+                id=brid, buildsetid=11, builderid=77,
+                submitted_at=rnd.randint(1300000000, 1300100000)))
+        yield self.master.db.insertTestData(rows)
+
+        bldr = mock.Mock(name='A')
+        bldr.name = 'A'
+        bldr.getBuilderId = lambda: 77
+        bldr.config.nextWorker = None
+        bldr.config.nextBuild = None
+        bldr.canStartWithWorkerForBuilder = lambda _: True
+        bldr.canStartBuild = lambda *args: True
+        workers = []
+        for i in range(num_workers):
+            wfb = mock.Mock(spec=['isAvailable'], name='worker%d' % i)
+            wfb.isAvailable.return_value = True
+            workers.append(wfb)
+        bldr.getAvailableWorkers = lambda: list(workers)
+        defer.returnValue(bldr)
+
+    @defer.inlineCallbacks
+    def chooseBuilds(self, bldr):
+        # choose a build for every worker, the way the distributor does
+        bc = buildrequestdistributor.BasicBuildChooser(bldr, self.master)
+        chosen = 0
+        while True:
+            worker, breqs = yield bc.chooseNextBuild()
+            if not worker:
+                break
+            chosen += 1
+        defer.returnValue((bc, chosen))
+
+    def lookupAndRemoveAll(self, bc):
+        # what the chooser does for each chosen request, in an arbitrary
+        # order, as a custom nextBuild may choose them
+        breqs = [FakeBuildRequest(brdict['buildrequestid'])
+                 for brdict in bc.unclaimedBrdicts]
+        random.Random(1).shuffle(breqs)
+        for breq in breqs:
+            assert bc._getBrdictForBuildRequest(breq) is not None
+            bc._removeBuildRequest(breq)
+        assert not bc.unclaimedBrdicts
+        return len(breqs)
+
+    @defer.inlineCallbacks
+    def measure(self, num_requests, num_workers):
+        bldr = yield self.makeBuilder(num_requests, num_workers)
+        start = time.time()
+        bc, chosen = yield self.chooseBuilds(bldr)
+        choose_time = time.time() - start
+        assert chosen == min(num_requests, num_workers)
+
+        start = time.time()
+        removed = self.lookupAndRemoveAll(bc)
+        remove_time = time.time() - start
+        assert removed == num_requests - chosen
+        defer.returnValue((chosen, choose_time, removed, remove_time))
+
+    @defer.inlineCallbacks
+    def test_benchmark_chooser(self):
+        for num_requests in self.QUEUE_LENGTHS:
+            self.master = fakemaster.make_master(testcase=self,
+                                                 wantData=True, wantDb=True)
+            chosen, choose_time, removed, remove_time = \
+                yield self.measure(num_requests, self.NUM_WORKERS)
+            what = "%d pending requests" % num_requests
+            self.report(what + ", choosing builds for %d workers" % chosen,
+                        chosen / choose_time, "builds/sec")
+            self.report(what + ", looking up and removing",
+                        removed / remove_time, "requests/sec")
+
+    @defer.inlineCallbacks
+    def test_chooser_smoke(self):
+        # make sure the benchmark itself keeps working, even when not enabled
+        chosen, _, removed, _ = yield self.measure(200, 20)
+        self.assertEqual((chosen, removed), (20, 180))
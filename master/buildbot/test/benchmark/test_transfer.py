@@ -0,0 +1,140 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import shutil
+import tempfile
+import time
+
+from twisted.internet import defer
+from twisted.internet import reactor
+from twisted.trial import unittest
+
+from buildbot.process import remotetransfer
+from buildbot.test.util import benchmark
+
+try:
+    from buildbot_worker.commands import transfer
+    from buildbot_worker.test.fake import workerforbuilder
+except ImportError:
+    transfer = None
+
+
+class LatentRemote(object):
+
+    """
+    Calls the remote_* methods of a master-side transfer object as a worker
+    would through PB, each way of the round trip taking C{rtt / 2} seconds.
+    Calls are delivered, and their results returned, in order.
+    """
+
+    def __init__(self, obj, rtt):
+        self.obj = obj
+        self.rtt = rtt
+
+    def callRemote(self, meth, *args):
+        d = defer.Deferred()
+
+        def returned(result):
+            reactor.callLater(self.rtt / 2, d.callback, result)
+
+        def call():
+            method = getattr(self.obj, 'remote_' + meth)
+            defer.maybeDeferred(method, *args).addBoth(returned)
+        reactor.callLater(self.rtt / 2, call)
+        return d
+
+
+class TransferBenchmark(benchmark.BenchmarkTestCase):
+
+    SIZE = 4 * 1024 * 1024
+    BLOCKSIZE = 16 * 1024
+    RTTS = (0, 0.005, 0.05)
+    WINDOWS = (1, 4, 16)
+
+    def setUp(self):
+        benchmark.BenchmarkTestCase.setUp(self)
+        if transfer is None:
+            raise unittest.SkipTest("buildbot_worker is not installed")
+        self.basedir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.basedir)
+        os.makedirs(os.path.join(self.basedir, 'workdir'))
+
+    def makeData(self, size):
+        data = os.urandom(size)
+        with open(os.path.join(self.basedir, 'workdir', 'src'), 'wb') as f:
+            f.write(data)
+        return data
+
+    def runCommand(self, cmdclass, args):
+        builder = workerforbuilder.FakeWorkerForBuilder(basedir=self.basedir)
+        cmd = cmdclass(builder, 'fake-stepid', args)
+        return cmd.doStart()
+
+    @defer.inlineCallbacks
+    def upload(self, rtt, window, blocksize):
+        dest = os.path.join(self.basedir, 'uploaded')
+        writer = remotetransfer.FileWriter(dest, None, None)
+        start = time.time()
+        yield self.runCommand(transfer.WorkerFileUploadCommand, dict(
+            workdir='workdir', workersrc='src',
+            writer=LatentRemote(writer, rtt), maxsize=None,
+            blocksize=blocksize, window=window, keepstamp=False))
+        elapsed = time.time() - start
+        with open(dest, 'rb') as f:
+            defer.returnValue((f.read(), elapsed))
+
+    @defer.inlineCallbacks
+    def download(self, rtt, window, blocksize):
+        with open(os.path.join(self.basedir, 'workdir', 'src'), 'rb') as fp:
+            reader = remotetransfer.FileReader(fp)
+            start = time.time()
+            yield self.runCommand(transfer.WorkerFileDownloadCommand, dict(
+                workdir='workdir', workerdest='downloaded',
+                reader=LatentRemote(reader, rtt), maxsize=None,
+                blocksize=blocksize, window=window, mode=None))
+            elapsed = time.time() - start
+        dest = os.path.join(self.basedir, 'workdir', 'downloaded')
+        with open(dest, 'rb') as f:
+            defer.returnValue((f.read(), elapsed))
+
+    @defer.inlineCallbacks
+    def test_benchmark_transfer(self):
+        data = self.makeData(self.SIZE)
+        for rtt in self.RTTS:
+            for window in self.WINDOWS:
+                for name, fn in [('upload', self.upload),
+                                 ('download', self.download)]:
+                    got, elapsed = yield fn(rtt, window, self.BLOCKSIZE)
+                    self.assertEqual(got, data)
+                    self.report("%s, %dms rtt, window %d" %
+                                (name, rtt * 1000, window),
+                                len(data) / elapsed / 1e6, "MB/s")
+
+    # a stop-and-wait transfer at the largest latency takes a while
+    test_benchmark_transfer.timeout = 600
+
+    @defer.inlineCallbacks
+    def test_transfer_smoke(self):
+        # make sure the benchmark itself keeps working, even when not enabled
+        data = self.makeData(100000)
+        for window in (1, 8):
+            got, _ = yield self.upload(0.001, window, 4096)
+            self.assertEqual(got, data)
+            got, _ = yield self.download(0.001, window, 4096)
+            self.assertEqual(got, data)
@@ -18,6 +18,7 @@ from __future__ import print_function
 
 from twisted.internet import defer
 
+from buildbot.process import buildrequestindex
 from buildbot.util import service
 
 
@@ -30,6 +31,8 @@ class FakeBotMaster(service.AsyncMultiService):
         self.builders = {}
         self.buildsStartedForWorkers = []
         self.delayShutdown = False
+        # never synced, unless a test starts it
+        self.brIndex = buildrequestindex.UnclaimedBuildRequestIndex()
 
     def getLockByID(self, lockid):
         if lockid not in self.locks:
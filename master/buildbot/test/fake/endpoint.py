@@ -58,6 +58,30 @@ class RawTestsEndpoint(base.Endpoint):
         })
 
 
+class RawStreamTestsEndpoint(base.Endpoint):
+    isCollection = False
+    isRaw = True
+    pathPatterns = "/rawstream"
+    lines = [u'line %d\n' % i for i in range(5)]
+
+    def stream(self, resultSpec, kwargs):
+        firstline = resultSpec.offset or 0
+        lastline = len(self.lines) - 1
+        if resultSpec.limit is not None:
+            lastline = min(lastline, firstline + resultSpec.limit - 1)
+        # two lines per chunk
+        chunks = [defer.succeed(u''.join(self.lines[i:min(i + 2, lastline + 1)]))
+                  for i in range(firstline, lastline + 1, 2)]
+        return defer.succeed({
+            "filename": "stream.txt",
+            "mime-type": "text/plain",
+            "chunks": iter(chunks),
+            "firstline": firstline,
+            "lastline": lastline,
+            "num_lines": len(self.lines),
+        })
+
+
 class FailEndpoint(base.Endpoint):
     isCollection = False
     pathPatterns = "/test/fail"
@@ -84,7 +108,8 @@ class TestEndpoint(base.Endpoint):
 class Test(base.ResourceType):
     name = "test"
     plural = "tests"
-    endpoints = [TestsEndpoint, TestEndpoint, FailEndpoint, RawTestsEndpoint]
+    endpoints = [TestsEndpoint, TestEndpoint, FailEndpoint, RawTestsEndpoint,
+                 RawStreamTestsEndpoint]
 
     class EntityType(types.Entity):
         id = types.Integer()
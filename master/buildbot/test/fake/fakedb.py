@@ -37,6 +37,7 @@ from buildbot.data import resultspec
 from buildbot.db import buildrequests
 from buildbot.db import changesources
 from buildbot.db import schedulers
+from buildbot.process.results import RETRY
 from buildbot.test.util import validation
 from buildbot.util import bytes2NativeString
 from buildbot.util import datetime2epoch
@@ -582,6 +583,16 @@ class LogChunk(Row):
     binary_columns = ('content',)
 
 
+class LogCompaction(Row):
+    table = "logcompaction_queue"
+
+    defaults = dict(
+        logid=None,
+        queued_at=0)
+
+    required_columns = ('logid', )
+
+
 class Master(Row):
     table = "masters"
 
@@ -1206,10 +1217,11 @@ class FakeSourceStampsComponent(FakeDBComponent):
     def getSourceStamp(self, key, no_cache=False):
         return defer.succeed(self._getSourceStamp_sync(key))
 
-    def getSourceStamps(self):
+    def getSourceStamps(self, ssids=None):
         return defer.succeed([
             self._getSourceStamp_sync(ssid)
             for ssid in self.sourcestamps
+            if ssids is None or ssid in ssids
         ])
 
     def _getSourceStamp_sync(self, ssid):
@@ -1334,9 +1346,11 @@ class FakeBuildsetsComponent(FakeDBComponent):
         row = self.buildsets[bsid]
         return defer.succeed(self._row2dict(row))
 
-    def getBuildsets(self, complete=None, resultSpec=None):
+    def getBuildsets(self, complete=None, resultSpec=None, bsids=None):
         rv = []
         for bs in itervalues(self.buildsets):
+            if bsids is not None and bs['id'] not in bsids:
+                continue
             if complete is not None:
                 if complete and bs['complete']:
                     rv.append(self._row2dict(bs))
@@ -1398,6 +1412,15 @@ class FakeBuildsetsComponent(FakeDBComponent):
                 self.buildsets[key]['properties'])
         return defer.succeed({})
 
+    def getBuildsetPropertiesForBuildsets(self, bsids):
+        rv = {}
+        for bsid in bsids:
+            if bsid in self.buildsets:
+                rv[bsid] = self.buildsets[bsid]['properties'].copy()
+            else:
+                rv[bsid] = {}
+        return defer.succeed(rv)
+
     # fake methods
 
     def fakeBuildsetCompletion(self, bsid, result):
@@ -1723,13 +1746,23 @@ class FakeBuildRequestsComponent(FakeDBComponent):
         else:
             defer.returnValue(None)
 
-    @defer.inlineCallbacks
     def getBuildRequests(self, builderid=None, complete=None, claimed=None,
-                         bsid=None, branch=None, repository=None, resultSpec=None):
+                         bsid=None, branch=None, repository=None, resultSpec=None,
+                         brids=None):
+        assert resultSpec is None or brids is None, \
+            "resultSpec cannot be applied to requests fetched by brids"
+        return self._getBuildRequests(builderid, complete, claimed, bsid,
+                                      branch, repository, resultSpec, brids)
+
+    @defer.inlineCallbacks
+    def _getBuildRequests(self, builderid, complete, claimed, bsid, branch,
+                          repository, resultSpec, brids):
         rv = []
         for br in itervalues(self.reqs):
             if builderid and br.builderid != builderid:
                 continue
+            if brids is not None and br.id not in brids:
+                continue
             if complete is not None:
                 if complete and not br.complete:
                     continue
@@ -1886,6 +1919,15 @@ class FakeBuildsComponent(FakeDBComponent):
                 return defer.succeed(self._row2dict(row))
         return defer.succeed(None)
 
+    def getPreviousBuild(self, builderid, number):
+        prev = None
+        for row in itervalues(self.builds):
+            if (row['builderid'] == builderid and row['number'] < number and
+                    row['results'] not in (None, RETRY) and
+                    (prev is None or row['number'] > prev['number'])):
+                prev = row
+        return defer.succeed(self._row2dict(prev) if prev else None)
+
     def getBuilds(self, builderid=None, buildrequestid=None, workerid=None, complete=None, resultSpec=None):
         ret = []
         for (id, row) in iteritems(self.builds):
@@ -1902,6 +1944,13 @@ class FakeBuildsComponent(FakeDBComponent):
             ret = self.applyResultSpec(ret, resultSpec)
         return defer.succeed(ret)
 
+    def getBuildsForBuildRequests(self, buildrequestids):
+        buildrequestids = set(buildrequestids)
+        ret = [self._row2dict(row) for row in itervalues(self.builds)
+               if row['buildrequestid'] in buildrequestids]
+        ret.sort(key=lambda r: r['id'])
+        return defer.succeed(ret)
+
     def addBuild(self, builderid, buildrequestid, workerid, masterid,
                  state_string, _reactor=reactor):
         validation.verifyType(self.t, 'state_string', state_string,
@@ -1938,6 +1987,15 @@ class FakeBuildsComponent(FakeDBComponent):
             return defer.succeed(self.builds[bid]['properties'])
         return defer.succeed({})
 
+    def getBuildPropertiesForBuilds(self, buildids):
+        rv = {}
+        for bid in buildids:
+            if bid in self.builds:
+                rv[bid] = self.builds[bid]['properties'].copy()
+            else:
+                rv[bid] = {}
+        return defer.succeed(rv)
+
     def setBuildProperty(self, bid, name, value, source):
         assert bid in self.builds
         self.builds[bid]['properties'][name] = (value, source)
@@ -2005,6 +2063,15 @@ class FakeStepsComponent(FakeDBComponent):
         ret.sort(key=lambda r: r['number'])
         return defer.succeed(ret)
 
+    def getStepsForBuilds(self, buildids):
+        rv = dict((buildid, []) for buildid in buildids)
+        for row in itervalues(self.steps):
+            if row['buildid'] in rv:
+                rv[row['buildid']].append(self._row2dict(row))
+        for steps in itervalues(rv):
+            steps.sort(key=lambda r: r['number'])
+        return defer.succeed(rv)
+
     def addStep(self, buildid, name, state_string, _reactor=reactor):
         validation.verifyType(self.t, 'state_string', state_string,
                               validation.StringValidator())
@@ -2082,6 +2149,7 @@ class FakeLogsComponent(FakeDBComponent):
     def setUp(self):
         self.logs = {}
         self.log_lines = {}  # { logid : [ lines ] }
+        self.compactions = {}  # { logid : queued_at }
 
     def insertTestData(self, rows):
         for row in rows:
@@ -2095,6 +2163,8 @@ class FakeLogsComponent(FakeDBComponent):
                     lines.append([None] * (row.last_line + 1 - len(lines)))
                 row_lines = row.content.decode('utf-8').split('\n')
                 lines[row.first_line:row.last_line + 1] = row_lines
+            if isinstance(row, LogCompaction):
+                self.compactions[row.logid] = row.queued_at
 
     # component methods
 
@@ -2135,6 +2205,14 @@ class FakeLogsComponent(FakeDBComponent):
             for row in itervalues(self.logs)
             if row['stepid'] == stepid])
 
+    def getLogsForSteps(self, stepids):
+        rv = dict((stepid, []) for stepid in stepids)
+        for id in sorted(self.logs):
+            row = self.logs[id]
+            if row['stepid'] in rv:
+                rv[row['stepid']].append(self._row2dict(row))
+        return defer.succeed(rv)
+
     def getLogLines(self, logid, first_line, last_line):
         if logid not in self.logs or first_line > last_line:
             return defer.succeed('')
@@ -2142,6 +2220,17 @@ class FakeLogsComponent(FakeDBComponent):
         rv = lines[first_line:last_line + 1]
         return defer.succeed(u'\n'.join(rv) + u'\n' if rv else u'')
 
+    def getLogLinesChunk(self, logid, first_line, last_line):
+        # the fake does not store chunks, so pretend that every chunk is made
+        # of 10 lines
+        chunk_last_line = first_line - first_line % 10 + 9
+        last_line = min(last_line, chunk_last_line,
+                        len(self.log_lines.get(logid, [])) - 1)
+        if logid not in self.logs or first_line > last_line:
+            return defer.succeed((u'', None))
+        rv = self.log_lines[logid][first_line:last_line + 1]
+        return defer.succeed((u'\n'.join(rv) + u'\n', last_line))
+
     def addLog(self, stepid, name, slug, type):
         id = self._newId()
         self.logs[id] = dict(id=id, stepid=stepid,
@@ -2163,11 +2252,38 @@ class FakeLogsComponent(FakeDBComponent):
         return defer.succeed((num_lines - len(content), num_lines - 1))
 
     def finishLog(self, logid):
-        if id in self.logs:
-            self.logs['id'].complete = 1
+        if logid in self.logs and not self.logs[logid]['complete']:
+            self.logs[logid]['complete'] = 1
+            self.compactions[logid] = int(reactor.seconds())
         return defer.succeed(None)
 
     def compressLog(self, logid, force=False):
+        self.compactions.pop(logid, None)
+        return defer.succeed(0)
+
+    def getLogCompactions(self, masterid=None, limit=None):
+        logids = []
+        for logid, queued_at in sorted(iteritems(self.compactions),
+                                       key=lambda kv: (kv[1], kv[0])):
+            if masterid is not None:
+                log = self.logs.get(logid)
+                step = log and self.db.steps.steps.get(log['stepid'])
+                build = step and self.db.builds.builds.get(step['buildid'])
+                if not build:
+                    continue
+                master = self.db.masters.masters.get(build['masterid'])
+                if build['masterid'] != masterid and master['active']:
+                    continue
+            logids.append(logid)
+        if limit is not None:
+            logids = logids[:limit]
+        return defer.succeed(logids)
+
+    def claimLogCompaction(self, logid):
+        return defer.succeed(self.compactions.pop(logid, None) is not None)
+
+    def removeLogCompaction(self, logid):
+        self.compactions.pop(logid, None)
         return defer.succeed(None)
 
     def deleteOldLogChunks(self, older_than_timestamp):
@@ -27,6 +27,9 @@ from zope.interface import implementer
 
 from buildbot import config
 from buildbot import interfaces
+from buildbot.process import artifactstore
+from buildbot.reporters.utils import BuildDetailsLoader
+from buildbot.reporters.utils import PreviousBuildCache
 from buildbot.status import build
 from buildbot.test.fake import bworkermanager
 from buildbot.test.fake import fakedata
@@ -34,6 +37,7 @@ from buildbot.test.fake import fakedb
 from buildbot.test.fake import fakemq
 from buildbot.test.fake import pbmanager
 from buildbot.test.fake.botmaster import FakeBotMaster
+from buildbot.util import lru
 from buildbot.util import service
 
 
@@ -65,6 +69,10 @@ class FakeCaches(object):
     def get_cache(self, name, miss_fn):
         return FakeCache(name, miss_fn)
 
+    def get_sized_cache(self, name, default_max_size):
+        # a cache that is too small to hold anything
+        return lru.SizedLRUCache(0)
+
 
 class FakeStatus(service.BuildbotService):
 
@@ -184,6 +192,14 @@ class FakeMaster(service.MasterService):
         self.workers = bworkermanager.FakeWorkerManager()
         self.workers.setServiceParent(self)
         self.log_rotation = FakeLogRotation()
+        self.previous_builds = PreviousBuildCache()
+        self.previous_builds.setServiceParent(self)
+        self.build_details = BuildDetailsLoader()
+        self.build_details.setServiceParent(self)
+        self.artifacts = artifactstore.ArtifactStore()
+        self.artifacts.setServiceParent(self)
+        # directory uploads are extracted in the reactor's thread pool
+        self.extractions = None
         self.db = mock.Mock()
         self.next_objectid = 0
 
@@ -28,6 +28,7 @@ from twisted.trial.unittest import SynchronousTestCase
 from buildbot.config import BuilderConfig
 from buildbot.interfaces import LatentWorkerFailedToSubstantiate
 from buildbot.interfaces import LatentWorkerSubstantiatiationCancelled
+from buildbot.process import metrics
 from buildbot.process.buildstep import BuildStep
 from buildbot.process.factory import BuildFactory
 from buildbot.process.results import RETRY
@@ -538,3 +539,126 @@ class Tests(SynchronousTestCase):
         builds = self.successResultOf(
             master.data.get(("builds",)))
         self.assertEqual(builds[1]['results'], SUCCESS)
+
+    def getWarmPoolMetrics(self):
+        events = []
+
+        def observer(eventDict):
+            metric = eventDict.get('metric')
+            if (isinstance(metric, metrics.MetricCountEvent) and
+                    metric.counter.startswith('AbstractLatentWorker.warmPool')):
+                events.append((metric.counter, metric.count))
+        log.addObserver(observer)
+        self.addCleanup(log.removeObserver, observer)
+        return events
+
+    def getWarmPoolMaster(self, controllers, **pool):
+        pool['workernames'] = [c.worker.name for c in controllers]
+        config_dict = {
+            'builders': [
+                BuilderConfig(name="testy",
+                              workernames=pool['workernames'],
+                              factory=BuildFactory(),
+                              ),
+            ],
+            'workers': [controller.worker for controller in controllers],
+            'latentWarmPool': pool,
+            'protocols': {'null': {}},
+            # Disable checks about missing scheduler.
+            'multiMaster': True,
+        }
+        master = self.getMaster(config_dict)
+        # let the pool rebalance after the configuration
+        self.reactor.advance(0)
+        return master
+
+    def test_warm_pool_prewarms_worker(self):
+        """
+        A worker of the warm pool is substantiated without any build request,
+        and the next build starts on it without substantiating again.
+        """
+        events = self.getWarmPoolMetrics()
+        controller = LatentController('local')
+        master = self.getWarmPoolMaster([controller], minIdle=1,
+                                        idleTimeout=30)
+        builder_id = self.successResultOf(
+            master.data.updates.findBuilderId('testy'))
+
+        self.assertTrue(controller.starting)
+        controller.start_instance(True)
+        controller.connect_worker(self)
+        self.assertTrue(controller.worker.substantiated)
+        self.assertEqual(controller.worker.build_wait_timer.getTime(),
+                         self.reactor.seconds() + 30)
+
+        finished_builds = []
+        self.successResultOf(master.mq.startConsuming(
+            lambda key, build: finished_builds.append(build),
+            ('builds', None, 'finished')))
+        self.reactor.advance(10)
+        self.createBuildrequest(master, [builder_id])
+
+        self.assertFalse(controller.starting)
+        self.assertEqual([build['results'] for build in finished_builds],
+                         [SUCCESS])
+        self.assertEqual(events, [
+            ('AbstractLatentWorker.warmPoolHits', 1),
+            ('AbstractLatentWorker.warmPoolIdleSeconds', 10),
+        ])
+        controller.auto_stop(True)
+
+    def test_warm_pool_idle_timeout(self):
+        """
+        A pre-warmed worker which stays idle is insubstantiated after
+        C{idleTimeout} seconds, and its idle time is reported.
+        """
+        events = self.getWarmPoolMetrics()
+        controller = LatentController('local')
+        soft_disconnects = []
+        self.patch(controller.worker, '_soft_disconnect',
+                   lambda: soft_disconnects.append(self.reactor.seconds()))
+        self.getWarmPoolMaster([controller], minIdle=1, idleTimeout=30)
+        controller.start_instance(True)
+        controller.connect_worker(self)
+        warm_since = self.reactor.seconds()
+
+        self.reactor.advance(30)
+        self.assertEqual(soft_disconnects, [warm_since + 30])
+
+        controller.auto_stop(True)
+        self.successResultOf(controller.worker.insubstantiate())
+        self.assertEqual(events, [
+            ('AbstractLatentWorker.warmPoolIdleSeconds', 30),
+        ])
+
+    def test_warm_pool_max_total(self):
+        """
+        The warm pool does not pre-warm more than C{maxTotal} workers.
+        """
+        controllers = [LatentController('local1'),
+                       LatentController('local2')]
+        self.getWarmPoolMaster(controllers, minIdle=2, maxTotal=1)
+
+        self.assertEqual([c.starting for c in controllers], [True, False])
+        for controller in controllers:
+            controller.auto_stop(True)
+        controllers[0].start_instance(True)
+
+    def test_warm_pool_miss(self):
+        """
+        A build on a cold worker of the warm pool is reported as a miss.
+        """
+        events = self.getWarmPoolMetrics()
+        controller = LatentController('local')
+        master = self.getWarmPoolMaster([controller])
+        builder_id = self.successResultOf(
+            master.data.updates.findBuilderId('testy'))
+        self.assertFalse(controller.starting)
+
+        self.createBuildrequest(master, [builder_id])
+        self.assertTrue(controller.starting)
+        self.assertEqual(events, [
+            ('AbstractLatentWorker.warmPoolMisses', 1),
+        ])
+        controller.start_instance(True)
+        controller.auto_stop(True)
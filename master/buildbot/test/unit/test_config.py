@@ -32,6 +32,7 @@ import mock
 
 from twisted.internet import defer
 from twisted.trial import unittest
+from zope.interface import alsoProvides
 from zope.interface import implementer
 
 from buildbot import config
@@ -69,9 +70,12 @@ global_defaults = dict(
     logEncoding='utf-8',
     logMaxTailSize=None,
     logMaxSize=None,
+    logAppendBatchDelay=0,
+    logAppendBatchMaxSize=1024 * 1024,
     properties=properties.Properties(),
     collapseRequests=None,
     prioritizeBuilders=None,
+    buildStartConcurrency=1,
     protocols={},
     multiMaster=False,
     manhole=None,
@@ -505,7 +509,17 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
         self.cfg.load_global(self.filename,
                              dict(logCompressionMethod='foo'))
         self.assertConfigError(
-            self.errors, "c['logCompressionMethod'] must be 'raw', 'bz2', 'gz' or 'lz4'")
+            self.errors, "c['logCompressionMethod'] must be 'raw', 'bz2', 'gz', 'lz4' or 'zstd'")
+
+    def test_load_global_logCompressionMethod_zstd_missing(self):
+        # a None entry in sys.modules makes the import fail
+        with mock.patch.dict('sys.modules', {'zstandard': None}):
+            with assertProducesWarning(
+                    config.ConfigWarning,
+                    message_pattern=r"zstandard library is not installed"):
+                self.cfg.load_global(self.filename,
+                                     dict(logCompressionMethod='zstd'))
+        self.assertEqual(self.cfg.logCompressionMethod, 'gz')
 
     def test_load_global_codebaseGenerator(self):
         func = lambda _: "dummy"
@@ -529,6 +543,19 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
         self.do_test_load_global(
             dict(logEncoding='latin-2'), logEncoding='latin-2')
 
+    def test_load_global_logAppendBatchDelay(self):
+        self.do_test_load_global(dict(logAppendBatchDelay=0.5),
+                                 logAppendBatchDelay=0.5)
+
+    def test_load_global_logAppendBatchDelay_invalid(self):
+        self.cfg.load_global(self.filename, dict(logAppendBatchDelay='1'))
+        self.assertConfigError(self.errors,
+                               "c['logAppendBatchDelay'] must be a number")
+
+    def test_load_global_logAppendBatchMaxSize(self):
+        self.do_test_load_global(dict(logAppendBatchMaxSize=4096),
+                                 logAppendBatchMaxSize=4096)
+
     def test_load_global_properties(self):
         exp = properties.Properties()
         exp.setProperty('x', 10, self.filename)
@@ -564,6 +591,15 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
                              dict(prioritizeBuilders='yes'))
         self.assertConfigError(self.errors, "must be a callable")
 
+    def test_load_global_buildStartConcurrency(self):
+        self.do_test_load_global(dict(buildStartConcurrency=4),
+                                 buildStartConcurrency=4)
+
+    def test_load_global_buildStartConcurrency_invalid(self):
+        self.cfg.load_global(self.filename,
+                             dict(buildStartConcurrency=0))
+        self.assertConfigError(self.errors, "must be at least 1")
+
     def test_load_global_slavePortnum_int(self):
         with assertProducesWarning(
                 DeprecatedWorkerNameWarning,
@@ -739,6 +775,95 @@ class MasterConfig_loaders(ConfigErrorsMixin, unittest.TestCase):
         self.assertConfigError(self.errors,
                                "'Changes' cache size must be at least 1, got '-12'")
 
+    def test_load_latent_warm_pool_defaults(self):
+        self.cfg.load_latent_warm_pool(self.filename, {})
+        self.assertResults(latentWarmPool=None)
+
+    def test_load_latent_warm_pool_invalid(self):
+        self.cfg.load_latent_warm_pool(self.filename,
+                                       dict(latentWarmPool=13))
+        self.assertConfigError(self.errors, "must be a dictionary")
+
+    def test_load_latent_warm_pool(self):
+        self.cfg.load_latent_warm_pool(self.filename,
+                                       dict(latentWarmPool=dict(
+                                           workernames=['w1', 'w2'],
+                                           minIdle=1)))
+        self.assertResults(latentWarmPool=dict(workernames=['w1', 'w2'],
+                                               minIdle=1, maxTotal=None,
+                                               idleTimeout=600))
+
+    def test_load_latent_warm_pool_all_keys(self):
+        self.cfg.load_latent_warm_pool(self.filename,
+                                       dict(latentWarmPool=dict(
+                                           workernames=['w1'], minIdle=0,
+                                           maxTotal=3, idleTimeout=30)))
+        self.assertResults(latentWarmPool=dict(workernames=['w1'],
+                                               minIdle=0, maxTotal=3,
+                                               idleTimeout=30))
+
+    def test_load_latent_warm_pool_unknown_key(self):
+        self.cfg.load_latent_warm_pool(self.filename,
+                                       dict(latentWarmPool=dict(
+                                           workernames=['w1'], maxIdle=3)))
+        self.assertConfigError(self.errors,
+                               "unrecognized keys in c['latentWarmPool']: "
+                               "maxIdle")
+
+    def test_load_latent_warm_pool_bad_workernames(self):
+        self.cfg.load_latent_warm_pool(self.filename,
+                                       dict(latentWarmPool=dict(
+                                           workernames='w1')))
+        self.assertConfigError(self.errors, "must be a list of worker names")
+
+    def test_load_latent_warm_pool_bad_value(self):
+        self.cfg.load_latent_warm_pool(self.filename,
+                                       dict(latentWarmPool=dict(
+                                           workernames=['w1'], maxTotal=0)))
+        self.assertConfigError(self.errors,
+                               "c['latentWarmPool']['maxTotal'] must be an "
+                               "integer of at least 1")
+
+    def test_load_artifact_store_defaults(self):
+        self.cfg.load_artifact_store(self.filename, {})
+        self.assertResults(artifactStore=None)
+
+    def test_load_artifact_store_invalid(self):
+        self.cfg.load_artifact_store(self.filename,
+                                     dict(artifactStore='artifacts'))
+        self.assertConfigError(self.errors, "must be a dictionary")
+
+    def test_load_artifact_store_empty(self):
+        self.cfg.load_artifact_store(self.filename, dict(artifactStore={}))
+        self.assertResults(artifactStore=dict(basedir='artifacts',
+                                              maxSize=10 * 1024 ** 3))
+
+    def test_load_artifact_store(self):
+        self.cfg.load_artifact_store(self.filename,
+                                     dict(artifactStore=dict(
+                                         basedir='/srv/artifacts',
+                                         maxSize=1000)))
+        self.assertResults(artifactStore=dict(basedir='/srv/artifacts',
+                                              maxSize=1000))
+
+    def test_load_artifact_store_unknown_key(self):
+        self.cfg.load_artifact_store(self.filename,
+                                     dict(artifactStore=dict(size=1000)))
+        self.assertConfigError(self.errors,
+                               "unrecognized keys in c['artifactStore']: size")
+
+    def test_load_artifact_store_bad_basedir(self):
+        self.cfg.load_artifact_store(self.filename,
+                                     dict(artifactStore=dict(basedir='')))
+        self.assertConfigError(self.errors, "must be a directory name")
+
+    def test_load_artifact_store_bad_max_size(self):
+        self.cfg.load_artifact_store(self.filename,
+                                     dict(artifactStore=dict(maxSize=0)))
+        self.assertConfigError(self.errors,
+                               "c['artifactStore']['maxSize'] must be a "
+                               "positive integer")
+
     def test_load_schedulers_defaults(self):
         self.cfg.load_schedulers(self.filename, {})
         self.assertResults(schedulers={})
@@ -1235,6 +1360,31 @@ class MasterConfig_checkers(ConfigErrorsMixin, unittest.TestCase):
         self.cfg.check_builders()
         self.assertNoConfigErrors(self.errors)
 
+    def test_check_latent_warm_pool_unknown_worker(self):
+        self.cfg.workers = []
+        self.cfg.latentWarmPool = dict(workernames=['xyz'])
+
+        self.cfg.check_latent_warm_pool()
+        self.assertConfigError(self.errors,
+                               "c['latentWarmPool'] uses unknown worker 'xyz'")
+
+    def test_check_latent_warm_pool_not_latent(self):
+        self.cfg.workers = [worker.Worker('xyz', 'pa')]
+        self.cfg.latentWarmPool = dict(workernames=['xyz'])
+
+        self.cfg.check_latent_warm_pool()
+        self.assertConfigError(self.errors, "which is not a latent worker")
+
+    def test_check_latent_warm_pool(self):
+        wrk = mock.Mock()
+        wrk.workername = 'xyz'
+        alsoProvides(wrk, interfaces.ILatentWorker)
+        self.cfg.workers = [wrk]
+        self.cfg.latentWarmPool = dict(workernames=['xyz'])
+
+        self.cfg.check_latent_warm_pool()
+        self.assertNoConfigErrors(self.errors)
+
     def test_check_status_fails(self):
         st = FakeStatusReceiver()
         st.checkConfig = lambda status: config.error("oh noes")
@@ -66,6 +66,28 @@ class ResourceType(unittest.TestCase):
             (('foo', '10', 'bar', '20', 'tested'), dict(fooid=10, barid='20'))
         ])
 
+    def test_produceEvent_readonly(self):
+        cls = self.makeResourceTypeSubclass(
+            name='singular',
+            eventPathPatterns="""
+                /foo/:fooid
+                /bar/:barid
+            """)
+        master = fakemaster.make_master(testcase=self, wantMq=True)
+        master.mq.verifyMessages = False  # since this is a pretend message
+        inst = cls(master)
+        msg = dict(fooid=10, barid=20, sub=dict(x=[1, 2]))
+        inst.produceEvent(msg, 'tested')
+        (_, msg1), (_, msg2) = master.mq.productions
+        # both routing keys share the same read-only message..
+        self.assertIdentical(msg1, msg2)
+        self.assertEqual(msg1, msg)
+        self.assertRaises(TypeError, msg1.__setitem__, 'fooid', 11)
+        self.assertRaises(TypeError, msg1['sub']['x'].append, 3)
+        # ..which is not the producer's object
+        msg['sub']['x'].append(3)
+        self.assertEqual(msg1['sub']['x'], [1, 2])
+
     def test_compilePatterns(self):
         class MyResourceType(base.ResourceType):
             eventPathPatterns = """
@@ -78,6 +100,18 @@ class ResourceType(unittest.TestCase):
         self.assertEqual(
             inst.eventPaths, ['builder/{builderid}/build/{number}', 'build/{buildid}'])
 
+    def test_getRoutingKeys(self):
+        class MyResourceType(base.ResourceType):
+            eventPathPatterns = """
+                /builder/:builderid/build/:number
+                /build/:buildid
+            """
+        inst = MyResourceType(None)
+        self.assertEqual(
+            list(inst.getRoutingKeys(dict(builderid=1, number=2, buildid=3),
+                                     'new')),
+            [('builder', '1', 'build', '2', 'new'), ('build', '3', 'new')])
+
 
 class Endpoint(endpoint.EndpointMixin, unittest.TestCase):
 
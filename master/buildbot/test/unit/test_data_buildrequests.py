@@ -306,6 +306,27 @@ class TestBuildRequest(interfaces.InterfaceTests, unittest.TestCase):
               'buildrequests', '44', 'claimed'), msg),
         ]))
 
+    @defer.inlineCallbacks
+    def testGenerateEventBulk(self):
+        self.master.db.insertTestData([
+            fakedb.Builder(id=123),
+            fakedb.BuildRequest(id=44, buildsetid=8822, builderid=123),
+            fakedb.BuildRequest(id=55, buildsetid=8822, builderid=123),
+        ])
+        self.patch(self.master.db.buildrequests, 'getBuildRequest',
+                   mock.Mock(side_effect=AssertionError('not bulk')))
+        getBuildRequests = mock.Mock(
+            wraps=self.master.db.buildrequests.getBuildRequests)
+        self.patch(self.master.db.buildrequests, 'getBuildRequests',
+                   getBuildRequests)
+        yield self.rtype.generateEvent([55, 44, 66], 'new')
+        getBuildRequests.assert_called_once_with(brids=[55, 44, 66])
+        self.assertEqual(
+            [(k, m['buildrequestid'])
+             for k, m in self.master.mq.productions if k[0] == 'buildrequests'],
+            [(('buildrequests', '55', 'new'), 55),
+             (('buildrequests', '44', 'new'), 44)])
+
     @defer.inlineCallbacks
     def testClaimBuildRequestsNoBrids(self):
         claimBuildRequestsMock = mock.Mock(return_value=defer.succeed(None))
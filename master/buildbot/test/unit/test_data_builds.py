@@ -140,6 +140,10 @@ class BuildsEndpoint(endpoint.EndpointMixin, unittest.TestCase):
                          buildrequestid=82, number=4),
             fakedb.Build(id=15, builderid=78, masterid=88, workerid=12,
                          buildrequestid=83, number=5, complete_at=1),
+            fakedb.BuildProperty(buildid=13, name='reason', value='"force"',
+                                 source='test'),
+            fakedb.BuildProperty(buildid=14, name='owner', value='"me"',
+                                 source='test'),
         ])
 
     def tearDown(self):
@@ -211,6 +215,17 @@ class BuildsEndpoint(endpoint.EndpointMixin, unittest.TestCase):
             self.validateData(b)
             self.assertIn('properties', b)
 
+    @defer.inlineCallbacks
+    def test_properties_filtered(self):
+        self.patch(self.master.db.builds, 'getBuildProperties',
+                   mock.Mock(side_effect=AssertionError('not bulk')))
+        resultSpec = MockedResultSpec(properties=[
+            resultspec.Property('property', 'eq', ['reason'])])
+        builds = yield self.callGet(('builds',), resultSpec=resultSpec)
+        props = dict((b['buildid'], b['properties']) for b in builds)
+        self.assertEqual(props, {13: {'reason': ('"force"', 'test')},
+                                 14: {}, 15: {}})
+
 
 class Build(interfaces.InterfaceTests, unittest.TestCase):
     new_build_event = {'builderid': 10,
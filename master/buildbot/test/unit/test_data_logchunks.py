@@ -202,3 +202,51 @@ class RawLogChunkEndpoint(LogChunkEndpointBase):
 
         self.assertEqual(logchunk,
                          {'filename': expFilename, 'mime-type': u"text/plain", 'raw': expContent})
+
+    @defer.inlineCallbacks
+    def collectStream(self, path, resultSpec=None):
+        data = yield self.callStream(path, resultSpec=resultSpec)
+        pieces = []
+        for d in data.pop('chunks'):
+            piece = yield d
+            pieces.append(piece)
+        defer.returnValue((data, pieces))
+
+    @defer.inlineCallbacks
+    def test_stream_chunk_by_chunk(self):
+        # the fake db pretends that chunks are made of 10 lines
+        data, pieces = yield self.collectStream(('logs', 61, 'raw'))
+        self.assertEqual(data, {'filename': u'errors',
+                                'mime-type': u'text/plain',
+                                'firstline': 0, 'lastline': 99,
+                                'num_lines': 100})
+        self.assertEqual(len(pieces), 10)
+        self.assertEqual(pieces[1],
+                         u'\n'.join(self.log61Lines[10:20]) + u'\n')
+
+    @defer.inlineCallbacks
+    def test_stream_range(self):
+        data, pieces = yield self.collectStream(
+            ('logs', 61, 'raw'),
+            resultSpec=resultspec.ResultSpec(offset=15, limit=10))
+        self.assertEqual((data['firstline'], data['lastline']), (15, 24))
+        self.assertEqual(u''.join(pieces),
+                         u'\n'.join(self.log61Lines[15:25]) + u'\n')
+
+    @defer.inlineCallbacks
+    def test_stream_stdio(self):
+        data, pieces = yield self.collectStream(
+            ('logs', 60, 'raw'),
+            resultSpec=resultspec.ResultSpec(offset=2, limit=3))
+        self.assertEqual(u''.join(pieces), u'ine TWO\nine 3\nine 2**2')
+
+    @defer.inlineCallbacks
+    def test_stream_empty(self):
+        data, pieces = yield self.collectStream(('logs', 62, 'raw'))
+        self.assertEqual(pieces, [])
+        self.assertEqual(data['num_lines'], 0)
+
+    @defer.inlineCallbacks
+    def test_stream_missing(self):
+        data = yield self.callStream(('logs', 99, 'raw'))
+        self.assertEqual(data, None)
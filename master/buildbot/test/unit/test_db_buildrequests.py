@@ -20,9 +20,11 @@ from future.utils import lrange
 
 import datetime
 
+from twisted.internet import defer
 from twisted.internet import task
 from twisted.trial import unittest
 
+from buildbot.data import resultspec
 from buildbot.db import buildrequests
 from buildbot.test.fake import fakedb
 from buildbot.test.fake import fakemaster
@@ -240,6 +242,28 @@ class Tests(interfaces.InterfaceTests):
                              sorted([70, 72]))
         return d
 
+    def test_getBuildRequests_complete_brids(self):
+        return self.do_test_getBuildRequests_complete_arg(
+            complete=True, brids=[70, 80, 82],
+            expected=[80])
+
+    @defer.inlineCallbacks
+    def test_getBuildRequests_brids_arg(self):
+        # more requests than fit in a single IN clause batch
+        yield self.insertTestData([
+            fakedb.BuildRequest(id=1000 + i, buildsetid=self.BSID,
+                                builderid=self.BLDRID1)
+            for i in range(150)])
+        brids = [1000 + i for i in range(0, 150, 3)] + [5000]
+        brlist = yield self.db.buildrequests.getBuildRequests(brids=brids)
+        self.assertEqual(sorted([br['buildrequestid'] for br in brlist]),
+                         brids[:-1])
+
+    def test_getBuildRequests_brids_resultSpec(self):
+        self.assertRaises(AssertionError,
+                          self.db.buildrequests.getBuildRequests,
+                          brids=[70], resultSpec=resultspec.ResultSpec())
+
     def test_getBuildRequests_combo(self):
         d = self.insertTestData([
             # 44: everything we want
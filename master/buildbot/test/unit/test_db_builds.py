@@ -23,6 +23,9 @@ from twisted.trial import unittest
 
 from buildbot.data import resultspec
 from buildbot.db import builds
+from buildbot.process.results import FAILURE
+from buildbot.process.results import RETRY
+from buildbot.process.results import SUCCESS
 from buildbot.test.fake import fakedb
 from buildbot.test.fake import fakemaster
 from buildbot.test.util import connector_component
@@ -96,12 +99,22 @@ class Tests(interfaces.InterfaceTests):
         def getBuild(self, builderid, number):
             pass
 
+    def test_signature_getPreviousBuild(self):
+        @self.assertArgSpecMatches(self.db.builds.getPreviousBuild)
+        def getPreviousBuild(self, builderid, number):
+            pass
+
     def test_signature_getBuilds(self):
         @self.assertArgSpecMatches(self.db.builds.getBuilds)
         def getBuilds(self, builderid=None, buildrequestid=None, workerid=None,
                       complete=None, resultSpec=None):
             pass
 
+    def test_signature_getBuildsForBuildRequests(self):
+        @self.assertArgSpecMatches(self.db.builds.getBuildsForBuildRequests)
+        def getBuildsForBuildRequests(self, buildrequestids):
+            pass
+
     def test_signature_addBuild(self):
         @self.assertArgSpecMatches(self.db.builds.addBuild)
         def addBuild(self, builderid, buildrequestid, workerid, masterid,
@@ -123,6 +136,11 @@ class Tests(interfaces.InterfaceTests):
         def getBuildProperties(self, bid):
             pass
 
+    def test_signature_getBuildPropertiesForBuilds(self):
+        @self.assertArgSpecMatches(self.db.builds.getBuildPropertiesForBuilds)
+        def getBuildPropertiesForBuilds(self, buildids):
+            pass
+
     def test_signature_setBuildProperty(self):
         @self.assertArgSpecMatches(self.db.builds.setBuildProperty)
         def setBuildProperty(self, bid, name, value, source):
@@ -152,6 +170,38 @@ class Tests(interfaces.InterfaceTests):
         validation.verifyDbDict(self, 'dbbuilddict', bdict)
         self.assertEqual(bdict['id'], 50)
 
+    @defer.inlineCallbacks
+    def test_getPreviousBuild(self):
+        yield self.insertTestData(self.backgroundData + [
+            fakedb.Build(id=60, buildrequestid=40, number=1, masterid=88,
+                         builderid=77, workerid=13, started_at=TIME1,
+                         complete_at=TIME2, results=SUCCESS),
+            fakedb.Build(id=61, buildrequestid=40, number=2, masterid=88,
+                         builderid=77, workerid=13, started_at=TIME2,
+                         complete_at=TIME3, results=FAILURE),
+            fakedb.Build(id=62, buildrequestid=40, number=3, masterid=88,
+                         builderid=77, workerid=13, started_at=TIME2,
+                         complete_at=TIME3, results=RETRY),
+            fakedb.Build(id=63, buildrequestid=40, number=4, masterid=88,
+                         builderid=77, workerid=13, started_at=TIME3),
+            fakedb.Build(id=64, buildrequestid=40, number=5, masterid=88,
+                         builderid=77, workerid=13, started_at=TIME3,
+                         complete_at=TIME4, results=RETRY),
+            fakedb.Build(id=65, buildrequestid=42, number=7, masterid=88,
+                         builderid=88, workerid=13, started_at=TIME3,
+                         complete_at=TIME4, results=SUCCESS),
+        ])
+        # the running build 4 and the retried builds 3 and 5 are skipped
+        bdict = yield self.db.builds.getPreviousBuild(77, 6)
+        validation.verifyDbDict(self, 'dbbuilddict', bdict)
+        self.assertEqual(bdict['id'], 61)
+        bdict = yield self.db.builds.getPreviousBuild(77, 2)
+        self.assertEqual(bdict['id'], 60)
+        bdict = yield self.db.builds.getPreviousBuild(77, 1)
+        self.assertEqual(bdict, None)
+        bdict = yield self.db.builds.getPreviousBuild(99, 6)
+        self.assertEqual(bdict, None)
+
     @defer.inlineCallbacks
     def test_getBuilds(self):
         yield self.insertTestData(self.backgroundData + self.threeBuilds)
@@ -180,6 +230,21 @@ class Tests(interfaces.InterfaceTests):
         self.assertEqual(sorted(bdicts, key=lambda bd: bd['id']),
                          [self.threeBdicts[50], self.threeBdicts[52]])
 
+    @defer.inlineCallbacks
+    def test_getBuildsForBuildRequests(self):
+        yield self.insertTestData(self.backgroundData + self.threeBuilds)
+        bdicts = yield self.db.builds.getBuildsForBuildRequests([41, 42, 40])
+        for bdict in bdicts:
+            validation.verifyDbDict(self, 'dbbuilddict', bdict)
+        self.assertEqual(bdicts, [self.threeBdicts[50], self.threeBdicts[51],
+                                  self.threeBdicts[52]])
+
+    @defer.inlineCallbacks
+    def test_getBuildsForBuildRequests_none(self):
+        yield self.insertTestData(self.backgroundData + self.threeBuilds)
+        bdicts = yield self.db.builds.getBuildsForBuildRequests([40])
+        self.assertEqual(bdicts, [])
+
     @defer.inlineCallbacks
     def test_getBuilds_workerid(self):
         yield self.insertTestData(self.backgroundData + self.threeBuilds)
@@ -296,6 +361,41 @@ class Tests(interfaces.InterfaceTests):
         props = yield self.db.builds.getBuildProperties(50)
         self.assertEqual(props, {'prop': (45, 'test_source')})
 
+    @defer.inlineCallbacks
+    def testgetBuildPropertiesForBuilds(self):
+        yield self.insertTestData(self.backgroundData + self.threeBuilds)
+        yield self.db.builds.setBuildProperty(50, 'prop', 42, 'test')
+        yield self.db.builds.setBuildProperty(50, 'other', u'x', 'test')
+        yield self.db.builds.setBuildProperty(52, 'prop', 43, 'test2')
+        props = yield self.db.builds.getBuildPropertiesForBuilds([50, 51, 52, 999])
+        self.assertEqual(props, {
+            50: {'prop': (42, 'test'), 'other': (u'x', 'test')},
+            51: {},
+            52: {'prop': (43, 'test2')},
+            999: {}})
+
+    @defer.inlineCallbacks
+    def testgetBuildPropertiesForBuildsEmpty(self):
+        props = yield self.db.builds.getBuildPropertiesForBuilds([])
+        self.assertEqual(props, {})
+
+    @defer.inlineCallbacks
+    def testgetBuildPropertiesForBuildsManyBuilds(self):
+        # more builds than fit in a single IN clause batch
+        rows = []
+        for i in range(250):
+            rows.append(fakedb.Build(id=1000 + i, buildrequestid=42,
+                                     number=i, masterid=88, builderid=77,
+                                     workerid=13, started_at=TIME1))
+            rows.append(fakedb.BuildProperty(buildid=1000 + i, name='n',
+                                             value=i, source='test'))
+        yield self.insertTestData(self.backgroundData + rows)
+        props = yield self.db.builds.getBuildPropertiesForBuilds(
+            [1000 + i for i in range(250)])
+        self.assertEqual(len(props), 250)
+        for i in range(250):
+            self.assertEqual(props[1000 + i], {'n': (i, 'test')})
+
 
 class RealTests(Tests):
 
@@ -70,7 +70,7 @@ class Tests(interfaces.InterfaceTests):
 
     def test_signature_getBuildsets(self):
         @self.assertArgSpecMatches(self.db.buildsets.getBuildsets)
-        def getBuildsets(self, complete=None, resultSpec=None):
+        def getBuildsets(self, complete=None, resultSpec=None, bsids=None):
             pass
 
     def test_signature_getRecentBuildsets(self):
@@ -84,6 +84,12 @@ class Tests(interfaces.InterfaceTests):
         def getBuildsetProperties(self, key, no_cache=False):
             pass
 
+    def test_signature_getBuildsetPropertiesForBuildsets(self):
+        @self.assertArgSpecMatches(
+            self.db.buildsets.getBuildsetPropertiesForBuildsets)
+        def getBuildsetPropertiesForBuildsets(self, bsids):
+            pass
+
     @defer.inlineCallbacks
     def test_addBuildset_getBuildset(self):
         bsid, brids = yield self.db.buildsets.addBuildset(sourcestamps=[234],
@@ -149,6 +155,32 @@ class Tests(interfaces.InterfaceTests):
         "returns an empty dict even if no such buildset exists"
         return self.do_test_getBuildsetProperties(91, [], dict())
 
+    @defer.inlineCallbacks
+    def test_getBuildsetPropertiesForBuildsets(self):
+        yield self.insertTestData([
+            fakedb.Buildset(id=91, complete=0, results=-1, submitted_at=0),
+            fakedb.BuildsetProperty(buildsetid=91, property_name='prop1',
+                                    property_value='["one", "fake1"]'),
+            fakedb.Buildset(id=92, complete=0, results=-1, submitted_at=0),
+            fakedb.Buildset(id=93, complete=0, results=-1, submitted_at=0),
+            fakedb.BuildsetProperty(buildsetid=93, property_name='prop1',
+                                    property_value='["three", "fake3"]'),
+            fakedb.BuildsetProperty(buildsetid=93, property_name='prop2',
+                                    property_value='[3, "fake3"]'),
+        ])
+        props = yield self.db.buildsets.getBuildsetPropertiesForBuildsets(
+            [91, 92, 93, 94])
+        self.assertEqual(props, {
+            91: dict(prop1=("one", "fake1")),
+            92: {},
+            93: dict(prop1=("three", "fake3"), prop2=(3, "fake3")),
+            94: {}})
+
+    @defer.inlineCallbacks
+    def test_getBuildsetPropertiesForBuildsets_empty(self):
+        props = yield self.db.buildsets.getBuildsetPropertiesForBuildsets([])
+        self.assertEqual(props, {})
+
     def test_getBuildset_incomplete_None(self):
         d = self.insertTestData([
             fakedb.Buildset(id=91, complete=0,
@@ -276,6 +308,48 @@ class Tests(interfaces.InterfaceTests):
         d.addCallback(check)
         return d
 
+    @defer.inlineCallbacks
+    def test_getBuildsets_bsids(self):
+        yield self.insert_test_getBuildsets_data()
+        yield self.insertTestData([
+            fakedb.SourceStamp(id=235, codebase='other'),
+            fakedb.Buildset(id=93, complete=0, results=-1,
+                            submitted_at=266761877, reason='rsn3'),
+            fakedb.BuildsetSourceStamp(buildsetid=93, sourcestampid=234),
+            fakedb.BuildsetSourceStamp(buildsetid=93, sourcestampid=235),
+        ])
+        bsdictlist = yield self.db.buildsets.getBuildsets(bsids=[92, 93, 94])
+        for bsdict in bsdictlist:
+            validation.verifyDbDict(self, 'bsdict', bsdict)
+        self.assertEqual(
+            sorted((bsdict['bsid'], bsdict['reason'], bsdict['sourcestamps'])
+                   for bsdict in bsdictlist),
+            [(92, 'rsn2', [234]), (93, 'rsn3', [234, 235])])
+
+    @defer.inlineCallbacks
+    def test_getBuildsets_bsids_complete(self):
+        yield self.insert_test_getBuildsets_data()
+        bsdictlist = yield self.db.buildsets.getBuildsets(
+            complete=False, bsids=[91, 92])
+        self.assertEqual([bsdict['bsid'] for bsdict in bsdictlist], [91])
+
+    @defer.inlineCallbacks
+    def test_getBuildsets_bsids_many(self):
+        # more buildsets than fit in a single IN clause batch
+        rows = []
+        for i in range(250):
+            rows.append(fakedb.Buildset(id=1000 + i, complete=0, results=-1,
+                                        submitted_at=0))
+            rows.append(fakedb.BuildsetSourceStamp(buildsetid=1000 + i,
+                                                   sourcestampid=234))
+        yield self.insertTestData(rows)
+        bsdictlist = yield self.db.buildsets.getBuildsets(
+            bsids=[1000 + i for i in range(250)])
+        self.assertEqual(sorted(bsdict['bsid'] for bsdict in bsdictlist),
+                         [1000 + i for i in range(250)])
+        for bsdict in bsdictlist:
+            self.assertEqual(bsdict['sourcestamps'], [234])
+
     def test_getBuildsets_complete(self):
         d = self.insert_test_getBuildsets_data()
         d.addCallback(lambda _:
@@ -826,6 +826,79 @@ class RealTests(Tests):
         yield expect(6, [u'10th commit'])
         yield expect(7, [u'11th commit'])
 
+    def changeChainRows(self, count):
+        # changes 1..count, each one the parent of the next one
+        rows = [fakedb.SourceStamp(id=1)]
+        for changeid in range(1, count + 1):
+            rows.extend([
+                fakedb.Change(changeid=changeid, sourcestampid=1,
+                              comments=u'commit %d' % changeid,
+                              parent_changeids=changeid - 1 or None),
+                fakedb.ChangeFile(changeid=changeid,
+                                  filename=u'file%d' % changeid),
+                fakedb.ChangeProperty(changeid=changeid, property_name='n',
+                                      property_value='[%d, "Change"]'
+                                      % changeid),
+            ])
+        return rows
+
+    def corruptParentChangeId(self, changeid, parent_changeid):
+        def thd(conn):
+            tbl = self.db.model.changes
+            conn.execute(tbl.update(whereclause=(tbl.c.changeid == changeid)),
+                         parent_changeids=parent_changeid)
+        return self.db.pool.do(thd)
+
+    @defer.inlineCallbacks
+    def getChangeAncestors(self, changeid, stop_changeid):
+        change = yield self.db.changes.getChange(changeid)
+        ancestors = yield self.db.changes._getChangeAncestors(
+            change, stop_changeid)
+        defer.returnValue([ch['changeid'] for ch in ancestors])
+
+    @defer.inlineCallbacks
+    def test_getChangeAncestors(self):
+        yield self.insertTestData(self.changeChainRows(150))
+        ancestors = yield self.db.changes._getChangeAncestors(
+            (yield self.db.changes.getChange(150)), 10)
+        self.assertEqual([ch['changeid'] for ch in ancestors],
+                         list(range(149, 10, -1)))
+        # files and properties are loaded too
+        for ch in ancestors:
+            expected = yield self.db.changes.getChange(ch['changeid'])
+            self.assertEqual(ch, expected)
+
+    @defer.inlineCallbacks
+    def test_getChangeAncestors_stop_at_parent(self):
+        yield self.insertTestData(self.changeChainRows(5))
+        self.assertEqual((yield self.getChangeAncestors(5, 4)), [])
+        self.assertEqual((yield self.getChangeAncestors(1, None)), [])
+
+    @defer.inlineCallbacks
+    def test_getChangeAncestors_whole_ancestry(self):
+        yield self.insertTestData(self.changeChainRows(5))
+        self.assertEqual((yield self.getChangeAncestors(5, None)),
+                         [4, 3, 2, 1])
+        # a change which is not an ancestor does not stop the walk
+        self.assertEqual((yield self.getChangeAncestors(3, 5)), [2, 1])
+
+    @defer.inlineCallbacks
+    def test_getChangeAncestors_cycle(self):
+        yield self.insertTestData(self.changeChainRows(5))
+        yield self.corruptParentChangeId(1, 5)
+        self.assertEqual((yield self.getChangeAncestors(3, None)),
+                         [2, 1, 5, 4])
+
+    @defer.inlineCallbacks
+    def test_getChangeAncestors_without_cte(self):
+        self.patch(self.db.changes, '_thd_supportsRecursiveCTE',
+                   lambda conn: False)
+        yield self.insertTestData(self.changeChainRows(5))
+        yield self.corruptParentChangeId(1, 5)
+        self.assertEqual((yield self.getChangeAncestors(5, 2)), [4, 3])
+        self.assertEqual((yield self.getChangeAncestors(3, None)),
+                         [2, 1, 5, 4])
+
 
 class TestFakeDB(unittest.TestCase, Tests):
 
@@ -32,6 +32,7 @@ from buildbot.test.util import connector_component
 from buildbot.test.util import interfaces
 from buildbot.test.util import validation
 from buildbot.util import bytes2NativeString
+from buildbot.util import lru
 from buildbot.util import unicode2bytes
 
 
@@ -116,11 +117,21 @@ class Tests(interfaces.InterfaceTests):
         def getLogs(self, stepid=None):
             pass
 
+    def test_signature_getLogsForSteps(self):
+        @self.assertArgSpecMatches(self.db.logs.getLogsForSteps)
+        def getLogsForSteps(self, stepids):
+            pass
+
     def test_signature_getLogLines(self):
         @self.assertArgSpecMatches(self.db.logs.getLogLines)
         def getLogLines(self, logid, first_line, last_line):
             pass
 
+    def test_signature_getLogLinesChunk(self):
+        @self.assertArgSpecMatches(self.db.logs.getLogLinesChunk)
+        def getLogLinesChunk(self, logid, first_line, last_line):
+            pass
+
     def test_signature_addLog(self):
         @self.assertArgSpecMatches(self.db.logs.addLog)
         def addLog(self, stepid, name, slug, type):
@@ -141,6 +152,21 @@ class Tests(interfaces.InterfaceTests):
         def compressLog(self, logid, force=False):
             pass
 
+    def test_signature_getLogCompactions(self):
+        @self.assertArgSpecMatches(self.db.logs.getLogCompactions)
+        def getLogCompactions(self, masterid=None, limit=None):
+            pass
+
+    def test_signature_claimLogCompaction(self):
+        @self.assertArgSpecMatches(self.db.logs.claimLogCompaction)
+        def claimLogCompaction(self, logid):
+            pass
+
+    def test_signature_removeLogCompaction(self):
+        @self.assertArgSpecMatches(self.db.logs.removeLogCompaction)
+        def removeLogCompaction(self, logid):
+            pass
+
     def test_signature_deleteOldLogChunks(self):
         @self.assertArgSpecMatches(self.db.logs.deleteOldLogChunks)
         def deleteOldLogChunks(self, older_than_timestamp):
@@ -207,6 +233,24 @@ class Tests(interfaces.InterfaceTests):
             validation.verifyDbDict(self, 'logdict', logdict)
         self.assertEqual(sorted([ld['id'] for ld in logdicts]), [201, 202])
 
+    @defer.inlineCallbacks
+    def test_getLogsForSteps(self):
+        yield self.insertTestData(self.backgroundData + [
+            fakedb.Log(id=201, stepid=101, name=u'stdio', slug=u'stdio',
+                       complete=0, num_lines=200, type=u's'),
+            fakedb.Log(id=202, stepid=101, name=u'dbg.log', slug=u'dbg_log',
+                       complete=1, num_lines=300, type=u't'),
+            fakedb.Log(id=203, stepid=102, name=u'stdio', slug=u'stdio',
+                       complete=0, num_lines=200, type=u's'),
+        ])
+        logdicts = yield self.db.logs.getLogsForSteps([101, 102, 999])
+        for logdict in logdicts[101] + logdicts[102]:
+            validation.verifyDbDict(self, 'logdict', logdict)
+        self.assertEqual(
+            dict((stepid, [ld['id'] for ld in lds])
+                 for stepid, lds in logdicts.items()),
+            {101: [201, 202], 102: [203], 999: []})
+
     @defer.inlineCallbacks
     def test_getLogLines(self):
         yield self.insertTestData(self.backgroundData + self.testLogLines)
@@ -238,6 +282,33 @@ class Tests(interfaces.InterfaceTests):
         self.assertEqual((yield self.db.logs.getLogLines(1470, 0, 0)),
                          expected)
 
+    @defer.inlineCallbacks
+    def test_getLogLinesChunk(self):
+        yield self.insertTestData(self.backgroundData + self.testLogLines)
+        for first_line in range(0, 7):
+            for last_line in range(first_line, 9):
+                expected = yield self.db.logs.getLogLines(
+                    201, first_line, last_line)
+                # reading chunk by chunk gives the same result
+                content = []
+                line = first_line
+                while line <= last_line:
+                    lines, line = yield self.db.logs.getLogLinesChunk(
+                        201, line, last_line)
+                    if line is None:
+                        break
+                    content.append(lines)
+                    line += 1
+                self.assertEqual(u''.join(content), expected)
+
+    @defer.inlineCallbacks
+    def test_getLogLinesChunk_empty(self):
+        yield self.insertTestData(self.backgroundData + self.testLogLines)
+        self.assertEqual((yield self.db.logs.getLogLinesChunk(201, 7, 99)),
+                         (u'', None))
+        self.assertEqual((yield self.db.logs.getLogLinesChunk(999, 0, 99)),
+                         (u'', None))
+
     @defer.inlineCallbacks
     def test_addLog_getLog(self):
         yield self.insertTestData(self.backgroundData)
@@ -291,6 +362,84 @@ class Tests(interfaces.InterfaceTests):
         # test log lines should still be readable just the same
         yield self.checkTestLogLines()
 
+    @defer.inlineCallbacks
+    def test_finishLog_queues_compaction(self):
+        yield self.insertTestData(self.backgroundData + self.testLogLines)
+        self.assertEqual((yield self.db.logs.getLogCompactions()), [])
+        yield self.db.logs.finishLog(201)
+        self.assertEqual((yield self.db.logs.getLog(201))['complete'], True)
+        self.assertEqual((yield self.db.logs.getLogCompactions()), [201])
+        # finishing it again does not queue it twice
+        yield self.db.logs.finishLog(201)
+        self.assertEqual((yield self.db.logs.getLogCompactions()), [201])
+
+    @defer.inlineCallbacks
+    def test_getLogCompactions(self):
+        yield self.insertTestData(self.backgroundData + [
+            fakedb.Master(id=89, name='other:master'),
+            fakedb.Build(id=31, buildrequestid=41, number=8, masterid=89,
+                         builderid=88, workerid=47),
+            fakedb.Step(id=103, buildid=31, number=1, name='one'),
+            fakedb.Master(id=90, name='dead:master', active=0),
+            fakedb.Build(id=32, buildrequestid=41, number=9, masterid=90,
+                         builderid=88, workerid=47),
+            fakedb.Step(id=104, buildid=32, number=1, name='one'),
+            fakedb.Log(id=201, stepid=101, name=u'stdio', slug=u'stdio',
+                       complete=1),
+            fakedb.Log(id=202, stepid=102, name=u'stdio', slug=u'stdio',
+                       complete=1),
+            fakedb.Log(id=203, stepid=103, name=u'stdio', slug=u'stdio',
+                       complete=1),
+            fakedb.Log(id=204, stepid=104, name=u'stdio', slug=u'stdio',
+                       complete=1),
+            fakedb.LogCompaction(logid=201, queued_at=300),
+            fakedb.LogCompaction(logid=202, queued_at=100),
+            fakedb.LogCompaction(logid=203, queued_at=200),
+            fakedb.LogCompaction(logid=204, queued_at=400),
+        ])
+        self.assertEqual((yield self.db.logs.getLogCompactions()),
+                         [202, 203, 201, 204])
+        self.assertEqual((yield self.db.logs.getLogCompactions(limit=2)),
+                         [202, 203])
+        # the logs of the inactive master are returned to any master
+        self.assertEqual((yield self.db.logs.getLogCompactions(masterid=88)),
+                         [202, 201, 204])
+        self.assertEqual(
+            (yield self.db.logs.getLogCompactions(masterid=88, limit=1)),
+            [202])
+        self.assertEqual((yield self.db.logs.getLogCompactions(masterid=89)),
+                         [203, 204])
+        self.assertEqual((yield self.db.logs.getLogCompactions(masterid=91)),
+                         [204])
+
+    @defer.inlineCallbacks
+    def test_removeLogCompaction(self):
+        yield self.insertTestData(self.backgroundData + self.testLogLines + [
+            fakedb.LogCompaction(logid=201, queued_at=300),
+        ])
+        yield self.db.logs.removeLogCompaction(201)
+        self.assertEqual((yield self.db.logs.getLogCompactions()), [])
+        # removing it again is harmless
+        yield self.db.logs.removeLogCompaction(201)
+
+    @defer.inlineCallbacks
+    def test_claimLogCompaction(self):
+        yield self.insertTestData(self.backgroundData + self.testLogLines + [
+            fakedb.LogCompaction(logid=201, queued_at=300),
+        ])
+        self.assertTrue((yield self.db.logs.claimLogCompaction(201)))
+        self.assertEqual((yield self.db.logs.getLogCompactions()), [])
+        # only one claim succeeds
+        self.assertFalse((yield self.db.logs.claimLogCompaction(201)))
+
+    @defer.inlineCallbacks
+    def test_compressLog_removes_compaction(self):
+        yield self.insertTestData(self.backgroundData + self.testLogLines + [
+            fakedb.LogCompaction(logid=201, queued_at=300),
+        ])
+        yield self.db.logs.compressLog(201)
+        self.assertEqual((yield self.db.logs.getLogCompactions()), [])
+
     @defer.inlineCallbacks
     def test_addLogLines_big_chunk(self):
         yield self.insertTestData(self.backgroundData + self.testLogLines)
@@ -335,6 +484,124 @@ class RealTests(Tests):
             'content': b'abc\ndef\nghi\njkl',
             'compressed': 0})
 
+    def getChunkRows(self, logid):
+        def thd(conn):
+            tbl = self.db.model.logchunks
+            res = conn.execute(sa.select([tbl.c.first_line, tbl.c.last_line])
+                               .where(tbl.c.logid == logid)
+                               .order_by(tbl.c.first_line))
+            return [tuple(row) for row in res.fetchall()]
+        return self.db.pool.do(thd)
+
+    @defer.inlineCallbacks
+    def test_appendLog_batched(self):
+        yield self.insertTestData(self.backgroundData + self.testLogLines)
+        logid = yield self.db.logs.addLog(
+            stepid=102, name=u'another', slug=u'another', type=u's')
+        self.db.master.config.logAppendBatchDelay = 0.01
+        calls = []
+        self.patch(self.db.logs, 'thdAppendLogs',
+                   lambda conn, appends: calls.append(appends) or
+                   logs.LogsConnectorComponent.thdAppendLogs(
+                       self.db.logs, conn, appends))
+        res = yield defer.gatherResults([
+            self.db.logs.appendLog(201, u'abc\n'),
+            self.db.logs.appendLog(logid, u'xyz\n'),
+            self.db.logs.appendLog(201, u'def\nghi\n'),
+            self.db.logs.appendLog(999, u'missing\n'),
+        ])
+        self.assertEqual(res, [(7, 7), (0, 0), (8, 9), None])
+        # all written at once, with the appends to each log coalesced
+        self.assertEqual(calls, [[(201, [u'abc\n', u'def\nghi\n']),
+                                  (logid, [u'xyz\n']),
+                                  (999, [u'missing\n'])]])
+        self.assertEqual((yield self.getChunkRows(201))[-1], (7, 9))
+        self.assertEqual((yield self.db.logs.getLogLines(201, 6, 9)),
+                         u'yet another line\nabc\ndef\nghi\n')
+        self.assertEqual((yield self.db.logs.getLog(201))['num_lines'], 10)
+        self.assertEqual((yield self.db.logs.getLog(logid))['num_lines'], 1)
+
+    @defer.inlineCallbacks
+    def test_appendLog_bad_content(self):
+        yield self.insertTestData(self.backgroundData + self.testLogLines)
+        self.db.master.config.logAppendBatchDelay = 0.01
+        d1 = self.db.logs.appendLog(201, u'abc\n')
+        # the missing newline only fails this call
+        yield self.assertFailure(self.db.logs.appendLog(201, u'def'),
+                                 AssertionError)
+        yield self.assertFailure(self.db.logs.appendLog(201, u''),
+                                 AssertionError)
+        self.assertEqual((yield d1), (7, 7))
+
+    @defer.inlineCallbacks
+    def test_appendLog_batch_failure(self):
+        yield self.insertTestData(self.backgroundData + self.testLogLines)
+        logid = yield self.db.logs.addLog(
+            stepid=102, name=u'another', slug=u'another', type=u's')
+        self.db.master.config.logAppendBatchDelay = 0.01
+        calls = []
+
+        def thdAppendLogs(conn, appends):
+            calls.append([l for l, _ in appends])
+            if logid in calls[-1]:
+                raise RuntimeError("bad log")
+            return logs.LogsConnectorComponent.thdAppendLogs(
+                self.db.logs, conn, appends)
+        self.patch(self.db.logs, 'thdAppendLogs', thdAppendLogs)
+        d1 = self.db.logs.appendLog(201, u'abc\n')
+        d2 = self.db.logs.appendLog(logid, u'xyz\n')
+        # the batch is retried log by log, so only the faulty log fails
+        self.assertEqual((yield d1), (7, 7))
+        yield self.assertFailure(d2, RuntimeError)
+        self.assertEqual(calls, [[201, logid], [201], [logid]])
+        self.assertEqual((yield self.db.logs.getLog(201))['num_lines'], 8)
+        self.flushLoggedErrors(RuntimeError)
+
+    @defer.inlineCallbacks
+    def test_appendLog_during_flush(self):
+        yield self.insertTestData(self.backgroundData + self.testLogLines)
+        d1 = self.db.logs.appendLog(201, u'abc\n')
+        # this append is made while the first one is being written
+        self.assertTrue(self.db.logs._appendsLock.locked)
+        d2 = self.db.logs.appendLog(201, u'def\n')
+        self.assertEqual((yield d1), (7, 7))
+        self.assertEqual((yield d2), (8, 8))
+        self.assertEqual((yield self.getChunkRows(201))[-2:],
+                         [(7, 7), (8, 8)])
+
+    @defer.inlineCallbacks
+    def test_appendLog_max_size(self):
+        yield self.insertTestData(self.backgroundData + self.testLogLines)
+        self.db.master.config.logAppendBatchDelay = 60
+        self.db.master.config.logAppendBatchMaxSize = 8
+        d1 = self.db.logs.appendLog(201, u'abc\n')
+        self.assertNotEqual(self.db.logs._appendsTimer, None)
+        d2 = self.db.logs.appendLog(201, u'def\n')
+        # the size limit is reached, so this is written without waiting
+        self.assertEqual(self.db.logs._appendsTimer, None)
+        self.assertEqual((yield defer.gatherResults([d1, d2])),
+                         [(7, 7), (8, 8)])
+
+    @defer.inlineCallbacks
+    def test_appendLog_empty_line(self):
+        yield self.insertTestData(self.backgroundData + self.testLogLines)
+        rows = yield self.getChunkRows(201)
+        self.assertEqual((yield self.db.logs.appendLog(201, u'\n')), (7, 7))
+        # no chunk is written, but the line is counted
+        self.assertEqual((yield self.getChunkRows(201)), rows)
+        self.assertEqual((yield self.db.logs.getLog(201))['num_lines'], 8)
+
+    @defer.inlineCallbacks
+    def test_finishLog_flushes_appends(self):
+        yield self.insertTestData(self.backgroundData + self.testLogLines)
+        self.db.master.config.logAppendBatchDelay = 60
+        d = self.db.logs.appendLog(201, u'abc\n')
+        yield self.db.logs.finishLog(201)
+        self.assertEqual((yield d), (7, 7))
+        self.assertEqual((yield self.db.logs.getLog(201))['complete'], True)
+        self.assertEqual((yield self.db.logs.getLogLines(201, 7, 7)),
+                         u'abc\n')
+
     @defer.inlineCallbacks
     def test_addLogLines_huge_lines(self):
         yield self.insertTestData(self.backgroundData + self.testLogLines)
@@ -479,6 +746,119 @@ class RealTests(Tests):
             'content': logs.dumps_lz4(line.encode('utf-8')),
             'compressed': 3})
 
+    @defer.inlineCallbacks
+    def test_zstd_compress_big_chunk(self):
+        if logs.zstandard is None:
+            raise unittest.SkipTest("zstandard not installed, skip the test")
+
+        yield self.insertTestData(self.backgroundData + self.testLogLines)
+        line = u'xy' * 10000
+        self.db.master.config.logCompressionMethod = "zstd"
+        self.assertEqual(
+            (yield self.db.logs.appendLog(201, line + '\n')),
+            (7, 7))
+
+        def thd(conn):
+            res = conn.execute(self.db.model.logchunks.select(
+                whereclause=self.db.model.logchunks.c.first_line > 6))
+            row = res.fetchone()
+            res.close()
+            return dict(row)
+        newRow = yield self.db.pool.do(thd)
+        self.assertEqual(newRow, {
+            'logid': 201,
+            'first_line': 7,
+            'last_line': 7,
+            'content': logs.dumps_zstd(line.encode('utf-8')),
+            'compressed': 4})
+        self.assertEqual((yield self.db.logs.getLogLines(201, 7, 7)),
+                         line + u'\n')
+
+    @defer.inlineCallbacks
+    def test_zstd_not_installed(self):
+        yield self.insertTestData(self.backgroundData + self.testLogLines + [
+            fakedb.LogChunk(logid=201, first_line=7, last_line=7,
+                            content=b'not really zstd', compressed=4),
+        ])
+        self.patch(logs, 'zstandard', None)
+        d = self.db.logs.getLogLines(201, 7, 7)
+        e = yield self.assertFailure(d, RuntimeError)
+        self.assertIn("zstandard library is not installed", str(e))
+        self.flushLoggedErrors(RuntimeError)
+
+    def getDictionaryIds(self):
+        def thd(conn):
+            tbl = self.db.model.logchunk_dictionaries
+            res = conn.execute(sa.select([tbl.c.id, tbl.c.builderid]))
+            return [tuple(row) for row in res.fetchall()]
+        return self.db.pool.do(thd)
+
+    def getLastChunkDictionaryId(self, logid):
+        def thd(conn):
+            tbl = self.db.model.logchunks
+            res = conn.execute(sa.select([tbl.c.content])
+                               .where(tbl.c.logid == logid)
+                               .order_by(tbl.c.first_line.desc()))
+            content = res.fetchone().content
+            res.close()
+            return logs.zstandard.get_frame_parameters(content).dict_id
+        return self.db.pool.do(thd)
+
+    def makeCompilerOutput(self, n):
+        return u''.join(
+            u'gcc -O2 -Wall -Iinclude -c src/module%d/file%d.c -o '
+            u'build/module%d/file%d.o\n'
+            u'src/module%d/file%d.c:%d:5: warning: unused variable '
+            u'\u2018tmp%d\u2019 [-Wunused-variable]\n'
+            % (i % 7, i, i % 7, i, i % 7, i, i % 300, i % 13)
+            for i in range(n))
+
+    @defer.inlineCallbacks
+    def test_zstd_dictionary(self):
+        if logs.zstandard is None:
+            raise unittest.SkipTest("zstandard not installed, skip the test")
+
+        yield self.insertTestData(self.backgroundData)
+        self.db.master.config.logCompressionMethod = "zstd"
+        self.patch(self.db.logs, 'ZSTD_DICT_SIZE', 4096)
+        self.patch(self.db.logs, 'ZSTD_DICT_SAMPLE_SIZE', 1024)
+        self.patch(self.db.logs, 'ZSTD_DICT_MIN_SAMPLES', 100 * 1024)
+
+        # not enough content to train a dictionary
+        logid = yield self.db.logs.addLog(
+            stepid=101, name=u'small', slug=u'small', type=u's')
+        yield self.db.logs.appendLog(logid, u'abc\n')
+        yield self.db.logs.appendLog(logid, u'def\n')
+        yield self.db.logs.compressLog(logid)
+        self.assertEqual((yield self.getDictionaryIds()), [])
+
+        # this is enough, once the retry delay is over
+        self.db.logs._zstdTrainingAttempts.clear()
+        logid = yield self.db.logs.addLog(
+            stepid=101, name=u'big', slug=u'big', type=u's')
+        content = self.makeCompilerOutput(2000)
+        lines = content.splitlines(True)
+        for i in range(0, len(lines), 100):
+            yield self.db.logs.appendLog(logid, u''.join(lines[i:i + 100]))
+        yield self.db.logs.compressLog(logid)
+        dictids = yield self.getDictionaryIds()
+        self.assertEqual([builderid for _, builderid in dictids], [88])
+        dictid = dictids[0][0]
+        self.assertEqual((yield self.getLastChunkDictionaryId(logid)), dictid)
+        self.assertEqual(
+            (yield self.db.logs.getLogLines(logid, 0, len(lines))), content)
+
+        # later appends to the logs of the builder use the dictionary, and can
+        # be read back without it being cached
+        logid = yield self.db.logs.addLog(
+            stepid=102, name=u'next', slug=u'next', type=u's')
+        content = self.makeCompilerOutput(10)
+        yield self.db.logs.appendLog(logid, content)
+        self.assertEqual((yield self.getLastChunkDictionaryId(logid)), dictid)
+        self.db.logs._zstdDicts.clear()
+        self.assertEqual((yield self.db.logs.getLogLines(logid, 0, 19)),
+                         content)
+
     @defer.inlineCallbacks
     def do_addLogLines_huge_log(self, NUM_CHUNKS=3000, chunk=(u'xy' * 70 + u'\n') * 3):
         if chunk.endswith("\n"):
@@ -573,6 +953,79 @@ class RealTests(Tests):
             lines = yield self.db.logs.getLogLines(logid, 0, logdict['num_lines'])
             self.assertEqual(lines, '')
 
+    @defer.inlineCallbacks
+    def test_getLogLines_cached(self):
+        self.db.logs.chunkCache = cache = lru.SizedLRUCache(1024 * 1024)
+        yield self.insertTestData(self.backgroundData + self.testLogLines)
+        lines = yield self.db.logs.getLogLines(201, 1, 5)
+        self.assertEqual((cache.hits, cache.misses), (0, 3))
+        self.assertEqual(sorted(cache.keys()),
+                         [(201, 0, 1), (201, 2, 4), (201, 5, 5)])
+        self.assertEqual((yield self.db.logs.getLogLines(201, 1, 5)), lines)
+        self.assertEqual((cache.hits, cache.misses), (3, 3))
+        self.assertEqual(
+            (yield self.db.logs.getLogLinesChunk(201, 3, 6)),
+            (u'\nline 2**2\n', 4))
+        self.assertEqual((cache.hits, cache.misses), (4, 3))
+
+    @defer.inlineCallbacks
+    def test_getLogLines_cache_size(self):
+        # only the most recently used chunks fit in the cache
+        self.db.logs.chunkCache = cache = lru.SizedLRUCache(250)
+        yield self.insertTestData(self.backgroundData + self.testLogLines)
+        yield self.db.logs.getLogLines(201, 0, 6)
+        self.assertEqual(sorted(cache.keys()),
+                         [(201, 2, 4), (201, 5, 5), (201, 6, 6)])
+        self.assertTrue(cache.size <= 250)
+
+    @defer.inlineCallbacks
+    def test_getLogLines_cached_line_index(self):
+        self.db.logs.chunkCache = cache = lru.SizedLRUCache(1024 * 1024)
+        yield self.insertTestData(self.backgroundData + self.testLogLines)
+        yield self.db.logs.getLogLines(201, 0, 6)
+        # reading whole chunks does not need the line index
+        lines = cache.get((201, 2, 4))
+        self.assertEqual(lines.offsets, None)
+        yield self.db.logs.getLogLines(201, 3, 3)
+        self.assertEqual(list(lines.offsets), [0, 9, 10])
+        # the index is then reused for any range
+        yield self.checkTestLogLines()
+        self.assertIdentical(cache.get((201, 2, 4)), lines)
+
+    @defer.inlineCallbacks
+    def test_compressLog_invalidates_cache(self):
+        self.db.logs.chunkCache = cache = lru.SizedLRUCache(1024 * 1024)
+        yield self.insertTestData(self.backgroundData + self.testLogLines)
+        yield self.db.logs.getLogLines(201, 0, 6)
+        yield self.db.logs.compressLog(201)
+        self.assertEqual(cache.keys(), [])
+        yield self.checkTestLogLines()
+        self.assertEqual(cache.keys(), [(201, 0, 6)])
+
+    @defer.inlineCallbacks
+    def test_deleteOldLogChunks_clears_cache(self):
+        self.db.logs.chunkCache = cache = lru.SizedLRUCache(1024 * 1024)
+        yield self.insertTestData(self.backgroundData + self.testLogLines)
+        yield self.db.logs.getLogLines(201, 0, 6)
+        yield self.db.logs.deleteOldLogChunks(self.TIMESTAMP_STEP101 + 1)
+        self.assertEqual(cache.keys(), [])
+        self.assertEqual((yield self.db.logs.getLogLines(201, 0, 6)), u'')
+
+
+class LogChunkLines(unittest.TestCase):
+
+    def test_getLines(self):
+        lines = logs.LogChunkLines(u'zero\none\n\nthree')
+        self.assertEqual(lines.getLines(0, 0), u'zero')
+        self.assertEqual(lines.getLines(1, 2), u'one\n')
+        self.assertEqual(lines.getLines(2, 3), u'\nthree')
+        self.assertEqual(lines.getLines(3, 3), u'three')
+        self.assertEqual(lines.getLines(0, 3), u'zero\none\n\nthree')
+
+    def test_getLines_unicode(self):
+        lines = logs.LogChunkLines(u'\N{SNOWMAN}\n\N{SNOWMAN}x')
+        self.assertEqual(lines.getLines(1, 1), u'\N{SNOWMAN}x')
+
 
 class TestFakeDB(unittest.TestCase, Tests):
 
@@ -589,7 +1042,9 @@ class TestRealDB(unittest.TestCase,
 
     def setUp(self):
         d = self.setUpConnectorComponent(
-            table_names=['logs', 'logchunks', 'steps', 'builds', 'builders',
+            table_names=['logs', 'logchunks', 'logchunk_dictionaries',
+                         'logcompaction_queue', 'steps',
+                         'builds', 'builders',
                          'masters', 'buildrequests', 'buildsets',
                          'workers'])
 
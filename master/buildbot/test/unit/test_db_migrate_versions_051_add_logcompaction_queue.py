@@ -0,0 +1,62 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import sqlalchemy as sa
+
+from twisted.trial import unittest
+
+from buildbot.test.util import migration
+from buildbot.util import sautils
+
+
+class Migration(migration.MigrateTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        return self.setUpMigrateTest()
+
+    def tearDown(self):
+        return self.tearDownMigrateTest()
+
+    def test_migration(self):
+        def setup_thd(conn):
+            metadata = sa.MetaData()
+            metadata.bind = conn
+
+            sautils.Table(
+                'logs', metadata,
+                sa.Column('id', sa.Integer, primary_key=True),
+                # ..
+            ).create()
+
+        def verify_thd(conn):
+            metadata = sa.MetaData()
+            metadata.bind = conn
+
+            logcompaction_queue = sautils.Table(
+                'logcompaction_queue', metadata, autoload=True)
+
+            q = sa.select([logcompaction_queue.c.logid,
+                           logcompaction_queue.c.queued_at])
+            self.assertEqual(conn.execute(q).fetchall(), [])
+
+            indexes = sa.inspect(conn).get_indexes('logcompaction_queue')
+            self.assertEqual([(idx['name'], bool(idx['unique']))
+                              for idx in indexes],
+                             [('logcompaction_queue_logid', True)])
+
+        return self.do_test_migration(50, 51, setup_thd, verify_thd)
@@ -54,7 +54,7 @@ class Tests(interfaces.InterfaceTests):
 
     def test_signature_getSourceStamps(self):
         @self.assertArgSpecMatches(self.db.sourcestamps.getSourceStamps)
-        def getSourceStamps(self):
+        def getSourceStamps(self, ssids=None):
             pass
 
     @defer.inlineCallbacks
@@ -263,6 +263,40 @@ class Tests(interfaces.InterfaceTests):
                              }], key=sourceStampKey))
         return d
 
+    @defer.inlineCallbacks
+    def test_getSourceStamps_ssids(self):
+        yield self.insertTestData([
+            fakedb.Patch(id=99, patch_base64='aGVsbG8sIHdvcmxk',
+                         patch_author='bar', patch_comment='foo', subdir='/foo',
+                         patchlevel=3),
+            fakedb.SourceStamp(id=234, revision='r', codebase='c', patchid=99,
+                               created_at=CREATED_AT),
+            fakedb.SourceStamp(id=235, revision='r2', codebase='c2',
+                               created_at=CREATED_AT),
+            fakedb.SourceStamp(id=236, revision='r3', codebase='c3',
+                               created_at=CREATED_AT),
+        ])
+        sourcestamps = yield self.db.sourcestamps.getSourceStamps(
+            ssids=[234, 236, 237])
+        for ssdict in sourcestamps:
+            validation.verifyDbDict(self, 'ssdict', ssdict)
+        self.assertEqual(
+            sorted((ss['ssid'], ss['revision'], ss['patch_body'])
+                   for ss in sourcestamps),
+            [(234, u'r', b'hello, world'), (236, u'r3', None)])
+
+    @defer.inlineCallbacks
+    def test_getSourceStamps_ssids_many(self):
+        # more sourcestamps than fit in a single IN clause batch
+        yield self.insertTestData([
+            fakedb.SourceStamp(id=1000 + i, revision='r%d' % i,
+                               created_at=CREATED_AT)
+            for i in range(250)])
+        sourcestamps = yield self.db.sourcestamps.getSourceStamps(
+            ssids=[1000 + i for i in range(0, 250, 2)])
+        self.assertEqual(sorted(ss['ssid'] for ss in sourcestamps),
+                         [1000 + i for i in range(0, 250, 2)])
+
     def test_getSourceStamps_empty(self):
         d = self.db.sourcestamps.getSourceStamps()
 
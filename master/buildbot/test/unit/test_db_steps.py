@@ -101,6 +101,11 @@ class Tests(interfaces.InterfaceTests):
         def getSteps(self, buildid):
             pass
 
+    def test_signature_getStepsForBuilds(self):
+        @self.assertArgSpecMatches(self.db.steps.getStepsForBuilds)
+        def getStepsForBuilds(self, buildids):
+            pass
+
     def test_signature_addStep(self):
         @self.assertArgSpecMatches(self.db.steps.addStep)
         def addStep(self, buildid, name, state_string):
@@ -180,6 +185,17 @@ class Tests(interfaces.InterfaceTests):
         stepdicts = yield self.db.steps.getSteps(buildid=33)
         self.assertEqual(stepdicts, [])
 
+    @defer.inlineCallbacks
+    def test_getStepsForBuilds(self):
+        yield self.insertTestData(self.backgroundData + self.stepRows)
+        stepdicts = yield self.db.steps.getStepsForBuilds([30, 31, 33])
+        for stepdict in stepdicts[30] + stepdicts[31]:
+            validation.verifyDbDict(self, 'stepdict', stepdict)
+        self.assertEqual(stepdicts[30], self.stepDicts[:3])
+        self.assertEqual([sd['id'] for sd in stepdicts[31]], [73])
+        self.assertEqual(stepdicts[33], [])
+        self.assertEqual(sorted(stepdicts), [30, 31, 33])
+
     @defer.inlineCallbacks
     def test_addStep_getStep(self):
         clock = task.Clock()
@@ -21,13 +21,76 @@ import mock
 from twisted.trial import unittest
 
 from buildbot.mq import simple
+from buildbot.test.fake import fakemaster
 
 
 class SimpleMQ(unittest.TestCase):
 
     def setUp(self):
-        self.master = mock.Mock(name='master')
-        self.mq = simple.SimpleMQ(self.master)
+        self.master = fakemaster.make_master()
+        self.mq = simple.SimpleMQ()
+        self.mq.setServiceParent(self.master)
 
-    # this class *only* implements the interface, so there's little left to
-    # test
+    # this class mostly implements the interface, tested in test_mq; here we
+    # only test the routing details
+
+    def test_produce_order(self):
+        calls = []
+        self.mq.startConsuming(lambda k, d: calls.append(1), ('a', None))
+        self.mq.startConsuming(lambda k, d: calls.append(2), (None, 'b'))
+        self.mq.startConsuming(lambda k, d: calls.append(3), ('a', 'b'))
+        self.mq.startConsuming(lambda k, d: calls.append(4), (None, None))
+        self.mq.produce(('a', 'b'), 'x')
+        self.assertEqual(calls, [1, 2, 3, 4])
+
+    def test_stopConsuming_prunes_index(self):
+        d = self.mq.startConsuming(mock.Mock(), ('a', None, 'c'))
+        qref = self.successResultOf(d)
+        self.assertEqual(len(self.mq.qrefs), 1)
+        qref.stopConsuming()
+        self.assertEqual(len(self.mq.qrefs), 0)
+        self.assertEqual(self.mq.qrefs.roots, {})
+
+
+class RoutingIndex(unittest.TestCase):
+
+    def makeQref(self, filter):
+        return simple.QueueRef(None, mock.Mock(), filter)
+
+    def test_match_literal_and_wildcard(self):
+        idx = simple.RoutingIndex()
+        q1 = self.makeQref(('builds', None, 'new'))
+        q2 = self.makeQref(('builds', '1', None))
+        q3 = self.makeQref(('steps', None, 'new'))
+        q4 = self.makeQref(('builds', None))
+        for q in q1, q2, q3, q4:
+            idx.add(q)
+        self.assertEqual(idx.match(('builds', '1', 'new')), [q1, q2])
+        self.assertEqual(idx.match(('builds', '2', 'new')), [q1])
+        self.assertEqual(idx.match(('builds', '1', 'finished')), [q2])
+        self.assertEqual(idx.match(('builds', '1')), [q4])
+        self.assertEqual(idx.match(('changes', '1', 'new')), [])
+        self.assertEqual(idx.match(()), [])
+
+    def test_same_filter_twice(self):
+        idx = simple.RoutingIndex()
+        q1 = self.makeQref(('a', None))
+        q2 = self.makeQref(('a', None))
+        idx.add(q1)
+        idx.add(q2)
+        self.assertEqual(idx.match(('a', 'b')), [q1, q2])
+        idx.remove(q1)
+        self.assertEqual(idx.match(('a', 'b')), [q2])
+        self.assertEqual(len(idx), 1)
+
+    def test_remove_keeps_other_branches(self):
+        idx = simple.RoutingIndex()
+        q1 = self.makeQref(('a', 'b', 'c'))
+        q2 = self.makeQref(('a', 'b', None))
+        idx.add(q1)
+        idx.add(q2)
+        idx.remove(q1)
+        idx.remove(q1)
+        self.assertEqual(idx.match(('a', 'b', 'c')), [q2])
+        idx.remove(q2)
+        self.assertEqual(idx.roots, {})
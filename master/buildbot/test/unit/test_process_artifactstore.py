@@ -0,0 +1,216 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from buildbot.process import artifactstore
+from buildbot.test.fake import fakemaster
+
+
+def makeStore(testcase, maxSize=100):
+    master = fakemaster.make_master(testcase=testcase)
+    master.basedir = tempfile.mkdtemp()
+    testcase.addCleanup(shutil.rmtree, master.basedir)
+    master.config.artifactStore = dict(basedir='artifacts', maxSize=maxSize)
+    return master.artifacts
+
+
+class TestArtifactStore(unittest.TestCase):
+
+    def setUp(self):
+        self.store = makeStore(self)
+        self.basedir = self.store.master.basedir
+
+    def makeFile(self, data, name=None):
+        digest = hashlib.sha256(data).hexdigest()
+        path = os.path.join(self.basedir, name or digest[:8])
+        with open(path, 'wb') as f:
+            f.write(data)
+        return digest, path
+
+    def storedPath(self, digest):
+        return os.path.join(self.basedir, 'artifacts', digest[:2], digest)
+
+    def test_enabled(self):
+        self.assertTrue(self.store.enabled)
+        self.store.master.config.artifactStore = None
+        self.assertFalse(self.store.enabled)
+
+    def test_hashFile_function(self):
+        digest, path = self.makeFile(b'some data')
+        self.assertEqual(artifactstore.hashFile(path, blocksize=4), digest)
+
+    @defer.inlineCallbacks
+    def test_lookup_empty(self):
+        found = yield self.store.lookup('0' * 64)
+        self.assertEqual(found, None)
+
+    @defer.inlineCallbacks
+    def test_lookup_bad_digest(self):
+        found = yield self.store.lookup('../../etc/passwd')
+        self.assertEqual(found, None)
+
+    @defer.inlineCallbacks
+    def test_add_lookup(self):
+        digest, path = self.makeFile(b'some data')
+        yield self.store.add(digest, path)
+        found = yield self.store.lookup(digest)
+        self.assertEqual(found, (self.storedPath(digest), 9))
+        # the stored file is a copy
+        with open(path, 'wb') as f:
+            f.write(b'modified')
+        with open(self.storedPath(digest), 'rb') as f:
+            self.assertEqual(f.read(), b'some data')
+
+    @defer.inlineCallbacks
+    def test_add_too_large(self):
+        digest, path = self.makeFile(b'x' * 101)
+        yield self.store.add(digest, path)
+        found = yield self.store.lookup(digest)
+        self.assertEqual(found, None)
+
+    @defer.inlineCallbacks
+    def test_addInBackground_stop(self):
+        added = defer.Deferred()
+        self.patch(self.store, 'add', lambda digest, filename: added)
+        self.store.addInBackground(*self.makeFile(b'some data'))
+        yield self.store.startService()
+        # stopping waits for the pending additions
+        stopped = self.store.stopService()
+        self.assertNoResult(stopped)
+        added.callback(None)
+        yield stopped
+
+    @defer.inlineCallbacks
+    def test_retrieve(self):
+        digest, path = self.makeFile(b'some data')
+        yield self.store.add(digest, path)
+        dest = os.path.join(self.basedir, 'dest')
+        ok = yield self.store.retrieve(digest, dest)
+        self.assertTrue(ok)
+        with open(dest, 'rb') as f:
+            self.assertEqual(f.read(), b'some data')
+
+    @defer.inlineCallbacks
+    def test_retrieve_missing(self):
+        dest = os.path.join(self.basedir, 'dest')
+        ok = yield self.store.retrieve('0' * 64, dest)
+        self.assertFalse(ok)
+        self.assertFalse(os.path.exists(dest))
+
+    @defer.inlineCallbacks
+    def test_retrieve_copy(self):
+        digest, path = self.makeFile(b'some data')
+        yield self.store.add(digest, path)
+        dest = os.path.join(self.basedir, 'dest')
+        yield self.store.retrieve(digest, dest)
+        with open(dest, 'ab') as f:
+            f.write(b'modified')
+        with open(self.storedPath(digest), 'rb') as f:
+            self.assertEqual(f.read(), b'some data')
+
+    @defer.inlineCallbacks
+    def test_removed_behind_our_back(self):
+        digest, path = self.makeFile(b'some data')
+        yield self.store.add(digest, path)
+        os.unlink(self.storedPath(digest))
+        found = yield self.store.lookup(digest)
+        self.assertEqual(found, None)
+        self.assertEqual(self.store._totalSize, 0)
+
+    @defer.inlineCallbacks
+    def test_evict_least_recently_used(self):
+        digests = []
+        for c in 'abc':
+            digest, path = self.makeFile(c.encode('ascii') * 40)
+            yield self.store.add(digest, path)
+            digests.append(digest)
+            if len(digests) == 2:
+                # use the first file again
+                yield self.store.lookup(digests[0])
+        found = yield self.store.lookup(digests[1])
+        self.assertEqual(found, None)
+        self.assertFalse(os.path.exists(self.storedPath(digests[1])))
+        for digest in digests[0], digests[2]:
+            found = yield self.store.lookup(digest)
+            self.assertEqual(found, (self.storedPath(digest), 40))
+        # the uploaded files are kept
+        self.assertTrue(os.path.exists(
+            os.path.join(self.basedir, digests[1][:8])))
+
+    @defer.inlineCallbacks
+    def test_load(self):
+        digests = []
+        for data, mtime in [(b'a' * 40, 2000), (b'b' * 40, 1000)]:
+            digest, path = self.makeFile(data)
+            yield self.store.add(digest, path)
+            os.utime(self.storedPath(digest), (mtime, mtime))
+            digests.append(digest)
+
+        # a fresh store finds the files, and evicts the oldest one first
+        store = makeStore(self)
+        store.master.basedir = self.basedir
+        digest, path = self.makeFile(b'c' * 40)
+        yield store.add(digest, path)
+        digests.append(digest)
+        self.assertEqual([os.path.exists(self.storedPath(d)) for d in digests],
+                         [True, False, True])
+
+    @defer.inlineCallbacks
+    def test_reconfigured_basedir(self):
+        digest, path = self.makeFile(b'some data')
+        yield self.store.add(digest, path)
+        self.store.master.config.artifactStore = dict(basedir='other',
+                                                      maxSize=100)
+        found = yield self.store.lookup(digest)
+        self.assertEqual(found, None)
+
+    @defer.inlineCallbacks
+    def test_hashFile(self):
+        digest, path = self.makeFile(b'some data', name='file')
+        got = yield self.store.hashFile(path)
+        self.assertEqual(got, digest)
+
+        # the digest is remembered while the file does not change
+        self.patch(artifactstore, 'hashFile', lambda path: 'cached')
+        got = yield self.store.hashFile(path)
+        self.assertEqual(got, digest)
+
+        with open(path, 'wb') as f:
+            f.write(b'other data')
+        got = yield self.store.hashFile(path)
+        self.assertEqual(got, 'cached')
+
+    @defer.inlineCallbacks
+    def test_hashFile_same_size_and_mtime(self):
+        digest, path = self.makeFile(b'some data', name='file')
+        st = os.stat(path)
+        yield self.store.hashFile(path)
+
+        # an edit which restores the modification time is noticed
+        with open(path, 'wb') as f:
+            f.write(b'SOME DATA')
+        os.utime(path, (st.st_atime, st.st_mtime))
+        got = yield self.store.hashFile(path)
+        self.assertEqual(got, hashlib.sha256(b'SOME DATA').hexdigest())
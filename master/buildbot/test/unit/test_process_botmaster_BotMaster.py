@@ -39,6 +39,9 @@ class TestCleanShutdown(unittest.TestCase):
         self.reactor = mock.Mock()
         self.botmaster.startService()
 
+    def tearDown(self):
+        return self.botmaster.stopService()
+
     def assertReactorStopped(self, _=None):
         self.assertTrue(self.reactor.stop.called)
 
@@ -203,6 +206,53 @@ class TestBotMaster(unittest.TestCase):
         self.assertEqual(self.botmaster.builders, {})
         self.assertEqual(self.botmaster.builderNames, [])
 
+    @defer.inlineCallbacks
+    def test_reconfigServiceBuilders_buildersById(self):
+        self.new_config.builders = [
+            config.BuilderConfig(name=name, factory=factory.BuildFactory(),
+                                 workername='f')
+            for name in ('bldr1', 'bldr2')]
+
+        yield self.botmaster.reconfigServiceBuilders(self.new_config)
+
+        bldr1 = self.botmaster.builders['bldr1']
+        bldr2 = self.botmaster.builders['bldr2']
+        bldr1id = yield bldr1.getBuilderId()
+        bldr2id = yield bldr2.getBuilderId()
+        self.assertEqual(self.botmaster.buildersById,
+                         {bldr1id: bldr1, bldr2id: bldr2})
+
+        self.new_config.builders = self.new_config.builders[1:]
+
+        yield self.botmaster.reconfigServiceBuilders(self.new_config)
+
+        self.assertEqual(self.botmaster.buildersById, {bldr2id: bldr2})
+
+    @defer.inlineCallbacks
+    def test_buildRequestEvent(self):
+        self.new_config.builders = [
+            config.BuilderConfig(name=name, factory=factory.BuildFactory(),
+                                 workername='f')
+            for name in ('bldr1', 'bldr2')]
+        yield self.botmaster.reconfigServiceBuilders(self.new_config)
+        bldr2id = yield self.botmaster.builders['bldr2'].getBuilderId()
+        self.patch(self.botmaster, 'maybeStartBuildsForBuilder', mock.Mock())
+        self.master.mq.verifyMessages = False
+
+        for brid, builderid, event in [(10, bldr2id, 'new'),
+                                       (11, 999, 'new'),
+                                       (12, bldr2id, 'claimed'),
+                                       (13, bldr2id, 'unclaimed')]:
+            self.master.mq.callConsumer(
+                ('buildrequests', str(brid), event),
+                dict(buildrequestid=brid, builderid=builderid,
+                     claimed=event == 'claimed', complete=False,
+                     submitted_at=None))
+
+        self.assertEqual(
+            self.botmaster.maybeStartBuildsForBuilder.call_args_list,
+            [mock.call('bldr2'), mock.call('bldr2')])
+
     def test_maybeStartBuildsForBuilder(self):
         brd = self.botmaster.brd = mock.Mock()
 
@@ -470,6 +470,19 @@ class TestGetOldestRequestTime(BuilderMixin, unittest.TestCase):
         rqtime = yield self.bldr.getOldestRequestTime()
         self.assertEqual(rqtime, None)
 
+    @defer.inlineCallbacks
+    def test_gort_indexed(self):
+        yield self.makeBuilder(name='bldr1')
+        brIndex = self.master.botmaster.brIndex
+        yield brIndex.setServiceParent(self.master.botmaster)
+        yield brIndex.startService()
+        self.addCleanup(brIndex.stopService)
+        self.assertTrue(brIndex.synced)
+        # the index is used instead of the data API
+        self.patch(self.master.data, 'get', None)
+        rqtime = yield self.bldr.getOldestRequestTime()
+        self.assertEqual(rqtime, epoch2datetime(1000))
+
 
 class TestReconfig(BuilderMixin, unittest.TestCase):
 
@@ -23,6 +23,7 @@ from twisted.internet import defer
 from twisted.trial import unittest
 
 from buildbot.process import buildrequest
+from buildbot.process import buildrequestindex
 from buildbot.process.builder import Builder
 from buildbot.test.fake import fakedb
 from buildbot.test.fake import fakemaster
@@ -37,6 +38,8 @@ class TestBuildRequestCollapser(unittest.TestCase):
                                              wantDb=True)
         self.master.botmaster = mock.Mock(name='botmaster')
         self.master.botmaster.builders = {}
+        self.master.botmaster.brIndex = \
+            buildrequestindex.UnclaimedBuildRequestIndex()
         self.builders = {}
         self.bldr = yield self.createBuilder('A', builderid=77)
 
@@ -185,6 +188,74 @@ class TestBuildRequestCollapser(unittest.TestCase):
         yield self.do_request_collapse(rows, [22], [])
         yield self.do_request_collapse(rows, [21], [19, 20])
 
+    @defer.inlineCallbacks
+    def test_collapseRequests_collapse_default_batched(self):
+        # two new buildrequests on two builders, against a queue of requests
+        # from the same buildsets: each buildset is only fetched once
+        bldrB = yield self.createBuilder('B', builderid=78)
+        rows = [
+            fakedb.Builder(id=77, name='A'),
+            fakedb.Builder(id=78, name='B'),
+            fakedb.SourceStamp(id=234, codebase='C', revision='abc'),
+            fakedb.SourceStamp(id=235, codebase='C', revision='def'),
+            fakedb.SourceStamp(id=236, codebase='C', revision='abc'),
+        ]
+        for bsid, ssid in [(30, 234), (31, 235), (32, 236)]:
+            rows += [
+                fakedb.Buildset(id=bsid, reason='foo',
+                                submitted_at=1300305712, results=-1),
+                fakedb.BuildsetSourceStamp(sourcestampid=ssid,
+                                           buildsetid=bsid),
+            ]
+        for brid, bsid, builderid in [(19, 30, 77), (20, 31, 77),
+                                      (21, 30, 78), (22, 31, 78),
+                                      (23, 32, 77), (24, 32, 78)]:
+            rows.append(
+                fakedb.BuildRequest(id=brid, buildsetid=bsid,
+                                    builderid=builderid, priority=13,
+                                    submitted_at=1300305712 + brid,
+                                    results=-1))
+        self.bldr.getCollapseRequestsFn = \
+            lambda: Builder._defaultCollapseRequestFn
+        bldrB.getCollapseRequestsFn = lambda: Builder._defaultCollapseRequestFn
+
+        get = self.master.data.get
+        paths = []
+
+        def countingGet(path, *args, **kwargs):
+            paths.append(path)
+            return get(path, *args, **kwargs)
+        self.patch(self.master.data, 'get', countingGet)
+
+        yield self.do_request_collapse(rows, [23, 24], [19, 21])
+        self.assertEqual(sorted(p for p in paths if p[0] == 'buildsets'),
+                         [('buildsets', '30'), ('buildsets', '31'),
+                          ('buildsets', '32')])
+        self.assertEqual(
+            len([p for p in paths if p[-1] == 'buildrequests']), 2)
+
+    def test_collapseRequests_collapse_default_patch(self):
+        rows = [
+            fakedb.Builder(id=77, name='A'),
+            fakedb.Patch(id=99, patch_base64='aGVsbG8sIHdvcmxk',
+                         patch_author='bar', patch_comment='foo',
+                         subdir='/foo', patchlevel=3),
+            fakedb.SourceStamp(id=234, codebase='C'),
+            fakedb.SourceStamp(id=235, codebase='C', patchid=99),
+            fakedb.Buildset(id=30, reason='foo',
+                            submitted_at=1300305712, results=-1),
+            fakedb.BuildsetSourceStamp(sourcestampid=234, buildsetid=30),
+            fakedb.Buildset(id=31, reason='foo',
+                            submitted_at=1300305712, results=-1),
+            fakedb.BuildsetSourceStamp(sourcestampid=235, buildsetid=31),
+            fakedb.BuildRequest(id=19, buildsetid=30, builderid=77,
+                                priority=13, submitted_at=1300305712, results=-1),
+            fakedb.BuildRequest(id=20, buildsetid=31, builderid=77,
+                                priority=13, submitted_at=1300305712, results=-1),
+        ]
+        self.bldr.getCollapseRequestsFn = lambda: Builder._defaultCollapseRequestFn
+        return self.do_request_collapse(rows, [20], [])
+
 
 class TestBuildRequest(unittest.TestCase):
 
@@ -255,6 +326,114 @@ class TestBuildRequest(unittest.TestCase):
         d.addCallback(check)
         return d
 
+    @defer.inlineCallbacks
+    def test_fromBrdicts(self):
+        master = fakemaster.make_master(testcase=self,
+                                        wantData=True, wantDb=True)
+        yield master.db.insertTestData([
+            fakedb.Builder(id=77, name='bldr'),
+            fakedb.Builder(id=78, name='bldr2'),
+            fakedb.Patch(id=99, patch_base64='aGVsbG8sIHdvcmxk',
+                         patch_author='bar', patch_comment='foo',
+                         subdir='/foo', patchlevel=3),
+            fakedb.SourceStamp(id=234, branch='trunk', codebase='A',
+                               revision='9284', repository='svn://...',
+                               project='world-domination'),
+            fakedb.SourceStamp(id=235, codebase='B', patchid=99),
+            fakedb.Change(changeid=13, branch='trunk', revision='9283',
+                          repository='svn://...', project='world-domination',
+                          codebase='A', sourcestampid=234),
+            fakedb.Buildset(id=539, reason='triggered'),
+            fakedb.BuildsetSourceStamp(buildsetid=539, sourcestampid=234),
+            fakedb.BuildsetSourceStamp(buildsetid=539, sourcestampid=235),
+            fakedb.BuildsetProperty(buildsetid=539, property_name='x',
+                                    property_value='[1, "X"]'),
+            fakedb.Buildset(id=540, reason='forced'),
+            fakedb.BuildsetSourceStamp(buildsetid=540, sourcestampid=234),
+            fakedb.BuildRequest(id=288, buildsetid=539, builderid=77,
+                                priority=13, submitted_at=1200000000),
+            fakedb.BuildRequest(id=289, buildsetid=539, builderid=78),
+            fakedb.BuildRequest(id=290, buildsetid=540, builderid=77),
+        ])
+        brdicts = yield master.db.buildrequests.getBuildRequests()
+        brdicts.sort(key=lambda brdict: -brdict['buildrequestid'])
+
+        # the buildsets are not fetched one by one
+        def getBuildset(bsid):
+            self.fail("getBuildset should not be called")
+        self.patch(master.db.buildsets, 'getBuildset', getBuildset)
+        breqs = yield buildrequest.BuildRequest.fromBrdicts(master, brdicts)
+
+        self.assertEqual([br.id for br in breqs], [290, 289, 288])
+        br290, br289, br288 = breqs
+        self.assertEqual((br288.bsid, br288.buildername, br288.priority,
+                          br288.submittedAt, br288.reason),
+                         (539, 'bldr', 13, 1200000000, 'triggered'))
+        self.assertEqual(br288.properties.getProperty('x'), 1)
+        self.assertEqual(br289.buildername, 'bldr2')
+        self.assertEqual(br290.reason, 'forced')
+        self.assertEqual(br290.properties.getProperty('x'), None)
+
+        self.assertEqual(sorted(br288.sources), ['A', 'B'])
+        ssA = br288.sources['A']
+        self.assertEqual((ssA.ssid, ssA.branch, ssA.revision, ssA.patch),
+                         (234, 'trunk', '9284', None))
+        self.assertEqual([ch.changeid for ch in ssA.changes], [13])
+        ssB = br288.sources['B']
+        self.assertEqual(ssB.patch, (3, b'hello, world', '/foo'))
+        self.assertEqual(ssB.patch_info, ('bar', 'foo'))
+        # requests from the same buildset share their sourcestamps, and
+        # buildsets share common sourcestamps
+        self.assertIdentical(br289.sources, br288.sources)
+        self.assertIdentical(br290.sources['A'], ssA)
+
+    @defer.inlineCallbacks
+    def test_fromBrdicts_same_as_fromBrdict(self):
+        master = fakemaster.make_master(testcase=self,
+                                        wantData=True, wantDb=True)
+        yield master.db.insertTestData([
+            fakedb.Builder(id=77, name='bldr'),
+            fakedb.SourceStamp(id=234, branch='trunk', revision='9284',
+                               repository='svn://...', project='world'),
+            fakedb.Buildset(id=539, reason='triggered'),
+            fakedb.BuildsetSourceStamp(buildsetid=539, sourcestampid=234),
+            fakedb.BuildsetProperty(buildsetid=539, property_name='y',
+                                    property_value='[2, "Y"]'),
+            fakedb.BuildRequest(id=288, buildsetid=539, builderid=77,
+                                priority=13, submitted_at=1200000000),
+        ])
+        brdict = yield master.db.buildrequests.getBuildRequest(288)
+        br = yield buildrequest.BuildRequest.fromBrdict(master, brdict)
+        bulk_br, = yield buildrequest.BuildRequest.fromBrdicts(master, [brdict])
+
+        def attrs(br):
+            return dict(
+                (k, v) for k, v in vars(br).items()
+                if k not in ('sources', 'properties'))
+
+        def ssattrs(ss):
+            return dict((k, v) for k, v in vars(ss).items() if k != 'changes')
+        self.assertEqual(attrs(bulk_br), attrs(br))
+        self.assertEqual(bulk_br.properties.asDict(), br.properties.asDict())
+        self.assertEqual(ssattrs(bulk_br.sources['']),
+                         ssattrs(br.sources['']))
+
+    @defer.inlineCallbacks
+    def test_fromBrdicts_no_sourcestamps(self):
+        master = fakemaster.make_master(testcase=self,
+                                        wantData=True, wantDb=True)
+        yield master.db.insertTestData([
+            fakedb.Builder(id=78, name='not important'),
+            fakedb.Buildset(id=539, reason='triggered'),
+            # buildset has no sourcestamps
+            fakedb.BuildRequest(id=288, buildsetid=539, builderid=78,
+                                priority=0, submitted_at=None),
+        ])
+        brdict = yield master.db.buildrequests.getBuildRequest(288)
+        yield self.assertFailure(
+            buildrequest.BuildRequest.fromBrdicts(master, [brdict]),
+            AssertionError)
+
     def test_fromBrdict_no_sourcestamps(self):
         master = fakemaster.make_master(testcase=self,
                                         wantData=True, wantDb=True)
@@ -406,6 +585,21 @@ class TestBuildRequest(unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_collapseKey(self):
+        def ss(codebase, revision, patch=None):
+            return dict(codebase=codebase, revision=revision,
+                        repository='svn://a..', branch='trunk',
+                        project='world-domination', patch=patch)
+        collapseKey = buildrequest.BuildRequest.collapseKey
+        self.assertEqual(collapseKey([ss('A', '1'), ss('B', None)]),
+                         collapseKey([ss('B', None), ss('A', '1')]))
+        self.assertNotEqual(collapseKey([ss('A', '1')]),
+                            collapseKey([ss('A', '2')]))
+        self.assertNotEqual(collapseKey([ss('A', '1')]),
+                            collapseKey([ss('A', '1'), ss('B', '1')]))
+        self.assertEqual(collapseKey([ss('A', '1', patch={'level': 1})]),
+                         None)
+
     def test_canBeCollapsed_different_codebases_raises_error(self):
         """ This testcase has two buildrequests
             Request Change Codebase   Revision Comment
@@ -22,13 +22,16 @@ import mock
 
 from twisted.internet import defer
 from twisted.internet import reactor
+from twisted.internet import task
 from twisted.python import failure
+from twisted.python import log
 from twisted.trial import unittest
 
 from buildbot import config
 from buildbot.db import buildrequests
 from buildbot.process import buildrequestdistributor
 from buildbot.process import factory
+from buildbot.process import metrics
 from buildbot.test.fake import fakedb
 from buildbot.test.fake import fakemaster
 from buildbot.test.util.warnings import assertProducesWarning
@@ -56,6 +59,37 @@ class SkipWorkerThatCantGetLock(buildrequestdistributor.BasicBuildChooser):
         self.rejectedWorkers = None  # disable this feature
 
 
+class TestUnclaimedBrdicts(unittest.TestCase):
+
+    def setUp(self):
+        self.brdicts = [dict(buildrequestid=brid) for brid in (12, 10, 11)]
+        self.unclaimed = buildrequestdistributor.UnclaimedBrdicts(
+            self.brdicts)
+
+    def test_list_like(self):
+        self.assertEqual(list(self.unclaimed), self.brdicts)
+        self.assertEqual(len(self.unclaimed), 3)
+        self.assertTrue(self.unclaimed)
+        self.assertIdentical(self.unclaimed[0], self.brdicts[0])
+        self.assertIdentical(self.unclaimed[-1], self.brdicts[2])
+
+    def test_get(self):
+        self.assertIdentical(self.unclaimed.get(10), self.brdicts[1])
+        self.assertEqual(self.unclaimed.get(13), None)
+
+    def test_remove(self):
+        self.unclaimed.remove(self.brdicts[0])
+        self.assertEqual(list(self.unclaimed), self.brdicts[1:])
+        self.assertIdentical(self.unclaimed[0], self.brdicts[1])
+        self.assertEqual(self.unclaimed.get(12), None)
+        self.assertRaises(ValueError, self.unclaimed.remove, self.brdicts[0])
+
+    def test_empty(self):
+        unclaimed = buildrequestdistributor.UnclaimedBrdicts()
+        self.assertFalse(unclaimed)
+        self.assertRaises(IndexError, lambda: unclaimed[0])
+
+
 class TestBRDBase(unittest.TestCase):
 
     def setUp(self):
@@ -274,6 +308,56 @@ class Test(TestBRDBase):
         self.quiet_deferred.addCallback(check)
         return self.quiet_deferred
 
+    def test_maybeStartBuildsOn_burst(self):
+        # a burst of calls for the same builder, e.g. when a buildset adds
+        # many build requests, only sorts the builders and runs it once
+        sorted_builders = []
+
+        def slow_sorter(master, bldrs):
+            sorted_builders.append([b.name for b in bldrs])
+            d = defer.Deferred()
+            reactor.callLater(0, d.callback, bldrs)
+            return d
+        self.master.config.prioritizeBuilders = slow_sorter
+
+        self.useMock_maybeStartBuildsOnBuilder()
+        self.addBuilders(['bldr1'])
+        for _ in range(100):
+            self.brd.maybeStartBuildsOn(['bldr1'])
+
+        def check(_):
+            self.assertEqual(sorted_builders, [['bldr1']])
+            self.assertEqual(self.maybeStartBuildsOnBuilder_calls, ['bldr1'])
+            self.checkAllCleanedUp()
+        self.quiet_deferred.addCallback(check)
+        return self.quiet_deferred
+
+    @defer.inlineCallbacks
+    def test_maybeStartBuildsOn_sorter_drops_builder(self):
+        # a custom prioritizeBuilders may leave builders out; they are not
+        # considered queued afterwards
+        dropping = [True]
+
+        def sorter(master, bldrs):
+            if dropping[0]:
+                return [b for b in bldrs if b.name != 'bldr1']
+            return bldrs
+        self.master.config.prioritizeBuilders = sorter
+
+        self.useMock_maybeStartBuildsOnBuilder()
+        self.addBuilders(['bldr1'])
+        self.brd.maybeStartBuildsOn(['bldr1'])
+        yield self.quiet_deferred
+        self.assertEqual(self.maybeStartBuildsOnBuilder_calls, [])
+        self.assertEqual(self.brd._queuedBuilders, set())
+
+        dropping[0] = False
+        self.quiet_deferred = defer.Deferred()
+        self.brd.maybeStartBuildsOn(['bldr1'])
+        yield self.quiet_deferred
+        self.assertEqual(self.maybeStartBuildsOnBuilder_calls, ['bldr1'])
+        self.checkAllCleanedUp()
+
     def test_maybeStartBuildsOn_builders_missing(self):
         self.useMock_maybeStartBuildsOnBuilder()
         self.addBuilders(['bldr1', 'bldr2', 'bldr3'])
@@ -398,6 +482,78 @@ class Test(TestBRDBase):
         self.quiet_deferred.addCallback(check)
         return self.quiet_deferred
 
+    def useMock_concurrent_maybeStartBuildsOnBuilder(self):
+        # like useMock_maybeStartBuildsOnBuilder, but the runs of each builder
+        # only finish when the test fires them
+        self.master.config.buildStartConcurrency = 2
+        self.maybeStartBuildsOnBuilder_calls = []
+        self.builderRuns = {}
+
+        def maybeStartBuildsOnBuilder(bldr, _reserveWorkers=False):
+            self.assertTrue(_reserveWorkers)
+            self.maybeStartBuildsOnBuilder_calls.append(bldr.name)
+            d = self.builderRuns[bldr.name] = defer.Deferred()
+            return d
+        self.brd._maybeStartBuildsOnBuilder = maybeStartBuildsOnBuilder
+
+    def finishBuilderRun(self, name):
+        self.builderRuns.pop(name).callback(None)
+
+    @defer.inlineCallbacks
+    def test_maybeStartBuildsOn_concurrent(self):
+        self.useMock_concurrent_maybeStartBuildsOnBuilder()
+        yield self.addBuilders(['bldr1', 'bldr2', 'bldr3'])
+        self.brd.maybeStartBuildsOn(['bldr3', 'bldr2', 'bldr1'])
+
+        # two builders run at once, by priority
+        self.assertEqual(self.maybeStartBuildsOnBuilder_calls,
+                         ['bldr1', 'bldr2'])
+        # the next one takes the first free slot
+        self.finishBuilderRun('bldr2')
+        self.assertEqual(self.maybeStartBuildsOnBuilder_calls,
+                         ['bldr1', 'bldr2', 'bldr3'])
+        self.finishBuilderRun('bldr1')
+        self.assertFalse(self.quiet_deferred.called)
+        self.finishBuilderRun('bldr3')
+
+        yield self.quiet_deferred
+        self.checkAllCleanedUp()
+        self.assertEqual(self.brd._startingBuilders, {})
+
+    @defer.inlineCallbacks
+    def test_maybeStartBuildsOn_concurrent_rerun(self):
+        self.useMock_concurrent_maybeStartBuildsOnBuilder()
+        yield self.addBuilders(['bldr1', 'bldr2'])
+        self.brd.maybeStartBuildsOn(['bldr1'])
+        self.brd.maybeStartBuildsOn(['bldr1', 'bldr2'])
+
+        # bldr1 is not run twice at once, but runs again once it is done
+        self.assertEqual(self.maybeStartBuildsOnBuilder_calls,
+                         ['bldr1', 'bldr2'])
+        self.finishBuilderRun('bldr2')
+        self.finishBuilderRun('bldr1')
+        self.assertEqual(self.maybeStartBuildsOnBuilder_calls,
+                         ['bldr1', 'bldr2', 'bldr1'])
+        self.finishBuilderRun('bldr1')
+
+        yield self.quiet_deferred
+        self.checkAllCleanedUp()
+
+    @defer.inlineCallbacks
+    def test_stopService_concurrent(self):
+        # check that stopService waits for all running builders
+        self.useMock_concurrent_maybeStartBuildsOnBuilder()
+        yield self.addBuilders(['A', 'B', 'C'])
+        self.brd.maybeStartBuildsOn(['A', 'B', 'C'])
+
+        stop_d = self.brd.stopService()
+        self.finishBuilderRun('A')
+        self.assertFalse(stop_d.called)
+        self.finishBuilderRun('B')
+
+        yield stop_d
+        self.assertEqual(self.maybeStartBuildsOnBuilder_calls, ['A', 'B'])
+
 
 class TestMaybeStartBuilds(TestBRDBase):
 
@@ -470,6 +626,30 @@ class TestMaybeStartBuilds(TestBRDBase):
         yield self.do_test_maybeStartBuildsOnBuilder(rows=rows,
                                                      exp_claims=[10], exp_builds=[('test-worker1', [10])])
 
+    @defer.inlineCallbacks
+    def test_sorted_by_submit_time_indexed(self):
+        self.addWorkers({'test-worker1': 1})
+        rows = self.base_rows + [
+            fakedb.BuildRequest(id=11, buildsetid=11, builderid=77,
+                                submitted_at=135000),
+            fakedb.BuildRequest(id=10, buildsetid=11, builderid=77,
+                                submitted_at=130000),
+        ]
+        yield self.master.db.insertTestData(rows)
+        brIndex = self.master.botmaster.brIndex
+        yield brIndex.setServiceParent(self.master.botmaster)
+        yield brIndex.startService()
+        self.addCleanup(brIndex.stopService)
+        # the unclaimed requests come from the index
+        get = self.master.data.get
+
+        def checkedGet(path, *args, **kwargs):
+            self.assertNotEqual(path[-1], 'buildrequests')
+            return get(path, *args, **kwargs)
+        self.patch(self.master.data, 'get', checkedGet)
+        yield self.do_test_maybeStartBuildsOnBuilder(
+            exp_claims=[10], exp_builds=[('test-worker1', [10])])
+
     @defer.inlineCallbacks
     def test_limited_by_available_workers(self):
         self.addWorkers({'test-worker1': 0, 'test-worker2': 1})
@@ -507,6 +687,70 @@ class TestMaybeStartBuilds(TestBRDBase):
         yield self.do_test_maybeStartBuildsOnBuilder(rows=rows,
                                                      exp_claims=[10], exp_builds=[('test-worker1', [10])])
 
+    @defer.inlineCallbacks
+    def test_reserved_worker(self):
+        # when builds are started on several builders at once, a worker
+        # shared by two builders only gets one build
+        bldrB = yield self.createBuilder('B', builderid=78)
+        self.addWorkers({'test-worker1': 1})
+        for wfb in self.bldr.workers:
+            wfb.worker = 'worker-object'
+        rows = self.base_rows + [
+            fakedb.Builder(id=78, name='B'),
+            fakedb.BuildRequest(id=10, buildsetid=11, builderid=77),
+            fakedb.BuildRequest(id=11, buildsetid=11, builderid=78),
+        ]
+        yield self.master.db.insertTestData(rows)
+
+        started = defer.Deferred()
+
+        def maybeStartBuild(worker, breqs):
+            self.startedBuilds.append((worker.name, breqs))
+            return started
+        self.bldr.maybeStartBuild = maybeStartBuild
+        reruns = []
+        self.brd.maybeStartBuildsOn = reruns.append
+
+        d = self.brd._maybeStartBuildsOnBuilder(self.bldr,
+                                                _reserveWorkers=True)
+        yield self.brd._maybeStartBuildsOnBuilder(bldrB,
+                                                  _reserveWorkers=True)
+        self.assertMyClaims([10])
+        self.assertEqual(reruns, [])
+
+        # B runs again once A is done with the worker
+        started.callback(True)
+        yield d
+        self.assertBuildsStarted([('test-worker1', [10])])
+        self.assertEqual(reruns, [set(['B'])])
+        self.assertEqual(self.brd._startingWorkers, {})
+
+    @defer.inlineCallbacks
+    def test_timeToSaturate(self):
+        self.addWorkers({'test-worker1': 1})
+        yield self.master.db.insertTestData(self.base_rows + [
+            fakedb.BuildRequest(id=10, buildsetid=11, builderid=77),
+        ])
+        self.master.reactor = clock = task.Clock()
+        clock.advance(10)
+        timings = []
+
+        def observer(eventDict):
+            metric = eventDict.get('metric')
+            if isinstance(metric, metrics.MetricTimeEvent):
+                timings.append((metric.timer, metric.elapsed))
+        log.addObserver(observer)
+        self.addCleanup(log.removeObserver, observer)
+
+        def maybeStartBuild(worker, breqs):
+            clock.advance(3)
+            return defer.succeed(True)
+        self.bldr.maybeStartBuild = maybeStartBuild
+
+        self.brd.maybeStartBuildsOn(['A'])
+        yield self.quiet_deferred
+        self.assertIn(('BuildRequestDistributor.timeToSaturate', 3), timings)
+
     @defer.inlineCallbacks
     def test_limited_by_canStartBuild(self):
         """Set the 'canStartBuild' value in the config to something
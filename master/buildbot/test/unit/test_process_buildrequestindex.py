@@ -0,0 +1,162 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+from twisted.internet import defer
+from twisted.internet import task
+from twisted.trial import unittest
+
+from buildbot.process import buildrequestindex
+from buildbot.test.fake import fakedb
+from buildbot.test.fake import fakemaster
+from buildbot.util import epoch2datetime
+
+
+def brdict(brid, builderid=77, submitted_at=1000, claimed=False,
+           complete=False):
+    return {
+        'buildrequestid': brid,
+        'buildsetid': 11,
+        'builderid': builderid,
+        'priority': 0,
+        'claimed': claimed,
+        'claimed_at': epoch2datetime(2000) if claimed else None,
+        'claimed_by_masterid': 92 if claimed else None,
+        'complete': complete,
+        'results': -1,
+        'submitted_at': epoch2datetime(submitted_at),
+        'complete_at': None,
+        'waited_for': False,
+    }
+
+
+class TestUnclaimedBuildRequestIndex(unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        self.master = fakemaster.make_master(testcase=self, wantData=True)
+        self.master.reactor = self.clock = task.Clock()
+        self.index = buildrequestindex.UnclaimedBuildRequestIndex()
+        yield self.index.setServiceParent(self.master)
+        master_id = fakedb.FakeBuildRequestsComponent.MASTER_ID
+        yield self.master.db.insertTestData([
+            fakedb.Buildset(id=11, reason='because'),
+            fakedb.Builder(id=77, name='bldr1'),
+            fakedb.Builder(id=78, name='bldr2'),
+            fakedb.BuildRequest(id=111, submitted_at=1000,
+                                builderid=77, buildsetid=11),
+            fakedb.BuildRequest(id=222, submitted_at=2000,
+                                builderid=77, buildsetid=11),
+            fakedb.BuildRequestClaim(brid=222, masterid=master_id,
+                                     claimed_at=2001),
+            fakedb.BuildRequest(id=333, submitted_at=500,
+                                builderid=77, buildsetid=11),
+            fakedb.BuildRequest(id=444, submitted_at=2500,
+                                builderid=78, buildsetid=11),
+        ])
+
+    def tearDown(self):
+        if self.index.running:
+            return self.index.stopService()
+
+    def send(self, event, brdict):
+        self.index.handleMessage(
+            ('buildrequests', str(brdict['buildrequestid']), event), brdict)
+
+    def assertUnclaimed(self, builderid, brids):
+        self.assertEqual(
+            [br['buildrequestid']
+             for br in self.index.getUnclaimedBuildRequests(builderid)],
+            brids)
+
+    def test_not_synced(self):
+        self.assertFalse(self.index.synced)
+
+    @defer.inlineCallbacks
+    def test_sync_at_startup(self):
+        yield self.index.startService()
+        self.assertTrue(self.index.synced)
+        self.assertUnclaimed(77, [333, 111])
+        self.assertUnclaimed(78, [444])
+        self.assertUnclaimed(79, [])
+        self.assertEqual(self.index.getOldestRequestTime(77),
+                         epoch2datetime(500))
+        self.assertEqual(self.index.getOldestRequestTime(79), None)
+
+    @defer.inlineCallbacks
+    def test_messages(self):
+        yield self.index.startService()
+        self.send('new', brdict(555, submitted_at=300))
+        self.assertEqual(self.index.getOldestRequestTime(77),
+                         epoch2datetime(300))
+        self.send('claimed', brdict(555, submitted_at=300, claimed=True))
+        self.send('claimed', brdict(333, submitted_at=500, claimed=True))
+        self.assertEqual(self.index.getOldestRequestTime(77),
+                         epoch2datetime(1000))
+        self.assertUnclaimed(77, [111])
+        self.send('unclaimed', brdict(333, submitted_at=500))
+        self.assertUnclaimed(77, [333, 111])
+        self.send('complete', brdict(111, claimed=True, complete=True))
+        self.send('complete', brdict(444, builderid=78, claimed=True,
+                                     complete=True))
+        self.assertUnclaimed(77, [333])
+        self.assertEqual(self.index.getOldestRequestTime(78), None)
+        self.assertUnclaimed(78, [])
+
+    @defer.inlineCallbacks
+    def test_duplicate_messages(self):
+        yield self.index.startService()
+        self.send('new', brdict(555, submitted_at=300))
+        self.send('new', brdict(555, submitted_at=300))
+        self.assertUnclaimed(77, [555, 333, 111])
+
+    @defer.inlineCallbacks
+    def test_messages_during_resync(self):
+        yield self.index.startService()
+        d = defer.Deferred()
+        get = self.master.data.get
+
+        @defer.inlineCallbacks
+        def slowGet(*args, **kwargs):
+            rv = yield get(*args, **kwargs)
+            yield d
+            defer.returnValue(rv)
+        self.patch(self.master.data, 'get', slowGet)
+        self.clock.advance(self.index.RESYNC_INTERVAL)
+        # these messages arrive after the database was read
+        self.send('claimed', brdict(111, claimed=True))
+        self.send('new', brdict(555, submitted_at=300))
+        d.callback(None)
+        self.assertUnclaimed(77, [555, 333])
+
+    @defer.inlineCallbacks
+    def test_resync_fixes_missed_messages(self):
+        yield self.index.startService()
+        yield self.master.db.insertTestData([
+            fakedb.BuildRequest(id=555, submitted_at=100,
+                                builderid=78, buildsetid=11),
+        ])
+        self.assertUnclaimed(78, [444])
+        self.clock.advance(self.index.RESYNC_INTERVAL)
+        self.assertUnclaimed(78, [555, 444])
+
+    @defer.inlineCallbacks
+    def test_stop(self):
+        yield self.index.startService()
+        yield self.index.stopService()
+        self.assertFalse(self.index.synced)
+        self.assertUnclaimed(77, [])
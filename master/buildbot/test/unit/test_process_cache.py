@@ -18,6 +18,7 @@ from __future__ import print_function
 
 import mock
 
+from twisted.internet import defer
 from twisted.trial import unittest
 
 from buildbot.process import cache
@@ -52,6 +53,29 @@ class CacheManager(unittest.TestCase):
             self.assertEqual((foo_cache.max_size, bar_cache.max_size),
                              (5, 6))
 
+    def test_get_sized_cache(self):
+        cache = self.caches.get_sized_cache("foo", 100)
+        self.assertEqual(cache.max_size, 100)
+        self.assertIdentical(self.caches.get_sized_cache("foo", 100), cache)
+
+    @defer.inlineCallbacks
+    def test_get_sized_cache_reconfig(self):
+        cache = self.caches.get_sized_cache("foo", 100)
+        yield self.caches.reconfigServiceWithBuildbotConfig(
+            self.make_config(foo=50))
+        self.assertEqual(cache.max_size, 50)
+        # back to the default when the configuration is removed
+        yield self.caches.reconfigServiceWithBuildbotConfig(
+            self.make_config())
+        self.assertEqual(cache.max_size, 100)
+
+    def test_get_sized_cache_metrics(self):
+        cache = self.caches.get_sized_cache("foo", 100)
+        cache.put('a', 'aaa')
+        metric = self.caches.get_metrics()['foo']
+        self.assertEqual(metric['size'], 3)
+        self.assertEqual(metric['max_size'], 100)
+
     def test_get_metrics(self):
         self.caches.get_cache("foo", None)
         self.assertIn('foo', self.caches.get_metrics())
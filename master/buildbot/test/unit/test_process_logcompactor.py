@@ -0,0 +1,207 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import mock
+
+from twisted.internet import defer
+from twisted.internet import task
+from twisted.python import log
+from twisted.trial import unittest
+
+from buildbot.process import logcompactor
+from buildbot.process import metrics
+from buildbot.test.fake import fakedb
+from buildbot.test.fake import fakemaster
+
+
+class TestLogCompactor(unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        self.master = fakemaster.make_master(testcase=self,
+                                             wantMq=True, wantDb=True)
+        self.master.reactor = self.clock = task.Clock()
+        self.compactor = logcompactor.LogCompactor()
+        yield self.compactor.setServiceParent(self.master)
+        self.compressed = []
+        self.patch(self.master.db.logs, 'compressLog', self.compressLog)
+        self.metrics = []
+
+        def observer(eventDict):
+            if 'metric' in eventDict:
+                self.metrics.append(eventDict['metric'])
+        log.addObserver(observer)
+        self.addCleanup(log.removeObserver, observer)
+
+        yield self.master.db.insertTestData([
+            fakedb.Master(id=fakedb.FakeBuildRequestsComponent.MASTER_ID),
+            fakedb.Master(id=999, name='other:master'),
+            fakedb.Master(id=998, name='dead:master', active=0),
+            fakedb.Builder(id=77),
+            fakedb.Buildset(id=20),
+            fakedb.BuildRequest(id=41, buildsetid=20, builderid=77),
+            fakedb.Worker(id=13, name='wrk'),
+            fakedb.Build(id=30, buildrequestid=41, number=1, builderid=77,
+                         workerid=13,
+                         masterid=fakedb.FakeBuildRequestsComponent.MASTER_ID),
+            fakedb.Build(id=31, buildrequestid=41, number=2, builderid=77,
+                         workerid=13, masterid=999),
+            fakedb.Build(id=32, buildrequestid=41, number=3, builderid=77,
+                         workerid=13, masterid=998),
+            fakedb.Step(id=50, buildid=30),
+            fakedb.Step(id=51, buildid=31),
+            fakedb.Step(id=52, buildid=32),
+        ] + [fakedb.Log(id=60 + i, stepid=50, slug='log%d' % i)
+             for i in range(5)] + [
+            fakedb.Log(id=70, stepid=51),
+            fakedb.Log(id=80, stepid=52),
+        ])
+
+    def tearDown(self):
+        if self.compactor.running:
+            return self.compactor.stopService()
+
+    def compressLog(self, logid, force=False):
+        self.compressed.append(logid)
+        self.master.db.logs.compactions.pop(logid, None)
+        # compacting takes 2 seconds
+        self.clock.advance(2)
+        if logid == 62:
+            return defer.fail(RuntimeError("oh noes"))
+        return defer.succeed(100)
+
+    def queueLogs(self, *logids):
+        return self.master.db.insertTestData([
+            fakedb.LogCompaction(logid=logid, queued_at=i)
+            for i, logid in enumerate(logids)])
+
+    @defer.inlineCallbacks
+    def test_compacts_queued_logs_at_startup(self):
+        yield self.queueLogs(60, 61, 70)
+        yield self.compactor.startService()
+        self.assertEqual(self.compressed, [60])
+        # the compactor pauses as long as it worked
+        self.clock.advance(1.9)
+        self.assertEqual(self.compressed, [60])
+        self.clock.advance(0.1)
+        self.assertEqual(self.compressed, [60, 61])
+        self.clock.advance(2)
+        # the log of the other master's build is left alone
+        self.assertEqual(self.compressed, [60, 61])
+        self.assertEqual(self.master.db.logs.compactions, {70: 2})
+
+    @defer.inlineCallbacks
+    def test_compacts_finished_logs(self):
+        yield self.compactor.startService()
+        self.assertEqual(self.compressed, [])
+        yield self.master.db.logs.finishLog(63)
+        # there is no validator for log messages
+        self.master.mq.verifyMessages = False
+        self.master.mq.callConsumer(('logs', '63', 'finished'),
+                                    {'logid': 63, 'complete': True})
+        self.clock.advance(0)
+        self.assertEqual(self.compressed, [63])
+
+    @defer.inlineCallbacks
+    def test_polls_queue(self):
+        yield self.compactor.startService()
+        yield self.queueLogs(64)
+        self.clock.advance(self.compactor.POLL_INTERVAL)
+        self.assertEqual(self.compressed, [64])
+
+    @defer.inlineCallbacks
+    def test_batches(self):
+        self.compactor.BATCH_SIZE = 2
+        self.compactor.MAX_LOAD = 1
+        getLogCompactions = mock.Mock(
+            wraps=self.master.db.logs.getLogCompactions)
+        self.patch(self.master.db.logs, 'getLogCompactions',
+                   getLogCompactions)
+        yield self.queueLogs(60, 61, 63)
+        yield self.compactor.startService()
+        self.assertEqual(self.compressed, [60, 61, 63])
+        self.assertEqual(getLogCompactions.call_args_list, [
+            mock.call(masterid=fakedb.FakeBuildRequestsComponent.MASTER_ID,
+                      limit=2)] * 3)
+
+    @defer.inlineCallbacks
+    def test_failure_is_logged(self):
+        self.compactor.MAX_LOAD = 1
+        yield self.queueLogs(62, 63)
+        yield self.compactor.startService()
+        self.assertEqual(self.compressed, [62, 63])
+        self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
+
+    @defer.inlineCallbacks
+    def test_metrics(self):
+        yield self.queueLogs(60)
+        yield self.compactor.startService()
+        self.assertEqual(
+            [(m.counter, m.count) for m in self.metrics
+             if isinstance(m, metrics.MetricCountEvent)],
+            [("LogCompactor.compacted_logs", 1),
+             ("LogCompactor.bytes_saved", 100)])
+        self.assertEqual(
+            [(m.timer, m.elapsed) for m in self.metrics
+             if isinstance(m, metrics.MetricTimeEvent)],
+            [("LogCompactor.compactLog", 2)])
+
+    @defer.inlineCallbacks
+    def test_stop_during_pause(self):
+        yield self.queueLogs(60, 61)
+        yield self.compactor.startService()
+        self.assertEqual(self.compressed, [60])
+        yield self.compactor.stopService()
+        self.clock.advance(10)
+        self.assertEqual(self.compressed, [60])
+        # the remaining log is still queued for the next start
+        self.assertEqual(self.master.db.logs.compactions, {61: 1})
+
+    @defer.inlineCallbacks
+    def test_orphaned_log_compacted_once(self):
+        # another master shares the database, and both masters find the log
+        # of the inactive master in the queue before compacting it
+        other = fakemaster.make_master(testcase=self, wantMq=True)
+        other.db = self.master.db
+        other.masterid = 999
+        other.reactor = self.clock
+        other_compactor = logcompactor.LogCompactor()
+        yield other_compactor.setServiceParent(other)
+
+        getLogCompactions = self.master.db.logs.getLogCompactions
+
+        def slowGetLogCompactions(**kwargs):
+            d = getLogCompactions(**kwargs)
+            d.addCallback(
+                lambda logids: task.deferLater(self.clock, 1, lambda: logids))
+            return d
+        self.patch(self.master.db.logs, 'getLogCompactions',
+                   slowGetLogCompactions)
+        yield self.queueLogs(80)
+        yield self.compactor.startService()
+        yield other_compactor.startService()
+        self.clock.advance(1)
+        self.clock.advance(10)
+        self.assertEqual(self.compressed, [80])
+        self.assertEqual(self.master.db.logs.compactions, {})
+
+        # let the last polls of the queue finish
+        d = defer.gatherResults([self.compactor.stopService(),
+                                 other_compactor.stopService()])
+        self.clock.advance(1)
+        yield d
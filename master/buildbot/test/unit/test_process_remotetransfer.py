@@ -16,15 +16,22 @@
 from __future__ import absolute_import
 from __future__ import print_function
 
+import hashlib
 import os
+import shutil
 import stat
+import tarfile
 import tempfile
+from io import BytesIO
 
 from mock import Mock
 
+from twisted.internet import defer
+from twisted.internet import threads
 from twisted.trial import unittest
 
 from buildbot.process import remotetransfer
+from buildbot.test.fake import fakemaster
 
 
 # Test buildbot.steps.remotetransfer.FileWriter class.
@@ -69,6 +76,209 @@ class TestFileWriter(unittest.TestCase):
         mockedFdopen.assert_called_once_with(7, 'wb')
 
 
+class TestDirectoryWriter(unittest.TestCase):
+
+    pool = None
+
+    def setUp(self):
+        self.destroot = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.destroot)
+
+    def makeWriter(self, compress=None):
+        return remotetransfer.DirectoryWriter(self.destroot, None, compress,
+                                              0o600, pool=self.pool)
+
+    def makeArchive(self, compress=None, **members):
+        f = BytesIO()
+        archive = tarfile.open(fileobj=f, mode='w|' + (compress or ''))
+        for name, content in sorted(members.items()):
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            archive.addfile(info, BytesIO(content))
+        archive.close()
+        return f.getvalue()
+
+    def assertExtracted(self, name, content):
+        with open(os.path.join(self.destroot, name), 'rb') as f:
+            self.assertEqual(f.read(), content)
+
+    @defer.inlineCallbacks
+    def writeBlocks(self, writer, data, blocksize=100):
+        for i in range(0, len(data), blocksize):
+            yield writer.remote_write(data[i:i + blocksize])
+
+    @defer.inlineCallbacks
+    def test_extract(self):
+        writer = self.makeWriter()
+        data = self.makeArchive(a=b'aaa' * 100, b=b'b')
+        yield self.writeBlocks(writer, data)
+        yield writer.remote_unpack()
+        self.assertExtracted('a', b'aaa' * 100)
+        self.assertExtracted('b', b'b')
+
+    @defer.inlineCallbacks
+    def test_extract_gz(self):
+        writer = self.makeWriter('gz')
+        data = self.makeArchive('gz', a=b'aaa' * 100)
+        yield self.writeBlocks(writer, data)
+        yield writer.remote_unpack()
+        self.assertExtracted('a', b'aaa' * 100)
+
+    @defer.inlineCallbacks
+    def test_extract_buffer_full(self):
+        # writes wait for the extraction to catch up
+        writer = self.makeWriter()
+        writer.pipe.limit = 1000
+        content = os.urandom(100000)
+        yield self.writeBlocks(writer, self.makeArchive(a=content), 4096)
+        yield writer.remote_unpack()
+        self.assertExtracted('a', content)
+
+    @defer.inlineCallbacks
+    def test_extract_corrupt(self):
+        writer = self.makeWriter()
+        yield writer.remote_write(b'not a tarball' * 100)
+        yield self.assertFailure(writer.remote_unpack(), tarfile.ReadError)
+        # further writes fail too
+        yield self.assertFailure(writer.remote_write(b'more'),
+                                 tarfile.ReadError)
+
+    @defer.inlineCallbacks
+    def test_cancel(self):
+        writer = self.makeWriter()
+        data = self.makeArchive(a=b'aaa' * 100)
+        yield writer.remote_write(data[:1000])
+        writer.cancel()
+        yield self.assertFailure(writer.remote_unpack(), IOError)
+
+
+class TestExtractionPool(TestDirectoryWriter):
+
+    # the tests of DirectoryWriter run again, extracting in the pool
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        TestDirectoryWriter.setUp(self)
+        master = fakemaster.make_master(testcase=self)
+        self.pool = remotetransfer.ExtractionPool()
+        yield self.pool.setServiceParent(master)
+        yield self.pool.startService()
+        self.addCleanup(self.stopPool)
+
+    def stopPool(self):
+        if self.pool.running:
+            return self.pool.stopService()
+
+    @defer.inlineCallbacks
+    def test_extract_in_pool(self):
+        # the reactor's thread pool is left alone
+        self.patch(threads, 'deferToThread', None)
+        writer = self.makeWriter()
+        yield self.writeBlocks(writer, self.makeArchive(a=b'aaa' * 100))
+        yield writer.remote_unpack()
+        self.assertExtracted('a', b'aaa' * 100)
+        self.assertEqual(self.pool._pipes, set())
+
+    @defer.inlineCallbacks
+    def test_stop_aborts_extractions(self):
+        writer = self.makeWriter()
+        data = self.makeArchive(a=b'aaa' * 100)
+        yield writer.remote_write(data[:1000])
+        # the extraction waiting for more data does not block the stop
+        yield self.pool.stopService()
+        yield self.assertFailure(writer.remote_unpack(), IOError)
+
+    @defer.inlineCallbacks
+    def test_not_running(self):
+        yield self.pool.stopService()
+        writer = self.makeWriter()
+        yield self.assertFailure(writer.remote_unpack(), RuntimeError)
+
+
+class TestStoringFileWriter(unittest.TestCase):
+
+    def setUp(self):
+        master = fakemaster.make_master(testcase=self)
+        master.basedir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, master.basedir)
+        master.config.artifactStore = dict(basedir='artifacts', maxSize=1000)
+        self.store = master.artifacts
+        self.destdir = master.basedir
+
+    @defer.inlineCallbacks
+    def upload(self, name, data, maxsize=None):
+        writer = remotetransfer.StoringFileWriter(
+            self.store, os.path.join(self.destdir, name), maxsize, None)
+        stored = yield writer.remote_useStored(
+            hashlib.sha256(data).hexdigest())
+        if not stored:
+            writer.remote_write(data)
+        yield writer.remote_close()
+        yield self.store.waitForAdditions()
+        defer.returnValue(stored)
+
+    def assertUploaded(self, name, data):
+        with open(os.path.join(self.destdir, name), 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+    @defer.inlineCallbacks
+    def test_upload_twice(self):
+        stored = yield self.upload('a', b'some data')
+        self.assertFalse(stored)
+        stored = yield self.upload('b', b'some data')
+        self.assertTrue(stored)
+        self.assertUploaded('a', b'some data')
+        self.assertUploaded('b', b'some data')
+        # the temporary files are gone
+        self.assertEqual(sorted(os.listdir(self.destdir)),
+                         ['a', 'artifacts', 'b'])
+
+    @defer.inlineCallbacks
+    def test_upload_different(self):
+        yield self.upload('a', b'some data')
+        stored = yield self.upload('b', b'other data')
+        self.assertFalse(stored)
+        self.assertUploaded('b', b'other data')
+
+    @defer.inlineCallbacks
+    def test_upload_truncated(self):
+        yield self.upload('a', b'some data', maxsize=4)
+        self.assertUploaded('a', b'some')
+        # the truncated content is stored, under its own digest
+        found = yield self.store.lookup(hashlib.sha256(b'some').hexdigest())
+        self.assertEqual(found[1], 4)
+
+    @defer.inlineCallbacks
+    def test_close_does_not_wait(self):
+        added = defer.Deferred()
+        self.patch(self.store, 'add', lambda digest, filename: added)
+        writer = remotetransfer.StoringFileWriter(
+            self.store, os.path.join(self.destdir, 'a'), None, None)
+        writer.remote_write(b'some data')
+        yield writer.remote_close()
+        self.assertUploaded('a', b'some data')
+        waiting = self.store.waitForAdditions()
+        self.assertNoResult(waiting)
+        added.callback(None)
+        yield waiting
+
+    @defer.inlineCallbacks
+    def test_store_error(self):
+        self.patch(self.store, 'add',
+                   lambda digest, filename: defer.fail(IOError('disk full')))
+        yield self.upload('a', b'some data')
+        # the file was uploaded all the same
+        self.assertUploaded('a', b'some data')
+        self.assertEqual(len(self.flushLoggedErrors(IOError)), 1)
+
+    @defer.inlineCallbacks
+    def test_stored_too_large(self):
+        yield self.upload('a', b'some data')
+        stored = yield self.upload('b', b'some data', maxsize=4)
+        self.assertFalse(stored)
+        self.assertUploaded('b', b'some')
+
+
 class TestStringFileWriter(unittest.TestCase):
 
     def testBasic(self):
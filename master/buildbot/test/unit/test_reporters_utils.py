@@ -179,6 +179,334 @@ class TestDataUtils(unittest.TestCase, logging.LoggingMixin):
         self.assertEqual(res['buildid'], 18)
 
 
+class TestPreviousBuildCache(unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        self.master = fakemaster.make_master(testcase=self, wantData=True,
+                                             wantDb=True, wantMq=True)
+        # the build messages are the data API builds, as sent by the master
+        self.master.mq.verifyMessages = False
+        self.cache = self.master.previous_builds
+        yield self.cache.startService()
+        yield self.master.db.insertTestData([
+            fakedb.Master(id=92),
+            fakedb.Worker(id=13, name='wrk'),
+            fakedb.Buildset(id=98),
+            fakedb.Builder(id=80, name='Builder1'),
+            fakedb.BuildRequest(id=11, buildsetid=98, builderid=80),
+        ] + [
+            fakedb.Build(id=20 + n, number=n, builderid=80, buildrequestid=11,
+                         workerid=13, masterid=92, results=results)
+            for n, results in enumerate([SUCCESS, FAILURE, RETRY, None])
+        ])
+        self.dbQueries = []
+        getPreviousBuild = self.master.db.builds.getPreviousBuild
+
+        def countingGetPreviousBuild(builderid, number):
+            self.dbQueries.append(number)
+            return getPreviousBuild(builderid, number)
+        self.patch(self.master.db.builds, 'getPreviousBuild',
+                   countingGetPreviousBuild)
+
+    def tearDown(self):
+        return self.cache.stopService()
+
+    @defer.inlineCallbacks
+    def getPreviousBuild(self, number):
+        prev = yield utils.getPreviousBuild(self.master,
+                                            dict(builderid=80, number=number))
+        defer.returnValue(prev['number'] if prev else None)
+
+    @defer.inlineCallbacks
+    def finishBuild(self, buildid, results):
+        yield self.master.db.builds.finishBuild(buildid, results)
+        build = yield self.master.data.get(('builds', buildid))
+        self.master.mq.callConsumer(('builds', str(buildid), 'finished'),
+                                    build)
+
+    @defer.inlineCallbacks
+    def test_cached(self):
+        self.assertEqual((yield self.getPreviousBuild(3)), 1)
+        self.assertEqual((yield self.getPreviousBuild(2)), 1)
+        self.assertEqual((yield self.getPreviousBuild(0)), None)
+        self.assertEqual((yield self.getPreviousBuild(3)), 1)
+        self.assertEqual((yield self.getPreviousBuild(0)), None)
+        self.assertEqual(self.dbQueries, [3, 2, 0])
+
+    @defer.inlineCallbacks
+    def test_returns_copies(self):
+        prev = yield utils.getPreviousBuild(self.master,
+                                            dict(builderid=80, number=2))
+        self.assertEqual(prev['buildid'], 21)
+        prev['buildid'] = 'modified'
+        prev = yield utils.getPreviousBuild(self.master,
+                                            dict(builderid=80, number=2))
+        self.assertEqual(prev['buildid'], 21)
+
+    @defer.inlineCallbacks
+    def test_build_finished(self):
+        self.assertEqual((yield self.getPreviousBuild(5)), 1)
+        yield self.finishBuild(23, SUCCESS)
+        # the cached previous build of build 5 is updated, and the one of the
+        # next build is known without querying the database
+        self.assertEqual((yield self.getPreviousBuild(5)), 3)
+        self.assertEqual((yield self.getPreviousBuild(4)), 3)
+        self.assertEqual(self.dbQueries, [5])
+
+    @defer.inlineCallbacks
+    def test_build_finished_retry(self):
+        self.assertEqual((yield self.getPreviousBuild(3)), 1)
+        yield self.finishBuild(23, RETRY)
+        self.assertEqual((yield self.getPreviousBuild(4)), 1)
+        self.assertEqual(self.dbQueries, [3])
+
+    @defer.inlineCallbacks
+    def test_concurrent_queries(self):
+        d = defer.Deferred()
+        getPreviousBuild = self.master.db.builds.getPreviousBuild
+
+        def slowGetPreviousBuild(builderid, number):
+            return d.addCallback(
+                lambda _: getPreviousBuild(builderid, number))
+        self.patch(self.master.db.builds, 'getPreviousBuild',
+                   slowGetPreviousBuild)
+        d1 = self.getPreviousBuild(3)
+        d2 = self.getPreviousBuild(3)
+        d.callback(None)
+        self.assertEqual((yield d1), 1)
+        self.assertEqual((yield d2), 1)
+        self.assertEqual(self.dbQueries, [3])
+
+    @defer.inlineCallbacks
+    def test_build_finished_during_query(self):
+        d = defer.Deferred()
+        getPreviousBuild = self.master.db.builds.getPreviousBuild
+
+        def slowGetPreviousBuild(builderid, number):
+            return d.addCallback(
+                lambda _: getPreviousBuild(builderid, number))
+        self.patch(self.master.db.builds, 'getPreviousBuild',
+                   slowGetPreviousBuild)
+        d1 = self.getPreviousBuild(5)
+        self.master.db.builds.getPreviousBuild = getPreviousBuild
+        yield self.finishBuild(23, SUCCESS)
+        d.callback(None)
+        # the result of the query may be outdated, so it is not cached
+        self.assertEqual((yield d1), 3)
+        self.assertEqual((yield self.getPreviousBuild(5)), 3)
+        self.assertEqual(self.dbQueries, [5, 5])
+
+    @defer.inlineCallbacks
+    def test_cache_size(self):
+        self.patch(self.cache, 'BUILDS_PER_BUILDER', 2)
+        for number in (3, 2, 1, 3):
+            yield self.getPreviousBuild(number)
+        self.assertEqual(self.dbQueries, [3, 2, 1, 3])
+
+
+class TestBuildDetailsLoader(unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        self.master = fakemaster.make_master(testcase=self, wantData=True,
+                                             wantDb=True, wantMq=True)
+        self.loader = self.master.build_details
+        yield self.loader.startService()
+        yield self.master.db.insertTestData([
+            fakedb.Master(id=92),
+            fakedb.Worker(id=13, name='wrk'),
+            fakedb.Buildset(id=98, complete=1, results=SUCCESS),
+            fakedb.Buildset(id=99),
+            fakedb.Builder(id=80, name='Builder1'),
+            fakedb.Builder(id=81, name='Builder2'),
+            fakedb.BuildRequest(id=11, buildsetid=98, builderid=80),
+            fakedb.BuildRequest(id=12, buildsetid=98, builderid=81),
+            fakedb.BuildRequest(id=13, buildsetid=99, builderid=80),
+            fakedb.Build(id=20, number=0, builderid=80, buildrequestid=11,
+                         workerid=13, masterid=92, results=SUCCESS,
+                         complete_at=1304262222),
+            fakedb.Build(id=21, number=0, builderid=81, buildrequestid=12,
+                         workerid=13, masterid=92, results=SUCCESS,
+                         complete_at=1304262222),
+            fakedb.Build(id=22, number=1, builderid=80, buildrequestid=13,
+                         workerid=13, masterid=92),
+            fakedb.BuildProperty(buildid=20, name="reason", value="because"),
+            fakedb.Step(id=120, buildid=20, number=0, name="step1"),
+            fakedb.Step(id=121, buildid=20, number=1, name="step2"),
+            fakedb.Step(id=122, buildid=22, number=0, name="step1"),
+            fakedb.Log(id=60, stepid=120, name='stdio', slug='stdio',
+                       type='s', num_lines=1),
+            fakedb.LogChunk(logid=60, first_line=0, last_line=0,
+                            compressed=0, content=u'line zero\n'),
+        ])
+        self.dbQueries = []
+        for component, method in [('builds', 'getBuildsForBuildRequests'),
+                                  ('builds', 'getBuildPropertiesForBuilds'),
+                                  ('steps', 'getStepsForBuilds'),
+                                  ('logs', 'getLogsForSteps')]:
+            self.countQueries(getattr(self.master.db, component), method)
+
+    def tearDown(self):
+        return self.loader.stopService()
+
+    def countQueries(self, component, method):
+        orig = getattr(component, method)
+
+        def counting(ids):
+            self.dbQueries.append((method, sorted(ids)))
+            return orig(ids)
+        self.patch(component, method, counting)
+
+    def getDetailsForBuildset(self, bsid):
+        return utils.getDetailsForBuildset(self.master, bsid,
+                                           wantProperties=True,
+                                           wantSteps=True, wantLogs=True)
+
+    @defer.inlineCallbacks
+    def test_getDetailsForBuildset(self):
+        res = yield self.getDetailsForBuildset(98)
+        self.assertEqual(res['buildset']['bsid'], 98)
+        build1, build2 = res['builds']
+        self.assertEqual((build1['buildid'], build2['buildid']), (20, 21))
+        self.assertEqual(build1['builder']['name'], 'Builder1')
+        self.assertEqual(build2['builder']['name'], 'Builder2')
+        self.assertEqual(build1['properties'],
+                         {u'reason': (u'because', u'fakedb')})
+        self.assertEqual(build2['properties'], {})
+        self.assertEqual([step['name'] for step in build1['steps']],
+                         ['step1', 'step2'])
+        self.assertEqual(build2['steps'], [])
+        self.assertEqual(
+            build1['steps'][0]['logs'][0]['content']['content'],
+            u'line zero\n')
+        self.assertEqual(build1['steps'][1]['logs'], [])
+        # each kind of detail is fetched once, for all the builds
+        self.assertEqual(self.dbQueries, [
+            ('getBuildsForBuildRequests', [11, 12]),
+            ('getBuildPropertiesForBuilds', [20, 21]),
+            ('getStepsForBuilds', [20, 21]),
+            ('getLogsForSteps', [120, 121]),
+        ])
+
+    @defer.inlineCallbacks
+    def test_complete_buildset_kept(self):
+        yield self.getDetailsForBuildset(98)
+        del self.dbQueries[:]
+        res = yield self.getDetailsForBuildset(98)
+        self.assertEqual([b['buildid'] for b in res['builds']], [20, 21])
+        # except the log contents, which can be big
+        self.assertEqual(self.dbQueries, [('getLogsForSteps', [120, 121])])
+        self.assertEqual(
+            res['builds'][0]['steps'][0]['logs'][0]['content']['content'],
+            u'line zero\n')
+
+    @defer.inlineCallbacks
+    def test_concurrent_logs_shared(self):
+        d = defer.Deferred()
+        getLogs = self.master.db.logs.getLogsForSteps
+
+        def slowGetLogs(ids):
+            return d.addCallback(lambda _: getLogs(ids))
+        self.patch(self.master.db.logs, 'getLogsForSteps', slowGetLogs)
+        d1 = self.getDetailsForBuildset(98)
+        d2 = self.getDetailsForBuildset(98)
+        d.callback(None)
+        res1, res2 = yield defer.gatherResults([d1, d2])
+        log1 = res1['builds'][0]['steps'][0]['logs'][0]
+        log2 = res2['builds'][0]['steps'][0]['logs'][0]
+        self.assertEqual(log1, log2)
+        self.assertIsNot(log1, log2)
+        self.assertEqual(
+            [ids for method, ids in self.dbQueries
+             if method == 'getLogsForSteps'], [[120, 121]])
+
+    @defer.inlineCallbacks
+    def test_incomplete_buildset_not_kept(self):
+        yield self.getDetailsForBuildset(99)
+        yield self.getDetailsForBuildset(99)
+        self.assertEqual(
+            [method for method, ids in self.dbQueries],
+            ['getBuildsForBuildRequests', 'getBuildPropertiesForBuilds',
+             'getStepsForBuilds', 'getLogsForSteps'] * 2)
+
+    @defer.inlineCallbacks
+    def test_concurrent_reporters(self):
+        d = defer.Deferred()
+        getSteps = self.master.db.steps.getStepsForBuilds
+
+        def slowGetSteps(ids):
+            return d.addCallback(lambda _: getSteps(ids))
+        self.patch(self.master.db.steps, 'getStepsForBuilds', slowGetSteps)
+        d1 = self.getDetailsForBuildset(99)
+        d2 = utils.getDetailsForBuildset(self.master, 99, wantSteps=True)
+        d.callback(None)
+        res1, res2 = yield defer.gatherResults([d1, d2])
+        self.assertEqual(res1['builds'][0]['steps'][0]['logs'], [])
+        self.assertEqual(
+            [step['stepid'] for step in res2['builds'][0]['steps']], [122])
+        self.assertNotIn('logs', res2['builds'][0]['steps'][0])
+        # the buildset is not complete, but the reporters still share the
+        # fetches in progress
+        self.assertEqual(
+            [ids for method, ids in self.dbQueries
+             if method == 'getStepsForBuilds'], [[22]])
+
+    @defer.inlineCallbacks
+    def test_returns_copies(self):
+        res = yield self.getDetailsForBuildset(98)
+        res['builds'][0]['steps'][0]['name'] = 'modified'
+        res['buildset']['reason'] = 'modified'
+        res = yield self.getDetailsForBuildset(98)
+        self.assertEqual(res['builds'][0]['steps'][0]['name'], 'step1')
+        self.assertNotEqual(res['buildset']['reason'], 'modified')
+
+    @defer.inlineCallbacks
+    def test_getDetailsForBuilds_complete_builds_kept(self):
+        buildset = yield self.master.data.get(('buildsets', 99))
+        for _ in range(2):
+            builds = yield defer.gatherResults([
+                self.master.data.get(('builds', buildid))
+                for buildid in (20, 22)])
+            yield utils.getDetailsForBuilds(self.master, buildset, builds,
+                                            wantProperties=True,
+                                            wantSteps=True)
+            self.assertEqual([len(b['steps']) for b in builds], [2, 1])
+        self.assertEqual(self.dbQueries, [
+            ('getBuildPropertiesForBuilds', [20, 22]),
+            ('getStepsForBuilds', [20, 22]),
+            ('getBuildPropertiesForBuilds', [22]),
+            ('getStepsForBuilds', [22]),
+        ])
+
+    @defer.inlineCallbacks
+    def test_fetch_error(self):
+        d = defer.Deferred()
+        getSteps = self.master.db.steps.getStepsForBuilds
+        self.patch(self.master.db.steps, 'getStepsForBuilds',
+                   lambda ids: d)
+        d1 = self.getDetailsForBuildset(98)
+        d2 = self.getDetailsForBuildset(98)
+        d.errback(RuntimeError('oh noes'))
+        yield self.assertFailure(d1, RuntimeError)
+        yield self.assertFailure(d2, RuntimeError)
+        # failed fetches are not kept
+        self.patch(self.master.db.steps, 'getStepsForBuilds', getSteps)
+        res = yield self.getDetailsForBuildset(98)
+        self.assertEqual(len(res['builds'][0]['steps']), 2)
+
+    @defer.inlineCallbacks
+    def test_kept_limit(self):
+        self.patch(self.loader, 'KEPT', dict(self.loader.KEPT, buildset=1))
+        yield self.master.db.insertTestData([
+            fakedb.Buildset(id=97, complete=1, results=SUCCESS),
+        ])
+        for bsid in (98, 97, 98):
+            yield utils.getDetailsForBuildset(self.master, bsid)
+        self.assertEqual(
+            [ids for method, ids in self.dbQueries], [[11, 12], [], [11, 12]])
+
+
 class TestURLUtils(unittest.TestCase):
 
     def setUp(self):
@@ -40,6 +40,13 @@ try:
 except ImportError:
     hasLz4 = False
 
+try:
+    import zstandard
+    [zstandard]
+    hasZstd = True
+except ImportError:
+    hasZstd = False
+
 
 def mkconfig(**kwargs):
     config = dict(quiet=False, basedir=os.path.abspath('basedir'), force=True)
@@ -127,7 +134,9 @@ class TestCleanupDb(misc.StdoutAssertionsMixin, dirs.DirsMixin,
     def test_cleanup(self):
 
         # we reuse RealDatabaseMixin to setup the db
-        yield self.setUpRealDatabase(table_names=['logs', 'logchunks', 'steps', 'builds', 'builders',
+        yield self.setUpRealDatabase(table_names=['logs', 'logchunks', 'logchunk_dictionaries',
+                                                  'logcompaction_queue',
+                                                  'steps', 'builds', 'builders',
                                                   'masters', 'buildrequests', 'buildsets',
                                                   'workers'])
         master = fakemaster.make_master()
@@ -151,6 +160,10 @@ class TestCleanupDb(misc.StdoutAssertionsMixin, dirs.DirsMixin,
                 # ok.. lz4 is not installed, don't fail
                 lengths["lz4"] = 40
                 continue
+            if mode == "zstd" and not hasZstd:
+                # zstandard is not installed either
+                lengths["zstd"] = 20
+                continue
             # create a master.cfg with different compression method
             self.createMasterCfg("c['logCompressionMethod'] = '%s'" % (mode,))
             res = yield cleanupdb._cleanupDatabase(mkconfig(basedir='basedir'))
@@ -170,7 +183,7 @@ class TestCleanupDb(misc.StdoutAssertionsMixin, dirs.DirsMixin,
             lengths[mode] = yield self.db.pool.do(thd)
 
         self.assertDictAlmostEqual(
-            lengths, {'raw': 5999, 'bz2': 44, 'lz4': 40, 'gz': 31})
+            lengths, {'raw': 5999, 'bz2': 44, 'lz4': 40, 'gz': 31, 'zstd': 20})
 
     def assertDictAlmostEqual(self, d1, d2):
         # The test shows each methods return different size
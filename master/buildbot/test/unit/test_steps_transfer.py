@@ -17,6 +17,7 @@ from __future__ import absolute_import
 from __future__ import print_function
 from future.utils import iteritems
 
+import hashlib
 import json
 import os
 import shutil
@@ -27,6 +28,7 @@ from io import BytesIO
 
 from mock import Mock
 
+from twisted.internet import defer
 from twisted.trial import unittest
 
 from buildbot import config
@@ -52,9 +54,10 @@ def uploadString(string, timestamp=None):
     def behavior(command):
         writer = command.args['writer']
         writer.remote_write(string + "\n")
-        writer.remote_close()
+        d = defer.maybeDeferred(writer.remote_close)
         if timestamp:
-            writer.remote_utime(timestamp)
+            d.addCallback(lambda _: writer.remote_utime(timestamp))
+        return d
     return behavior
 
 
@@ -80,10 +83,17 @@ def uploadTarFile(filename, **members):
             archive.addfile(tarfile.TarInfo(name), BytesIO(content))
         writer = command.args['writer']
         writer.remote_write(f.getvalue())
-        writer.remote_unpack()
+        return writer.remote_unpack()
     return behavior
 
 
+def enableArtifactStore(testcase):
+    testcase.master.basedir = tempfile.mkdtemp()
+    testcase.addCleanup(shutil.rmtree, testcase.master.basedir)
+    testcase.master.config.artifactStore = dict(basedir='artifacts',
+                                                maxSize=1000)
+
+
 class UploadError(object):
 
     def __init__(self, behavior):
@@ -121,7 +131,7 @@ class TestFileUpload(steps.BuildStepMixin, unittest.TestCase):
         self.expectCommands(
             Expect('uploadFile', dict(
                 workersrc="srcfile", workdir='wkdir',
-                blocksize=16384, maxsize=None, keepstamp=False,
+                blocksize=16384, window=8, maxsize=None, keepstamp=False,
                 writer=ExpectRemoteRef(remotetransfer.FileWriter)))
             + Expect.behavior(uploadString("Hello world!"))
             + 0)
@@ -149,6 +159,147 @@ class TestFileUpload(steps.BuildStepMixin, unittest.TestCase):
         d = self.runStep()
         return d
 
+    def testWindow(self):
+        self.setupStep(
+            transfer.FileUpload(workersrc='srcfile', masterdest=self.destfile,
+                                window=32))
+
+        self.expectCommands(
+            Expect('uploadFile', dict(
+                workersrc="srcfile", workdir='wkdir',
+                blocksize=16384, window=32, maxsize=None, keepstamp=False,
+                writer=ExpectRemoteRef(remotetransfer.FileWriter)))
+            + Expect.behavior(uploadString("Hello world!"))
+            + 0)
+
+        self.expectOutcome(
+            result=SUCCESS, state_string="uploading srcfile")
+        d = self.runStep()
+        return d
+
+    def testNoWindow(self):
+        self.setupStep(
+            transfer.FileUpload(workersrc='srcfile', masterdest=self.destfile,
+                                window=1))
+
+        self.expectCommands(
+            Expect('uploadFile', dict(
+                workersrc="srcfile", workdir='wkdir',
+                blocksize=16384, maxsize=None, keepstamp=False,
+                writer=ExpectRemoteRef(remotetransfer.FileWriter)))
+            + Expect.behavior(uploadString("Hello world!"))
+            + 0)
+
+        self.expectOutcome(
+            result=SUCCESS, state_string="uploading srcfile")
+        d = self.runStep()
+        return d
+
+    def testWorker3_1(self):
+        # workers older than 3.2 do not support windowed transfers
+        self.setupStep(
+            transfer.FileUpload(workersrc='srcfile', masterdest=self.destfile),
+            worker_version={'*': '3.1'})
+
+        self.expectCommands(
+            Expect('uploadFile', dict(
+                workersrc="srcfile", workdir='wkdir',
+                blocksize=16384, maxsize=None, keepstamp=False,
+                writer=ExpectRemoteRef(remotetransfer.FileWriter)))
+            + Expect.behavior(uploadString("Hello world!"))
+            + 0)
+
+        self.expectOutcome(
+            result=SUCCESS, state_string="uploading srcfile")
+        d = self.runStep()
+        return d
+
+    def testArtifactStore(self):
+        self.setupStep(
+            transfer.FileUpload(workersrc='srcfile', masterdest=self.destfile))
+        enableArtifactStore(self)
+
+        self.expectCommands(
+            Expect('uploadFile', dict(
+                workersrc="srcfile", workdir='wkdir',
+                blocksize=16384, window=8, maxsize=None, keepstamp=False,
+                contentHash=True,
+                writer=ExpectRemoteRef(remotetransfer.StoringFileWriter)))
+            + Expect.behavior(uploadString("Hello world!"))
+            + 0)
+
+        self.expectOutcome(
+            result=SUCCESS, state_string="uploading srcfile")
+        d = self.runStep()
+
+        @d.addCallback
+        def checkStored(_):
+            store = self.master.artifacts
+            d = store.waitForAdditions()
+            d.addCallback(lambda _: store.lookup(
+                hashlib.sha256(b"Hello world!\n").hexdigest()))
+            return d
+
+        @d.addCallback
+        def check(found):
+            self.assertEqual(found[1], 13)
+        return d
+
+    def testArtifactStoreWorker3_3(self):
+        # older workers always send the file, which is stored all the same
+        self.setupStep(
+            transfer.FileUpload(workersrc='srcfile', masterdest=self.destfile),
+            worker_version={'*': '3.3'})
+        enableArtifactStore(self)
+
+        self.expectCommands(
+            Expect('uploadFile', dict(
+                workersrc="srcfile", workdir='wkdir',
+                blocksize=16384, window=8, maxsize=None, keepstamp=False,
+                writer=ExpectRemoteRef(remotetransfer.StoringFileWriter)))
+            + Expect.behavior(uploadString("Hello world!"))
+            + 0)
+
+        self.expectOutcome(
+            result=SUCCESS, state_string="uploading srcfile")
+        return self.runStep()
+
+    def testArtifactStoreMode(self):
+        # the mode is set on the destination, not on the stored copy
+        self.setupStep(
+            transfer.FileUpload(workersrc='srcfile', masterdest=self.destfile,
+                                mode=0o755))
+        enableArtifactStore(self)
+
+        self.expectCommands(
+            Expect('uploadFile', dict(
+                workersrc="srcfile", workdir='wkdir',
+                blocksize=16384, window=8, maxsize=None, keepstamp=False,
+                contentHash=True,
+                writer=ExpectRemoteRef(remotetransfer.StoringFileWriter)))
+            + Expect.behavior(uploadString("Hello world!"))
+            + 0)
+
+        self.expectOutcome(
+            result=SUCCESS, state_string="uploading srcfile")
+        d = self.runStep()
+
+        @d.addCallback
+        def checkStored(_):
+            store = self.master.artifacts
+            d = store.waitForAdditions()
+            d.addCallback(lambda _: store.lookup(
+                hashlib.sha256(b"Hello world!\n").hexdigest()))
+            return d
+
+        @d.addCallback
+        def check(found):
+            self.assertEqual(stat.S_IMODE(os.stat(self.destfile).st_mode),
+                             0o755)
+            self.assertNotEqual(stat.S_IMODE(os.stat(found[0]).st_mode),
+                                0o755)
+        return d
+
     def testTimestamp(self):
         self.setupStep(
             transfer.FileUpload(workersrc=__file__, masterdest=self.destfile, keepstamp=True))
@@ -159,7 +310,7 @@ class TestFileUpload(steps.BuildStepMixin, unittest.TestCase):
         self.expectCommands(
             Expect('uploadFile', dict(
                 workersrc=__file__, workdir='wkdir',
-                blocksize=16384, maxsize=None, keepstamp=True,
+                blocksize=16384, window=8, maxsize=None, keepstamp=True,
                 writer=ExpectRemoteRef(remotetransfer.FileWriter)))
             + Expect.behavior(uploadString('test', timestamp=timestamp))
             + 0)
@@ -192,7 +343,7 @@ class TestFileUpload(steps.BuildStepMixin, unittest.TestCase):
         self.expectCommands(
             Expect('uploadFile', dict(
                 workersrc=__file__, workdir='wkdir',
-                blocksize=16384, maxsize=None, keepstamp=False,
+                blocksize=16384, window=8, maxsize=None, keepstamp=False,
                 writer=ExpectRemoteRef(remotetransfer.FileWriter)))
             + Expect.behavior(uploadString("Hello world!"))
             + 0)
@@ -213,7 +364,7 @@ class TestFileUpload(steps.BuildStepMixin, unittest.TestCase):
         self.expectCommands(
             Expect('uploadFile', dict(
                 workersrc=__file__, workdir='wkdir',
-                blocksize=16384, maxsize=None, keepstamp=False,
+                blocksize=16384, window=8, maxsize=None, keepstamp=False,
                 writer=ExpectRemoteRef(remotetransfer.FileWriter)))
             + Expect.behavior(uploadString("Hello world!"))
             + 0)
@@ -239,7 +390,7 @@ class TestFileUpload(steps.BuildStepMixin, unittest.TestCase):
         self.expectCommands(
             Expect('uploadFile', dict(
                 workersrc=__file__, workdir='wkdir',
-                blocksize=16384, maxsize=None, keepstamp=False,
+                blocksize=16384, window=8, maxsize=None, keepstamp=False,
                 writer=ExpectRemoteRef(remotetransfer.FileWriter)))
             + Expect.behavior(uploadString("Hello world!"))
             + 0)
@@ -263,7 +414,7 @@ class TestFileUpload(steps.BuildStepMixin, unittest.TestCase):
         self.expectCommands(
             Expect('uploadFile', dict(
                 workersrc="srcfile", workdir='wkdir',
-                blocksize=16384, maxsize=None, keepstamp=False,
+                blocksize=16384, window=8, maxsize=None, keepstamp=False,
                 writer=ExpectRemoteRef(remotetransfer.FileWriter)))
             + 1)
 
@@ -282,7 +433,7 @@ class TestFileUpload(steps.BuildStepMixin, unittest.TestCase):
         self.expectCommands(
             Expect('uploadFile', dict(
                 workersrc="srcfile", workdir='wkdir',
-                blocksize=16384, maxsize=None, keepstamp=False,
+                blocksize=16384, window=8, maxsize=None, keepstamp=False,
                 writer=ExpectRemoteRef(remotetransfer.FileWriter)))
             + Expect.behavior(behavior))
 
@@ -360,7 +511,7 @@ class TestDirectoryUpload(steps.BuildStepMixin, unittest.TestCase):
         self.expectCommands(
             Expect('uploadDirectory', dict(
                 workersrc="srcdir", workdir='wkdir',
-                blocksize=16384, compress=None, maxsize=None,
+                blocksize=16384, window=8, compress=None, maxsize=None,
                 writer=ExpectRemoteRef(remotetransfer.DirectoryWriter)))
             + Expect.behavior(uploadTarFile('fake.tar', test="Hello world!"))
             + 0)
@@ -396,7 +547,7 @@ class TestDirectoryUpload(steps.BuildStepMixin, unittest.TestCase):
         self.expectCommands(
             Expect('uploadDirectory', dict(
                 workersrc="srcdir", workdir='wkdir',
-                blocksize=16384, compress=None, maxsize=None,
+                blocksize=16384, window=8, compress=None, maxsize=None,
                 writer=ExpectRemoteRef(remotetransfer.DirectoryWriter)))
             + 1)
 
@@ -414,7 +565,7 @@ class TestDirectoryUpload(steps.BuildStepMixin, unittest.TestCase):
         self.expectCommands(
             Expect('uploadDirectory', dict(
                 workersrc="srcdir", workdir='wkdir',
-                blocksize=16384, compress=None, maxsize=None,
+                blocksize=16384, window=8, compress=None, maxsize=None,
                 writer=ExpectRemoteRef(remotetransfer.DirectoryWriter)))
             + Expect.behavior(behavior))
 
@@ -508,7 +659,7 @@ class TestMultipleFileUpload(steps.BuildStepMixin, unittest.TestCase):
             + 0,
             Expect('uploadFile', dict(
                 workersrc="srcfile", workdir='wkdir',
-                blocksize=16384, maxsize=None, keepstamp=False,
+                blocksize=16384, window=8, maxsize=None, keepstamp=False,
                 writer=ExpectRemoteRef(remotetransfer.FileWriter)))
             + Expect.behavior(uploadString("Hello world!"))
             + 0)
@@ -528,7 +679,7 @@ class TestMultipleFileUpload(steps.BuildStepMixin, unittest.TestCase):
             + 0,
             Expect('uploadDirectory', dict(
                 workersrc="srcdir", workdir='wkdir',
-                blocksize=16384, compress=None, maxsize=None,
+                blocksize=16384, window=8, compress=None, maxsize=None,
                 writer=ExpectRemoteRef(remotetransfer.DirectoryWriter)))
             + Expect.behavior(uploadTarFile('fake.tar', test="Hello world!"))
             + 0)
@@ -541,6 +692,35 @@ class TestMultipleFileUpload(steps.BuildStepMixin, unittest.TestCase):
         self.setupStep(
             transfer.MultipleFileUpload(workersrcs=["srcfile", "srcdir"], masterdest=self.destdir))
 
+        self.expectCommands(
+            Expect('stat', dict(files=["srcfile", "srcdir"],
+                                workdir='wkdir'))
+            + Expect.update('stats', [[stat.S_IFREG, 99, 99], [stat.S_IFDIR, 99, 99]])
+            + 0,
+            Expect('uploadFile', dict(
+                workersrc="srcfile", workdir='wkdir',
+                blocksize=16384, window=8, maxsize=None, keepstamp=False,
+                writer=ExpectRemoteRef(remotetransfer.FileWriter)))
+            + Expect.behavior(uploadString("Hello world!"))
+            + 0,
+            Expect('uploadDirectory', dict(
+                workersrc="srcdir", workdir='wkdir',
+                blocksize=16384, window=8, compress=None, maxsize=None,
+                writer=ExpectRemoteRef(remotetransfer.DirectoryWriter)))
+            + Expect.behavior(uploadTarFile('fake.tar', test="Hello world!"))
+            + 0)
+
+        self.expectOutcome(
+            result=SUCCESS, state_string="uploading 2 files")
+        d = self.runStep()
+        return d
+
+    def testMultipleWorker3_2(self):
+        # workers older than 3.3 stat one file at a time
+        self.setupStep(
+            transfer.MultipleFileUpload(workersrcs=["srcfile", "srcdir"], masterdest=self.destdir),
+            worker_version={'*': '3.2'})
+
         self.expectCommands(
             Expect('stat', dict(file="srcfile",
                                 workdir='wkdir'))
@@ -548,7 +728,7 @@ class TestMultipleFileUpload(steps.BuildStepMixin, unittest.TestCase):
             + 0,
             Expect('uploadFile', dict(
                 workersrc="srcfile", workdir='wkdir',
-                blocksize=16384, maxsize=None, keepstamp=False,
+                blocksize=16384, window=8, maxsize=None, keepstamp=False,
                 writer=ExpectRemoteRef(remotetransfer.FileWriter)))
             + Expect.behavior(uploadString("Hello world!"))
             + 0,
@@ -558,7 +738,7 @@ class TestMultipleFileUpload(steps.BuildStepMixin, unittest.TestCase):
             + 0,
             Expect('uploadDirectory', dict(
                 workersrc="srcdir", workdir='wkdir',
-                blocksize=16384, compress=None, maxsize=None,
+                blocksize=16384, window=8, compress=None, maxsize=None,
                 writer=ExpectRemoteRef(remotetransfer.DirectoryWriter)))
             + Expect.behavior(uploadTarFile('fake.tar', test="Hello world!"))
             + 0)
@@ -568,6 +748,150 @@ class TestMultipleFileUpload(steps.BuildStepMixin, unittest.TestCase):
         d = self.runStep()
         return d
 
+    @defer.inlineCallbacks
+    def testRunUploadsConcurrently(self):
+        step = transfer.MultipleFileUpload(workersrcs=["srcfile"], masterdest=self.destdir,
+                                           maxConcurrentUploads=2)
+        started = []
+
+        def upload(i):
+            d = defer.Deferred()
+            started.append(d)
+            return d
+
+        d = step.runUploads([lambda i=i: upload(i) for i in range(3)])
+        # only two uploads run at a time
+        self.assertEqual(len(started), 2)
+        started[1].callback(SUCCESS)
+        self.assertEqual(len(started), 3)
+        started[0].callback(SUCCESS)
+        started[2].callback(FAILURE)
+        results = yield d
+        self.assertEqual(results, [SUCCESS, SUCCESS, FAILURE])
+
+    @defer.inlineCallbacks
+    def testRunUploadsStopsOnFailure(self):
+        step = transfer.MultipleFileUpload(workersrcs=["srcfile"], masterdest=self.destdir,
+                                           maxConcurrentUploads=2)
+        started = []
+
+        def upload():
+            d = defer.Deferred()
+            started.append(d)
+            return d
+
+        d = step.runUploads([upload] * 3)
+        started[0].callback(FAILURE)
+        # the third upload is not started, and the running one completes
+        self.assertEqual(len(started), 2)
+        started[1].callback(SUCCESS)
+        results = yield d
+        self.assertEqual(results, [FAILURE, SUCCESS, SKIPPED])
+
+    @defer.inlineCallbacks
+    def testInterruptConcurrentUploads(self):
+        step = transfer.MultipleFileUpload(workersrcs=["srcfile"], masterdest=self.destdir,
+                                           maxConcurrentUploads=2)
+        step.addCompleteLog = Mock()
+        running = []
+
+        def runCommand(cmd):
+            d = defer.Deferred()
+            running.append(d)
+            return d
+        step.runCommand = runCommand
+        cmds = [Mock() for _ in range(3)]
+        for cmd in cmds:
+            cmd.interrupt.return_value = defer.succeed(None)
+            cmd.didFail.return_value = True
+
+        d = step.runUploads(
+            [lambda cmd=cmd: step.runTransferCommand(cmd) for cmd in cmds])
+        yield step.interrupt('stopped')
+        # both running uploads are interrupted, and the third one is not
+        # started
+        self.assertEqual([cmd.interrupt.call_args_list for cmd in cmds],
+                         [[(('stopped',),)], [(('stopped',),)], []])
+        for r in running:
+            r.callback(None)
+        results = yield d
+        self.assertEqual(results, [FAILURE, FAILURE, SKIPPED])
+        self.assertEqual(step.cmds, set())
+
+    def testConcurrentFailure(self):
+        self.setupStep(
+            transfer.MultipleFileUpload(workersrcs=["srcfile", "srcdir", "srcfile2"],
+                                        masterdest=self.destdir,
+                                        maxConcurrentUploads=2))
+
+        # no upload is started once the first one failed
+        self.expectCommands(
+            Expect('stat', dict(files=["srcfile", "srcdir", "srcfile2"],
+                                workdir='wkdir'))
+            + Expect.update('stats', [[stat.S_IFREG, 99, 99], [stat.S_IFDIR, 99, 99],
+                                      [stat.S_IFREG, 99, 99]])
+            + 0,
+            Expect('uploadFile', dict(
+                workersrc="srcfile", workdir='wkdir',
+                blocksize=16384, window=8, maxsize=None, keepstamp=False,
+                writer=ExpectRemoteRef(remotetransfer.FileWriter)))
+            + 1)
+
+        self.expectOutcome(
+            result=FAILURE, state_string="uploading 3 files (failure)")
+        d = self.runStep()
+        return d
+
+    def testConcurrentConfError(self):
+        self.assertRaises(config.ConfigErrors, lambda:
+                          transfer.MultipleFileUpload(workersrcs=["srcfile"], masterdest=self.destdir,
+                                                      maxConcurrentUploads=0))
+
+    def testPack(self):
+        self.setupStep(
+            transfer.MultipleFileUpload(workersrcs=["small1", "srcdir", "large", "small2"],
+                                        masterdest=self.destdir, packThreshold=1000))
+
+        def fileStat(size):
+            return [stat.S_IFREG, 99, 99, 1, 0, 0, size, 0, 0, 0]
+
+        self.expectCommands(
+            Expect('stat', dict(files=["small1", "srcdir", "large", "small2"],
+                                workdir='wkdir'))
+            + Expect.update('stats', [fileStat(10), [stat.S_IFDIR, 99, 99],
+                                      fileStat(5000), fileStat(999)])
+            + 0,
+            Expect('uploadDirectory', dict(
+                workersrc=".", files=["small1", "small2"], workdir='wkdir',
+                blocksize=16384, window=8, compress=None, maxsize=None,
+                writer=ExpectRemoteRef(remotetransfer.DirectoryWriter)))
+            + Expect.behavior(uploadTarFile('fake.tar', small1="", small2=""))
+            + 0,
+            Expect('uploadDirectory', dict(
+                workersrc="srcdir", workdir='wkdir',
+                blocksize=16384, window=8, compress=None, maxsize=None,
+                writer=ExpectRemoteRef(remotetransfer.DirectoryWriter)))
+            + Expect.behavior(uploadTarFile('fake.tar', test="Hello world!"))
+            + 0,
+            Expect('uploadFile', dict(
+                workersrc="large", workdir='wkdir',
+                blocksize=16384, window=8, maxsize=None, keepstamp=False,
+                writer=ExpectRemoteRef(remotetransfer.FileWriter)))
+            + Expect.behavior(uploadString("Hello world!"))
+            + 0)
+
+        self.expectOutcome(
+            result=SUCCESS, state_string="uploading 4 files")
+        d = self.runStep()
+
+        @d.addCallback
+        def checkFiles(_):
+            # the packed files are extracted into masterdest
+            self.assertTrue(os.path.exists(os.path.join(self.destdir, 'small1')))
+            self.assertTrue(os.path.exists(os.path.join(self.destdir, 'small2')))
+
+        return d
+
     def testMultipleString(self):
         self.setupStep(
             transfer.MultipleFileUpload(workersrcs="srcfile", masterdest=self.destdir))
@@ -578,7 +902,7 @@ class TestMultipleFileUpload(steps.BuildStepMixin, unittest.TestCase):
             + 0,
             Expect('uploadFile', dict(
                 workersrc="srcfile", workdir='wkdir',
-                blocksize=16384, maxsize=None, keepstamp=False,
+                blocksize=16384, window=8, maxsize=None, keepstamp=False,
                 writer=ExpectRemoteRef(remotetransfer.FileWriter)))
             + Expect.behavior(uploadString("Hello world!"))
             + 0)
@@ -601,7 +925,7 @@ class TestMultipleFileUpload(steps.BuildStepMixin, unittest.TestCase):
             + 0,
             Expect('uploadFile', dict(
                 workersrc="srcfile", workdir='wkdir',
-                blocksize=16384, maxsize=None, keepstamp=False,
+                blocksize=16384, window=8, maxsize=None, keepstamp=False,
                 writer=ExpectRemoteRef(remotetransfer.FileWriter)))
             + Expect.behavior(uploadString("Hello world!"))
             + 0,
@@ -706,13 +1030,13 @@ class TestMultipleFileUpload(steps.BuildStepMixin, unittest.TestCase):
             transfer.MultipleFileUpload(workersrcs=["srcfile", "srcdir"], masterdest=self.destdir))
 
         self.expectCommands(
-            Expect('stat', dict(file="srcfile",
+            Expect('stat', dict(files=["srcfile", "srcdir"],
                                 workdir='wkdir'))
-            + Expect.update('stat', [stat.S_IFREG, 99, 99])
+            + Expect.update('stats', [[stat.S_IFREG, 99, 99], [stat.S_IFDIR, 99, 99]])
             + 0,
             Expect('uploadFile', dict(
                 workersrc="srcfile", workdir='wkdir',
-                blocksize=16384, maxsize=None, keepstamp=False,
+                blocksize=16384, window=8, maxsize=None, keepstamp=False,
                 writer=ExpectRemoteRef(remotetransfer.FileWriter)))
             + 1)
 
@@ -728,13 +1052,13 @@ class TestMultipleFileUpload(steps.BuildStepMixin, unittest.TestCase):
         behavior = UploadError(uploadString("Hello world!"))
 
         self.expectCommands(
-            Expect('stat', dict(file="srcfile",
+            Expect('stat', dict(files=["srcfile", "srcdir"],
                                 workdir='wkdir'))
-            + Expect.update('stat', [stat.S_IFREG, 99, 99])
+            + Expect.update('stats', [[stat.S_IFREG, 99, 99], [stat.S_IFDIR, 99, 99]])
             + 0,
             Expect('uploadFile', dict(
                 workersrc="srcfile", workdir='wkdir',
-                blocksize=16384, maxsize=None, keepstamp=False,
+                blocksize=16384, window=8, maxsize=None, keepstamp=False,
                 writer=ExpectRemoteRef(remotetransfer.FileWriter)))
             + Expect.behavior(behavior))
 
@@ -760,23 +1084,19 @@ class TestMultipleFileUpload(steps.BuildStepMixin, unittest.TestCase):
         self.setupStep(step)
 
         self.expectCommands(
-            Expect('stat', dict(file="srcfile",
+            Expect('stat', dict(files=["srcfile", "srcdir"],
                                 workdir='wkdir'))
-            + Expect.update('stat', [stat.S_IFREG, 99, 99])
+            + Expect.update('stats', [[stat.S_IFREG, 99, 99], [stat.S_IFDIR, 99, 99]])
             + 0,
             Expect('uploadFile', dict(
                 workersrc="srcfile", workdir='wkdir',
-                blocksize=16384, maxsize=None, keepstamp=False,
+                blocksize=16384, window=8, maxsize=None, keepstamp=False,
                 writer=ExpectRemoteRef(remotetransfer.FileWriter)))
             + Expect.behavior(uploadString("Hello world!"))
             + 0,
-            Expect('stat', dict(file="srcdir",
-                                workdir='wkdir'))
-            + Expect.update('stat', [stat.S_IFDIR, 99, 99])
-            + 0,
             Expect('uploadDirectory', dict(
                 workersrc="srcdir", workdir='wkdir',
-                blocksize=16384, compress=None, maxsize=None,
+                blocksize=16384, window=8, compress=None, maxsize=None,
                 writer=ExpectRemoteRef(remotetransfer.DirectoryWriter)))
             + Expect.behavior(uploadTarFile('fake.tar', test="Hello world!"))
             + 0)
@@ -906,7 +1226,7 @@ class TestFileDownload(steps.BuildStepMixin, unittest.TestCase):
         self.expectCommands(
             Expect('downloadFile', dict(
                 workerdest=self.destfile, workdir='wkdir',
-                blocksize=16384, maxsize=None, mode=None,
+                blocksize=16384, window=8, maxsize=None, mode=None,
                 reader=ExpectRemoteRef(remotetransfer.FileReader)))
             + Expect.behavior(downloadString(read.append))
             + 0)
@@ -961,6 +1281,79 @@ class TestFileDownload(steps.BuildStepMixin, unittest.TestCase):
 
         return d
 
+    def testArtifactStore(self):
+        master_file = __file__
+        self.setupStep(
+            transfer.FileDownload(
+                mastersrc=master_file, workerdest=self.destfile))
+        enableArtifactStore(self)
+        with open(master_file, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+
+        read = []
+        self.expectCommands(
+            Expect('downloadFile', dict(
+                workerdest=self.destfile, workdir='wkdir',
+                blocksize=16384, window=8, maxsize=None, mode=None,
+                sha256=digest,
+                reader=ExpectRemoteRef(remotetransfer.FileReader)))
+            + Expect.behavior(downloadString(read.append))
+            + 0)
+
+        self.expectOutcome(
+            result=SUCCESS,
+            state_string="downloading to {0}".format(
+                os.path.basename(self.destfile)))
+        return self.runStep()
+
+    def testArtifactStoreWorker3_3(self):
+        master_file = __file__
+        self.setupStep(
+            transfer.FileDownload(
+                mastersrc=master_file, workerdest=self.destfile),
+            worker_version={'*': '3.3'})
+        enableArtifactStore(self)
+
+        read = []
+        self.expectCommands(
+            Expect('downloadFile', dict(
+                workerdest=self.destfile, workdir='wkdir',
+                blocksize=16384, window=8, maxsize=None, mode=None,
+                reader=ExpectRemoteRef(remotetransfer.FileReader)))
+            + Expect.behavior(downloadString(read.append))
+            + 0)
+
+        self.expectOutcome(
+            result=SUCCESS,
+            state_string="downloading to {0}".format(
+                os.path.basename(self.destfile)))
+        return self.runStep()
+
+    def testBasicWorker3_1(self):
+        # workers older than 3.2 do not support windowed transfers
+        master_file = __file__
+        self.setupStep(
+            transfer.FileDownload(
+                mastersrc=master_file, workerdest=self.destfile),
+            worker_version={'*': '3.1'})
+
+        # A place to store what gets read
+        read = []
+
+        self.expectCommands(
+            Expect('downloadFile', dict(
+                workerdest=self.destfile, workdir='wkdir',
+                blocksize=16384, maxsize=None, mode=None,
+                reader=ExpectRemoteRef(remotetransfer.FileReader)))
+            + Expect.behavior(downloadString(read.append))
+            + 0)
+
+        self.expectOutcome(
+            result=SUCCESS,
+            state_string="downloading to {0}".format(
+                os.path.basename(self.destfile)))
+        return self.runStep()
+
 
 class TestStringDownload(steps.BuildStepMixin, unittest.TestCase):
 
@@ -992,7 +1385,7 @@ class TestStringDownload(steps.BuildStepMixin, unittest.TestCase):
         self.expectCommands(
             Expect('downloadFile', dict(
                 workerdest="hello.txt", workdir='wkdir',
-                blocksize=16384, maxsize=None, mode=None,
+                blocksize=16384, window=8, maxsize=None, mode=None,
                 reader=ExpectRemoteRef(remotetransfer.StringFileReader)))
             + Expect.behavior(downloadString(read.append))
             + 0)
@@ -1040,7 +1433,7 @@ class TestStringDownload(steps.BuildStepMixin, unittest.TestCase):
         self.expectCommands(
             Expect('downloadFile', dict(
                 workerdest="hello.txt", workdir='wkdir',
-                blocksize=16384, maxsize=None, mode=None,
+                blocksize=16384, window=8, maxsize=None, mode=None,
                 reader=ExpectRemoteRef(remotetransfer.StringFileReader)))
             + 1)
 
@@ -1108,7 +1501,7 @@ class TestJSONStringDownload(steps.BuildStepMixin, unittest.TestCase):
         self.expectCommands(
             Expect('downloadFile', dict(
                 workerdest="hello.json", workdir='wkdir',
-                blocksize=16384, maxsize=None, mode=None,
+                blocksize=16384, window=8, maxsize=None, mode=None,
                 reader=ExpectRemoteRef(remotetransfer.StringFileReader))
             )
             + Expect.behavior(downloadString(read.append))
@@ -1130,7 +1523,7 @@ class TestJSONStringDownload(steps.BuildStepMixin, unittest.TestCase):
         self.expectCommands(
             Expect('downloadFile', dict(
                 workerdest="hello.json", workdir='wkdir',
-                blocksize=16384, maxsize=None, mode=None,
+                blocksize=16384, window=8, maxsize=None, mode=None,
                 reader=ExpectRemoteRef(remotetransfer.StringFileReader)))
             + 1)
 
@@ -16,6 +16,11 @@
 from __future__ import absolute_import
 from __future__ import print_function
 
+import copy
+import datetime
+import json
+import pickle
+
 from twisted.trial import unittest
 
 from buildbot.util import bbcollections
@@ -72,3 +77,63 @@ class KeyedSets(unittest.TestCase):
 
     def test_pop_missing(self):
         self.assertEqual(self.ks.pop('flavors'), set())
+
+
+class Freeze(unittest.TestCase):
+
+    def test_freeze_nested(self):
+        when = datetime.datetime(2017, 1, 1)
+        obj = dict(a=[1, dict(b=2)], c=(3, [4]), d=when, e=u'x')
+        frozen = bbcollections.freeze(obj)
+        self.assertEqual(frozen, obj)
+        self.assertIsInstance(frozen, bbcollections.ReadOnlyDict)
+        self.assertIsInstance(frozen['a'], bbcollections.ReadOnlyList)
+        self.assertIsInstance(frozen['a'][1], bbcollections.ReadOnlyDict)
+        self.assertIsInstance(frozen['c'][1], bbcollections.ReadOnlyList)
+        self.assertIdentical(frozen['d'], when)
+
+    def test_freeze_frozen(self):
+        frozen = bbcollections.freeze(dict(a=[1]))
+        self.assertIdentical(bbcollections.freeze(frozen), frozen)
+        refrozen = bbcollections.freeze(dict(x=frozen))
+        self.assertIdentical(refrozen['x'], frozen)
+
+    def test_dict_readonly(self):
+        d = bbcollections.freeze(dict(a=1))
+        self.assertRaises(TypeError, d.__setitem__, 'a', 2)
+        self.assertRaises(TypeError, d.__delitem__, 'a')
+        self.assertRaises(TypeError, d.update, dict(b=2))
+        self.assertRaises(TypeError, d.setdefault, 'b', 2)
+        self.assertRaises(TypeError, d.pop, 'a')
+        self.assertRaises(TypeError, d.popitem)
+        self.assertRaises(TypeError, d.clear)
+        self.assertEqual(d, dict(a=1))
+
+    def test_list_readonly(self):
+        l = bbcollections.freeze([1, 2])
+        self.assertRaises(TypeError, l.__setitem__, 0, 2)
+        self.assertRaises(TypeError, l.__delitem__, 0)
+        self.assertRaises(TypeError, l.append, 3)
+        self.assertRaises(TypeError, l.extend, [3])
+        self.assertRaises(TypeError, l.insert, 0, 3)
+        self.assertRaises(TypeError, l.pop)
+        self.assertRaises(TypeError, l.remove, 1)
+        self.assertRaises(TypeError, l.sort)
+        self.assertRaises(TypeError, l.reverse)
+        self.assertEqual(l, [1, 2])
+
+    def test_copies_are_mutable(self):
+        frozen = bbcollections.freeze(dict(a=[1]))
+        for c in (dict(frozen), frozen.copy(), copy.copy(frozen),
+                  copy.deepcopy(frozen)):
+            c['b'] = 2
+        deep = copy.deepcopy(frozen)
+        deep['a'].append(2)
+        self.assertEqual(frozen, dict(a=[1]))
+
+    def test_serialization(self):
+        frozen = bbcollections.freeze(dict(a=[1, dict(b=2)]))
+        self.assertEqual(json.loads(json.dumps(frozen)), dict(a=[1, dict(b=2)]))
+        unpickled = pickle.loads(pickle.dumps(frozen))
+        self.assertEqual(unpickled, dict(a=[1, dict(b=2)]))
+        unpickled['c'] = 3
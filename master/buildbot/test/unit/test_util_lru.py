@@ -589,3 +589,63 @@ class AsyncLRUCacheTest(unittest.TestCase):
         self.assertEqual((yield self.lru.get('p')), short('p'))
         self.lru.put('p', set(['P2P2']))
         self.assertEqual((yield self.lru.get('p')), set(['P2P2']))
+
+
+class SizedLRUCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.lru = lru.SizedLRUCache(10)
+
+    def test_get_miss(self):
+        self.assertEqual(self.lru.get('a'), None)
+        self.assertEqual((self.lru.hits, self.lru.misses), (0, 1))
+
+    def test_put_get(self):
+        self.lru.put('a', 'aaa')
+        self.assertEqual(self.lru.get('a'), 'aaa')
+        self.assertEqual((self.lru.hits, self.lru.misses), (1, 0))
+        self.assertEqual(self.lru.size, 3)
+
+    def test_put_explicit_size(self):
+        self.lru.put('a', 'a', size=6)
+        self.lru.put('b', 'b', size=6)
+        self.assertEqual(self.lru.keys(), ['b'])
+        self.assertEqual(self.lru.size, 6)
+
+    def test_put_replace(self):
+        self.lru.put('a', 'aaa')
+        self.lru.put('a', 'aaaaa')
+        self.assertEqual(self.lru.get('a'), 'aaaaa')
+        self.assertEqual(self.lru.size, 5)
+
+    def test_put_too_big(self):
+        self.lru.put('a', 'aaa')
+        self.lru.put('b', 'b' * 11)
+        self.assertEqual(self.lru.keys(), ['a'])
+
+    def test_lru_expulsion(self):
+        for k in 'abc':
+            self.lru.put(k, k * 3)
+        # touch 'a', so that 'b' is the least recently used
+        self.lru.get('a')
+        self.lru.put('d', 'ddd')
+        self.assertEqual(sorted(self.lru.keys()), ['a', 'c', 'd'])
+        self.assertEqual(self.lru.size, 9)
+
+    def test_remove(self):
+        self.lru.put('a', 'aaa')
+        self.lru.remove('a')
+        self.lru.remove('b')
+        self.assertEqual((self.lru.keys(), self.lru.size), ([], 0))
+
+    def test_clear(self):
+        self.lru.put('a', 'aaa')
+        self.lru.put('b', 'bbb')
+        self.lru.clear()
+        self.assertEqual((self.lru.keys(), self.lru.size), ([], 0))
+
+    def test_set_max_size(self):
+        for k in 'abc':
+            self.lru.put(k, k * 3)
+        self.lru.set_max_size(4)
+        self.assertEqual(self.lru.keys(), ['c'])
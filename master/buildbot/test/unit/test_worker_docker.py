@@ -227,6 +227,17 @@ class TestDockerLatentWorker(unittest.SynchronousTestCase):
         id, name = self.successResultOf(bs.start_instance(self.build))
         self.assertEqual(name, 'customworker')
 
+    def test_prewarm_image_renderable(self):
+        bs = self.setupWorker(
+            'bot', 'pass', 'tcp://1234:2375',
+            Interpolate('busybox%(prop:tag:~)s'), ['bin/bash'])
+        d = bs.prewarm(idle_timeout=30)
+        # the container is started, without build properties
+        self.assertEqual(bs.instance['image'], 'busybox')
+        self.assertNoResult(d)
+        # the fake docker client does not remember the container
+        bs.instance = None
+
 
 class testDockerPyStreamLogs(unittest.TestCase):
 
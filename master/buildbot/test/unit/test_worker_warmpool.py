@@ -0,0 +1,202 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import mock
+
+from twisted.internet import defer
+from twisted.internet import task
+from twisted.trial import unittest
+from zope.interface import implementer
+
+from buildbot import interfaces
+from buildbot.test.fake import fakedb
+from buildbot.test.fake import fakemaster
+from buildbot.worker import warmpool
+
+
+@implementer(interfaces.ILatentWorker)
+class FakeLatentWorker(object):
+
+    def __init__(self, name, state='cold'):
+        self.name = name
+        self.running = True
+        self.building = set(['wfb']) if state == 'building' else set()
+        self.insubstantiating = state == 'insubstantiating'
+        self.substantiated = state == 'substantiated'
+        self.substantiating = state == 'substantiating'
+        self.prewarmed = []
+
+    def prewarm(self, idle_timeout):
+        self.prewarmed.append(idle_timeout)
+        return defer.succeed(True)
+
+
+class TestPlanPrewarm(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = warmpool.LatentWorkerWarmPool()
+
+    def plan(self, states, demand=None, minIdle=0, maxTotal=None):
+        workers = [FakeLatentWorker('w%d' % i, state)
+                   for i, state in enumerate(states)]
+        return [w.name for w in self.pool.planPrewarm(
+            workers, demand or [], minIdle, maxTotal)]
+
+    def test_nothing_to_do(self):
+        self.assertEqual(self.plan(['cold', 'cold']), [])
+
+    def test_min_idle(self):
+        self.assertEqual(self.plan(['cold', 'cold', 'cold'], minIdle=2),
+                         ['w0', 'w1'])
+
+    def test_min_idle_counts_ready_workers(self):
+        self.assertEqual(
+            self.plan(['substantiated', 'substantiating', 'building', 'cold',
+                       'cold'], minIdle=3),
+            ['w3'])
+
+    def test_min_idle_skips_unavailable_workers(self):
+        self.assertEqual(
+            self.plan(['insubstantiating', 'building', 'cold'], minIdle=1),
+            ['w2'])
+
+    def test_demand(self):
+        self.assertEqual(
+            self.plan(['cold', 'cold', 'cold', 'cold'],
+                      demand=[(2, ['w2', 'w3']), (1, ['w0'])]),
+            ['w2', 'w3', 'w0'])
+
+    def test_demand_counts_ready_workers(self):
+        self.assertEqual(
+            self.plan(['substantiated', 'cold', 'cold'],
+                      demand=[(2, ['w0', 'w1', 'w2'])]),
+            ['w1'])
+
+    def test_demand_shared_worker(self):
+        # w0 is warmed for the first builder, and is then considered ready
+        # for the second one
+        self.assertEqual(
+            self.plan(['cold', 'cold'],
+                      demand=[(1, ['w0']), (1, ['w0', 'w1'])]),
+            ['w0'])
+
+    def test_demand_and_min_idle(self):
+        self.assertEqual(
+            self.plan(['cold', 'cold', 'cold'], demand=[(1, ['w2'])],
+                      minIdle=2),
+            ['w2', 'w0'])
+
+    def test_max_total(self):
+        self.assertEqual(
+            self.plan(['building', 'substantiated', 'cold', 'cold', 'cold'],
+                      demand=[(2, ['w3', 'w4'])], minIdle=4, maxTotal=3),
+            ['w3'])
+
+    def test_max_total_reached(self):
+        self.assertEqual(
+            self.plan(['building', 'building', 'cold'], minIdle=1,
+                      maxTotal=2),
+            [])
+
+    def test_stopped_worker(self):
+        workers = [FakeLatentWorker('w0'), FakeLatentWorker('w1')]
+        workers[0].running = False
+        self.assertEqual(
+            self.pool.planPrewarm(workers, [], 1, None), [workers[1]])
+
+
+class TestLatentWorkerWarmPool(unittest.TestCase):
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        self.master = fakemaster.make_master(testcase=self, wantData=True)
+        self.master.reactor = task.Clock()
+        self.pool = warmpool.LatentWorkerWarmPool()
+        yield self.pool.setServiceParent(self.master)
+        yield self.master.db.insertTestData([
+            fakedb.Buildset(id=11, reason='because'),
+            fakedb.Builder(id=77, name='bldr1'),
+            fakedb.Builder(id=78, name='bldr2'),
+            fakedb.BuildRequest(id=111, builderid=77, buildsetid=11),
+            fakedb.BuildRequest(id=222, builderid=77, buildsetid=11),
+            fakedb.BuildRequest(id=333, builderid=78, buildsetid=11),
+        ])
+        self.workers = {}
+        for name in ['w1', 'w2', 'w3', 'w4']:
+            self.workers[name] = FakeLatentWorker(name)
+        self.master.workers.workers = self.workers
+        self.builders = [self.makeBuilder(77, ['w1', 'w2', 'other']),
+                         self.makeBuilder(78, ['w3'])]
+        self.master.botmaster.getBuilders = lambda: self.builders
+
+    def tearDown(self):
+        if self.pool.running:
+            return self.pool.stopService()
+
+    def makeBuilder(self, builderid, workernames):
+        bldr = mock.Mock()
+        bldr.config.workernames = workernames
+        bldr.getBuilderId = lambda: defer.succeed(builderid)
+        return bldr
+
+    def configure(self, **pool):
+        config = dict(workernames=['w1', 'w2', 'w3', 'w4'], minIdle=0,
+                      maxTotal=None, idleTimeout=600)
+        config.update(pool)
+        self.master.config.latentWarmPool = config
+
+    def assertPrewarmed(self, names):
+        self.assertEqual(sorted(name for name, w in self.workers.items()
+                                if w.prewarmed), names)
+
+    @defer.inlineCallbacks
+    def test_rebalance_not_configured(self):
+        yield self.pool.rebalance.fn(self.pool)
+        self.assertPrewarmed([])
+
+    @defer.inlineCallbacks
+    def test_rebalance_demand_from_data(self):
+        self.configure(idleTimeout=30)
+        yield self.pool.rebalance.fn(self.pool)
+        self.assertPrewarmed(['w1', 'w2', 'w3'])
+        self.assertEqual(self.workers['w1'].prewarmed, [30])
+
+    @defer.inlineCallbacks
+    def test_rebalance_demand_from_index(self):
+        self.configure(minIdle=2)
+        brIndex = self.master.botmaster.brIndex
+        yield brIndex.setServiceParent(self.master.botmaster)
+        yield self.master.db.buildrequests.claimBuildRequests([111, 222])
+        yield brIndex.resync.fn(brIndex)
+        yield self.pool.rebalance.fn(self.pool)
+        # only builder 78 has a demand; w1 is warmed to keep two idle workers
+        self.assertPrewarmed(['w1', 'w3'])
+
+    @defer.inlineCallbacks
+    def test_rebalance_unknown_worker(self):
+        self.configure(workernames=['w4', 'nosuch'], minIdle=2)
+        yield self.pool.rebalance.fn(self.pool)
+        self.assertPrewarmed(['w4'])
+
+    @defer.inlineCallbacks
+    def test_rebalance_poll(self):
+        self.configure(minIdle=1)
+        yield self.pool.startService()
+        self.assertPrewarmed([])
+        self.master.reactor.advance(self.pool.POLL_INTERVAL)
+        self.assertPrewarmed(['w1', 'w2', 'w3'])
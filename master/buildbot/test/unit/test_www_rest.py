@@ -343,6 +343,76 @@ class V2RootResource_REST(www.WwwTestMixin, unittest.TestCase):
             responseCode=200,
             headers={b"content-disposition": [b'attachment; filename=test.txt']})
 
+    @defer.inlineCallbacks
+    def test_raw_stream(self):
+        yield self.render_resource(self.rsrc, b'/rawstream')
+        self.assertRequest(
+            content=b''.join(l.encode() for l in endpoint.RawStreamTestsEndpoint.lines),
+            contentType=b'text/plain; charset=utf-8',
+            responseCode=200,
+            headers={b"content-disposition": [b'attachment; filename=stream.txt'],
+                     b"accept-ranges": [b'lines']})
+        self.assertEqual(self.request.producer, None)
+
+    @defer.inlineCallbacks
+    def test_raw_stream_range(self):
+        yield self.render_resource(self.rsrc, b'/rawstream',
+                                   extraHeaders={b'range': b'lines=1-3'})
+        self.assertRequest(
+            content=b'line 1\nline 2\nline 3\n',
+            responseCode=206,
+            headers={b"content-range": [b'lines 1-3/5']})
+
+    @defer.inlineCallbacks
+    def test_raw_stream_range_open(self):
+        yield self.render_resource(self.rsrc, b'/rawstream',
+                                   extraHeaders={b'range': b'lines=3-'})
+        self.assertRequest(
+            content=b'line 3\nline 4\n',
+            responseCode=206,
+            headers={b"content-range": [b'lines 3-4/5']})
+
+    @defer.inlineCallbacks
+    def test_raw_stream_range_unsatisfiable(self):
+        yield self.render_resource(self.rsrc, b'/rawstream',
+                                   extraHeaders={b'range': b'lines=7-9'})
+        self.assertRequest(
+            content=b'',
+            responseCode=416,
+            headers={b"content-range": [b'lines */5']})
+
+    @defer.inlineCallbacks
+    def test_raw_stream_range_malformed(self):
+        yield self.render_resource(self.rsrc, b'/rawstream',
+                                   extraHeaders={b'range': b'bytes=0-10'})
+        self.assertRequest(responseCode=200)
+        self.assertEqual(self.request.written.count(b'\n'), 5)
+
+    @defer.inlineCallbacks
+    def test_raw_stream_paused(self):
+        chunks = [defer.Deferred(), defer.succeed(u'b\n')]
+        request = self.make_request(b'/')
+        d = rest.RawChunksProducer(request, iter(chunks)).produce()
+        producer = request.producer
+        producer.pauseProducing()
+        chunks[0].callback(u'a\n')
+        # nothing more is written until the transport resumes us
+        self.assertEqual(request.written, b'a\n')
+        self.assertFalse(d.called)
+        producer.resumeProducing()
+        yield d
+        self.assertEqual(request.written, b'a\nb\n')
+        self.assertEqual(request.producer, None)
+
+    @defer.inlineCallbacks
+    def test_raw_stream_stopped(self):
+        chunks = [defer.succeed(u'a\n'), defer.succeed(u'b\n')]
+        request = self.make_request(b'/')
+        producer = rest.RawChunksProducer(request, iter(chunks))
+        producer.stopProducing()
+        yield producer.produce()
+        self.assertEqual(request.written, b'')
+
     @defer.inlineCallbacks
     def test_api_head(self):
         get = yield self.render_resource(self.rsrc, b'/test', method=b'GET')
@@ -0,0 +1,48 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import os
+import time
+
+from twisted.python import log
+from twisted.trial import unittest
+
+
+class BenchmarkTestCase(unittest.TestCase):
+
+    """
+    Base class for micro-benchmarks.  Test methods named C{test_benchmark_*}
+    are only run if C{BUILDBOT_BENCHMARK} is set in the environment, as they
+    take a while and their results are only meaningful on an idle machine.
+    """
+
+    def setUp(self):
+        if 'BUILDBOT_BENCHMARK' not in os.environ and \
+                self._testMethodName.startswith('test_benchmark'):
+            raise unittest.SkipTest("set BUILDBOT_BENCHMARK to run benchmarks")
+
+    def timeit(self, fn, *args, **kwargs):
+        """Call C{fn} and return the wall-clock time it took, in seconds"""
+        start = time.time()
+        fn(*args, **kwargs)
+        return time.time() - start
+
+    def report(self, name, value, unit):
+        msg = "%s: %s: %.1f %s" % (self.id(), name, value, unit)
+        log.msg(msg)
+        print(msg)
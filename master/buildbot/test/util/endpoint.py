@@ -92,6 +92,16 @@ class EndpointMixin(interfaces.InterfaceTests):
             return rv
         return d
 
+    def callStream(self, path, resultSpec=None):
+        self.assertIsInstance(path, tuple)
+        if resultSpec is None:
+            resultSpec = resultspec.ResultSpec()
+        endpoint, kwargs = self.matcher[path]
+        self.assertIdentical(endpoint, self.ep)
+        d = endpoint.stream(resultSpec, kwargs)
+        self.assertIsInstance(d, defer.Deferred)
+        return d
+
     def callControl(self, action, args, path):
         self.assertIsInstance(path, tuple)
         endpoint, kwargs = self.matcher[path]
@@ -15,7 +15,9 @@
 
 from __future__ import absolute_import
 from __future__ import print_function
+from future.utils import iteritems
 
+import copy
 # this is here for compatibility
 from collections import defaultdict
 
@@ -48,3 +50,99 @@ class KeyedSets:
         if key in self.d:
             return self.d.pop(key)
         return set()
+
+
+def _readonly(self, *args, **kwargs):
+    raise TypeError("%s is read-only" % (type(self).__name__,))
+
+
+class ReadOnlyDict(dict):
+
+    """
+    A dictionary which cannot be modified after it is created.  Copying it
+    (with C{dict(d)}, C{copy.copy} or C{copy.deepcopy}) gives a plain,
+    mutable dictionary.
+    """
+
+    __slots__ = ()
+
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def copy(self):
+        return dict(self)
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return dict((k, copy.deepcopy(v, memo)) for k, v in iteritems(self))
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+    def __repr__(self):
+        return "ReadOnlyDict(%s)" % (dict.__repr__(self),)
+
+
+class ReadOnlyList(list):
+
+    """
+    A list which cannot be modified after it is created.  Copying it gives a
+    plain, mutable list.
+    """
+
+    __slots__ = ()
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _readonly
+    append = extend = insert = pop = remove = reverse = sort = _readonly
+
+    # python2 only
+    __setslice__ = __delslice__ = _readonly
+
+    def __copy__(self):
+        return list(self)
+
+    def __deepcopy__(self, memo):
+        return [copy.deepcopy(v, memo) for v in self]
+
+    def __reduce__(self):
+        return (list, (list(self),))
+
+    def __repr__(self):
+        return "ReadOnlyList(%s)" % (list.__repr__(self),)
+
+
+def freeze(obj):
+    """
+    Return a read-only version of C{obj}, where plain dicts and lists are
+    replaced by L{ReadOnlyDict} and L{ReadOnlyList}.  Parts of C{obj} which
+    are already read-only are shared rather than copied, and other values
+    (strings, numbers, datetimes..) are never copied.
+    """
+    freezer = _freezers.get(type(obj))
+    if freezer is None:
+        return obj
+    return freezer(obj)
+
+
+def _freezeDict(obj):
+    rv = dict.__new__(ReadOnlyDict)
+    dict.update(rv, [(k, freeze(v) if type(v) in _containers else v)
+                     for k, v in iteritems(obj)])
+    return rv
+
+
+def _freezeList(obj):
+    rv = list.__new__(ReadOnlyList)
+    list.extend(rv, [freeze(v) if type(v) in _containers else v
+                     for v in obj])
+    return rv
+
+
+def _freezeTuple(obj):
+    return tuple([freeze(v) if type(v) in _containers else v for v in obj])
+
+
+_freezers = {dict: _freezeDict, list: _freezeList, tuple: _freezeTuple}
+_containers = frozenset(_freezers)
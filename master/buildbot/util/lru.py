@@ -17,6 +17,8 @@ from __future__ import absolute_import
 from __future__ import print_function
 from future.moves.itertools import filterfalse
 
+import threading
+from collections import OrderedDict
 from collections import defaultdict
 from collections import deque
 from weakref import WeakValueDictionary
@@ -235,5 +237,83 @@ class AsyncLRUCache(LRUCache):
         return d
 
 
+class SizedLRUCache(object):
+
+    """
+    A least-recently-used cache whose maximum size is the total size of the
+    cached values, rather than their number.  Unlike the other caches, there
+    is no miss function: callers check for a value and put it themselves.
+
+    All methods are thread-safe, so that the cache can be used from database
+    threads.
+    """
+
+    __slots__ = ('max_size size_fn size cache lock '
+                 'hits refhits misses'.split())
+
+    def __init__(self, max_size, size_fn=len):
+        self.max_size = max_size
+        self.size_fn = size_fn
+        self.size = 0
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.refhits = self.misses = 0
+
+    def get(self, key):
+        """Return the value for KEY, or None if it is not cached."""
+        with self.lock:
+            try:
+                value, size = self.cache.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self.cache[key] = value, size
+            self.hits += 1
+            return value
+
+    def put(self, key, value, size=None):
+        if size is None:
+            size = self.size_fn(value)
+        with self.lock:
+            self._remove(key)
+            # a value larger than the whole cache would evict everything else
+            if size > self.max_size:
+                return
+            self.cache[key] = value, size
+            self.size += size
+            self._purge()
+
+    def remove(self, key):
+        with self.lock:
+            self._remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+            self.size = 0
+
+    def keys(self):
+        with self.lock:
+            return list(self.cache)
+
+    def set_max_size(self, max_size):
+        with self.lock:
+            self.max_size = max_size
+            self._purge()
+
+    def _remove(self, key):
+        try:
+            _, size = self.cache.pop(key)
+        except KeyError:
+            return
+        self.size -= size
+
+    def _purge(self):
+        cache = self.cache
+        while self.size > self.max_size:
+            _, (_, size) = cache.popitem(last=False)
+            self.size -= size
+
+
 # for tests
 inv_failed = False
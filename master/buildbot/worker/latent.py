@@ -29,6 +29,8 @@ from zope.interface import implementer
 from buildbot.interfaces import ILatentWorker
 from buildbot.interfaces import LatentWorkerFailedToSubstantiate
 from buildbot.interfaces import LatentWorkerSubstantiatiationCancelled
+from buildbot.process import metrics
+from buildbot.process.properties import Properties
 from buildbot.util import Notifier
 from buildbot.worker.base import AbstractWorker
 
@@ -47,6 +49,8 @@ class AbstractLatentWorker(AbstractWorker):
     insubstantiating = False
     build_wait_timer = None
     start_missing_on_startup = False
+    # time at which the worker was pre-warmed, while it stays idle
+    warm_since = None
 
     def checkConfig(self, name, password,
                     build_wait_timeout=60 * 10,
@@ -97,7 +101,13 @@ class AbstractLatentWorker(AbstractWorker):
     def substantiated(self):
         return self.conn is not None
 
+    @property
+    def substantiating(self):
+        return bool(self._substantiation_notifier)
+
     def substantiate(self, wfb, build):
+        if build is not None:
+            self._logWarmPoolUse()
         if self.conn is not None:
             self._clearBuildWaitTimer()
             self._setBuildWaitTimer()
@@ -113,9 +123,60 @@ class AbstractLatentWorker(AbstractWorker):
             # else: we're waiting for an old one to detach.  the _substantiate
             # will be done in ``detached`` below.
             return d
+        if self.substantiation_build is None:
+            # the worker is being pre-warmed; this build now owns the
+            # substantiation
+            self.substantiation_build = build
         return self._substantiation_notifier.wait()
 
+    @defer.inlineCallbacks
+    def prewarm(self, idle_timeout):
+        """
+        Substantiate this worker ahead of demand, without a build.  If no
+        build starts on the worker within C{idle_timeout} seconds, it is
+        insubstantiated again.  C{start_instance} renders the worker
+        configuration from empty properties, since there is no build yet.
+
+        @returns: Deferred firing True once the worker is substantiated, or
+            False if it was not idle and insubstantiated
+        """
+        if (self.substantiated or self.substantiating or
+                self.insubstantiating or self.building):
+            defer.returnValue(False)
+        yield self.substantiate(None, None)
+        if not self.building:
+            self.warm_since = self.master.reactor.seconds()
+            self._setBuildWaitTimer(idle_timeout)
+        defer.returnValue(True)
+
+    def _inWarmPool(self):
+        pool = self.master.config.latentWarmPool
+        return pool is not None and self.name in pool['workernames']
+
+    def _logWarmPoolUse(self):
+        # called when a build wants this worker; it is a hit for the warm
+        # pool if the worker is already (being) substantiated
+        if self._inWarmPool():
+            if self.substantiated or self.substantiating:
+                metrics.MetricCountEvent.log('AbstractLatentWorker.warmPoolHits')
+            else:
+                metrics.MetricCountEvent.log(
+                    'AbstractLatentWorker.warmPoolMisses')
+        self._logWarmPoolIdleTime()
+
+    def _logWarmPoolIdleTime(self):
+        if self.warm_since is None:
+            return
+        idle = self.master.reactor.seconds() - self.warm_since
+        self.warm_since = None
+        metrics.MetricCountEvent.log('AbstractLatentWorker.warmPoolIdleSeconds',
+                                     idle)
+
     def _substantiate(self, build):
+        if build is None:
+            # pre-warming: start_instance renders its configuration without
+            # any build property
+            build = Properties()
         # register event trigger
         try:
             d = self.start_instance(build)
@@ -182,7 +243,7 @@ class AbstractLatentWorker(AbstractWorker):
         return self._substantiation_failed(defer.TimeoutError())
 
     def _substantiation_failed(self, failure):
-        if self.substantiation_build:
+        if self._substantiation_notifier:
             self.substantiation_build = None
             self._substantiation_notifier.notify(failure)
         d = self.insubstantiate()
@@ -232,17 +293,20 @@ class AbstractLatentWorker(AbstractWorker):
                 self.build_wait_timer.cancel()
             self.build_wait_timer = None
 
-    def _setBuildWaitTimer(self):
+    def _setBuildWaitTimer(self, timeout=None):
         self._clearBuildWaitTimer()
-        if self.build_wait_timeout <= 0:
+        if timeout is None:
+            timeout = self.build_wait_timeout
+        if timeout <= 0:
             return
         self.build_wait_timer = self.master.reactor.callLater(
-            self.build_wait_timeout, self._soft_disconnect)
+            timeout, self._soft_disconnect)
 
     @defer.inlineCallbacks
     def insubstantiate(self, fast=False):
         self.insubstantiating = True
         self._clearBuildWaitTimer()
+        self._logWarmPoolIdleTime()
         d = self.stop_instance(fast)
         try:
             yield d
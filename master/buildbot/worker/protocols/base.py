@@ -101,6 +101,9 @@ class FileWriterImpl(object):
     def remote_unpack(self):
         raise NotImplementedError
 
+    def remote_useStored(self, digest):
+        raise NotImplementedError
+
     def remote_close(self):
         raise NotImplementedError
 
@@ -0,0 +1,168 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+from collections import Counter
+
+from twisted.internet import defer
+from twisted.python import log
+
+from buildbot import interfaces
+from buildbot.data import resultspec
+from buildbot.process import metrics
+from buildbot.util import poll
+from buildbot.util import service
+
+
+class LatentWorkerWarmPool(service.AsyncService):
+
+    """
+    Keeps some latent workers substantiated ahead of demand, as configured by
+    C{c['latentWarmPool']}.
+
+    Each time the pool is rebalanced, it forecasts how many of its workers
+    each builder will soon need from the builder's unclaimed build requests,
+    adds C{minIdle} spare workers, and pre-warms cold workers to reach that
+    number without having more than C{maxTotal} of them substantiated.  A
+    pre-warmed worker is insubstantiated again if it stays idle for
+    C{idleTimeout} seconds.
+
+    The botmaster rebalances the pool on build request events and
+    reconfigurations; it is also rebalanced every C{POLL_INTERVAL} seconds.
+    """
+
+    POLL_INTERVAL = 60
+
+    def startService(self):
+        service.AsyncService.startService(self)
+        self.rebalance._reactor = self.master.reactor
+        self.rebalance.start(interval=self.POLL_INTERVAL, now=False)
+
+    @defer.inlineCallbacks
+    def stopService(self):
+        yield service.AsyncService.stopService(self)
+        yield self.rebalance.stop()
+
+    @poll.method
+    @defer.inlineCallbacks
+    def rebalance(self):
+        config = self.master.config.latentWarmPool
+        if config is None:
+            return
+        workers = self._getWorkers(config['workernames'])
+        if not workers:
+            return
+
+        timer = metrics.Timer("LatentWorkerWarmPool.rebalance")
+        timer._reactor = self.master.reactor
+        timer.start()
+        demand = yield self._forecastDemand(workers)
+        toWarm = self.planPrewarm(workers, demand, config['minIdle'],
+                                  config['maxTotal'])
+        for worker in toWarm:
+            log.msg("pre-warming latent worker %s" % (worker.name,))
+            d = worker.prewarm(config['idleTimeout'])
+            d.addErrback(log.err, 'while pre-warming latent worker %s'
+                         % (worker.name,))
+        timer.stop()
+
+    def _getWorkers(self, workernames):
+        workers = self.master.workers.workers
+        return [workers[name] for name in workernames
+                if name in workers and
+                interfaces.ILatentWorker.providedBy(workers[name])]
+
+    @defer.inlineCallbacks
+    def _forecastDemand(self, workers):
+        """
+        Get the demand on the pool workers
+
+        @returns: list of (number of unclaimed requests, names of the pool
+            workers able to run them), one per builder with a demand
+        """
+        names = set(w.name for w in workers)
+        brIndex = self.master.botmaster.brIndex
+        counts = None
+        if not brIndex.synced:
+            brdicts = yield self.master.data.get(
+                ('buildrequests',),
+                [resultspec.Filter('claimed', 'eq', [False])])
+            counts = Counter(brdict['builderid'] for brdict in brdicts)
+
+        demand = []
+        for builder in self.master.botmaster.getBuilders():
+            if builder.config is None:
+                continue
+            served = [n for n in builder.config.workernames if n in names]
+            if not served:
+                continue
+            builderid = yield builder.getBuilderId()
+            if counts is None:
+                count = len(brIndex.getUnclaimedBuildRequests(builderid))
+            else:
+                count = counts[builderid]
+            if count:
+                demand.append((count, served))
+        defer.returnValue(demand)
+
+    def planPrewarm(self, workers, demand, minIdle, maxTotal):
+        """
+        Choose the workers to pre-warm
+
+        @param workers: the pool workers, in order of preference
+        @param demand: the demand, as returned by L{_forecastDemand}
+        @param minIdle: the number of idle substantiated workers to keep
+        @param maxTotal: the maximum number of substantiated workers, or None
+        @returns: list of workers
+        """
+        active = set()
+        ready = set()
+        cold = []
+        for w in workers:
+            if w.building or w.insubstantiating:
+                active.add(w.name)
+            elif w.substantiated or w.substantiating:
+                active.add(w.name)
+                ready.add(w.name)
+            elif w.running:
+                cold.append(w.name)
+
+        # a ready worker counts towards the demand of all the builders it
+        # serves, so the forecast errs on the side of warming fewer workers
+        chosen = []
+        coldNames = set(cold)
+        for count, served in demand:
+            missing = count - len(ready.intersection(served))
+            for name in served:
+                if missing <= 0:
+                    break
+                if name in coldNames and name not in ready:
+                    chosen.append(name)
+                    ready.add(name)
+                    missing -= 1
+
+        for name in cold:
+            if len(ready) >= minIdle:
+                break
+            if name not in ready:
+                chosen.append(name)
+                ready.add(name)
+
+        if maxTotal is not None:
+            chosen = chosen[:max(0, maxTotal - len(active))]
+        byName = dict((w.name, w) for w in workers)
+        return [byName[name] for name in chosen]
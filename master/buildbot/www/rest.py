@@ -27,8 +27,10 @@ import re
 from contextlib import contextmanager
 
 from twisted.internet import defer
+from twisted.internet import interfaces
 from twisted.python import log
 from twisted.web.error import Error
+from zope.interface import implementer
 
 from buildbot.data import exceptions
 from buildbot.data import resultspec
@@ -51,6 +53,48 @@ class BadJsonRpc2(Exception):
         self.jsonrpccode = jsonrpccode
 
 
+@implementer(interfaces.IPushProducer)
+class RawChunksProducer(object):
+
+    """Write the chunks of a streamed raw endpoint to a request, one at a
+    time, pausing whenever the transport asks us to."""
+
+    def __init__(self, request, chunks):
+        self.request = request
+        self.chunks = chunks
+        self.stopped = False
+        self._resumed = None
+
+    @defer.inlineCallbacks
+    def produce(self):
+        self.request.registerProducer(self, True)
+        try:
+            for d in self.chunks:
+                content = yield d
+                if self.stopped:
+                    break
+                self.request.write(content.encode('utf-8'))
+                if self._resumed is not None:
+                    yield self._resumed
+                if self.stopped:
+                    break
+        finally:
+            self.request.unregisterProducer()
+
+    def pauseProducing(self):
+        if self._resumed is None:
+            self._resumed = defer.Deferred()
+
+    def resumeProducing(self):
+        d, self._resumed = self._resumed, None
+        if d is not None:
+            d.callback(None)
+
+    def stopProducing(self):
+        self.stopped = True
+        self.resumeProducing()
+
+
 class ContentTypeParser(object):
 
     def __init__(self, contenttype):
@@ -354,13 +398,48 @@ class V2RootResource(resource.Resource):
 
         return rspec
 
-    def encodeRaw(self, data, request):
+    rangeRe = re.compile(r'^lines=(\d+)-(\d*)$')
+
+    def decodeRange(self, request, rspec):
+        # support 'Range: lines=first-[last]' on raw endpoints; as per the
+        # HTTP specification, malformed ranges are simply ignored
+        header = request.getHeader(b'range')
+        if header is None:
+            return False
+        mo = self.rangeRe.match(bytes2NativeString(header).strip())
+        if not mo:
+            return False
+        first = int(mo.group(1))
+        last = int(mo.group(2)) if mo.group(2) else None
+        if last is not None and last < first:
+            return False
+        rspec.offset = first
+        rspec.limit = None if last is None else last - first + 1
+        return True
+
+    def encodeRaw(self, data, request, ranged=False):
         request.setHeader(b"content-type",
                           data['mime-type'].encode() + b'; charset=utf-8')
         request.setHeader(b"content-disposition",
                           b'attachment; filename=' + data['filename'].encode())
-        request.write(data['raw'].encode('utf-8'))
-        return
+        if 'chunks' not in data:
+            request.write(data['raw'].encode('utf-8'))
+            return
+
+        request.setHeader(b"accept-ranges", b"lines")
+        if ranged:
+            if data['firstline'] >= data['num_lines']:
+                request.setResponseCode(416)
+                request.setHeader(b"content-range", unicode2bytes(
+                    "lines */%d" % (data['num_lines'],)))
+                return
+            request.setResponseCode(206)
+            request.setHeader(b"content-range", unicode2bytes(
+                "lines %d-%d/%d" % (data['firstline'], data['lastline'],
+                                    data['num_lines'])))
+        if request.method == b"HEAD":
+            return
+        return RawChunksProducer(request, data['chunks']).produce()
 
     @defer.inlineCallbacks
     def renderRest(self, request):
@@ -378,7 +457,11 @@ class V2RootResource(resource.Resource):
             ep, kwargs = yield self.getEndpoint(request, bytes2NativeString(request.method), {})
 
             rspec = self.decodeResultSpec(request, ep)
-            data = yield ep.get(rspec, kwargs)
+            if ep.isRaw:
+                ranged = self.decodeRange(request, rspec)
+                data = yield ep.stream(rspec, kwargs)
+            else:
+                data = yield ep.get(rspec, kwargs)
             if data is None:
                 msg = ("not found while getting from {} with "
                        "arguments {} and {}").format(repr(ep), repr(rspec),
@@ -388,7 +471,7 @@ class V2RootResource(resource.Resource):
                 return
 
             if ep.isRaw:
-                self.encodeRaw(data, request)
+                yield self.encodeRaw(data, request, ranged)
                 return
 
             # post-process any remaining parts of the resultspec
@@ -201,6 +201,7 @@ setup_args = {
         "buildbot.test",
         "buildbot.test.util",
         "buildbot.test.fake",
+        "buildbot.test.benchmark",
         "buildbot.test.fuzz",
         "buildbot.test.integration",
         "buildbot.test.regressions",
@@ -488,6 +489,8 @@ test_deps = [
     'txgithub',
     'ramlfications',
     'mock>=2.0.0',
+    # zstandard required for log compression tests.
+    'zstandard',
 ]
 if sys.platform != 'win32':
     test_deps += [
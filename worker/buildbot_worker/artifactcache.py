@@ -0,0 +1,157 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+def hashFile(path, blocksize=1024 * 1024):
+    """
+    Get the SHA-256 digest of the file at C{path}.  This blocks, so call it
+    from a thread.
+    """
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(blocksize)
+            if not data:
+                break
+            h.update(data)
+    return h.hexdigest()
+
+
+class ArtifactCache(object):
+
+    """
+    Copies of the files downloaded from a master whose artifact store is
+    enabled, kept under their SHA-256 digest in C{basedir}.  A file the master
+    sends again is copied from the cache instead of being transferred.
+
+    The least recently used files are removed once their total size exceeds
+    C{maxSize}.  The cache is used both from the reactor and from the threads
+    copying files, hence the lock.
+    """
+
+    def __init__(self, basedir, maxSize):
+        self.basedir = basedir
+        self.maxSize = maxSize
+        self.lock = threading.Lock()
+        # digest -> size, least recently used first; None until loaded
+        self.index = None
+        self.totalSize = 0
+
+    def _path(self, digest):
+        return os.path.join(self.basedir, digest)
+
+    def _load(self):
+        # called with the lock held
+        if self.index is not None:
+            return
+        entries = []
+        if os.path.isdir(self.basedir):
+            for name in os.listdir(self.basedir):
+                path = self._path(name)
+                if name.endswith('.tmp'):
+                    # left over by an interrupted copy
+                    os.unlink(path)
+                elif DIGEST_RE.match(name):
+                    st = os.stat(path)
+                    entries.append((st.st_mtime, name, st.st_size))
+        self.index = OrderedDict(
+            (digest, size) for _, digest, size in sorted(entries))
+        self.totalSize = sum(self.index.values())
+
+    def get(self, digest):
+        """
+        Look for a file in the cache, marking it as recently used
+
+        @returns: path of the cached file, or None
+        """
+        with self.lock:
+            self._load()
+            if digest not in self.index:
+                return None
+            path = self._path(digest)
+            try:
+                # the modification times order the files after a restart
+                os.utime(path, None)
+            except OSError:
+                # removed behind our back
+                self.totalSize -= self.index.pop(digest)
+                return None
+            self.index[digest] = self.index.pop(digest)
+            return path
+
+    def remove(self, digest):
+        with self.lock:
+            self._load()
+            if digest in self.index:
+                self.totalSize -= self.index.pop(digest)
+            if os.path.exists(self._path(digest)):
+                os.unlink(self._path(digest))
+
+    def add(self, digest, filename):
+        """
+        Copy a file into the cache, then remove the least recently used files
+        if the cache grew too large.  This blocks, so call it from a thread.
+
+        @param digest: SHA-256 digest of the file content
+        """
+        size = os.path.getsize(filename)
+        if not DIGEST_RE.match(digest) or size > self.maxSize:
+            return
+        with self.lock:
+            self._load()
+            if digest in self.index:
+                return
+
+        if not os.path.isdir(self.basedir):
+            os.makedirs(self.basedir)
+        fd, tmpname = tempfile.mkstemp(dir=self.basedir, suffix='.tmp')
+        os.close(fd)
+        try:
+            shutil.copyfile(filename, tmpname)
+            with self.lock:
+                path = self._path(digest)
+                # on windows, os.rename does not automatically unlink
+                if os.path.exists(path):
+                    os.unlink(path)
+                os.rename(tmpname, path)
+                if digest not in self.index:
+                    self.index[digest] = size
+                    self.totalSize += size
+                self._evict()
+        finally:
+            if os.path.exists(tmpname):
+                os.unlink(tmpname)
+
+    def _evict(self):
+        # called with the lock held
+        while self.totalSize > self.maxSize and self.index:
+            digest = next(iter(self.index))
+            self.totalSize -= self.index.pop(digest)
+            path = self._path(digest)
+            if os.path.exists(path):
+                os.unlink(path)
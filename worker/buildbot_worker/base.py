@@ -15,11 +15,13 @@
 
 from __future__ import absolute_import
 from __future__ import print_function
+from future.utils import text_type
 
 import multiprocessing
 import os.path
 import socket
 import sys
+from collections import deque
 
 from twisted.application import service
 from twisted.internet import defer
@@ -29,11 +31,29 @@ from twisted.spread import pb
 
 import buildbot_worker
 from buildbot_worker import monkeypatches
+from buildbot_worker.artifactcache import ArtifactCache
 from buildbot_worker.commands import base
 from buildbot_worker.commands import registry
 from buildbot_worker.compat import bytes2NativeString
 
 
+# the default size limit of the cache of the files downloaded from masters
+# having an artifact store, in bytes; 0 disables the cache
+DEFAULT_ARTIFACT_CACHE_SIZE = 1024 ** 3
+
+
+def _updateSize(data):
+    # approximate size of a status update, counting the strings it carries
+    size = 0
+    for value in data.values():
+        if isinstance(value, tuple):
+            # {'log': (logname, data)}
+            value = value[-1]
+        if isinstance(value, (bytes, text_type)):
+            size += len(value)
+    return size
+
+
 class UnknownCommand(pb.Error):
     pass
 
@@ -62,9 +82,25 @@ class WorkerForBuilderBase(service.Service):
 
     bf = None
 
+    # the bot's ArtifactCache, or None
+    artifactCache = None
+
+    # number of update calls kept in flight; the updates queued in the
+    # meantime are packed into the next call
+    UPDATE_WINDOW = 2
+    # approximate size, in bytes, of the updates packed into one call
+    MAX_UPDATE_BATCH_SIZE = 512 * 1024
+    # approximate size of the queued updates beyond which they are sent
+    # whatever the number of calls in flight
+    MAX_QUEUED_UPDATE_SIZE = 4 * 1024 * 1024
+
     def __init__(self, name):
         # service.Service.__init__(self) # Service has no __init__ method
         self.setName(name)
+        # (remoteStep, update, size) of the updates not sent yet
+        self._updateQueue = deque()
+        self._queuedUpdateSize = 0
+        self._updatesInFlight = 0
 
     def __repr__(self):
         return "<WorkerForBuilder '%s' at %d>" % (self.name, id(self))
@@ -113,6 +149,9 @@ class WorkerForBuilderBase(service.Service):
     def lostRemoteStep(self, remotestep):
         log.msg("lost remote step")
         self.remoteStep = None
+        self._updateQueue = deque(u for u in self._updateQueue
+                                  if u[0] is not remotestep)
+        self._queuedUpdateSize = sum(u[2] for u in self._updateQueue)
         if self.stopCommandOnShutdown:
             self.stopCommand()
 
@@ -177,25 +216,57 @@ class WorkerForBuilderBase(service.Service):
     # sendUpdate is invoked by the Commands we spawn
     def sendUpdate(self, data):
         """This sends the status update to the master-side
-        L{buildbot.process.step.RemoteCommand} object, giving it a sequence
-        number in the process. It adds the update to a queue, and asks the
-        master to acknowledge the update so it can be removed from that
-        queue."""
+        L{buildbot.process.step.RemoteCommand} object. It adds the update to
+        a queue, which is sent right away unless UPDATE_WINDOW update calls
+        are waiting for the master's answer. The updates queued meanwhile are
+        then sent together, in order, in the next call."""
 
         if not self.running:
             # .running comes from service.Service, and says whether the
             # service is running or not. If we aren't running, don't send any
             # status messages.
             return
-        # the update[1]=0 comes from the leftover 'updateNum', which the
-        # master still expects to receive. Provide it to avoid significant
-        # interoperability issues between new workers and old masters.
         if self.remoteStep:
-            update = [data, 0]
-            updates = [update]
-            d = self.remoteStep.callRemote("update", updates)
-            d.addCallback(self.ackUpdate)
-            d.addErrback(self._ackFailed, "WorkerForBuilder.sendUpdate")
+            size = _updateSize(data)
+            self._updateQueue.append((self.remoteStep, data, size))
+            self._queuedUpdateSize += size
+            self._flushUpdates()
+
+    def _flushUpdates(self, force=False):
+        while self._updateQueue and (
+                force or self._updatesInFlight < self.UPDATE_WINDOW or
+                self._queuedUpdateSize > self.MAX_QUEUED_UPDATE_SIZE):
+            self._sendUpdateBatch()
+
+    def _sendUpdateBatch(self):
+        # the batch is removed from the queue before being sent, so that
+        # answers arriving synchronously can send the next one in order
+        remoteStep = self._updateQueue[0][0]
+        updates = []
+        batchSize = 0
+        while self._updateQueue:
+            step, data, size = self._updateQueue[0]
+            if step is not remoteStep or (
+                    updates and
+                    batchSize + size > self.MAX_UPDATE_BATCH_SIZE):
+                break
+            self._updateQueue.popleft()
+            self._queuedUpdateSize -= size
+            batchSize += size
+            # the update[1]=0 comes from the leftover 'updateNum', which the
+            # master still expects to receive. Provide it to avoid significant
+            # interoperability issues between new workers and old masters.
+            updates.append([data, 0])
+
+        self._updatesInFlight += 1
+        d = remoteStep.callRemote("update", updates)
+        d.addCallback(self.ackUpdate)
+        d.addErrback(self._ackFailed, "WorkerForBuilder.sendUpdate")
+        d.addBoth(self._updateBatchDone)
+
+    def _updateBatchDone(self, res):
+        self._updatesInFlight -= 1
+        self._flushUpdates()
 
     def ackUpdate(self, acknum):
         self.activity()  # update the "last activity" timer
@@ -224,6 +295,8 @@ class WorkerForBuilderBase(service.Service):
             log.msg(" but we weren't running, quitting silently")
             return
         if self.remoteStep:
+            # the master gets all the updates before the completion
+            self._flushUpdates(force=True)
             self.remoteStep.dontNotifyOnDisconnect(self.lostRemoteStep)
             d = self.remoteStep.callRemote("complete", failure)
             d.addCallback(self.ackComplete)
@@ -237,13 +310,19 @@ class BotBase(service.MultiService):
     name = "bot"
     WorkerForBuilder = WorkerForBuilderBase
 
-    def __init__(self, basedir, unicode_encoding=None):
+    def __init__(self, basedir, unicode_encoding=None,
+                 artifact_cache_size=DEFAULT_ARTIFACT_CACHE_SIZE):
         service.MultiService.__init__(self)
         self.basedir = basedir
         self.numcpus = None
         self.unicode_encoding = unicode_encoding or sys.getfilesystemencoding(
         ) or 'ascii'
         self.builders = {}
+        self.artifactCache = None
+        if artifact_cache_size:
+            self.artifactCache = ArtifactCache(
+                os.path.join(bytes2NativeString(basedir), 'artifact-cache'),
+                artifact_cache_size)
 
     def startService(self):
         assert os.path.isdir(self.basedir)
@@ -262,6 +341,7 @@ class BotBase(service.MultiService):
         wanted_names = set([name for (name, builddir) in wanted])
         wanted_dirs = set([builddir for (name, builddir) in wanted])
         wanted_dirs.add('info')
+        wanted_dirs.add('artifact-cache')
         for (name, builddir) in wanted:
             b = self.builders.get(name, None)
             if b:
@@ -272,6 +352,7 @@ class BotBase(service.MultiService):
             else:
                 b = self.WorkerForBuilder(name)
                 b.unicode_encoding = self.unicode_encoding
+                b.artifactCache = self.artifactCache
                 b.setServiceParent(self)
                 b.setBuilddir(builddir)
                 self.builders[name] = b
@@ -351,11 +432,13 @@ class WorkerBase(service.MultiService):
 
     def __init__(self, name, basedir,
                  umask=None,
-                 unicode_encoding=None):
+                 unicode_encoding=None,
+                 artifact_cache_size=DEFAULT_ARTIFACT_CACHE_SIZE):
 
         service.MultiService.__init__(self)
         self.name = name
-        bot = self.Bot(basedir, unicode_encoding=unicode_encoding)
+        bot = self.Bot(basedir, unicode_encoding=unicode_encoding,
+                       artifact_cache_size=artifact_cache_size)
         bot.setServiceParent(self)
         self.bot = bot
         self.umask = umask
@@ -28,7 +28,7 @@ from buildbot_worker.interfaces import IWorkerCommand
 # this used to be a CVS $-style "Revision" auto-updated keyword, but since I
 # moved to Darcs as the primary repository, this is updated manually each
 # time this file is changed. The last cvs_ver that was here was 1.51 .
-command_version = "3.1"
+command_version = "3.4"
 
 # version history:
 #  >=1.17: commands are interruptable
@@ -72,6 +72,13 @@ command_version = "3.1"
 #    * "slavedest" command argument renamed to "workerdest" in downloadFile
 #      command.
 #  >= 3.1: rmfile command added to remove a file
+#  >= 3.2: uploadFile, uploadDirectory and downloadFile accept a 'window'
+#    argument to keep several data blocks in flight
+#  >= 3.3: stat accepts a 'files' argument to stat several files at once, and
+#    uploadDirectory a 'files' argument to only archive the given files
+#  >= 3.4: uploadFile accepts a 'contentHash' argument to send the digest of
+#    the file before its content, and downloadFile a 'sha256' argument to
+#    copy the file from the worker's artifact cache
 
 
 @implementer(IWorkerCommand)
@@ -207,6 +207,9 @@ class StatFile(base.Command):
     requireArgs = ['file']
 
     def start(self):
+        if 'files' in self.args:
+            return self.statFiles(self.args['files'])
+
         filename = os.path.join(
             self.builder.basedir, self.args.get('workdir', ''), self.args['file'])
 
@@ -220,6 +223,21 @@ class StatFile(base.Command):
                 {'header': '%s: %s: %s' % (self.header, e.strerror, filename)})
             self.sendStatus({'rc': e.errno})
 
+    def statFiles(self, files):
+        # stat several files at once; the ones which cannot be stat'ed get
+        # None
+        stats = []
+        for f in files:
+            filename = os.path.join(
+                self.builder.basedir, self.args.get('workdir', ''), f)
+            try:
+                stats.append(tuple(os.stat(filename)))
+            except OSError as e:
+                log.msg("StatFile %s failed" % filename, e)
+                stats.append(None)
+        self.sendStatus({'stats': stats})
+        self.sendStatus({'rc': 0})
+
 
 class GlobPath(base.Command):
 
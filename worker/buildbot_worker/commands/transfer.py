@@ -16,18 +16,32 @@
 from __future__ import absolute_import
 from __future__ import print_function
 
+import hashlib
 import os
 import tarfile
-import tempfile
+import threading
+from collections import deque
 
 from twisted.internet import defer
+from twisted.internet import threads
+from twisted.python import failure
 from twisted.python import log
 
+from buildbot_worker.artifactcache import hashFile
 from buildbot_worker.commands.base import Command
 
 
 class TransferCommand(Command):
 
+    # the largest number of blocks kept in flight, whatever the master asks
+    MAX_WINDOW = 64
+
+    def _getWindow(self, args):
+        # masters which do not know about windowed transfers do not send a
+        # window, and get one block per round trip
+        window = args.get('window') or 1
+        return max(1, min(window, self.MAX_WINDOW))
+
     def finished(self, res):
         if self.debug:
             log.msg('finished: stderr=%r, rc=%r' % (self.stderr, self.rc))
@@ -51,6 +65,78 @@ class TransferCommand(Command):
         # when it sees self.interrupted set.
 
 
+class ArchivePipe(object):
+
+    """
+    Carries an archive from the thread creating it to the reactor, holding at
+    most C{limit} bytes of it at once.
+    """
+
+    def __init__(self, reactor, limit):
+        self._reactor = reactor
+        self.limit = limit
+        self.cond = threading.Condition()
+        self.blocks = deque()
+        self.size = 0
+        self.done = False
+        self.failure = None
+        self.aborted = False
+        self.waiting = None
+
+    def write(self, data):
+        # called from the thread creating the archive
+        with self.cond:
+            while self.size >= self.limit and not self.aborted:
+                self.cond.wait()
+            if self.aborted:
+                raise IOError("archive transfer aborted")
+            self.blocks.append(data)
+            self.size += len(data)
+        self._reactor.callFromThread(self._wake)
+
+    def finish(self, res):
+        # called once the thread is done, successfully or not
+        self.done = True
+        if isinstance(res, failure.Failure):
+            self.failure = res
+        self._wake()
+
+    def abort(self):
+        with self.cond:
+            self.aborted = True
+            self.cond.notify()
+
+    def _wake(self):
+        if self.waiting is not None:
+            d, self.waiting = self.waiting, None
+            d.callback(None)
+
+    def read(self, length):
+        """
+        Get up to C{length} bytes of the archive, C{b''} at its end, or a
+        Deferred which fires when there is more to read
+        """
+        with self.cond:
+            if not self.blocks:
+                if self.failure is not None:
+                    self.failure.raiseException()
+                if self.done:
+                    return b''
+                if self.waiting is None:
+                    self.waiting = defer.Deferred()
+                return self.waiting
+            data = self.blocks.popleft()
+            if len(data) > length:
+                self.blocks.appendleft(data[length:])
+                data = data[:length]
+            self.size -= len(data)
+            self.cond.notify()
+            return data
+
+    def close(self):
+        self.abort()
+
+
 class WorkerFileUploadCommand(TransferCommand):
 
     """
@@ -62,7 +148,11 @@ class WorkerFileUploadCommand(TransferCommand):
         - ['writer']:    RemoteReference to a buildbot_worker.protocols.base.FileWriterProxy object
         - ['maxsize']:   max size (in bytes) of file to write
         - ['blocksize']: max size for each data block
+        - ['window']:    max number of data blocks in flight (optional)
         - ['keepstamp']: whether to preserve file modified and accessed times
+        - ['contentHash']: whether to send the digest of the file first, the
+                           master telling whether it still needs the content
+                           (optional)
     """
     debug = False
     requiredArgs = ['workdir', 'workersrc', 'writer', 'blocksize']
@@ -73,7 +163,9 @@ class WorkerFileUploadCommand(TransferCommand):
         self.writer = args['writer']
         self.remaining = args['maxsize']
         self.blocksize = args['blocksize']
+        self.window = self._getWindow(args)
         self.keepstamp = args.get('keepstamp', False)
+        self.contentHash = args.get('contentHash', False)
         self.stderr = None
         self.rc = 0
         self.fp = None
@@ -105,7 +197,10 @@ class WorkerFileUploadCommand(TransferCommand):
         self.sendStatus({'header': "sending %s" % self.path})
 
         d = defer.Deferred()
-        self._reactor.callLater(0, self._loop, d)
+        if self.contentHash and self.fp is not None:
+            self._sendDigest(d)
+        else:
+            self._reactor.callLater(0, self._loop, d)
 
         def _close_ok(res):
             if self.fp:
@@ -138,27 +233,77 @@ class WorkerFileUploadCommand(TransferCommand):
         d.addBoth(self.finished)
         return d
 
-    def _loop(self, fire_when_done):
-        d = defer.maybeDeferred(self._writeBlock)
+    def _sendDigest(self, fire_when_done):
+        # the master does not need the content of a file already in its
+        # artifact store
+        d = threads.deferToThread(hashFile, self.path)
+        d.addCallback(
+            lambda digest: self.writer.callRemote('useStored', digest))
 
-        def _done(finished):
-            if finished:
+        @d.addCallback
+        def check(stored):
+            if stored:
                 fire_when_done.callback(None)
             else:
                 self._loop(fire_when_done)
+        d.addErrback(fire_when_done.errback)
 
-        def _err(why):
-            fire_when_done.errback(why)
-        d.addCallbacks(_done, _err)
+    def _loop(self, fire_when_done):
+        # keep up to self.window blocks in flight, so that the transfer is not
+        # limited to one block per round trip; the writer handles the blocks
+        # in the order they are sent
+        state = dict(in_flight=0, eof=False, filling=False, done=False)
+
+        def _finish(why=None):
+            if state['done']:
+                return
+            state['done'] = True
+            if why is None:
+                fire_when_done.callback(None)
+            else:
+                fire_when_done.errback(why)
+
+        def _written(res):
+            state['in_flight'] -= 1
+            _fill()
+
+        def _fill():
+            if state['filling'] or state['done']:
+                return
+            state['filling'] = True
+            try:
+                while (not state['eof'] and not state['done'] and
+                       state['in_flight'] < self.window):
+                    data = self._nextBlock()
+                    if isinstance(data, defer.Deferred):
+                        # nothing to send yet, try again once there is
+                        data.addCallbacks(lambda _: _fill(), _finish)
+                        break
+                    if data is None:
+                        state['eof'] = True
+                        break
+                    state['in_flight'] += 1
+                    d = self.writer.callRemote('write', data)
+                    d.addCallbacks(_written, _finish)
+            except Exception:
+                _finish(failure.Failure())
+            finally:
+                state['filling'] = False
+            if state['eof'] and not state['in_flight']:
+                _finish()
+        _fill()
         return None
 
-    def _writeBlock(self):
-        """Write a block of data to the remote writer"""
+    def _nextBlock(self):
+        """
+        Read the next block of data to write, None at the end, or a Deferred
+        which fires when there is data to read
+        """
 
         if self.interrupted or self.fp is None:
             if self.debug:
-                log.msg('WorkerFileUploadCommand._writeBlock(): end')
-            return True
+                log.msg('WorkerFileUploadCommand._nextBlock(): end')
+            return None
 
         length = self.blocksize
         if self.remaining is not None and length > self.remaining:
@@ -172,33 +317,38 @@ class WorkerFileUploadCommand(TransferCommand):
             data = ''
         else:
             data = self.fp.read(length)
+            if isinstance(data, defer.Deferred):
+                return data
 
         if self.debug:
-            log.msg('WorkerFileUploadCommand._writeBlock(): ' +
+            log.msg('WorkerFileUploadCommand._nextBlock(): ' +
                     'allowed=%d readlen=%d' % (length, len(data)))
         if not data:
             log.msg("EOF: callRemote(close)")
-            return True
+            return None
 
         if self.remaining is not None:
             self.remaining = self.remaining - len(data)
             assert self.remaining >= 0
-        d = self.writer.callRemote('write', data)
-        d.addCallback(lambda res: False)
-        return d
+        return data
 
 
 class WorkerDirectoryUploadCommand(WorkerFileUploadCommand):
     debug = False
     requiredArgs = ['workdir', 'workersrc', 'writer', 'blocksize']
 
+    # the most archive data created ahead of sending it
+    ARCHIVE_BUFFER = 1024 * 1024
+
     def setup(self, args):
         self.workdir = args['workdir']
         self.dirname = args['workersrc']
         self.writer = args['writer']
         self.remaining = args['maxsize']
         self.blocksize = args['blocksize']
+        self.window = self._getWindow(args)
         self.compress = args['compress']
+        self.files = args.get('files')
         self.stderr = None
         self.rc = 0
 
@@ -212,25 +362,10 @@ class WorkerDirectoryUploadCommand(WorkerFileUploadCommand):
         if self.debug:
             log.msg("path: %r" % self.path)
 
-        # Create temporary archive
-        fd, self.tarname = tempfile.mkstemp()
-        self.fp = os.fdopen(fd, "rb+")
-
-        if self.compress == 'bz2':
-            mode = 'w|bz2'
-        elif self.compress == 'gz':
-            mode = 'w|gz'
-        else:
-            mode = 'w'
-        # TODO: Use 'with' when depending on Python 2.7
-        # Not possible with older versions:
-        # exceptions.AttributeError: 'TarFile' object has no attribute '__exit__'
-        archive = tarfile.open(mode=mode, fileobj=self.fp)
-        archive.add(self.path, '')
-        archive.close()
-
-        # Transfer it
-        self.fp.seek(0)
+        # Stream the archive while it is being created in a thread
+        self.fp = ArchivePipe(self._reactor, self.ARCHIVE_BUFFER)
+        self.archiving = threads.deferToThread(self._archive, self.fp)
+        self.archiving.addBoth(self.fp.finish)
 
         self.sendStatus({'header': "sending %s" % self.path})
 
@@ -246,15 +381,42 @@ class WorkerDirectoryUploadCommand(WorkerFileUploadCommand):
             d1.addErrback(unpack_err)
             d1.addCallback(lambda ignored: res)
             return d1
-        d.addCallback(unpack)
+
+        def failed(f):
+            self.rc = 1
+            return f
+        d.addCallbacks(unpack, failed)
         d.addBoth(self.finished)
         return d
 
+    def _archive(self, fp):
+        # called in a thread
+        if self.compress == 'bz2':
+            mode = 'w|bz2'
+        elif self.compress == 'gz':
+            mode = 'w|gz'
+        else:
+            mode = 'w|'
+        # TODO: Use 'with' when depending on Python 2.7
+        # Not possible with older versions:
+        # exceptions.AttributeError: 'TarFile' object has no attribute '__exit__'
+        archive = tarfile.open(mode=mode, fileobj=fp)
+        if self.files is None:
+            archive.add(self.path, '')
+        else:
+            # only archive the given files, at the top of the archive
+            for f in self.files:
+                archive.add(os.path.join(self.path, f), os.path.basename(f))
+        archive.close()
+
     def finished(self, res):
-        self.fp.close()
+        # stop the thread creating the archive if it is not done yet
+        self.fp.abort()
         self.fp = None
-        os.remove(self.tarname)
-        return TransferCommand.finished(self, res)
+        d = defer.Deferred()
+        self.archiving.addBoth(d.callback)
+        d.addBoth(lambda _: TransferCommand.finished(self, res))
+        return d
 
 
 class WorkerFileDownloadCommand(TransferCommand):
@@ -268,7 +430,10 @@ class WorkerFileDownloadCommand(TransferCommand):
         - ['reader']:    RemoteReference to a buildbot_worker.protocols.base.FileReaderProxy object
         - ['maxsize']:   max size (in bytes) of file to write
         - ['blocksize']: max size for each data block
+        - ['window']:    max number of data blocks in flight (optional)
         - ['mode']:      access mode for the new file
+        - ['sha256']:    digest of the file, to look for it in the artifact
+                         cache (optional)
     """
     debug = False
     requiredArgs = ['workdir', 'workerdest', 'reader', 'blocksize']
@@ -279,7 +444,10 @@ class WorkerFileDownloadCommand(TransferCommand):
         self.reader = args['reader']
         self.bytes_remaining = args['maxsize']
         self.blocksize = args['blocksize']
+        self.window = self._getWindow(args)
         self.mode = args['mode']
+        self.sha256 = args.get('sha256')
+        self.hasher = None
         self.stderr = None
         self.rc = 0
         self.fp = None
@@ -320,8 +488,35 @@ class WorkerFileDownloadCommand(TransferCommand):
             if self.debug:
                 log.msg("Cannot open file '%s' for download" % self.path)
 
+        cache = self.builder.artifactCache
         d = defer.Deferred()
-        self._reactor.callLater(0, self._loop, d)
+        if cache is not None and self.sha256 and self.fp is not None:
+            self.hasher = hashlib.sha256()
+            d1 = threads.deferToThread(self._copyCached, cache)
+
+            @d1.addCallback
+            def copied(ok):
+                if ok:
+                    d.callback(None)
+                else:
+                    self._loop(d)
+            d1.addErrback(d.errback)
+        else:
+            self._reactor.callLater(0, self._loop, d)
+
+        @d.addCallback
+        def cache_download(res):
+            if self.hasher is None or self.rc != 0 or self.interrupted:
+                return
+            if self.hasher.hexdigest() != self.sha256:
+                log.msg("downloaded file '%s' does not match its digest, not "
+                        "caching it" % self.path)
+                return
+            self.fp.close()
+            self.fp = None
+            d1 = threads.deferToThread(cache.add, self.sha256, self.path)
+            d1.addErrback(log.err, 'while adding a file to the artifact cache')
+            return d1
 
         def _close(res):
             # close the file, but pass through any errors from _loop
@@ -333,46 +528,123 @@ class WorkerFileDownloadCommand(TransferCommand):
         d.addBoth(self.finished)
         return d
 
-    def _loop(self, fire_when_done):
-        d = defer.maybeDeferred(self._readBlock)
+    def _copyCached(self, cache):
+        """
+        Copy the file from the artifact cache, if it is there, checking its
+        digest on the way.  This runs in a thread.
+
+        @returns: True if the file was copied, False if it must be downloaded
+        """
+        path = cache.get(self.sha256)
+        if path is None:
+            return False
+        try:
+            with open(path, 'rb') as f:
+                if (self.bytes_remaining is not None and
+                        os.fstat(f.fileno()).st_size > self.bytes_remaining):
+                    return False
+                h = hashlib.sha256()
+                while True:
+                    data = f.read(self.blocksize)
+                    if not data:
+                        break
+                    h.update(data)
+                    self.fp.write(data)
+        except (IOError, OSError):
+            log.err(None, 'while copying %s from the artifact cache' % path)
+            h = None
+        if h is not None:
+            if h.hexdigest() == self.sha256:
+                # the file is not added to the cache again
+                self.hasher = None
+                return True
+            log.msg("corrupted file '%s' in the artifact cache" % path)
+        cache.remove(self.sha256)
+        self.fp.seek(0)
+        self.fp.truncate()
+        return False
 
-        def _done(finished):
-            if finished:
+    def _loop(self, fire_when_done):
+        # keep up to self.window reads in flight, so that the transfer is not
+        # limited to one block per round trip; the blocks are written in the
+        # order they were requested
+        state = dict(requested=0, eof=False, filling=False, done=False)
+        # [length, data] of each read in flight, data being None until it
+        # arrives
+        pending = []
+
+        def _finish(why=None):
+            if state['done']:
+                return
+            state['done'] = True
+            if why is None:
                 fire_when_done.callback(None)
             else:
-                self._loop(fire_when_done)
-
-        def _err(why):
-            fire_when_done.errback(why)
-        d.addCallbacks(_done, _err)
+                fire_when_done.errback(why)
+
+        def _arrived(data, read):
+            read[1] = data
+            try:
+                while pending and pending[0][1] is not None:
+                    length, data = pending.pop(0)
+                    state['requested'] -= length
+                    if not state['eof'] and not state['done']:
+                        state['eof'] = self._writeData(data)
+            except Exception:
+                _finish(failure.Failure())
+            _fill()
+
+        def _fill():
+            if state['filling'] or state['done']:
+                return
+            state['filling'] = True
+            try:
+                while (not state['eof'] and not state['done'] and
+                       len(pending) < self.window):
+                    length = self._nextLength(state['requested'], pending)
+                    if length is None:
+                        state['eof'] = True
+                        break
+                    if length <= 0:
+                        break
+                    read = [length, None]
+                    pending.append(read)
+                    state['requested'] += length
+                    d = self.reader.callRemote('read', length)
+                    d.addCallbacks(_arrived, _finish, callbackArgs=(read,))
+            finally:
+                state['filling'] = False
+            if state['eof'] and not pending:
+                _finish()
+        _fill()
         return None
 
-    def _readBlock(self):
-        """Read a block of data from the remote reader."""
+    def _nextLength(self, requested, pending):
+        """
+        Get the length of the next block to read, 0 to wait for the reads in
+        flight, or None at the end
+        """
 
         if self.interrupted or self.fp is None:
             if self.debug:
-                log.msg('WorkerFileDownloadCommand._readBlock(): end')
-            return True
+                log.msg('WorkerFileDownloadCommand._nextLength(): end')
+            return None
 
         length = self.blocksize
-        if self.bytes_remaining is not None and length > self.bytes_remaining:
-            length = self.bytes_remaining
+        if self.bytes_remaining is not None:
+            length = min(length, self.bytes_remaining - requested)
 
-        if length <= 0:
+        if length <= 0 and not pending:
             if self.stderr is None:
                 self.stderr = "Maximum filesize reached, truncating file '%s'" \
                     % self.path
                 self.rc = 1
-            return True
-        else:
-            d = self.reader.callRemote('read', length)
-            d.addCallback(self._writeData)
-            return d
+            return None
+        return length
 
     def _writeData(self, data):
         if self.debug:
-            log.msg('WorkerFileDownloadCommand._readBlock(): readlen=%d' %
+            log.msg('WorkerFileDownloadCommand._writeData(): readlen=%d' %
                     len(data))
         if not data:
             return True
@@ -380,6 +652,8 @@ class WorkerFileDownloadCommand(TransferCommand):
         if self.bytes_remaining is not None:
             self.bytes_remaining = self.bytes_remaining - len(data)
             assert self.bytes_remaining >= 0
+        if self.hasher is not None:
+            self.hasher.update(data)
         self.fp.write(data)
         return False
 
@@ -28,6 +28,7 @@ from twisted.internet import task
 from twisted.python import log
 from twisted.spread import pb
 
+from buildbot_worker.base import DEFAULT_ARTIFACT_CACHE_SIZE
 from buildbot_worker.base import BotBase
 from buildbot_worker.base import WorkerBase
 from buildbot_worker.base import WorkerForBuilderBase
@@ -156,7 +157,8 @@ class Worker(WorkerBase, service.MultiService):
     def __init__(self, buildmaster_host, port, name, passwd, basedir,
                  keepalive, usePTY=None, keepaliveTimeout=None, umask=None,
                  maxdelay=300, numcpus=None, unicode_encoding=None,
-                 allow_shutdown=None):
+                 allow_shutdown=None,
+                 artifact_cache_size=DEFAULT_ARTIFACT_CACHE_SIZE):
 
         # note: keepaliveTimeout is ignored, but preserved here for
         # backward-compatibility
@@ -165,7 +167,8 @@ class Worker(WorkerBase, service.MultiService):
 
         service.MultiService.__init__(self)
         WorkerBase.__init__(
-            self, name, basedir, umask=umask, unicode_encoding=unicode_encoding)
+            self, name, basedir, umask=umask, unicode_encoding=unicode_encoding,
+            artifact_cache_size=artifact_cache_size)
         if keepalive == 0:
             keepalive = None
 
@@ -33,6 +33,7 @@ class FakeWorkerForBuilder(object):
         self.updates = []
         self.basedir = basedir
         self.unicode_encoding = 'utf-8'
+        self.artifactCache = None
 
     def sendUpdate(self, data):
         if self.debug:
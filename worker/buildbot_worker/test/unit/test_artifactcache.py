@@ -0,0 +1,132 @@
+# This file is part of Buildbot.  Buildbot is free software: you can
+# redistribute it and/or modify it under the terms of the GNU General Public
+# License as published by the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright Buildbot Team Members
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import hashlib
+import os
+import shutil
+
+from twisted.trial import unittest
+
+from buildbot_worker import artifactcache
+
+
+class TestArtifactCache(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = os.path.abspath('basedir')
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+        os.makedirs(self.basedir)
+        self.cachedir = os.path.join(self.basedir, 'artifact-cache')
+        self.cache = artifactcache.ArtifactCache(self.cachedir, 100)
+
+    def tearDown(self):
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+
+    def makeFile(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        path = os.path.join(self.basedir, digest[:8])
+        with open(path, 'wb') as f:
+            f.write(data)
+        return digest, path
+
+    def readCached(self, digest):
+        with open(self.cache.get(digest), 'rb') as f:
+            return f.read()
+
+    def test_hashFile(self):
+        digest, path = self.makeFile(b'some data')
+        self.assertEqual(artifactcache.hashFile(path, blocksize=4), digest)
+
+    def test_get_empty(self):
+        self.assertEqual(self.cache.get('0' * 64), None)
+
+    def test_add_get(self):
+        digest, path = self.makeFile(b'some data')
+        self.cache.add(digest, path)
+        self.assertEqual(self.readCached(digest), b'some data')
+        # the cache keeps a copy
+        os.unlink(path)
+        self.assertEqual(self.readCached(digest), b'some data')
+        self.assertEqual(self.cache.totalSize, 9)
+
+    def test_add_twice(self):
+        digest, path = self.makeFile(b'some data')
+        self.cache.add(digest, path)
+        self.cache.add(digest, path)
+        self.assertEqual(self.cache.totalSize, 9)
+
+    def test_add_too_large(self):
+        digest, path = self.makeFile(b'x' * 101)
+        self.cache.add(digest, path)
+        self.assertEqual(self.cache.get(digest), None)
+
+    def test_add_bad_digest(self):
+        _, path = self.makeFile(b'some data')
+        self.cache.add('../escape', path)
+        self.assertFalse(os.path.exists(self.cachedir))
+
+    def test_evict_least_recently_used(self):
+        digests = []
+        for c in b'abc':
+            digest, path = self.makeFile(bytes(bytearray([c])) * 40)
+            self.cache.add(digest, path)
+            digests.append(digest)
+            if len(digests) == 2:
+                # use the first file again
+                self.cache.get(digests[0])
+        self.assertEqual(self.cache.get(digests[1]), None)
+        self.assertEqual(self.readCached(digests[0]), b'a' * 40)
+        self.assertEqual(self.readCached(digests[2]), b'c' * 40)
+        self.assertEqual(sorted(os.listdir(self.cachedir)),
+                         sorted([digests[0], digests[2]]))
+        self.assertEqual(self.cache.totalSize, 80)
+
+    def test_remove(self):
+        digest, path = self.makeFile(b'some data')
+        self.cache.add(digest, path)
+        self.cache.remove(digest)
+        self.assertEqual(self.cache.get(digest), None)
+        self.assertEqual(self.cache.totalSize, 0)
+
+    def test_removed_behind_our_back(self):
+        digest, path = self.makeFile(b'some data')
+        self.cache.add(digest, path)
+        os.unlink(os.path.join(self.cachedir, digest))
+        self.assertEqual(self.cache.get(digest), None)
+        self.assertEqual(self.cache.totalSize, 0)
+
+    def test_load(self):
+        digest1, path = self.makeFile(b'a' * 40)
+        self.cache.add(digest1, path)
+        digest2, path = self.makeFile(b'b' * 40)
+        self.cache.add(digest2, path)
+        os.utime(os.path.join(self.cachedir, digest1), (1000, 1000))
+        os.utime(os.path.join(self.cachedir, digest2), (2000, 2000))
+        # an interrupted copy
+        with open(os.path.join(self.cachedir, 'xyz.tmp'), 'wb') as f:
+            f.write(b'partial')
+
+        cache = artifactcache.ArtifactCache(self.cachedir, 100)
+        digest3, path = self.makeFile(b'c' * 40)
+        cache.add(digest3, path)
+        # the oldest file was evicted
+        self.assertEqual(sorted(os.listdir(self.cachedir)),
+                         sorted([digest2, digest3]))
+        self.assertEqual(cache.totalSize, 80)
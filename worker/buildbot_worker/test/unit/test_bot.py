@@ -127,6 +127,21 @@ class TestBot(unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_setBuilderList_artifact_cache(self):
+        d = self.bot.callRemote("setBuilderList", [('mybld', 'myblddir')])
+
+        def check(builders):
+            cache = self.real_bot.artifactCache
+            self.assertEqual(cache.basedir,
+                             os.path.join(self.basedir, 'artifact-cache'))
+            self.assertIdentical(builders['mybld'].artifactCache, cache)
+        d.addCallback(check)
+        return d
+
+    def test_artifact_cache_disabled(self):
+        bot = base.BotBase(self.basedir, False, artifact_cache_size=0)
+        self.assertEqual(bot.artifactCache, None)
+
     def test_setBuilderList_updates(self):
         d = defer.succeed(None)
 
@@ -233,6 +248,113 @@ class FakeStep(object):
         self.finished_d.callback(None)
 
 
+class SlowStep(object):
+
+    "A fake master-side BuildStep that answers the updates when told to."
+
+    def __init__(self):
+        self.actions = []
+        self.answers = []
+
+    def remote_update(self, updates):
+        self.actions.append(["update", [u[0] for u in updates]])
+        d = defer.Deferred()
+        self.answers.append(d)
+        return d
+
+    def remote_complete(self, f):
+        self.actions.append(["complete", f])
+
+    def answer(self):
+        self.answers.pop(0).callback(0)
+
+
+class TestWorkerForBuilderUpdates(unittest.TestCase):
+
+    def setUp(self):
+        self.wfb = base.WorkerForBuilderBase('wfb')
+        self.wfb.running = True
+        self.step = SlowStep()
+        self.wfb.remoteStep = FakeRemote(self.step)
+
+    def sendUpdates(self, *stdouts):
+        for stdout in stdouts:
+            self.wfb.sendUpdate({'stdout': stdout})
+
+    def assertUpdateCalls(self, *calls):
+        self.assertEqual(
+            self.step.actions,
+            [['update', [{'stdout': stdout} for stdout in call]]
+             for call in calls])
+
+    def test_window(self):
+        self.sendUpdates('a', 'b', 'c', 'd', 'e')
+        # the updates sent while two calls are in flight wait for an answer
+        self.assertUpdateCalls(['a'], ['b'])
+        self.step.answer()
+        self.assertUpdateCalls(['a'], ['b'], ['c', 'd', 'e'])
+        self.step.answer()
+        self.step.answer()
+        self.sendUpdates('f')
+        self.assertUpdateCalls(['a'], ['b'], ['c', 'd', 'e'], ['f'])
+
+    def test_batch_size(self):
+        self.wfb.MAX_UPDATE_BATCH_SIZE = 4
+        self.sendUpdates('a', 'b', 'cc', 'dd', 'eee', 'ffffff', 'g')
+        self.step.answer()
+        self.assertUpdateCalls(['a'], ['b'], ['cc', 'dd'])
+        self.step.answer()
+        self.assertUpdateCalls(['a'], ['b'], ['cc', 'dd'], ['eee'])
+        self.step.answer()
+        # an update larger than the batch size is sent alone
+        self.assertUpdateCalls(['a'], ['b'], ['cc', 'dd'], ['eee'],
+                               ['ffffff'])
+
+    def test_queue_full(self):
+        self.wfb.MAX_QUEUED_UPDATE_SIZE = 2
+        self.sendUpdates('a', 'b', 'c', 'd')
+        self.assertUpdateCalls(['a'], ['b'])
+        # the queue holds at most two bytes
+        self.sendUpdates('e')
+        self.assertUpdateCalls(['a'], ['b'], ['c', 'd', 'e'])
+
+    def test_log_update_size(self):
+        self.wfb.MAX_UPDATE_BATCH_SIZE = 4
+        self.sendUpdates('a', 'b')
+        self.wfb.sendUpdate({'log': ('log1', 'xxxx')})
+        self.wfb.sendUpdate({'rc': 0})
+        self.step.answer()
+        self.assertEqual(self.step.actions[2:], [
+            ['update', [{'log': ('log1', 'xxxx')}, {'rc': 0}]]])
+
+    def test_complete_sends_queued_updates(self):
+        self.wfb.command = mock.Mock()
+        self.sendUpdates('a', 'b', 'c')
+        self.wfb.commandComplete(None)
+        self.assertEqual(self.step.actions[2:], [
+            ['update', [{'stdout': 'c'}]],
+            ['complete', None],
+        ])
+
+    def test_lost_remote_step(self):
+        self.sendUpdates('a', 'b', 'c')
+        self.wfb.stopCommandOnShutdown = False
+        self.wfb.lostRemoteStep(self.wfb.remoteStep)
+        self.step.answer()
+        self.assertUpdateCalls(['a'], ['b'])
+
+    def test_new_remote_step(self):
+        # the updates of a step are not sent to the next one
+        self.sendUpdates('a', 'b', 'c')
+        step2 = SlowStep()
+        self.wfb.remoteStep = FakeRemote(step2)
+        self.sendUpdates('d')
+        self.step.answer()
+        self.assertUpdateCalls(['a'], ['b'], ['c'])
+        self.step.answer()
+        self.assertEqual(step2.actions, [['update', [{'stdout': 'd'}]]])
+
+
 class TestWorkerForBuilder(command.CommandTestMixin, unittest.TestCase):
 
     @defer.inlineCallbacks
@@ -244,6 +244,29 @@ class TestStatFile(CommandTestMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_files(self):
+        self.make_command(fs.StatFile, dict(
+            files=['test-file', 'no-such-file', 'wd'],
+            workdir='.'
+        ), True)
+        os.mkdir(os.path.join(self.basedir, 'wd'))
+        with open(os.path.join(self.basedir, 'test-file'), "w"):
+            pass
+
+        d = self.run_command()
+
+        def check(_):
+            import stat
+            stats = self.get_updates()[0]['stats']
+            self.assertTrue(stat.S_ISREG(stats[0][stat.ST_MODE]))
+            self.assertEqual(stats[1], None)
+            self.assertTrue(stat.S_ISDIR(stats[2][stat.ST_MODE]))
+            self.assertIn({'rc': 0},
+                          self.get_updates(),
+                          self.builder.show())
+        d.addCallback(check)
+        return d
+
     def test_file_workdir(self):
         self.make_command(fs.StatFile, dict(
             file='test-file',
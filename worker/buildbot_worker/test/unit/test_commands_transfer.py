@@ -16,6 +16,7 @@
 from __future__ import absolute_import
 from __future__ import print_function
 
+import hashlib
 import io
 import os
 import shutil
@@ -28,6 +29,7 @@ from twisted.python import failure
 from twisted.python import runtime
 from twisted.trial import unittest
 
+from buildbot_worker.artifactcache import ArtifactCache
 from buildbot_worker.commands import transfer
 from buildbot_worker.test.fake.remote import FakeRemote
 from buildbot_worker.test.util.command import CommandTestMixin
@@ -52,6 +54,13 @@ class FakeMasterMethods(object):
 
         self.unpack_fail = False
 
+        # digests of the files in the artifact store
+        self.stored = set()
+
+        # delayed writes and reads in flight
+        self.in_flight = 0
+        self.max_in_flight = 0
+
         self.written = False
         self.read = False
         self.data = b''
@@ -72,9 +81,18 @@ class FakeMasterMethods(object):
             self.data += data
 
         if self.delay_write:
-            d = defer.Deferred()
-            reactor.callLater(0.01, d.callback, None)
-            return d
+            return self._delay(None)
+
+    def _delay(self, result):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        d = defer.Deferred()
+
+        def fire():
+            self.in_flight -= 1
+            d.callback(result)
+        reactor.callLater(0.01, fire)
+        return d
 
     def remote_read(self, length):
         if self.count_reads:
@@ -88,9 +106,7 @@ class FakeMasterMethods(object):
 
         _slice, self.data = self.data[:length], self.data[length:]
         if self.delay_read:
-            d = defer.Deferred()
-            reactor.callLater(0.01, d.callback, _slice)
-            return d
+            return self._delay(_slice)
         return _slice
 
     def remote_unpack(self):
@@ -101,6 +117,10 @@ class FakeMasterMethods(object):
     def remote_utime(self, accessed_modified):
         self.add_update('utime - %s' % accessed_modified[0])
 
+    def remote_useStored(self, digest):
+        self.add_update('useStored')
+        return digest in self.stored
+
     def remote_close(self):
         self.add_update('close')
 
@@ -153,6 +173,58 @@ class TestUploadFile(CommandTestMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_content_hash_stored(self):
+        self.fakemaster.count_writes = True    # get actual byte counts
+        self.fakemaster.stored.add(
+            hashlib.sha256(b"this is some data\n" * 10).hexdigest())
+
+        self.make_command(transfer.WorkerFileUploadCommand, dict(
+            workdir='workdir',
+            workersrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=1000,
+            blocksize=64,
+            keepstamp=False,
+            contentHash=True,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            # the content is not sent
+            self.assertUpdates([
+                {'header': 'sending %s' % self.datafile},
+                'useStored', 'close',
+                {'rc': 0}
+            ])
+        d.addCallback(check)
+        return d
+
+    def test_content_hash_not_stored(self):
+        self.fakemaster.count_writes = True    # get actual byte counts
+        self.fakemaster.stored.add(hashlib.sha256(b"other").hexdigest())
+
+        self.make_command(transfer.WorkerFileUploadCommand, dict(
+            workdir='workdir',
+            workersrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=1000,
+            blocksize=64,
+            keepstamp=False,
+            contentHash=True,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                {'header': 'sending %s' % self.datafile},
+                'useStored', 'write 64', 'write 64', 'write 52', 'close',
+                {'rc': 0}
+            ])
+        d.addCallback(check)
+        return d
+
     def test_truncated(self):
         self.fakemaster.count_writes = True    # get actual byte counts
 
@@ -177,6 +249,100 @@ class TestUploadFile(CommandTestMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_windowed(self):
+        self.fakemaster.count_writes = True    # get actual byte counts
+        self.fakemaster.keep_data = True
+        self.fakemaster.delay_write = True
+
+        self.make_command(transfer.WorkerFileUploadCommand, dict(
+            workdir='workdir',
+            workersrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=1000,
+            blocksize=16,
+            window=4,
+            keepstamp=False,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                {'header': 'sending %s' % self.datafile}] +
+                ['write 16'] * 11 + ['write 4', 'close',
+                                     {'rc': 0}
+                                     ])
+            self.assertEqual(self.fakemaster.data,
+                             b"this is some data\n" * 10)
+            self.assertEqual(self.fakemaster.max_in_flight, 4)
+            self.assertEqual(self.fakemaster.in_flight, 0)
+        d.addCallback(check)
+        return d
+
+    def test_windowed_truncated(self):
+        self.fakemaster.count_writes = True    # get actual byte counts
+        self.fakemaster.delay_write = True
+
+        self.make_command(transfer.WorkerFileUploadCommand, dict(
+            workdir='workdir',
+            workersrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=100,
+            blocksize=64,
+            window=4,
+            keepstamp=False,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                {'header': 'sending %s' % self.datafile},
+                'write 64', 'write 36', 'close',
+                {'rc': 1,
+                 'stderr': "Maximum filesize reached, truncating file '%s'" % self.datafile}
+            ])
+        d.addCallback(check)
+        return d
+
+    def test_windowed_out_of_space(self):
+        self.fakemaster.write_out_of_space_at = 70
+        self.fakemaster.count_writes = True    # get actual byte counts
+
+        self.make_command(transfer.WorkerFileUploadCommand, dict(
+            workdir='workdir',
+            workersrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=1000,
+            blocksize=64,
+            window=4,
+            keepstamp=False,
+        ))
+
+        d = self.run_command()
+        self.assertFailure(d, RuntimeError)
+
+        def check(_):
+            self.assertUpdates([
+                {'header': 'sending %s' % self.datafile},
+                'write 64', 'close',
+                {'rc': 1}
+            ])
+        d.addCallback(check)
+        return d
+
+    def test_window_capped(self):
+        self.make_command(transfer.WorkerFileUploadCommand, dict(
+            workdir='workdir',
+            workersrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=1000,
+            blocksize=64,
+            window=1000,
+            keepstamp=False,
+        ))
+        self.assertEqual(self.cmd.window, self.cmd.MAX_WINDOW)
+
     def test_missing(self):
         self.make_command(transfer.WorkerFileUploadCommand, dict(
             workdir='workdir',
@@ -355,6 +521,85 @@ class TestWorkerDirectoryUpload(CommandTestMixin, unittest.TestCase):
     if sys.version_info[:2] <= (2, 4):
         test_simple_bz2.skip = "bz2 stream decompression not supported on Python-2.4"
 
+    def test_streamed(self):
+        # the archive is larger than what may be created ahead of sending it
+        self.fakemaster.keep_data = True
+        self.fakemaster.delay_write = True
+        content = os.urandom(64 * 1024)
+        with open(os.path.join(self.datadir, "cc"), mode="wb") as f:
+            f.write(content)
+
+        self.make_command(transfer.WorkerDirectoryUploadCommand, dict(
+            workdir='workdir',
+            workersrc='data',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=4096,
+            window=4,
+            compress=None,
+        ))
+        self.cmd.ARCHIVE_BUFFER = 8192
+
+        d = self.run_command()
+
+        def check(_):
+            self.assertUpdates([
+                {'header': 'sending %s' % self.datadir},
+                'write(s)', 'unpack',
+                {'rc': 0}
+            ])
+            a = tarfile.open(fileobj=io.BytesIO(self.fakemaster.data),
+                             mode="r")
+            self.assertEqual(a.extractfile('cc').read(), content)
+            a.close()
+        d.addCallback(check)
+        return d
+
+    def test_files(self):
+        self.fakemaster.keep_data = True
+
+        self.make_command(transfer.WorkerDirectoryUploadCommand, dict(
+            workdir='workdir',
+            workersrc='.',
+            files=[os.path.join('data', 'aa'), os.path.join('data', 'bb')],
+            writer=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=512,
+            compress=None,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            a = tarfile.open(fileobj=io.BytesIO(self.fakemaster.data),
+                             mode="r")
+            self.assertEqual(sorted(a.getnames()), ['aa', 'bb'])
+            self.assertEqual(a.extractfile('aa').read(), b"lots of a" * 100)
+            a.close()
+        d.addCallback(check)
+        return d
+
+    def test_missing(self):
+        self.make_command(transfer.WorkerDirectoryUploadCommand, dict(
+            workdir='workdir',
+            workersrc='data-nosuch',
+            writer=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=512,
+            compress=None,
+        ))
+
+        d = self.run_command()
+        self.assertFailure(d, OSError)
+
+        def check(_):
+            self.assertUpdates([
+                {'header': 'sending %s' % (self.datadir + '-nosuch')},
+                {'rc': 1}
+            ])
+        d.addCallback(check)
+        return d
+
     def test_out_of_space_unpack(self):
         self.fakemaster.keep_data = True
         self.fakemaster.unpack_fail = True
@@ -431,6 +676,145 @@ class TestDownloadFile(CommandTestMixin, unittest.TestCase):
         d.addCallback(check)
         return d
 
+    def test_windowed(self):
+        self.fakemaster.count_reads = True    # get actual byte counts
+        self.fakemaster.delay_read = True
+        self.fakemaster.data = test_data = b'1234' * 13
+
+        self.make_command(transfer.WorkerFileDownloadCommand, dict(
+            workdir='.',
+            workerdest='data',
+            reader=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=8,
+            window=4,
+            mode=0o777,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            # 7 reads return data; the reads past the end of the file are
+            # requested before the end of the file is seen
+            self.assertUpdates(['read 8'] * 10 + ['close', {'rc': 0}])
+            datafile = os.path.join(self.basedir, 'data')
+            with open(datafile, mode="rb") as f:
+                datafileContent = f.read()
+            self.assertEqual(datafileContent, test_data)
+            self.assertEqual(self.fakemaster.max_in_flight, 4)
+        d.addCallback(check)
+        return d
+
+    def test_windowed_truncated(self):
+        self.fakemaster.count_reads = True    # get actual byte counts
+        self.fakemaster.delay_read = True
+        self.fakemaster.data = test_data = b'tenchars--' * 10
+
+        self.make_command(transfer.WorkerFileDownloadCommand, dict(
+            workdir='.',
+            workerdest='data',
+            reader=FakeRemote(self.fakemaster),
+            maxsize=50,
+            blocksize=16,
+            window=4,
+            mode=0o777,
+        ))
+
+        d = self.run_command()
+
+        def check(_):
+            # no more than maxsize bytes are ever requested
+            self.assertUpdates([
+                'read 16', 'read 16', 'read 16', 'read 2', 'close',
+                {'rc': 1,
+                 'stderr': "Maximum filesize reached, truncating file '%s'"
+                 % os.path.join(self.basedir, '.', 'data')}
+            ])
+            datafile = os.path.join(self.basedir, 'data')
+            with open(datafile, mode="rb") as f:
+                data = f.read()
+            self.assertEqual(data, test_data[:50])
+        d.addCallback(check)
+        return d
+
+    def make_cached_command(self, test_data, sha256=None):
+        self.fakemaster.count_reads = True    # get actual byte counts
+        self.fakemaster.data = test_data
+        self.make_command(transfer.WorkerFileDownloadCommand, dict(
+            workdir='.',
+            workerdest='data',
+            reader=FakeRemote(self.fakemaster),
+            maxsize=None,
+            blocksize=32,
+            mode=None,
+            sha256=sha256 or hashlib.sha256(test_data).hexdigest(),
+        ))
+        self.cache = self.builder.artifactCache = ArtifactCache(
+            os.path.join(self.basedir, 'artifact-cache'), 1000)
+
+    def assertDownloaded(self, test_data):
+        with open(os.path.join(self.basedir, 'data'), mode="rb") as f:
+            self.assertEqual(f.read(), test_data)
+
+    @defer.inlineCallbacks
+    def test_cache_miss(self):
+        test_data = b'1234' * 13
+        self.make_cached_command(test_data)
+
+        yield self.run_command()
+
+        self.assertUpdates(['read 32', 'read 32', 'read 32', 'close',
+                            {'rc': 0}])
+        self.assertDownloaded(test_data)
+        cached = self.cache.get(hashlib.sha256(test_data).hexdigest())
+        with open(cached, mode="rb") as f:
+            self.assertEqual(f.read(), test_data)
+
+    @defer.inlineCallbacks
+    def test_cache_hit(self):
+        test_data = b'1234' * 13
+        self.make_cached_command(test_data)
+        cachedfile = os.path.join(self.basedir, 'cached')
+        with open(cachedfile, mode="wb") as f:
+            f.write(test_data)
+        self.cache.add(hashlib.sha256(test_data).hexdigest(), cachedfile)
+
+        yield self.run_command()
+
+        # nothing is read from the master
+        self.assertUpdates(['close', {'rc': 0}])
+        self.assertDownloaded(test_data)
+
+    @defer.inlineCallbacks
+    def test_cache_corrupted(self):
+        test_data = b'1234' * 13
+        digest = hashlib.sha256(test_data).hexdigest()
+        self.make_cached_command(test_data)
+        os.makedirs(self.cache.basedir)
+        with open(os.path.join(self.cache.basedir, digest), mode="wb") as f:
+            f.write(b'corrupted')
+
+        yield self.run_command()
+
+        self.assertUpdates(['read 32', 'read 32', 'read 32', 'close',
+                            {'rc': 0}])
+        self.assertDownloaded(test_data)
+        with open(self.cache.get(digest), mode="rb") as f:
+            self.assertEqual(f.read(), test_data)
+
+    @defer.inlineCallbacks
+    def test_cache_digest_mismatch(self):
+        test_data = b'1234' * 13
+        digest = hashlib.sha256(b'other').hexdigest()
+        self.make_cached_command(test_data, sha256=digest)
+
+        yield self.run_command()
+
+        self.assertUpdates(['read 32', 'read 32', 'read 32', 'close',
+                            {'rc': 0}])
+        self.assertDownloaded(test_data)
+        self.assertEqual(self.cache.get(digest), None)
+
     def test_mkdir(self):
         self.fakemaster.data = test_data = b'hi'
 